@@ -37,17 +37,18 @@
 
 import os
 import os.path
+import sys
 import shutil
 import time
 import stat
 import errno
-import re
 import random
 import logging
 import tempfile
 import zlib
 import base64
 import signal
+import threading
 
 from ganeti import errors
 from ganeti import utils
@@ -57,6 +58,7 @@ from ganeti import constants
 from ganeti.storage import bdev
 from ganeti.storage import drbd
 from ganeti.storage import filestorage
+from ganeti.storage import lvm_inventory
 from ganeti import objects
 from ganeti import ssconf
 from ganeti import serializer
@@ -69,6 +71,7 @@ from ganeti import ht
 from ganeti.storage.base import BlockDev
 from ganeti.storage.drbd import DRBD8
 from ganeti import hooksmaster
+from ganeti import impexpd
 
 
 _BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
@@ -85,9 +88,6 @@ _IES_STATUS_FILE = "status"
 _IES_PID_FILE = "pid"
 _IES_CA_FILE = "ca"
 
-#: Valid LVS output line regex
-_LVSLINE_REGEX = re.compile("^ *([^|]+)\|([^|]+)\|([0-9.]+)\|([^|]{6,})\|?$")
-
 # Actions for the master setup script
 _MASTER_START = "start"
 _MASTER_STOP = "stop"
@@ -927,75 +927,61 @@ def _VerifyNodeInfo(what, vm_capable, result, all_hvparams):
     result[constants.NV_HVINFO] = hyper.GetNodeInfo(hvparams=hvparams)
 
 
-def VerifyNode(what, cluster_name, all_hvparams):
-  """Verify the status of the local node.
+def _VerifyHypervisorState(what, vm_capable, all_hvparams, result):
+  """Runs all hypervisor-related checks.
 
-  Based on the input L{what} parameter, various checks are done on the
-  local node.
+  @see: L{_VerifyHypervisors}, L{_VerifyHvparams}, L{_VerifyInstanceList} and
+    L{_VerifyNodeInfo}
 
-  If the I{filelist} key is present, this list of
-  files is checksummed and the file/checksum pairs are returned.
+  """
+  _VerifyHypervisors(what, vm_capable, result, all_hvparams)
+  _VerifyHvparams(what, vm_capable, result)
+  _VerifyInstanceList(what, vm_capable, result, all_hvparams)
+  _VerifyNodeInfo(what, vm_capable, result, all_hvparams)
 
-  If the I{nodelist} key is present, we check that we have
-  connectivity via ssh with the target nodes (and check the hostname
-  report).
 
-  If the I{node-net-test} key is present, we check that we have
-  connectivity to the given nodes via both primary IP and, if
-  applicable, secondary IPs.
-
-  @type what: C{dict}
-  @param what: a dictionary of things to check:
-      - filelist: list of files for which to compute checksums
-      - nodelist: list of nodes we should check ssh communication with
-      - node-net-test: list of nodes we should check node daemon port
-        connectivity with
-      - hypervisor: list with hypervisors to run the verify for
-  @type cluster_name: string
-  @param cluster_name: the cluster's name
-  @type all_hvparams: dict of dict of strings
-  @param all_hvparams: a dictionary mapping hypervisor names to hvparams
-  @rtype: dict
-  @return: a dictionary with the same keys as the input dict, and
-      values representing the result of the checks
+def _VerifyFileList(what, result):
+  """Computes the checksums of the files to verify.
 
   """
-  result = {}
-  my_name = netutils.Hostname.GetSysName()
-  port = netutils.GetDaemonPort(constants.NODED)
-  vm_capable = my_name not in what.get(constants.NV_VMNODES, [])
+  fingerprints = \
+    utils.FingerprintFiles(map(vcluster.LocalizeVirtualPath,
+                               what[constants.NV_FILELIST]),
+                           cache_file=pathutils.FINGERPRINT_CACHE_FILE)
+  result[constants.NV_FILELIST] = \
+    dict((vcluster.MakeVirtualPath(key), value)
+         for (key, value) in fingerprints.items())
 
-  _VerifyHypervisors(what, vm_capable, result, all_hvparams)
-  _VerifyHvparams(what, vm_capable, result)
 
-  if constants.NV_FILELIST in what:
-    fingerprints = utils.FingerprintFiles(map(vcluster.LocalizeVirtualPath,
-                                              what[constants.NV_FILELIST]))
-    result[constants.NV_FILELIST] = \
-      dict((vcluster.MakeVirtualPath(key), value)
-           for (key, value) in fingerprints.items())
+def _VerifyNodeList(what, cluster_name, my_name, result):
+  """Checks the ssh connectivity with other nodes.
 
-  if constants.NV_NODELIST in what:
-    (nodes, bynode) = what[constants.NV_NODELIST]
+  """
+  (nodes, bynode) = what[constants.NV_NODELIST]
 
-    # Add nodes from other groups (different for each node)
-    try:
-      nodes.extend(bynode[my_name])
-    except KeyError:
-      pass
+  # Add nodes from other groups (different for each node)
+  try:
+    nodes.extend(bynode[my_name])
+  except KeyError:
+    pass
+
+  # Use a random order
+  random.shuffle(nodes)
 
-    # Use a random order
-    random.shuffle(nodes)
+  # Try to contact all nodes
+  val = {}
+  for node in nodes:
+    success, message = _GetSshRunner(cluster_name).VerifyNodeHostname(node)
+    if not success:
+      val[node] = message
 
-    # Try to contact all nodes
-    val = {}
-    for node in nodes:
-      success, message = _GetSshRunner(cluster_name).VerifyNodeHostname(node)
-      if not success:
-        val[node] = message
+  result[constants.NV_NODELIST] = val
 
-    result[constants.NV_NODELIST] = val
 
+def _VerifyNetwork(what, my_name, port, result):
+  """Checks the node daemon port connectivity with other nodes and the master.
+
+  """
   if constants.NV_NODENETTEST in what:
     result[constants.NV_NODENETTEST] = tmp = {}
     my_pip = my_sip = None
@@ -1030,6 +1016,11 @@ def VerifyNode(what, cluster_name, all_hvparams):
     result[constants.NV_MASTERIP] = netutils.TcpPing(master_ip, port,
                                                      source=source)
 
+
+def _VerifyLocalSetup(what, my_name, vm_capable, result):
+  """Checks the scripts, paths and bridges of the node.
+
+  """
   if constants.NV_USERSCRIPTS in what:
     result[constants.NV_USERSCRIPTS] = \
       [script for script in what[constants.NV_USERSCRIPTS]
@@ -1051,19 +1042,52 @@ def VerifyNode(what, cluster_name, all_hvparams):
         else:
           tmp.append("out of band helper %s is not a file" % path)
 
-  if constants.NV_LVLIST in what and vm_capable:
+  if constants.NV_NODESETUP in what:
+    result[constants.NV_NODESETUP] = tmpr = []
+    if not os.path.isdir("/sys/block") or not os.path.isdir("/sys/class/net"):
+      tmpr.append("The sysfs filesytem doesn't seem to be mounted"
+                  " under /sys, missing required directories /sys/block"
+                  " and /sys/class/net")
+    if (not os.path.isdir("/proc/sys") or
+        not os.path.isfile("/proc/sysrq-trigger")):
+      tmpr.append("The procfs filesystem doesn't seem to be mounted"
+                  " under /proc, missing required directory /proc/sys and"
+                  " the file /proc/sysrq-trigger")
+
+  if constants.NV_BRIDGES in what and vm_capable:
+    result[constants.NV_BRIDGES] = [bridge
+                                    for bridge in what[constants.NV_BRIDGES]
+                                    if not utils.BridgeExists(bridge)]
+
+  if what.get(constants.NV_ACCEPTED_STORAGE_PATHS) == my_name:
+    result[constants.NV_ACCEPTED_STORAGE_PATHS] = \
+        filestorage.ComputeWrongFileStoragePaths()
+
+  if what.get(constants.NV_FILE_STORAGE_PATH):
+    pathresult = filestorage.CheckFileStoragePath(
+        what[constants.NV_FILE_STORAGE_PATH])
+    if pathresult:
+      result[constants.NV_FILE_STORAGE_PATH] = pathresult
+
+
+def _VerifyLvm(what, vm_capable, result):
+  """Lists the logical volumes, volume groups and physical volumes.
+
+  """
+  if not vm_capable:
+    return
+
+  if constants.NV_LVLIST in what:
     try:
-      val = GetVolumeList(utils.ListVolumeGroups().keys())
+      val = GetVolumeList(ListVolumeGroups().keys())
     except RPCFail, err:
       val = str(err)
     result[constants.NV_LVLIST] = val
 
-  _VerifyInstanceList(what, vm_capable, result, all_hvparams)
+  if constants.NV_VGLIST in what:
+    result[constants.NV_VGLIST] = ListVolumeGroups()
 
-  if constants.NV_VGLIST in what and vm_capable:
-    result[constants.NV_VGLIST] = utils.ListVolumeGroups()
-
-  if constants.NV_PVLIST in what and vm_capable:
+  if constants.NV_PVLIST in what:
     check_exclusive_pvs = constants.NV_EXCLUSIVEPVS in what
     val = bdev.LogicalVolume.GetPVInfo(what[constants.NV_PVLIST],
                                        filter_allocatable=False,
@@ -1075,13 +1099,15 @@ def VerifyNode(what, cluster_name, all_hvparams):
         pvi.lv_list = []
     result[constants.NV_PVLIST] = map(objects.LvmPvInfo.ToDict, val)
 
-  if constants.NV_VERSION in what:
-    result[constants.NV_VERSION] = (constants.PROTOCOL_VERSION,
-                                    constants.RELEASE_VERSION)
 
-  _VerifyNodeInfo(what, vm_capable, result, all_hvparams)
+def _VerifyDrbd(what, vm_capable, result):
+  """Checks the DRBD version, used minors and usermode helper.
+
+  """
+  if not vm_capable:
+    return
 
-  if constants.NV_DRBDVERSION in what and vm_capable:
+  if constants.NV_DRBDVERSION in what:
     try:
       drbd_version = DRBD8.GetProcInfo().GetVersionString()
     except errors.BlockDeviceError, err:
@@ -1089,7 +1115,7 @@ def VerifyNode(what, cluster_name, all_hvparams):
       drbd_version = str(err)
     result[constants.NV_DRBDVERSION] = drbd_version
 
-  if constants.NV_DRBDLIST in what and vm_capable:
+  if constants.NV_DRBDLIST in what:
     try:
       used_minors = drbd.DRBD8.GetUsedDevs()
     except errors.BlockDeviceError, err:
@@ -1097,7 +1123,7 @@ def VerifyNode(what, cluster_name, all_hvparams):
       used_minors = str(err)
     result[constants.NV_DRBDLIST] = used_minors
 
-  if constants.NV_DRBDHELPER in what and vm_capable:
+  if constants.NV_DRBDHELPER in what:
     status = True
     try:
       payload = drbd.DRBD8.GetUsermodeHelper()
@@ -1107,38 +1133,154 @@ def VerifyNode(what, cluster_name, all_hvparams):
       payload = str(err)
     result[constants.NV_DRBDHELPER] = (status, payload)
 
-  if constants.NV_NODESETUP in what:
-    result[constants.NV_NODESETUP] = tmpr = []
-    if not os.path.isdir("/sys/block") or not os.path.isdir("/sys/class/net"):
-      tmpr.append("The sysfs filesytem doesn't seem to be mounted"
-                  " under /sys, missing required directories /sys/block"
-                  " and /sys/class/net")
-    if (not os.path.isdir("/proc/sys") or
-        not os.path.isfile("/proc/sysrq-trigger")):
-      tmpr.append("The procfs filesystem doesn't seem to be mounted"
-                  " under /proc, missing required directory /proc/sys and"
-                  " the file /proc/sysrq-trigger")
 
-  if constants.NV_TIME in what:
-    result[constants.NV_TIME] = utils.SplitTime(time.time())
+def _VerifyOsList(what, vm_capable, result):
+  """Diagnoses the installed operating systems.
 
+  """
   if constants.NV_OSLIST in what and vm_capable:
     result[constants.NV_OSLIST] = DiagnoseOS()
 
-  if constants.NV_BRIDGES in what and vm_capable:
-    result[constants.NV_BRIDGES] = [bridge
-                                    for bridge in what[constants.NV_BRIDGES]
-                                    if not utils.BridgeExists(bridge)]
 
-  if what.get(constants.NV_ACCEPTED_STORAGE_PATHS) == my_name:
-    result[constants.NV_ACCEPTED_STORAGE_PATHS] = \
-        filestorage.ComputeWrongFileStoragePaths()
+def _RunVerifyChecks(checks, result, _timer=time.time):
+  """Runs groups of node verification checks concurrently.
 
-  if what.get(constants.NV_FILE_STORAGE_PATH):
-    pathresult = filestorage.CheckFileStoragePath(
-        what[constants.NV_FILE_STORAGE_PATH])
-    if pathresult:
-      result[constants.NV_FILE_STORAGE_PATH] = pathresult
+  Checks still running when their timeout expires are abandoned and their
+  results are left out; the threads running them don't prevent the process
+  from exiting.
+
+  @type checks: list of tuples
+  @param checks: name, timeout and function of each group of checks; the
+    functions are called with a dictionary to add their results to
+  @type result: dict
+  @param result: dictionary of verification results; results of the checks
+    finishing in time are added here, along with their wall times
+    (L{constants.NV_CHECK_TIMES}) and the names of the checks which timed out
+    (L{constants.NV_TIMED_OUT_CHECKS})
+  @raise Exception: the first exception raised by a check
+
+  """
+  start = _timer()
+
+  def _Run(name, fn, check_result, state):
+    try:
+      fn(check_result)
+    except: # pylint: disable=W0702
+      logging.exception("Node verification check '%s' failed", name)
+      state["exc_info"] = sys.exc_info()
+    state["duration"] = _timer() - start
+
+  pending = []
+  for (name, timeout, fn) in checks:
+    check_result = {}
+    state = {}
+    thread = threading.Thread(target=_Run,
+                              args=(name, fn, check_result, state))
+    thread.setDaemon(True)
+    thread.start()
+    pending.append((name, timeout, thread, check_result, state))
+
+  check_times = {}
+  timed_out = []
+
+  for (name, timeout, thread, check_result, state) in pending:
+    thread.join(max(0, start + timeout - _timer()))
+
+    if thread.isAlive():
+      logging.warning("Node verification check '%s' timed out after %s"
+                      " seconds", name, timeout)
+      timed_out.append(name)
+      check_times[name] = _timer() - start
+      continue
+
+    exc_info = state.get("exc_info")
+    if exc_info:
+      raise exc_info[0], exc_info[1], exc_info[2]
+
+    result.update(check_result)
+    check_times[name] = state["duration"]
+
+  result[constants.NV_CHECK_TIMES] = check_times
+  result[constants.NV_TIMED_OUT_CHECKS] = timed_out
+
+
+def VerifyNode(what, cluster_name, all_hvparams):
+  """Verify the status of the local node.
+
+  Based on the input L{what} parameter, various checks are done on the
+  local node. Independent groups of checks are run concurrently, each with
+  a timeout of L{constants.NODE_VERIFY_CHECK_TIMEOUT} seconds; the wall time
+  of each group is returned in L{constants.NV_CHECK_TIMES}.
+
+  If the I{filelist} key is present, this list of
+  files is checksummed and the file/checksum pairs are returned.
+
+  If the I{nodelist} key is present, we check that we have
+  connectivity via ssh with the target nodes (and check the hostname
+  report).
+
+  If the I{node-net-test} key is present, we check that we have
+  connectivity to the given nodes via both primary IP and, if
+  applicable, secondary IPs.
+
+  @type what: C{dict}
+  @param what: a dictionary of things to check:
+      - filelist: list of files for which to compute checksums
+      - nodelist: list of nodes we should check ssh communication with
+      - node-net-test: list of nodes we should check node daemon port
+        connectivity with
+      - hypervisor: list with hypervisors to run the verify for
+  @type cluster_name: string
+  @param cluster_name: the cluster's name
+  @type all_hvparams: dict of dict of strings
+  @param all_hvparams: a dictionary mapping hypervisor names to hvparams
+  @rtype: dict
+  @return: a dictionary with the same keys as the input dict, and
+      values representing the result of the checks
+
+  """
+  result = {}
+  my_name = netutils.Hostname.GetSysName()
+  port = netutils.GetDaemonPort(constants.NODED)
+  vm_capable = my_name not in what.get(constants.NV_VMNODES, [])
+  timeout = constants.NODE_VERIFY_CHECK_TIMEOUT
+
+  # Groups of checks sharing no state, with the keys they handle
+  all_checks = [
+    ("hypervisor", [constants.NV_HYPERVISOR, constants.NV_HVPARAMS,
+                    constants.NV_INSTANCELIST, constants.NV_HVINFO],
+     compat.partial(_VerifyHypervisorState, what, vm_capable, all_hvparams)),
+    ("filelist", [constants.NV_FILELIST],
+     compat.partial(_VerifyFileList, what)),
+    ("nodelist", [constants.NV_NODELIST],
+     compat.partial(_VerifyNodeList, what, cluster_name, my_name)),
+    ("network", [constants.NV_NODENETTEST, constants.NV_MASTERIP],
+     compat.partial(_VerifyNetwork, what, my_name, port)),
+    ("setup", [constants.NV_USERSCRIPTS, constants.NV_OOB_PATHS,
+               constants.NV_NODESETUP, constants.NV_BRIDGES,
+               constants.NV_ACCEPTED_STORAGE_PATHS,
+               constants.NV_FILE_STORAGE_PATH],
+     compat.partial(_VerifyLocalSetup, what, my_name, vm_capable)),
+    ("lvm", [constants.NV_LVLIST, constants.NV_VGLIST, constants.NV_PVLIST],
+     compat.partial(_VerifyLvm, what, vm_capable)),
+    ("drbd", [constants.NV_DRBDVERSION, constants.NV_DRBDLIST,
+              constants.NV_DRBDHELPER],
+     compat.partial(_VerifyDrbd, what, vm_capable)),
+    ("oslist", [constants.NV_OSLIST],
+     compat.partial(_VerifyOsList, what, vm_capable)),
+    ]
+
+  _RunVerifyChecks([(name, timeout, fn)
+                    for (name, keys, fn) in all_checks
+                    if compat.any(key in what for key in keys)],
+                   result)
+
+  if constants.NV_VERSION in what:
+    result[constants.NV_VERSION] = (constants.PROTOCOL_VERSION,
+                                    constants.RELEASE_VERSION)
+
+  if constants.NV_TIME in what:
+    result[constants.NV_TIME] = utils.SplitTime(time.time())
 
   return result
 
@@ -1198,23 +1340,28 @@ def GetVolumeList(vg_names):
       details.
 
   """
-  lvs = {}
-  sep = "|"
-  if not vg_names:
-    vg_names = []
-  result = utils.RunCmd(["lvs", "--noheadings", "--units=m", "--nosuffix",
-                         "--separator=%s" % sep,
-                         "-ovg_name,lv_name,lv_size,lv_attr"] + vg_names)
-  if result.failed:
-    _Fail("Failed to list logical volumes, lvs output: %s", result.output)
+  try:
+    if vg_names:
+      missing = (frozenset(vg_names) -
+                 frozenset(vg["vg_name"] for vg in
+                           lvm_inventory.GetReport(lvm_inventory.REPORT_VGS)))
+      if missing:
+        _Fail("Failed to list logical volumes, volume group(s) not found: %s",
+              utils.CommaJoin(missing))
+
+    report = lvm_inventory.GetReport(lvm_inventory.REPORT_LVS)
+  except errors.CommandError, err:
+    _Fail("Failed to list logical volumes: %s", err)
 
-  for line in result.stdout.splitlines():
-    line = line.strip()
-    match = _LVSLINE_REGEX.match(line)
-    if not match:
-      logging.error("Invalid line returned from lvs output: '%s'", line)
+  lvs = {}
+  for lv in report:
+    if vg_names and lv["vg_name"] not in vg_names:
+      continue
+    attr = lv["lv_attr"]
+    if len(attr) < 6:
+      logging.error("Invalid attributes for logical volume %s/%s: '%s'",
+                    lv["vg_name"], lv["lv_name"], attr)
       continue
-    vg_name, name, size, attr = match.groups()
     inactive = attr[4] == "-"
     online = attr[5] == "o"
     virtual = attr[0] == "v"
@@ -1222,7 +1369,8 @@ def GetVolumeList(vg_names):
       # we don't want to report such volumes as existing, since they
       # don't really hold data
       continue
-    lvs[vg_name + "/" + name] = (size, inactive, online)
+    lvs[lv["vg_name"] + "/" + lv["lv_name"]] = (lv["lv_size"], inactive,
+                                                online)
 
   return lvs
 
@@ -1235,7 +1383,21 @@ def ListVolumeGroups():
       size of the volume
 
   """
-  return utils.ListVolumeGroups()
+  try:
+    report = lvm_inventory.GetReport(lvm_inventory.REPORT_VGS)
+  except errors.CommandError, err:
+    logging.error("Can't list volume groups: %s", err)
+    return {}
+
+  result = {}
+  for vg in report:
+    try:
+      result[vg["vg_name"]] = int(float(vg["vg_size"]))
+    except ValueError, err:
+      logging.error("Invalid size for volume group %s (%s): %s",
+                    vg["vg_name"], err, vg["vg_size"])
+
+  return result
 
 
 def NodeVolumes():
@@ -1257,12 +1419,10 @@ def NodeVolumes():
     multiple times.
 
   """
-  result = utils.RunCmd(["lvs", "--noheadings", "--units=m", "--nosuffix",
-                         "--separator=|",
-                         "--options=lv_name,lv_size,devices,vg_name"])
-  if result.failed:
-    _Fail("Failed to list logical volumes, lvs output: %s",
-          result.output)
+  try:
+    report = lvm_inventory.GetReport(lvm_inventory.REPORT_LVS)
+  except errors.CommandError, err:
+    _Fail("Failed to list logical volumes: %s", err)
 
   def parse_dev(dev):
     return dev.split("(")[0]
@@ -1270,17 +1430,11 @@ def NodeVolumes():
   def handle_dev(dev):
     return [parse_dev(x) for x in dev.split(",")]
 
-  def map_line(line):
-    line = [v.strip() for v in line]
-    return [{"name": line[0], "size": line[1],
-             "dev": dev, "vg": line[3]} for dev in handle_dev(line[2])]
-
   all_devs = []
-  for line in result.stdout.splitlines():
-    if line.count("|") >= 3:
-      all_devs.extend(map_line(line.split("|")))
-    else:
-      logging.warning("Strange line in the output from lvs: '%s'", line)
+  for lv in report:
+    all_devs.extend({"name": lv["lv_name"], "size": lv["lv_size"],
+                     "dev": dev, "vg": lv["vg_name"]}
+                    for dev in handle_dev(lv["devices"]))
   return all_devs
 
 
@@ -1603,6 +1757,20 @@ def _RemoveBlockDevLinks(instance_name, disks):
         logging.exception("Can't remove symlink '%s'", link_name)
 
 
+def _IsUserspaceAccessDisk(disk):
+  """Checks whether the hypervisor accesses a disk in userspace.
+
+  Such disks are neither opened nor symlinked on the node when they are
+  assembled for an instance, as the hypervisor accesses them directly.
+
+  @type disk: L{objects.Disk}
+  @param disk: the disk to check
+  @rtype: boolean
+
+  """
+  return disk.params.get(constants.LDP_ACCESS) == constants.DISK_USERSPACE
+
+
 def _GatherAndLinkBlockDevs(instance):
   """Set up an instance's block device(s).
 
@@ -1612,7 +1780,8 @@ def _GatherAndLinkBlockDevs(instance):
   @type instance: L{objects.Instance}
   @param instance: the instance whose disks we shoul assemble
   @rtype: list
-  @return: list of (disk_object, device_path)
+  @return: list of (disk_object, device_path); the device path is C{None}
+      for disks accessed in userspace
 
   """
   block_devices = []
@@ -1621,6 +1790,9 @@ def _GatherAndLinkBlockDevs(instance):
     if device is None:
       raise errors.BlockDeviceError("Block device '%s' is not set up." %
                                     str(disk))
+    if _IsUserspaceAccessDisk(disk):
+      block_devices.append((disk, None, device))
+      continue
     device.Open()
     try:
       link_name = _SymlinkBlockDev(instance.name, device.dev_path, idx)
@@ -2052,6 +2224,10 @@ def BlockdevWipe(disk, offset, size):
   if (offset + size) > rdev.size:
     _Fail("The provided offset and size to wipe is bigger than device size")
 
+  if _IsUserspaceAccessDisk(disk):
+    # make sure the disk is mapped into the kernel for dd
+    rdev.Open()
+
   _WipeDevice(rdev.dev_path, offset, size)
 
 
@@ -2171,6 +2347,9 @@ def _RecursiveAssembleBD(disk, owner, as_primary):
   if as_primary or disk.AssembleOnSecondary():
     r_dev = bdev.Assemble(disk, children)
     result = r_dev
+    if _IsUserspaceAccessDisk(disk):
+      # the hypervisor opens the disk itself, don't map it into the kernel
+      return result
     if as_primary or disk.OpenOnSecondary():
       r_dev.Open()
     DevCacheManager.UpdateCache(r_dev.dev_path, owner,
@@ -2187,13 +2366,17 @@ def BlockdevAssemble(disk, owner, as_primary, idx):
   This is a wrapper over _RecursiveAssembleBD.
 
   @rtype: str or boolean
-  @return: a C{/dev/...} path for primary nodes, and
-      C{True} for secondary nodes
+  @return: a C{/dev/...} path (or the userspace access URI) for primary
+      nodes, and C{True} for secondary nodes
 
   """
   try:
     result = _RecursiveAssembleBD(disk, owner, as_primary)
-    if isinstance(result, BlockDev):
+    if isinstance(result, BlockDev) and _IsUserspaceAccessDisk(disk):
+      # userspace access is only supported by KVM
+      # pylint: disable=E1103
+      result = result.GetUserspaceAccessUri(constants.HT_KVM)
+    elif isinstance(result, BlockDev):
       # pylint: disable=E1103
       result = result.dev_path
       if as_primary:
@@ -2206,6 +2389,37 @@ def BlockdevAssemble(disk, owner, as_primary, idx):
   return result
 
 
+@drbd.WithShowDataSnapshot
+def BlockdevAssembleMulti(disks):
+  """Activate a list of block devices.
+
+  The configuration of already active DRBD devices is read once for all
+  disks.
+
+  @type disks: list of tuples
+  @param disks: list of (disk, owner, as_primary, idx) tuples, see
+      L{BlockdevAssemble}
+  @rtype: list of tuples
+  @return: for each disk, a tuple (success, result), where result is the
+      return value of L{BlockdevAssemble} on success and the error message
+      otherwise
+
+  """
+  result = []
+  for (disk, owner, as_primary, idx) in disks:
+    try:
+      result.append((True, BlockdevAssemble(disk, owner, as_primary, idx)))
+    except RPCFail, err:
+      result.append((False, str(err)))
+    except Exception, err: # pylint: disable=W0703
+      logging.exception("Error while assembling disk %s", disk)
+      result.append((False, "Error while assembling disk: %s" % err))
+
+  assert len(disks) == len(result)
+
+  return result
+
+
 def BlockdevShutdown(disk):
   """Shut down a block device.
 
@@ -2292,6 +2506,7 @@ def BlockdevRemovechildren(parent_cdev, new_cdevs):
   parent_bdev.RemoveChildren(devs)
 
 
+@drbd.WithProcInfoSnapshot
 def BlockdevGetmirrorstatus(disks):
   """Get the mirroring status of a list of devices.
 
@@ -2314,6 +2529,7 @@ def BlockdevGetmirrorstatus(disks):
   return stats
 
 
+@drbd.WithProcInfoSnapshot
 def BlockdevGetmirrorstatusMulti(disks):
   """Get the mirroring status of a list of devices.
 
@@ -2381,6 +2597,7 @@ def _OpenRealBD(disk):
   return real_disk
 
 
+@drbd.WithProcInfoSnapshot
 def BlockdevFind(disk):
   """Check if a device is activated.
 
@@ -2404,6 +2621,7 @@ def BlockdevFind(disk):
   return rbd.GetSyncStatus()
 
 
+@drbd.WithProcInfoSnapshot
 def BlockdevGetdimensions(disks):
   """Computes the size of the given disks.
 
@@ -2981,6 +3199,58 @@ def BlockdevSnapshot(disk):
           disk.unique_id, disk.dev_type)
 
 
+def _GetRbdVolume(disk):
+  """Returns the device of an RBD disk without attaching to it.
+
+  Snapshots and diffs are handled by the rbd tool, so the volume doesn't
+  need to be mapped.
+
+  @type disk: L{objects.Disk}
+  @rtype: L{bdev.RADOSBlockDevice}
+
+  """
+  if disk.dev_type != constants.LD_RBD:
+    _Fail("Disk '%s' of type '%s' is not an RBD volume",
+          disk.unique_id, disk.dev_type)
+
+  return bdev.RADOSBlockDevice(disk.physical_id, [], disk.size, disk.params,
+                               attach=False)
+
+
+def BlockdevRbdSnapshot(disk, snap_name):
+  """Creates a snapshot of an RBD volume.
+
+  @type disk: L{objects.Disk}
+  @param disk: the RBD disk to be snapshotted
+  @type snap_name: string
+  @param snap_name: name of the snapshot
+
+  """
+  r_dev = _GetRbdVolume(disk)
+  try:
+    r_dev.CreateSnapshot(snap_name)
+  except errors.BlockDeviceError, err:
+    _Fail("Failed to snapshot RBD volume: %s", err, exc=True)
+
+
+def BlockdevRbdRemoveSnapshot(disk, snap_name):
+  """Removes a snapshot of an RBD volume.
+
+  Removing a snapshot which doesn't exist is not an error.
+
+  @type disk: L{objects.Disk}
+  @param disk: the RBD disk
+  @type snap_name: string
+  @param snap_name: name of the snapshot
+
+  """
+  r_dev = _GetRbdVolume(disk)
+  try:
+    r_dev.RemoveSnapshot(snap_name)
+  except errors.BlockDeviceError, err:
+    _Fail("Failed to remove RBD snapshot: %s", err, exc=True)
+
+
 def BlockdevSetInfo(disk, info):
   """Sets 'metadata' information on block devices.
 
@@ -3548,7 +3818,8 @@ def RemoveX509Certificate(name, cryptodir=pathutils.CRYPTO_KEYS_DIR):
           cert_dir, err)
 
 
-def _GetImportExportIoCommand(instance, mode, ieio, ieargs):
+def _GetImportExportIoCommand(instance, mode, ieio, ieargs, sparse=False,
+                              disk_range=None):
   """Returns the command for the requested input/output.
 
   @type instance: L{objects.Instance}
@@ -3556,6 +3827,13 @@ def _GetImportExportIoCommand(instance, mode, ieio, ieargs):
   @param mode: Import/export mode
   @param ieio: Input/output type
   @param ieargs: Input/output arguments
+  @type sparse: bool
+  @param sparse: Whether to transfer file and raw disk data as a sparse
+      stream (see L{impexpd.sparse}); as the amount of data sent is not
+      known in advance, no expected size is returned in that case
+  @type disk_range: tuple or None
+  @param disk_range: Offset and size in MiB of the part of a raw disk to
+      transfer, None for the whole disk
 
   """
   assert mode in (constants.IEM_IMPORT, constants.IEM_EXPORT)
@@ -3583,7 +3861,15 @@ def _GetImportExportIoCommand(instance, mode, ieio, ieargs):
 
     quoted_filename = utils.ShellQuote(filename)
 
-    if mode == constants.IEM_IMPORT:
+    if sparse:
+      if mode == constants.IEM_IMPORT:
+        suffix = utils.BuildShellCmd("| %s decode --create %s",
+                                     pathutils.SPARSE_TRANSFER, filename)
+      elif mode == constants.IEM_EXPORT:
+        prefix = utils.BuildShellCmd("%s encode %s |",
+                                     pathutils.SPARSE_TRANSFER, filename)
+
+    elif mode == constants.IEM_IMPORT:
       suffix = "> %s" % quoted_filename
     elif mode == constants.IEM_EXPORT:
       suffix = "< %s" % quoted_filename
@@ -3601,7 +3887,47 @@ def _GetImportExportIoCommand(instance, mode, ieio, ieargs):
 
     real_disk = _OpenRealBD(disk)
 
-    if mode == constants.IEM_IMPORT:
+    if disk_range is None:
+      (offset, size) = (None, disk.size)
+    else:
+      (offset, size) = disk_range
+      if offset < 0 or size <= 0 or offset + size > disk.size:
+        _Fail("Invalid range %s for disk of size %s", disk_range, disk.size)
+
+    if sparse:
+      if mode == constants.IEM_IMPORT:
+        # the sparse stream recreates zero regions by zeroing out the
+        # device, which lets the kernel discard them where supported
+        if offset is None:
+          suffix = utils.BuildShellCmd("| %s decode %s",
+                                       pathutils.SPARSE_TRANSFER,
+                                       real_disk.dev_path)
+        else:
+          suffix = utils.BuildShellCmd("| %s decode --offset=%s %s",
+                                       pathutils.SPARSE_TRANSFER,
+                                       str(offset), real_disk.dev_path)
+      elif mode == constants.IEM_EXPORT:
+        prefix = utils.BuildShellCmd("%s encode --offset=%s --size=%s %s |",
+                                     pathutils.SPARSE_TRANSFER,
+                                     str(offset or 0), str(size),
+                                     real_disk.dev_path)
+
+    elif offset is not None:
+      # only a range of the disk is transferred, the other ranges are
+      # transferred by separate imports/exports in parallel
+      if mode == constants.IEM_IMPORT:
+        # conv=notrunc is essential here, the other ranges must be kept
+        suffix = utils.BuildShellCmd(("| dd of=%s conv=nocreat,notrunc"
+                                      " bs=%s seek=%s oflag=dsync"),
+                                     real_disk.dev_path, str(1024 * 1024),
+                                     str(offset))
+      elif mode == constants.IEM_EXPORT:
+        prefix = utils.BuildShellCmd("dd if=%s bs=%s skip=%s count=%s |",
+                                     real_disk.dev_path, str(1024 * 1024),
+                                     str(offset), str(size))
+        exp_size = size
+
+    elif mode == constants.IEM_IMPORT:
       # we set here a smaller block size as, due to transport buffering, more
       # than 64-128k will mostly ignored; we use nocreat to fail if the device
       # is not already there or we pass a wrong path; we use notrunc to no
@@ -3653,6 +3979,20 @@ def _GetImportExportIoCommand(instance, mode, ieio, ieargs):
     # Let script predict size
     exp_size = constants.IE_CUSTOM_SIZE
 
+  elif ieio == constants.IEIO_RBD_DIFF:
+    # the data is read and written by the rbd tool, the volumes don't need
+    # to be mapped; as only allocated or changed extents are included, the
+    # amount of data sent is not known in advance
+    if mode == constants.IEM_IMPORT:
+      (disk, ) = ieargs
+      suffix = "| %s" % utils.ShellQuoteArgs(
+        _GetRbdVolume(disk).GetImportDiffCmd())
+
+    elif mode == constants.IEM_EXPORT:
+      (disk, from_snap, snap_name) = ieargs
+      prefix = "%s |" % utils.ShellQuoteArgs(
+        _GetRbdVolume(disk).GetExportDiffCmd(snap_name, from_snap=from_snap))
+
   else:
     _Fail("Invalid %s I/O mode %r", mode, ieio)
 
@@ -3678,7 +4018,8 @@ def StartImportExportDaemon(mode, opts, host, port, instance, component,
   @type host: string
   @param host: Remote host for export (None for import)
   @type port: int
-  @param port: Remote port for export (None for import)
+  @param port: Remote port for export (None for import, see
+      L{objects.ImportExportOptions.listen_port})
   @type instance: L{objects.Instance}
   @param instance: Instance object
   @type component: string
@@ -3694,6 +4035,9 @@ def StartImportExportDaemon(mode, opts, host, port, instance, component,
     if not (host is None and port is None):
       _Fail("Can not specify host or port on import")
 
+    # Imports listen on any free port unless told otherwise
+    port = opts.listen_port
+
   elif mode == constants.IEM_EXPORT:
     prefix = "export"
 
@@ -3706,8 +4050,16 @@ def StartImportExportDaemon(mode, opts, host, port, instance, component,
   if (opts.key_name is None) ^ (opts.ca_pem is None):
     _Fail("Cluster certificate can only be used for both key and CA")
 
+  if opts.sparse and ieio not in constants.IEIO_SPARSE:
+    _Fail("Sparse transfers are not supported for %s I/O", ieio)
+
+  if opts.disk_range is not None and ieio != constants.IEIO_RAW_DISK:
+    _Fail("Disk ranges can only be transferred with raw disk I/O")
+
   (cmd_env, cmd_prefix, cmd_suffix, exp_size) = \
-    _GetImportExportIoCommand(instance, mode, ieio, ieioargs)
+    _GetImportExportIoCommand(instance, mode, ieio, ieioargs,
+                              sparse=bool(opts.sparse),
+                              disk_range=opts.disk_range)
 
   if opts.key_name is None:
     # Use server.pem
@@ -3774,7 +4126,11 @@ def StartImportExportDaemon(mode, opts, host, port, instance, component,
 
     if mode == constants.IEM_EXPORT:
       # Retry connection a few times when connecting to remote peer
-      cmd.append("--connect-retries=%s" % constants.RIE_CONNECT_RETRIES)
+      if opts.connect_retries is None:
+        connect_retries = constants.RIE_CONNECT_RETRIES
+      else:
+        connect_retries = opts.connect_retries
+      cmd.append("--connect-retries=%s" % connect_retries)
       cmd.append("--connect-timeout=%s" % constants.RIE_CONNECT_ATTEMPT_TIMEOUT)
     elif opts.connect_timeout is not None:
       assert mode == constants.IEM_IMPORT
@@ -3796,6 +4152,16 @@ def StartImportExportDaemon(mode, opts, host, port, instance, component,
     raise
 
 
+def GetImportExportCompressionMethods():
+  """Returns the compression methods usable for imports and exports.
+
+  @rtype: list
+  @return: List of compression methods (from L{constants.IEC_ALL})
+
+  """
+  return impexpd.GetCompressionMethods()
+
+
 def GetImportExportStatus(names):
   """Returns import/export daemon status.
 
@@ -3996,6 +4362,7 @@ def DrbdWaitSync(target_node_uuid, nodes_ip, disks):
   return (alldone, min_resync)
 
 
+@drbd.WithProcInfoSnapshot
 def DrbdNeedsActivation(target_node_uuid, nodes_ip, disks):
   """Checks which of the passed disks needs activation and returns their UUIDs.
 
@@ -4283,14 +4650,19 @@ class HooksRunner(object):
     _, myself = ssconf.GetMasterAndMyself()
     assert node == myself
 
-    results = self.RunHooks(hpath, phase, env)
+    results = self.RunHooks(hpath, phase, env, with_durations=True)
 
     # Return values in the form expected by HooksMaster
     return {node: (None, False, results)}
 
-  def RunHooks(self, hpath, phase, env):
+  def RunHooks(self, hpath, phase, env, with_durations=False):
     """Run the scripts in the hooks directory.
 
+    If the directory contains a L{constants.HOOKS_PARALLEL_MARKER} file,
+    scripts with the same leading order number are run concurrently, see
+    L{utils.RunParts}. Each script is terminated after
+    L{constants.HOOKS_SCRIPT_TIMEOUT} seconds.
+
     @type hpath: str
     @param hpath: the path to the hooks directory which
         holds the scripts
@@ -4299,12 +4671,17 @@ class HooksRunner(object):
         L{constants.HOOKS_PHASE_POST}
     @type env: dict
     @param env: dictionary with the environment for the hook
+    @type with_durations: boolean
+    @param with_durations: whether to add the run time of each script to
+        its result
     @rtype: list
-    @return: list of 3-element tuples:
+    @return: list of tuples:
       - script path
       - script result, either L{constants.HKR_SUCCESS} or
         L{constants.HKR_FAIL}
       - output of the script
+      - only if C{with_durations} is set: run time of the script in
+        seconds, or None if it wasn't run
 
     @raise errors.ProgrammerError: for invalid input
         parameters
@@ -4327,7 +4704,13 @@ class HooksRunner(object):
       # warning at every operation
       return results
 
-    runparts_results = utils.RunParts(dir_name, env=env, reset_env=True)
+    parallel = os.path.exists(utils.PathJoin(dir_name,
+                                             constants.HOOKS_PARALLEL_MARKER))
+    durations = {}
+
+    runparts_results = utils.RunParts(dir_name, env=env, reset_env=True,
+                                      timeout=constants.HOOKS_SCRIPT_TIMEOUT,
+                                      parallel=parallel, durations=durations)
 
     for (relname, relstatus, runresult) in runparts_results:
       if relstatus == constants.RUNPARTS_SKIP:
@@ -4341,8 +4724,15 @@ class HooksRunner(object):
           rrval = constants.HKR_FAIL
         else:
           rrval = constants.HKR_SUCCESS
-        output = utils.SafeEncode(runresult.output.strip())
-      results.append(("%s/%s" % (subdir, relname), rrval, output))
+        output = runresult.output.strip()
+        if runresult.failed and runresult.exit_code is None:
+          # Terminated by a signal, e.g. after the timeout
+          output = "%s\n(%s)" % (output, runresult.fail_reason)
+        output = utils.SafeEncode(output.strip())
+      result = ("%s/%s" % (subdir, relname), rrval, output)
+      if with_durations:
+        result += (durations.get(relname, None), )
+      results.append(result)
 
     return results
 
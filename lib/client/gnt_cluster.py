@@ -58,6 +58,11 @@ FORCE_FAILOVER = cli_option("--yes-do-it", dest="yes_do_it",
                             help="Override interactive check for --no-voting",
                             default=False, action="store_true")
 
+SKIP_UNCHANGED_OPT = cli_option("--skip-unchanged", dest="skip_unchanged",
+                                default=False, action="store_true",
+                                help=("Don't upload ancillary files to nodes"
+                                      " whose copy has the same contents"))
+
 _EPO_PING_INTERVAL = 30 # 30 seconds between pings
 _EPO_PING_TIMEOUT = 1 # 1 second
 _EPO_REACHABLE_TIMEOUT = 15 * 60 # 15 minutes
@@ -358,7 +363,7 @@ def RedistributeConfig(opts, args):
   @return: the desired exit code
 
   """
-  op = opcodes.OpClusterRedistConf()
+  op = opcodes.OpClusterRedistConf(skip_unchanged=opts.skip_unchanged)
   SubmitOrSend(op, opts)
   return 0
 
@@ -1565,7 +1570,8 @@ commands = {
     "<new_name>",
     "Renames the cluster"),
   "redist-conf": (
-    RedistributeConfig, ARGS_NONE, SUBMIT_OPTS + [DRY_RUN_OPT, PRIORITY_OPT],
+    RedistributeConfig, ARGS_NONE,
+    SUBMIT_OPTS + [DRY_RUN_OPT, PRIORITY_OPT, SKIP_UNCHANGED_OPT],
     "", "Forces a push of the configuration file and ssconf files"
     " to the nodes in the cluster"),
   "verify": (
@@ -162,8 +162,30 @@ class LUBackupPrepare(NoHooksLU):
       cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM,
                                              cert_pem)
 
+      # Announce the compression methods usable on the source node, the
+      # destination chooses one it supports as well. Destination clusters
+      # of older versions only accept the legacy handshake, so the client
+      # uses the extended one only if the destination supports it.
+      (compressions, ) = \
+        masterd.instance.GetCompressionMethods(self,
+                                               [self.instance.primary_node])
+
+      # RBD volumes can be sent as diffs, which only contain the allocated
+      # extents
+      if (self.instance.disks and
+          compat.all(disk.dev_type == constants.LD_RBD
+                     for disk in self.instance.disks)):
+        ieios = [constants.IEIO_RBD_DIFF]
+      else:
+        ieios = None
+
       return {
-        "handshake": masterd.instance.ComputeRemoteExportHandshake(self._cds),
+        "handshake":
+          masterd.instance.ComputeRemoteExportHandshake(self._cds),
+        "extended_handshake":
+          masterd.instance.ComputeRemoteExportHandshake(self._cds,
+                                                        compressions,
+                                                        ieios=ieios),
         "x509_key_name": (name, utils.Sha1Hmac(self._cds, name, salt=salt),
                           salt),
         "x509_ca": utils.SignX509Certificate(cert, self._cds, salt),
@@ -323,13 +345,18 @@ class LUBackupExport(LogicalUnit):
       disk_info = []
       for idx, disk_data in enumerate(self.op.target_node):
         try:
-          (host, port, magic) = \
+          (host, port, magic, compress, ieio) = \
             masterd.instance.CheckRemoteExportDiskInfo(cds, idx, disk_data)
         except errors.GenericError, err:
           raise errors.OpPrereqError("Target info for disk %s: %s" %
                                      (idx, err), errors.ECODE_INVAL)
 
-        disk_info.append((host, port, magic))
+        if (ieio == constants.IEIO_RBD_DIFF and
+            self.instance.disks[idx].dev_type != constants.LD_RBD):
+          raise errors.OpPrereqError("Target info for disk %s: disk is not an"
+                                     " RBD volume" % idx, errors.ECODE_INVAL)
+
+        disk_info.append((host, port, magic, compress, ieio))
 
       assert len(disk_info) == len(self.op.target_node)
       self.dest_disk_info = disk_info
@@ -382,34 +409,56 @@ class LUBackupExport(LogicalUnit):
 
     src_node_uuid = self.instance.primary_node
 
-    if self.op.shutdown:
-      # shutdown the instance, but not the disks
-      feedback_fn("Shutting down instance %s" % self.instance.name)
-      result = self.rpc.call_instance_shutdown(src_node_uuid, self.instance,
-                                               self.op.shutdown_timeout,
-                                               self.op.reason)
-      # TODO: Maybe ignore failures if ignore_remove_failures is set
-      result.Raise("Could not shutdown instance %s on"
-                   " node %s" % (self.instance.name,
-                                 self.cfg.GetNodeName(src_node_uuid)))
-
-    # set the disks ID correctly since call_instance_start needs the
-    # correct drbd minor to create the symlinks
-    for disk in self.instance.disks:
-      self.cfg.SetDiskID(disk, src_node_uuid)
+    helper = masterd.instance.ExportInstanceHelper(self, feedback_fn,
+                                                   self.instance)
+
+    if self.op.mode == constants.EXPORT_MODE_REMOTE:
+      connect_timeout = constants.RIE_CONNECT_TIMEOUT
+      timeouts = masterd.instance.ImportExportTimeouts(connect_timeout)
+
+      (key_name, _, _) = self.x509_key_name
 
-    activate_disks = not self.instance.disks_active
+      dest_ca_pem = \
+        OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM,
+                                        self.dest_x509_ca)
 
-    if activate_disks:
-      # Activate the instance disks if we'exporting a stopped instance
-      feedback_fn("Activating disks for %s" % self.instance.name)
-      StartInstanceDisks(self, self.instance, None)
+      # Volumes sent as RBD diffs are sent while the instance is still
+      # running, only their changes are sent after shutting it down
+      if not helper.RemoteExportBase(self.dest_disk_info, key_name,
+                                     dest_ca_pem, timeouts):
+        raise errors.OpExecError("Export failed, errors in sending the base"
+                                 " of RBD disks")
 
     try:
-      helper = masterd.instance.ExportInstanceHelper(self, feedback_fn,
-                                                     self.instance)
+      if self.op.shutdown:
+        # shutdown the instance, but not the disks
+        feedback_fn("Shutting down instance %s" % self.instance.name)
+        result = self.rpc.call_instance_shutdown(src_node_uuid, self.instance,
+                                                 self.op.shutdown_timeout,
+                                                 self.op.reason)
+        # TODO: Maybe ignore failures if ignore_remove_failures is set
+        result.Raise("Could not shutdown instance %s on"
+                     " node %s" % (self.instance.name,
+                                   self.cfg.GetNodeName(src_node_uuid)))
+
+      # set the disks ID correctly since call_instance_start needs the
+      # correct drbd minor to create the symlinks
+      for disk in self.instance.disks:
+        self.cfg.SetDiskID(disk, src_node_uuid)
+
+      activate_disks = not self.instance.disks_active
 
-      helper.CreateSnapshots()
+      if activate_disks:
+        # Activate the instance disks if we'exporting a stopped instance
+        feedback_fn("Activating disks for %s" % self.instance.name)
+        StartInstanceDisks(self, self.instance, None)
+    except:
+      # Remove the base snapshots of RBD disks
+      helper.Cleanup()
+      raise
+
+    try:
+      helper.CreateSnapshots(disk_info=self.dest_disk_info)
       try:
         if (self.op.shutdown and
             self.instance.admin_state == constants.ADMINST_UP and
@@ -428,15 +477,6 @@ class LUBackupExport(LogicalUnit):
         if self.op.mode == constants.EXPORT_MODE_LOCAL:
           (fin_resu, dresults) = helper.LocalExport(self.dst_node)
         elif self.op.mode == constants.EXPORT_MODE_REMOTE:
-          connect_timeout = constants.RIE_CONNECT_TIMEOUT
-          timeouts = masterd.instance.ImportExportTimeouts(connect_timeout)
-
-          (key_name, _, _) = self.x509_key_name
-
-          dest_ca_pem = \
-            OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM,
-                                            self.dest_x509_ca)
-
           (fin_resu, dresults) = helper.RemoteExport(self.dest_disk_info,
                                                      key_name, dest_ca_pem,
                                                      timeouts)
@@ -65,6 +65,9 @@ class LogicalUnit(object):
     - redefine HPATH and HTYPE
     - optionally redefine their run requirements:
         REQ_BGL: the LU needs to hold the Big Ganeti Lock exclusively
+    - optionally set HOOKS_ASYNC_POST, if the post-hooks can run in the
+      background after the LU finished; their results are then only logged
+      and not passed to L{HooksCallBack}
 
   Note that all commands require root permissions.
 
@@ -75,6 +78,7 @@ class LogicalUnit(object):
   HPATH = None
   HTYPE = None
   REQ_BGL = True
+  HOOKS_ASYNC_POST = False
 
   def __init__(self, processor, op, context, rpc_runner):
     """Constructor for LogicalUnit.
@@ -350,7 +350,7 @@ class LUClusterRedistConf(NoHooksLU):
 
     """
     self.cfg.Update(self.cfg.GetClusterInfo(), feedback_fn)
-    RedistributeAncillaryFiles(self)
+    RedistributeAncillaryFiles(self, skip_unchanged=self.op.skip_unchanged)
 
 
 class LUClusterRename(LogicalUnit):
@@ -1352,6 +1352,25 @@ def _GetAllHypervisorParameters(cluster, instances):
   return hvp_data
 
 
+def _GetSlowestNodeCheck(nresult):
+  """Returns the slowest check run by a node verification RPC.
+
+  @param nresult: the results from the node
+  @rtype: tuple or None
+  @return: name and wall time of the check, or None if the node didn't report
+    the times of its checks
+
+  """
+  if not isinstance(nresult, dict):
+    return None
+
+  check_times = nresult.get(constants.NV_CHECK_TIMES, None)
+  if not check_times or not isinstance(check_times, dict):
+    return None
+
+  return max(check_times.items(), key=compat.snd)
+
+
 class LUClusterVerifyConfig(NoHooksLU, _VerifyErrors):
   """Verifies the cluster config.
 
@@ -1686,6 +1705,11 @@ class LUClusterVerifyGroup(LogicalUnit, _VerifyErrors):
     self._ErrorIf(test, constants.CV_ENODESETUP, ninfo.name,
                   "node setup error: %s", "; ".join(test))
 
+    for check in nresult.get(constants.NV_TIMED_OUT_CHECKS, []):
+      self._ErrorIf(True, constants.CV_ENODERPC, ninfo.name,
+                    "node verification check '%s' timed out, its results"
+                    " are missing", check)
+
     return True
 
   def _VerifyNodeTime(self, ninfo, nresult,
@@ -2872,6 +2896,7 @@ class LUClusterVerifyGroup(LogicalUnit, _VerifyErrors):
     feedback_fn("* Verifying node status")
 
     refos_img = None
+    slowest_check = None
 
     for node_i in node_data_list:
       nimg = node_image[node_i.uuid]
@@ -2904,6 +2929,14 @@ class LUClusterVerifyGroup(LogicalUnit, _VerifyErrors):
       nresult = all_nvinfo[node_i.uuid].payload
 
       nimg.call_ok = self._VerifyNode(node_i, nresult)
+
+      slowest = _GetSlowestNodeCheck(nresult)
+      if slowest:
+        if verbose:
+          feedback_fn("  - Slowest check: '%s' (%.1f seconds)" % slowest)
+        if not slowest_check or slowest[1] > slowest_check[2]:
+          slowest_check = (node_i.name, ) + slowest
+
       self._VerifyNodeTime(node_i, nresult, nvinfo_starttime, nvinfo_endtime)
       self._VerifyNodeNetwork(node_i, nresult)
       self._VerifyNodeUserScripts(node_i, nresult)
@@ -3000,6 +3033,10 @@ class LUClusterVerifyGroup(LogicalUnit, _VerifyErrors):
     if n_drained:
       feedback_fn("  - NOTICE: %d drained node(s) found." % n_drained)
 
+    if slowest_check:
+      feedback_fn("  - Slowest node check: '%s' on node %s (%.1f seconds)" %
+                  (slowest_check[1], slowest_check[0], slowest_check[2]))
+
     return not self.bad
 
   def HooksCallBack(self, phase, hooks_results, feedback_fn, lu_result):
@@ -3037,7 +3074,8 @@ class LUClusterVerifyGroup(LogicalUnit, _VerifyErrors):
           # No need to investigate payload if node is offline or gave
           # an error.
           continue
-        for script, hkr, output in res.payload:
+        for script_result in res.payload:
+          (script, hkr, output) = script_result[:3]
           test = hkr == constants.HKR_FAIL
           self._ErrorIf(test, constants.CV_ENODEHOOKS, node_name,
                         "Script %s failed, output:", script)
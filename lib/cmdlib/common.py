@@ -22,6 +22,7 @@
 """Common functions used by multiple logical units."""
 
 import copy
+import logging
 import os
 
 from ganeti import compat
@@ -35,6 +36,7 @@ from ganeti import pathutils
 from ganeti import rpc
 from ganeti import ssconf
 from ganeti import utils
+from ganeti import vcluster
 
 
 # States of instance
@@ -184,13 +186,18 @@ def RunPostHook(lu, node_name):
                   node_name, err)
 
 
-def RedistributeAncillaryFiles(lu):
+def RedistributeAncillaryFiles(lu, skip_unchanged=False):
   """Distribute additional files which are part of the cluster configuration.
 
   ConfigWriter takes care of distributing the config and ssconf files, but
   there are more files which should be distributed to all nodes. This function
   makes sure those are copied.
 
+  @type skip_unchanged: boolean
+  @param skip_unchanged: whether to only upload files to nodes whose copy has
+      different contents; the nodes are asked for the fingerprints of their
+      copies first, and file permissions are not compared
+
   """
   # Gather target nodes
   cluster = lu.cfg.GetClusterInfo()
@@ -222,8 +229,84 @@ def RedistributeAncillaryFiles(lu):
 
   # Upload the files
   for (node_uuids, files) in filemap:
+    if skip_unchanged:
+      up_to_date = _GetUpToDateFiles(lu, node_uuids, files)
+    else:
+      up_to_date = {}
     for fname in files:
-      UploadHelper(lu, node_uuids, fname)
+      target_node_uuids = [node_uuid for node_uuid in node_uuids
+                           if node_uuid not in up_to_date.get(fname, [])]
+      if target_node_uuids:
+        UploadHelper(lu, target_node_uuids, fname)
+
+
+def _GetFileListResult(nres):
+  """Returns the file fingerprints from a node verification result.
+
+  @type nres: L{rpc.RpcResult} or None
+  @rtype: dict or None
+  @return: the fingerprints keyed by virtual path, or None if the node
+      couldn't be queried
+
+  """
+  if nres is None or nres.fail_msg or not isinstance(nres.payload, dict):
+    return None
+
+  fingerprints = nres.payload.get(constants.NV_FILELIST, None)
+  if not isinstance(fingerprints, dict):
+    return None
+
+  return fingerprints
+
+
+def _GetUpToDateFiles(lu, node_uuids, files):
+  """Finds the nodes already having the same copy of files as the master.
+
+  The master node is queried along with the other nodes, so that the
+  fingerprints of its copies come from the node daemon's fingerprint cache.
+  Nodes which can't be queried are assumed to have no up-to-date files.
+
+  @type node_uuids: list of strings
+  @param node_uuids: the nodes to check
+  @type files: list of strings
+  @param files: the files to check
+  @rtype: dict
+  @return: the set of up-to-date node UUIDs for each file
+
+  """
+  if not (node_uuids and files):
+    return {}
+
+  vpaths = dict((vcluster.MakeVirtualPath(fname), fname) for fname in files)
+  master_node_uuid = lu.cfg.GetMasterNode()
+
+  result = lu.rpc.call_node_verify(
+             list(node_uuids) + [master_node_uuid],
+             {constants.NV_FILELIST: vpaths.keys()},
+             lu.cfg.GetClusterName(),
+             lu.cfg.GetClusterInfo().hvparams)
+
+  fingerprints = _GetFileListResult(result.get(master_node_uuid, None))
+  if fingerprints is None:
+    logging.warning("Can't get file fingerprints from the master node,"
+                    " computing them locally")
+    fingerprints = \
+      dict((vcluster.MakeVirtualPath(fname), fingerprint)
+           for (fname, fingerprint) in utils.FingerprintFiles(files).items())
+
+  up_to_date = dict((vpaths[vpath], set()) for vpath in fingerprints
+                    if vpath in vpaths)
+
+  for node_uuid in node_uuids:
+    remote = _GetFileListResult(result.get(node_uuid, None))
+    if remote is None:
+      continue
+
+    for (vpath, fingerprint) in fingerprints.items():
+      if vpath in vpaths and remote.get(vpath, None) == fingerprint:
+        up_to_date[vpaths[vpath]].add(node_uuid)
+
+  return up_to_date
 
 
 def ComputeAncillaryFiles(cluster, redist):
@@ -512,6 +512,11 @@ class LUInstanceCreate(LogicalUnit):
         raise errors.OpPrereqError("Invalid handshake: %s" % errmsg,
                                    errors.ECODE_INVAL)
 
+      self.source_compressions = \
+        masterd.instance.GetRemoteExportCompressions(src_handshake)
+      self.source_ieios = \
+        masterd.instance.GetRemoteExportIoTypes(src_handshake)
+
       # Load and check source CA
       self.source_x509_ca_pem = self.op.source_x509_ca
       if not self.source_x509_ca_pem:
@@ -1432,7 +1437,9 @@ class LUInstanceCreate(LogicalUnit):
           disk_results = \
             masterd.instance.RemoteImport(self, feedback_fn, iobj, self.pnode,
                                           self.source_x509_ca,
-                                          self._cds, timeouts)
+                                          self._cds, timeouts,
+                                          self.source_compressions,
+                                          source_ieios=self.source_ieios)
           if not compat.all(disk_results):
             # TODO: Should the instance still be started, even if some disks
             # failed to import (valid for local imports, too)?
@@ -1821,12 +1828,10 @@ class LUInstanceMove(LogicalUnit):
       self.cfg.ReleaseDRBDMinors(self.instance.uuid)
       raise
 
-    cluster_name = self.cfg.GetClusterInfo().cluster_name
-
     errs = []
-    # activate, get path, copy the data over
+    transfers = []
+    # activate the new disks and prepare the transfers
     for idx, disk in enumerate(self.instance.disks):
-      self.LogInfo("Copying data for disk %d", idx)
       result = self.rpc.call_blockdev_assemble(
                  target_node.uuid, (disk, self.instance), self.instance.name,
                  True, idx)
@@ -1835,16 +1840,35 @@ class LUInstanceMove(LogicalUnit):
                         idx, result.fail_msg)
         errs.append(result.fail_msg)
         break
-      dev_path = result.payload
-      result = self.rpc.call_blockdev_export(source_node.uuid, (disk,
-                                                                self.instance),
-                                             target_node.name, dev_path,
-                                             cluster_name)
-      if result.fail_msg:
-        self.LogWarning("Can't copy data over for disk %d: %s",
-                        idx, result.fail_msg)
-        errs.append(result.fail_msg)
-        break
+
+      (src_disk, dest_disk) = AnnotateDiskParams(self.instance, [disk, disk],
+                                                 self.cfg)
+      self.cfg.SetDiskID(src_disk, source_node.uuid)
+      self.cfg.SetDiskID(dest_disk, target_node.uuid)
+
+      # Raw disk I/O on both sides allows the data to be transferred as a
+      # sparse stream, skipping zero regions
+      transfers.append(masterd.instance.DiskTransfer("disk/%s" % idx,
+                                                     constants.IEIO_RAW_DISK,
+                                                     (src_disk, ),
+                                                     constants.IEIO_RAW_DISK,
+                                                     (dest_disk, ),
+                                                     None))
+
+    if not errs:
+      self.LogInfo("Copying data for %d disks", len(transfers))
+      streams = constants.IE_MOVE_DISK_STREAMS
+      results = \
+        masterd.instance.TransferInstanceData(self, feedback_fn,
+                                              source_node.uuid,
+                                              target_node.uuid,
+                                              target_node.secondary_ip,
+                                              self.instance, transfers,
+                                              streams=streams)
+      for (idx, success) in enumerate(results):
+        if not success:
+          self.LogWarning("Can't copy data over for disk %d", idx)
+          errs.append("disk/%s" % idx)
 
     if errs:
       self.LogWarning("Some disks failed to copy, aborting")
@@ -1907,9 +1931,9 @@ class LUInstanceMultiAlloc(NoHooksLU):
                                  " pnode/snode while others do not",
                                  errors.ECODE_INVAL)
 
-    if self.op.iallocator is None:
+    if not has_nodes and self.op.iallocator is None:
       default_iallocator = self.cfg.GetDefaultIAllocator()
-      if default_iallocator and has_nodes:
+      if default_iallocator:
         self.op.iallocator = default_iallocator
       else:
         raise errors.OpPrereqError("No iallocator or nodes on the instances"
@@ -1963,6 +1987,24 @@ class LUInstanceMultiAlloc(NoHooksLU):
   def CheckPrereq(self):
     """Check prerequisite.
 
+    """
+    if not self.op.iallocator:
+      # All instances have their nodes given already
+      self.ia_result = ([(op.instance_name,
+                          [node for node in (op.pnode, op.snode)
+                           if node is not None])
+                         for op in self.op.instances], [])
+    else:
+      self._RunAllocator()
+
+    if self.op.dry_run:
+      self.dry_run_result = objects.FillDict(self._ConstructPartialResult(), {
+        constants.JOB_IDS_KEY: [],
+        })
+
+  def _RunAllocator(self):
+    """Places all instances with a single iallocator run.
+
     """
     cluster = self.cfg.GetClusterInfo()
     default_vg = self.cfg.GetVGName()
@@ -1995,11 +2037,6 @@ class LUInstanceMultiAlloc(NoHooksLU):
 
     self.ia_result = ial.result
 
-    if self.op.dry_run:
-      self.dry_run_result = objects.FillDict(self._ConstructPartialResult(), {
-        constants.JOB_IDS_KEY: [],
-        })
-
   def _ConstructPartialResult(self):
     """Contructs the partial result.
 
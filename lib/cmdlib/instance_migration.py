@@ -776,7 +776,14 @@ class TLMigrateInstance(Tasklet):
                                self._MIGRATION_FEEDBACK_INTERVAL) and
           ms.transferred_ram is not None):
         mem_progress = 100 * float(ms.transferred_ram) / float(ms.total_ram)
-        self.feedback_fn("* memory transfer progress: %.2f %%" % mem_progress)
+        progress_msg = "* memory transfer progress: %.2f %%" % mem_progress
+        if ms.remaining_ram is not None:
+          progress_msg += ", %d MiB remaining" % (int(ms.remaining_ram) / 1024)
+        if ms.dirty_pages_rate:
+          progress_msg += ", %d dirty pages/s" % ms.dirty_pages_rate
+        if ms.expected_downtime is not None:
+          progress_msg += ", expected downtime %d ms" % ms.expected_downtime
+        self.feedback_fn(progress_msg)
         last_feedback = time.time()
 
       time.sleep(self._MIGRATION_POLL_INTERVAL)
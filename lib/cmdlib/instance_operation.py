@@ -51,6 +51,7 @@ class LUInstanceStartup(LogicalUnit):
   HPATH = "instance-start"
   HTYPE = constants.HTYPE_INSTANCE
   REQ_BGL = False
+  HOOKS_ASYNC_POST = True
 
   def CheckArguments(self):
     # extra beparams
@@ -24,6 +24,7 @@
 import itertools
 import logging
 import os
+import threading
 import time
 
 from ganeti import compat
@@ -1005,9 +1006,151 @@ def _CalcEta(time_taken, written, total_size):
   return (total_size - written) * avg_time
 
 
+class _WipeProgress(object):
+  """Keeps track of the progress of wiping several disks.
+
+  """
+  def __init__(self, total):
+    """Initializes this class.
+
+    @type total: int
+    @param total: total amount of data to be wiped
+
+    """
+    self._lock = threading.Lock()
+    self.total = total
+    self.written = 0
+    self.start_time = time.time()
+
+  def Add(self, size):
+    """Records a wiped chunk.
+
+    """
+    self._lock.acquire()
+    try:
+      self.written += size
+    finally:
+      self._lock.release()
+
+  def GetStatus(self, now):
+    """Returns the overall progress.
+
+    @rtype: tuple
+    @return: (percentage done, ETA in seconds or None)
+
+    """
+    self._lock.acquire()
+    try:
+      written = self.written
+    finally:
+      self._lock.release()
+
+    if not written:
+      return (0.0, None)
+
+    return (written / float(self.total) * 100,
+            _CalcEta(now - self.start_time, written, self.total))
+
+
+def _WipeDisk(lu, node_uuid, instance, idx, device, offset, progress, abort):
+  """Wipes a single disk in chunks.
+
+  @type progress: L{_WipeProgress}
+  @param progress: the overall progress, updated after every chunk
+  @type abort: threading.Event
+  @param abort: if set, the wipe is stopped before the next chunk
+
+  """
+  # The wipe size is MIN_WIPE_CHUNK_PERCENT % of the instance disk but
+  # MAX_WIPE_CHUNK at max. Truncating to integer to avoid rounding errors.
+  wipe_chunk_size = \
+    int(min(constants.MAX_WIPE_CHUNK,
+            device.size / 100.0 * constants.MIN_WIPE_CHUNK_PERCENT))
+
+  size = device.size
+
+  logging.info("Wiping disk %d for instance %s on node %s using"
+               " chunk size %s", idx, instance.name,
+               lu.cfg.GetNodeName(node_uuid), wipe_chunk_size)
+
+  while offset < size and not abort.isSet():
+    wipe_size = min(wipe_chunk_size, size - offset)
+
+    logging.debug("Wiping disk %d, offset %s, chunk %s",
+                  idx, offset, wipe_size)
+
+    result = lu.rpc.call_blockdev_wipe(node_uuid, (device, instance),
+                                       offset, wipe_size)
+    result.Raise("Could not wipe disk %d at offset %d for size %d" %
+                 (idx, offset, wipe_size))
+
+    offset += wipe_size
+    progress.Add(wipe_size)
+
+
+def _WipeDisksConcurrently(lu, node_uuid, instance, disks):
+  """Wipes disks, up to L{constants.MAX_CONCURRENT_WIPES} at a time.
+
+  Progress is reported as a whole for all disks. If wiping a disk fails, the
+  others are stopped after their current chunk.
+
+  @raise errors.OpExecError: if wiping any of the disks failed
+
+  """
+  progress = _WipeProgress(sum(device.size - offset
+                               for (_, device, offset) in disks))
+  abort = threading.Event()
+  pending = list(disks)
+  pending_lock = threading.Lock()
+  errs = []
+
+  def _Worker():
+    while not abort.isSet():
+      pending_lock.acquire()
+      try:
+        if not pending:
+          return
+        (idx, device, offset) = pending.pop(0)
+      finally:
+        pending_lock.release()
+
+      try:
+        _WipeDisk(lu, node_uuid, instance, idx, device, offset, progress,
+                  abort)
+      except Exception, err: # pylint: disable=W0703
+        logging.exception("Wiping disk %s of instance '%s' failed",
+                          idx, instance.name)
+        errs.append(err)
+        abort.set()
+
+  threads = [threading.Thread(target=_Worker)
+             for _ in range(min(len(disks), constants.MAX_CONCURRENT_WIPES))]
+  for thread in threads:
+    thread.setDaemon(True)
+    thread.start()
+
+  last_output = time.time()
+  for thread in threads:
+    while thread.isAlive():
+      thread.join(1.0)
+
+      now = time.time()
+      if now - last_output >= 60:
+        (percent, eta) = progress.GetStatus(now)
+        if eta is not None:
+          lu.LogInfo(" - done: %.1f%% ETA: %s", percent,
+                     utils.FormatSeconds(eta))
+        last_output = now
+
+  if errs:
+    raise errs[0]
+
+
 def WipeDisks(lu, instance, disks=None):
   """Wipes instance disks.
 
+  The disks are wiped concurrently, see L{_WipeDisksConcurrently}.
+
   @type lu: L{LogicalUnit}
   @param lu: the logical unit on whose behalf we execute
   @type instance: L{objects.Instance}
@@ -1042,47 +1185,16 @@ def WipeDisks(lu, instance, disks=None):
 
   try:
     for (idx, device, offset) in disks:
-      # The wipe size is MIN_WIPE_CHUNK_PERCENT % of the instance disk but
-      # MAX_WIPE_CHUNK at max. Truncating to integer to avoid rounding errors.
-      wipe_chunk_size = \
-        int(min(constants.MAX_WIPE_CHUNK,
-                device.size / 100.0 * constants.MIN_WIPE_CHUNK_PERCENT))
-
-      size = device.size
-      last_output = 0
-      start_time = time.time()
-
       if offset == 0:
         info_text = ""
       else:
         info_text = (" (from %s to %s)" %
                      (utils.FormatUnit(offset, "h"),
-                      utils.FormatUnit(size, "h")))
+                      utils.FormatUnit(device.size, "h")))
 
       lu.LogInfo("* Wiping disk %s%s", idx, info_text)
 
-      logging.info("Wiping disk %d for instance %s on node %s using"
-                   " chunk size %s", idx, instance.name, node_name,
-                   wipe_chunk_size)
-
-      while offset < size:
-        wipe_size = min(wipe_chunk_size, size - offset)
-
-        logging.debug("Wiping disk %d, offset %s, chunk %s",
-                      idx, offset, wipe_size)
-
-        result = lu.rpc.call_blockdev_wipe(node_uuid, (device, instance),
-                                           offset, wipe_size)
-        result.Raise("Could not wipe disk %d at offset %d for size %d" %
-                     (idx, offset, wipe_size))
-
-        now = time.time()
-        offset += wipe_size
-        if now - last_output >= 60:
-          eta = _CalcEta(now - start_time, offset, size)
-          lu.LogInfo(" - done: %.1f%% ETA: %s",
-                     offset / float(size) * 100, utils.FormatSeconds(eta))
-          last_output = now
+    _WipeDisksConcurrently(lu, node_uuid, instance, disks)
   finally:
     logging.info("Resuming synchronization of disks for instance '%s'",
                  instance.name)
@@ -1147,63 +1259,121 @@ def WaitForSync(lu, instance, disks=None, oneshot=False):
   """Sleep and poll for an instance's disk to sync.
 
   """
-  if not instance.disks or disks is not None and not disks:
-    return True
+  return WaitForInstancesSync(lu, [(instance, disks)],
+                              oneshot=oneshot)[instance.uuid]
 
-  disks = ExpandCheckDisks(instance, disks)
 
-  if not oneshot:
-    lu.LogInfo("Waiting for instance %s to sync disks", instance.name)
+def WaitForInstancesSync(lu, inst_disks, oneshot=False):
+  """Sleep and poll for the disks of several instances to sync.
 
-  node_uuid = instance.primary_node
-  node_name = lu.cfg.GetNodeName(node_uuid)
+  The status of all disks is queried with a single multi-node RPC per round,
+  so the time spent waiting is that of the slowest disk.
+
+  @type lu: L{LogicalUnit}
+  @param lu: the logical unit on whose behalf we execute
+  @type inst_disks: list of tuples
+  @param inst_disks: list of (instance, disks) tuples, where disks is a list
+      of L{objects.Disk} or None for all disks of the instance
+  @type oneshot: boolean
+  @param oneshot: whether to only check the status once
+  @rtype: dict
+  @return: dictionary indexed by instance UUID, with C{True} if the disks of
+      the instance are not degraded
+
+  """
+  result = {}
+  waited = []
+  # list of (instance, disk) for each node
+  node_disks = {}
+
+  for (instance, disks) in inst_disks:
+    result[instance.uuid] = True
+
+    if not instance.disks or disks is not None and not disks:
+      continue
+
+    disks = ExpandCheckDisks(instance, disks)
+    waited.append(instance)
 
-  for dev in disks:
-    lu.cfg.SetDiskID(dev, node_uuid)
+    if not oneshot:
+      lu.LogInfo("Waiting for instance %s to sync disks", instance.name)
 
-  # TODO: Convert to utils.Retry
+    for dev in disks:
+      lu.cfg.SetDiskID(dev, instance.primary_node)
+      node_disks.setdefault(instance.primary_node, []).append((instance, dev))
 
-  retries = 0
+  if not node_disks:
+    return result
+
+  node_devs = {}
+  for (node_uuid, entries) in node_disks.items():
+    node_devs[node_uuid] = []
+    for (instance, dev) in entries:
+      (anno_disk, ) = AnnotateDiskParams(instance, [dev], lu.cfg)
+      lu.cfg.SetDiskID(anno_disk, node_uuid)
+      node_devs[node_uuid].append(anno_disk)
+
+  if len(result) > 1:
+    dev_name_fn = lambda instance, dev: "%s/%s" % (instance.name, dev.iv_name)
+  else:
+    dev_name_fn = lambda _, dev: dev.iv_name
+
+  retries = dict.fromkeys(node_disks.keys(), 0)
   degr_retries = 10 # in seconds, as we sleep 1 second each time
   while True:
     max_time = 0
     done = True
-    cumul_degraded = False
-    rstats = lu.rpc.call_blockdev_getmirrorstatus(node_uuid, (disks, instance))
-    msg = rstats.fail_msg
-    if msg:
-      lu.LogWarning("Can't get any data from node %s: %s", node_name, msg)
-      retries += 1
-      if retries >= 10:
-        raise errors.RemoteError("Can't contact node %s for mirror data,"
-                                 " aborting." % node_name)
+    failed = False
+    degraded = set()
+    rstats = lu.rpc.call_blockdev_getmirrorstatus_multi(node_devs.keys(),
+                                                        node_devs)
+
+    for (node_uuid, nres) in rstats.items():
+      node_name = lu.cfg.GetNodeName(node_uuid)
+      msg = nres.fail_msg
+      if not msg:
+        # A single disk failing makes the whole node count as failed, just
+        # like it did with the per-instance RPC
+        disk_errors = ["%s: %s" % (dev_name_fn(instance, dev), mstat)
+                       for ((instance, dev), (success, mstat)) in
+                         zip(node_disks[node_uuid], nres.payload)
+                       if not success]
+        if disk_errors:
+          msg = ("Can't compute data for disk(s) %s" %
+                 utils.CommaJoin(disk_errors))
+      if msg:
+        lu.LogWarning("Can't get any data from node %s: %s", node_name, msg)
+        retries[node_uuid] += 1
+        if retries[node_uuid] >= 10:
+          raise errors.RemoteError("Can't contact node %s for mirror data,"
+                                   " aborting." % node_name)
+        failed = True
+        continue
+      retries[node_uuid] = 0
+
+      for ((instance, dev), (_, mstat)) in zip(node_disks[node_uuid],
+                                               nres.payload):
+        if mstat.is_degraded and mstat.sync_percent is None:
+          degraded.add(instance.uuid)
+        if mstat.sync_percent is not None:
+          done = False
+          if mstat.estimated_time is not None:
+            rem_time = ("%s remaining (estimated)" %
+                        utils.FormatSeconds(mstat.estimated_time))
+            max_time = max(max_time, mstat.estimated_time)
+          else:
+            rem_time = "no time estimate"
+          lu.LogInfo("- device %s: %5.2f%% done, %s",
+                     dev_name_fn(instance, dev), mstat.sync_percent, rem_time)
+
+    if failed:
       time.sleep(6)
       continue
-    rstats = rstats.payload
-    retries = 0
-    for i, mstat in enumerate(rstats):
-      if mstat is None:
-        lu.LogWarning("Can't compute data for node %s/%s",
-                      node_name, disks[i].iv_name)
-        continue
-
-      cumul_degraded = (cumul_degraded or
-                        (mstat.is_degraded and mstat.sync_percent is None))
-      if mstat.sync_percent is not None:
-        done = False
-        if mstat.estimated_time is not None:
-          rem_time = ("%s remaining (estimated)" %
-                      utils.FormatSeconds(mstat.estimated_time))
-          max_time = mstat.estimated_time
-        else:
-          rem_time = "no time estimate"
-        lu.LogInfo("- device %s: %5.2f%% done, %s",
-                   disks[i].iv_name, mstat.sync_percent, rem_time)
 
     # if we're done but degraded, let's do a few small retries, to
     # make sure we see a stable and not transient situation; therefore
     # we force restart of the loop
-    if (done or oneshot) and cumul_degraded and degr_retries > 0:
+    if (done or oneshot) and degraded and degr_retries > 0:
       logging.info("Degraded disks found, %d retries left", degr_retries)
       degr_retries -= 1
       time.sleep(1)
@@ -1215,9 +1385,13 @@ def WaitForSync(lu, instance, disks=None, oneshot=False):
     time.sleep(min(60, max_time))
 
   if done:
-    lu.LogInfo("Instance %s's disks are in sync", instance.name)
+    for instance in waited:
+      lu.LogInfo("Instance %s's disks are in sync", instance.name)
 
-  return not cumul_degraded
+  for inst_uuid in degraded:
+    result[inst_uuid] = False
+
+  return result
 
 
 def ShutdownInstanceDisks(lu, instance, disks=None, ignore_primary=False):
@@ -1282,9 +1456,93 @@ def AssembleInstanceDisks(lu, instance, disks=None, ignore_secondaries=False,
       with the mapping from node devices to instance devices
 
   """
-  device_info = []
-  disks_ok = True
-  disks = ExpandCheckDisks(instance, disks)
+  return AssembleInstancesDisks(lu, [(instance, disks)],
+                                ignore_secondaries=ignore_secondaries,
+                                ignore_size=ignore_size)[instance.uuid]
+
+
+def _AssembleDisksPass(lu, inst_disks, as_primary, ignore_size):
+  """Assembles disks of several instances with a single multi-node RPC.
+
+  @param inst_disks: list of (instance, disks) tuples
+  @type as_primary: boolean
+  @param as_primary: if true, only the disks on the primary nodes are
+      assembled, in primary mode; otherwise the disks on all nodes are
+      assembled in secondary mode
+  @rtype: list of tuples
+  @return: list of (instance, disk index, disk, node UUID, offline, error
+      message or None, result)
+
+  """
+  node_entries = {}
+  node_disks = {}
+  node_params = {}
+
+  for (instance, disks) in inst_disks:
+    for idx, inst_disk in enumerate(disks):
+      for node_uuid, node_disk in inst_disk.ComputeNodeTree(
+                                    instance.primary_node):
+        if as_primary and node_uuid != instance.primary_node:
+          continue
+        if ignore_size:
+          node_disk = node_disk.Copy()
+          node_disk.UnsetSize()
+        lu.cfg.SetDiskID(node_disk, node_uuid)
+        (anno_disk, ) = AnnotateDiskParams(instance, [node_disk], lu.cfg)
+        lu.cfg.SetDiskID(anno_disk, node_uuid)
+
+        node_entries.setdefault(node_uuid, []).append((instance, idx,
+                                                       inst_disk))
+        node_disks.setdefault(node_uuid, []).append(anno_disk)
+        node_params.setdefault(node_uuid, []).append((instance.name,
+                                                      as_primary, idx))
+
+  if not node_entries:
+    return []
+
+  rpc_result = lu.rpc.call_blockdev_assemble_multi(node_entries.keys(),
+                                                   node_disks, node_params)
+
+  result = []
+  for (node_uuid, entries) in node_entries.items():
+    nres = rpc_result[node_uuid]
+    if nres.fail_msg:
+      payload = [(False, nres.fail_msg)] * len(entries)
+    else:
+      payload = nres.payload
+
+    for ((instance, idx, inst_disk), (success, value)) in zip(entries,
+                                                              payload):
+      if success:
+        result.append((instance, idx, inst_disk, node_uuid, nres.offline,
+                       None, value))
+      else:
+        result.append((instance, idx, inst_disk, node_uuid, nres.offline,
+                       value, None))
+
+  return result
+
+
+def AssembleInstancesDisks(lu, inst_disks, ignore_secondaries=False,
+                           ignore_size=False):
+  """Prepare the block devices of several instances.
+
+  The disks of all instances are assembled with one multi-node RPC for each
+  of the two passes (secondary, then primary mode). See
+  L{AssembleInstanceDisks} for the parameters.
+
+  @type inst_disks: list of tuples
+  @param inst_disks: list of (instance, disks) tuples, where disks is a list
+      of L{objects.Disk} or None for all disks of the instance
+  @rtype: dict
+  @return: dictionary indexed by instance UUID, containing the result of
+      L{AssembleInstanceDisks} for each instance
+
+  """
+  inst_disks = [(instance, ExpandCheckDisks(instance, disks))
+                for (instance, disks) in inst_disks]
+  disks_ok = dict((instance.uuid, True) for (instance, _) in inst_disks)
+  dev_paths = {}
 
   # With the two passes mechanism we try to reduce the window of
   # opportunity for the race condition of switching DRBD to primary
@@ -1297,66 +1555,53 @@ def AssembleInstanceDisks(lu, instance, disks=None, ignore_secondaries=False,
 
   # mark instance disks as active before doing actual work, so watcher does
   # not try to shut them down erroneously
-  lu.cfg.MarkInstanceDisksActive(instance.uuid)
+  for (instance, _) in inst_disks:
+    lu.cfg.MarkInstanceDisksActive(instance.uuid)
 
   # 1st pass, assemble on all nodes in secondary mode
-  for idx, inst_disk in enumerate(disks):
-    for node_uuid, node_disk in inst_disk.ComputeNodeTree(
-                                  instance.primary_node):
-      if ignore_size:
-        node_disk = node_disk.Copy()
-        node_disk.UnsetSize()
-      lu.cfg.SetDiskID(node_disk, node_uuid)
-      result = lu.rpc.call_blockdev_assemble(node_uuid, (node_disk, instance),
-                                             instance.name, False, idx)
-      msg = result.fail_msg
-      if msg:
-        is_offline_secondary = (node_uuid in instance.secondary_nodes and
-                                result.offline)
-        lu.LogWarning("Could not prepare block device %s on node %s"
-                      " (is_primary=False, pass=1): %s",
-                      inst_disk.iv_name, lu.cfg.GetNodeName(node_uuid), msg)
-        if not (ignore_secondaries or is_offline_secondary):
-          disks_ok = False
+  for (instance, _, inst_disk, node_uuid, offline, msg, _) in \
+      _AssembleDisksPass(lu, inst_disks, False, ignore_size):
+    if msg:
+      is_offline_secondary = (node_uuid in instance.secondary_nodes and
+                              offline)
+      lu.LogWarning("Could not prepare block device %s on node %s"
+                    " (is_primary=False, pass=1): %s",
+                    inst_disk.iv_name, lu.cfg.GetNodeName(node_uuid), msg)
+      if not (ignore_secondaries or is_offline_secondary):
+        disks_ok[instance.uuid] = False
 
   # FIXME: race condition on drbd migration to primary
 
   # 2nd pass, do only the primary node
-  for idx, inst_disk in enumerate(disks):
-    dev_path = None
-
-    for node_uuid, node_disk in inst_disk.ComputeNodeTree(
-                                  instance.primary_node):
-      if node_uuid != instance.primary_node:
-        continue
-      if ignore_size:
-        node_disk = node_disk.Copy()
-        node_disk.UnsetSize()
-      lu.cfg.SetDiskID(node_disk, node_uuid)
-      result = lu.rpc.call_blockdev_assemble(node_uuid, (node_disk, instance),
-                                             instance.name, True, idx)
-      msg = result.fail_msg
-      if msg:
-        lu.LogWarning("Could not prepare block device %s on node %s"
-                      " (is_primary=True, pass=2): %s",
-                      inst_disk.iv_name, lu.cfg.GetNodeName(node_uuid), msg)
-        disks_ok = False
-      else:
-        dev_path = result.payload
-
-    device_info.append((lu.cfg.GetNodeName(instance.primary_node),
-                        inst_disk.iv_name, dev_path))
+  for (instance, idx, inst_disk, node_uuid, _, msg, dev_path) in \
+      _AssembleDisksPass(lu, inst_disks, True, ignore_size):
+    if msg:
+      lu.LogWarning("Could not prepare block device %s on node %s"
+                    " (is_primary=True, pass=2): %s",
+                    inst_disk.iv_name, lu.cfg.GetNodeName(node_uuid), msg)
+      disks_ok[instance.uuid] = False
+    else:
+      dev_paths[(instance.uuid, idx)] = dev_path
+
+  result = {}
+  for (instance, disks) in inst_disks:
+    primary_name = lu.cfg.GetNodeName(instance.primary_node)
+    device_info = [(primary_name, inst_disk.iv_name,
+                    dev_paths.get((instance.uuid, idx)))
+                   for (idx, inst_disk) in enumerate(disks)]
+
+    # leave the disks configured for the primary node
+    # this is a workaround that would be fixed better by
+    # improving the logical/physical id handling
+    for disk in disks:
+      lu.cfg.SetDiskID(disk, instance.primary_node)
 
-  # leave the disks configured for the primary node
-  # this is a workaround that would be fixed better by
-  # improving the logical/physical id handling
-  for disk in disks:
-    lu.cfg.SetDiskID(disk, instance.primary_node)
+    if not disks_ok[instance.uuid]:
+      lu.cfg.MarkInstanceDisksInactive(instance.uuid)
 
-  if not disks_ok:
-    lu.cfg.MarkInstanceDisksInactive(instance.uuid)
+    result[instance.uuid] = (disks_ok[instance.uuid], device_info)
 
-  return disks_ok, device_info
+  return result
 
 
 def StartInstanceDisks(lu, instance, force):
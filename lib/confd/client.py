@@ -43,6 +43,10 @@ You can use the provided ConfdFilterCallback to act as a filter, only passing
 "newer" answer to your callback, and filtering out outdated ones, or ones
 confirming what you already got.
 
+Synchronous users needing many answers at once can use L{ConfdClient.Query},
+which packs the queries into as few batch requests as possible and caches
+the answers for a short time.
+
 """
 
 # pylint: disable=E0203
@@ -117,9 +121,16 @@ class ConfdClient:
   @ivar _requests: dictionary indexes by salt, which contains data
       about the outstanding requests; the values are objects of type
       L{_Request}
+  @type _cache: dict
+  @ivar _cache: dictionary indexed by request type and serialized query,
+      containing tuples of (expiry, status, answer) of received replies
+  @type _query_replies: dict
+  @ivar _query_replies: dictionary indexed by the salts of requests sent by
+      L{Query}, containing the reply used for each of them (or None)
 
   """
-  def __init__(self, hmac_key, peers, callback, port=None, logger=None):
+  def __init__(self, hmac_key, peers, callback, port=None, logger=None,
+               cache_ttl=constants.CONFD_CLIENT_CACHE_TTL):
     """Constructor for ConfdClient
 
     @type hmac_key: string
@@ -132,6 +143,8 @@ class ConfdClient:
     @param port: confd port (default: use GetDaemonPort)
     @type logger: logging.Logger
     @param logger: optional logger for internal conditions
+    @type cache_ttl: number
+    @param cache_ttl: how long received answers are cached, in seconds
 
     """
     if not callable(callback):
@@ -145,6 +158,9 @@ class ConfdClient:
     self._confd_port = port
     self._logger = logger
     self._requests = {}
+    self._cache = {}
+    self._cache_ttl = cache_ttl
+    self._query_replies = {}
 
     if self._confd_port is None:
       self._confd_port = netutils.GetDaemonPort(constants.CONFD)
@@ -276,6 +292,14 @@ class ConfdClient:
 
       rq.rcvd.add(ip)
 
+      self._UpdateCache(rq.request, answer)
+
+      if salt in self._query_replies:
+        # Keep the first reply, unless it was an error
+        prev = self._query_replies[salt]
+        if prev is None or prev.status != constants.CONFD_REPL_STATUS_OK:
+          self._query_replies[salt] = answer
+
       client_reply = ConfdUpcallPayload(salt=salt,
                                         type=UPCALL_REPLY,
                                         server_reply=answer,
@@ -290,6 +314,174 @@ class ConfdClient:
     finally:
       self.ExpireRequests()
 
+  @staticmethod
+  def _CacheKey(rtype, query):
+    """Returns the cache key for a query.
+
+    """
+    return (rtype, serializer.DumpJson(query))
+
+  @staticmethod
+  def _GetBatchAnswers(request, reply):
+    """Returns the individual answers of a reply to a batch request.
+
+    @type request: L{objects.ConfdRequest}
+    @param request: the original batch request
+    @type reply: L{objects.ConfdReply}
+    @param reply: the server reply
+    @rtype: list or None
+    @return: list of (status, answer), one per query of the batch; None if
+        the reply isn't a valid answer to the batch
+
+    """
+    if (reply.status == constants.CONFD_REPL_STATUS_OK and
+        isinstance(reply.answer, list) and
+        len(reply.answer) == len(request.query)):
+      return [(status, answer) for (status, answer) in reply.answer]
+
+    return None
+
+  def _UpdateCache(self, request, reply):
+    """Stores the answers contained in a reply in the cache.
+
+    @type request: L{objects.ConfdRequest}
+    @param request: the original request
+    @type reply: L{objects.ConfdReply}
+    @param reply: the server reply
+
+    """
+    expiry = time.time() + self._cache_ttl
+
+    if request.type != constants.CONFD_REQ_BATCH:
+      self._cache[self._CacheKey(request.type, request.query)] = \
+        (expiry, reply.status, reply.answer)
+    else:
+      answers = self._GetBatchAnswers(request, reply)
+      if answers is not None:
+        for ((rtype, query), (status, answer)) in zip(request.query, answers):
+          self._cache[self._CacheKey(rtype, query)] = (expiry, status, answer)
+
+  def GetCachedAnswer(self, rtype, query):
+    """Returns a cached answer for a query.
+
+    @type rtype: int
+    @param rtype: request type, one of L{constants.CONFD_REQS}
+    @param query: the query
+    @rtype: tuple or None
+    @return: (status, answer) from the last reply received for this query,
+        or None if there is none or it is too old
+
+    """
+    key = self._CacheKey(rtype, query)
+
+    try:
+      (expiry, status, answer) = self._cache[key]
+    except KeyError:
+      return None
+
+    if time.time() >= expiry:
+      del self._cache[key]
+      return None
+
+    return (status, answer)
+
+  def _BuildBatchRequests(self, queries):
+    """Packs queries into batch requests.
+
+    Queries are added to a batch as long as the packed request stays below
+    L{constants.CONFD_MAX_REQUEST_SIZE}.
+
+    @type queries: list of tuples
+    @param queries: list of (request type, query)
+    @rtype: list of L{ConfdClientRequest}
+
+    """
+    result = []
+    batch = []
+    # Size of a packed empty batch request; the serialized queries are
+    # escaped when the request is signed, at most doubling their size
+    base_size = len(self._PackRequest(
+      ConfdClientRequest(type=constants.CONFD_REQ_BATCH, query=[])))
+    size = base_size
+
+    for (rtype, query) in queries:
+      if (rtype == constants.CONFD_REQ_BATCH or
+          rtype not in constants.CONFD_REQS):
+        raise errors.ConfdClientError("Invalid request type in batch")
+
+      query_size = 2 * (len(serializer.DumpJson([rtype, query])) + 1)
+      if base_size + query_size > constants.CONFD_MAX_REQUEST_SIZE:
+        raise errors.ConfdClientError("Request too big")
+
+      if batch and size + query_size > constants.CONFD_MAX_REQUEST_SIZE:
+        result.append(ConfdClientRequest(type=constants.CONFD_REQ_BATCH,
+                                         query=batch))
+        batch = []
+        size = base_size
+
+      batch.append([rtype, query])
+      size += query_size
+
+    if batch:
+      result.append(ConfdClientRequest(type=constants.CONFD_REQ_BATCH,
+                                       query=batch))
+
+    return result
+
+  def Query(self, queries, coverage=0,
+            timeout=constants.CONFD_CLIENT_EXPIRE_TIMEOUT):
+    """Synchronously answers many queries.
+
+    Cached answers are used where available; all other queries are packed
+    into batch requests, which are sent at once and waited for together.
+    Their answers are taken from the replies themselves, so they don't
+    depend on the cache.
+
+    @type queries: list of tuples
+    @param queries: list of (request type, query)
+    @type coverage: integer
+    @param coverage: number of remote nodes to contact, see L{SendRequest}
+    @param timeout: the maximum time to wait for the replies
+    @rtype: list
+    @return: for each query, in order, a tuple (status, answer), or None if
+        no reply was received
+
+    """
+    result = [self.GetCachedAnswer(rtype, query) for (rtype, query) in queries]
+
+    missing = [idx for (idx, answer) in enumerate(result) if answer is None]
+    if not missing:
+      return result
+
+    requests = self._BuildBatchRequests([queries[idx] for idx in missing])
+
+    for req in requests:
+      self._query_replies[req.rsalt] = None
+
+    try:
+      for req in requests:
+        self.SendRequest(req, coverage=coverage, async=False)
+      self.WaitForReplies([req.rsalt for req in requests], timeout=timeout)
+
+      # Requests contain the missing queries in order
+      missing_iter = iter(missing)
+      for req in requests:
+        reply = self._query_replies[req.rsalt]
+        if reply is None:
+          answers = None
+        else:
+          answers = self._GetBatchAnswers(req, reply)
+
+        for idx in range(len(req.query)):
+          result_idx = missing_iter.next()
+          if answers is not None:
+            result[result_idx] = answers[idx]
+    finally:
+      for req in requests:
+        del self._query_replies[req.rsalt]
+
+    return result
+
   def FlushSendQueue(self):
     """Send out all pending requests.
 
@@ -353,39 +545,65 @@ class ConfdClient:
         will be zero
 
     """
-    def _CheckResponse():
-      if salt not in self._requests:
-        # expired?
-        if self._logger:
-          self._logger.debug("Discarding unknown/expired request: %s" % salt)
-        return MISSING
-      rq = self._requests[salt]
-      if len(rq.rcvd) >= expected:
-        # already got all replies
-        return (False, len(rq.sent), len(rq.rcvd))
-      # else wait, using default timeout
-      self.ReceiveReply()
-      raise utils.RetryAgain()
+    return self.WaitForReplies([salt], timeout=timeout)[salt]
+
+  def WaitForReplies(self, salts,
+                     timeout=constants.CONFD_CLIENT_EXPIRE_TIMEOUT):
+    """Wait for replies to several requests at once.
+
+    Like L{WaitForReply}, but waits until all given requests have received
+    enough replies or the timeout expires.
 
+    @param salts: the salts of the requests we want responses for
+    @param timeout: the maximum timeout (should be less or equal to
+        L{ganeti.constants.CONFD_CLIENT_EXPIRE_TIMEOUT}
+    @rtype: dict
+    @return: dictionary indexed by salt, containing a tuple of
+        (timed_out, sent_cnt, recv_cnt) for each request (see
+        L{WaitForReply})
+
+    """
     MISSING = (True, 0, 0)
 
-    if salt not in self._requests:
-      return MISSING
-    # extend the expire time with the current timeout, so that we
-    # don't get the request expired from under us
-    rq = self._requests[salt]
-    rq.expiry += timeout
-    sent = len(rq.sent)
-    expected = self._NeededReplies(sent)
+    result = dict((salt, MISSING) for salt in salts)
 
-    try:
-      return utils.Retry(_CheckResponse, 0, timeout)
-    except utils.RetryTimeout:
+    # minimum number of replies, indexed by salt
+    expected = {}
+    for salt in salts:
       if salt in self._requests:
+        # extend the expire time with the current timeout, so that we
+        # don't get the request expired from under us
         rq = self._requests[salt]
-        return (True, len(rq.sent), len(rq.rcvd))
-      else:
-        return MISSING
+        rq.expiry += timeout
+        expected[salt] = self._NeededReplies(len(rq.sent))
+
+    def _CheckResponses():
+      for (salt, needed) in expected.items():
+        if salt not in self._requests:
+          # expired?
+          if self._logger:
+            self._logger.debug("Discarding unknown/expired request: %s" % salt)
+          del expected[salt]
+          continue
+        rq = self._requests[salt]
+        if len(rq.rcvd) >= needed:
+          # already got all replies
+          result[salt] = (False, len(rq.sent), len(rq.rcvd))
+          del expected[salt]
+      if expected:
+        # else wait, using default timeout
+        self.ReceiveReply()
+        raise utils.RetryAgain()
+
+    try:
+      utils.Retry(_CheckResponses, 0, timeout)
+    except utils.RetryTimeout:
+      for salt in expected:
+        if salt in self._requests:
+          rq = self._requests[salt]
+          result[salt] = (True, len(rq.sent), len(rq.rcvd))
+
+    return result
 
   def _SetPeersAddressFamily(self):
     if not self._peers:
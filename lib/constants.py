@@ -140,6 +140,8 @@ CPU_PINNING_ALL_KVM = 0xFFFFFFFF
 DD_CMD = "dd"
 MAX_WIPE_CHUNK = 1024 # 1GB
 MIN_WIPE_CHUNK_PERCENT = 10
+# maximum number of disks of an instance wiped at the same time
+MAX_CONCURRENT_WIPES = 4
 
 RUN_DIRS_MODE = 0775
 SECURE_DIR_MODE = 0700
@@ -329,13 +331,40 @@ IEM_EXPORT = "export"
 # Import/export transport compression
 IEC_NONE = "none"
 IEC_GZIP = "gzip"
+IEC_LZ4 = "lz4"
+IEC_ZSTD = "zstd"
 IEC_ALL = compat.UniqueFrozenset([
   IEC_NONE,
   IEC_GZIP,
+  IEC_LZ4,
+  IEC_ZSTD,
   ])
 
+# Preferred compression methods for transfers within a cluster, best first;
+# only fast methods are used as the nodes are usually well connected
+IEC_INTRA_CLUSTER_PREFERENCE = [
+  IEC_ZSTD,
+  IEC_LZ4,
+  ]
+
+# Preferred compression methods for transfers between clusters, best first
+IEC_INTER_CLUSTER_PREFERENCE = [
+  IEC_ZSTD,
+  IEC_GZIP,
+  IEC_LZ4,
+  ]
+
+# Compression method used by peers not announcing the methods they support
+IEC_DEFAULT = IEC_GZIP
+
 IE_CUSTOM_SIZE = "fd"
 
+# Number of parallel streams used to transfer a disk during an instance move
+IE_MOVE_DISK_STREAMS = 4
+
+# Minimum size of the disk range transferred by one stream (MiB)
+IE_MIN_STREAM_SIZE = 8 * 1024
+
 IE_MAGIC_RE = re.compile(r"^[-_.a-zA-Z0-9]{5,100}$")
 
 # Import/export I/O
@@ -345,6 +374,15 @@ IEIO_FILE = "file"
 IEIO_RAW_DISK = "raw"
 # OS definition import/export script
 IEIO_SCRIPT = "script"
+# RBD volume diff using "rbd export-diff" and "rbd import-diff"; remote
+# transfers send a base snapshot first and the changes made since then once
+# the instance has been shut down
+IEIO_RBD_DIFF = "rbd-diff"
+# I/O types which can be transferred as sparse streams
+IEIO_SPARSE = compat.UniqueFrozenset([
+  IEIO_FILE,
+  IEIO_RAW_DISK,
+  ])
 
 VALUE_DEFAULT = "default"
 VALUE_AUTO = "auto"
@@ -365,6 +403,12 @@ HOOKS_NAME_CFGUPDATE = "config-update"
 HOOKS_NAME_WATCHER = "watcher"
 HOOKS_VERSION = 2
 HOOKS_PATH = "/sbin:/bin:/usr/sbin:/usr/bin"
+# maximum runtime of a single hook script, in seconds; must be less than the
+# timeout of the hooks runner RPC
+HOOKS_SCRIPT_TIMEOUT = 10 * 60
+# file marking a hooks directory whose scripts with the same leading number
+# can run concurrently
+HOOKS_PARALLEL_MARKER = ".parallel"
 
 # hooks subject type (what object type does the LU deal with)
 HTYPE_CLUSTER = "CLUSTER"
@@ -400,6 +444,10 @@ STORAGE_TYPES = compat.UniqueFrozenset([
 # FIXME: Remove this, once storage reporting is available for all types.
 STS_REPORT = compat.UniqueFrozenset([ST_FILE, ST_LVM_PV, ST_LVM_VG])
 
+#: How long LVM reports are reused by the node daemon, in seconds (see
+#: L{ganeti.storage.lvm_inventory})
+LVM_INVENTORY_TTL = 10
+
 # Storage fields
 # first two are valid in LU context only, not passed to backend
 SF_NODE = "node"
@@ -669,6 +717,13 @@ INSTANCE_CREATE_MODES = compat.UniqueFrozenset([
 RIE_VERSION = 0
 RIE_HANDSHAKE = "Hi, I'm Ganeti"
 
+# I/O types usable for remote imports/exports; anything but the OS scripts
+# must be announced by the source and chosen by the destination
+RIE_IEIO_ALL = compat.UniqueFrozenset([
+  IEIO_SCRIPT,
+  IEIO_RBD_DIFF,
+  ])
+
 # Remote import/export certificate validity in seconds
 RIE_CERT_VALIDITY = 24 * 60 * 60
 
@@ -681,6 +736,11 @@ RIE_CONNECT_ATTEMPT_TIMEOUT = 20
 # Export only: number of attempts to connect
 RIE_CONNECT_RETRIES = 10
 
+# Export only: number of attempts to connect when sending the changes of an
+# RBD volume; the destination only starts listening for them once the bases
+# of all volumes have been applied
+RIE_RBD_DELTA_CONNECT_RETRIES = 60
+
 #: Give child process up to 5 seconds to exit after sending a signal
 CHILD_LINGER_TIMEOUT = 5.0
 
@@ -965,6 +1025,10 @@ HV_VIF_TYPE = "vif_type"
 HV_VIF_SCRIPT = "vif_script"
 HV_XEN_CMD = "xen_cmd"
 HV_VNET_HDR = "vnet_hdr"
+HV_KVM_MIGRATION_AUTO_CONVERGE = "migration_auto_converge"
+HV_KVM_MIGRATION_MULTIFD_CHANNELS = "migration_multifd_channels"
+HV_KVM_MIGRATION_COMPRESSION = "migration_compression"
+HV_KVM_MIGRATION_POSTCOPY = "migration_postcopy"
 
 
 HVS_PARAMETER_TYPES = {
@@ -1038,6 +1102,10 @@ HVS_PARAMETER_TYPES = {
   HV_VIF_SCRIPT: VTYPE_STRING,
   HV_XEN_CMD: VTYPE_STRING,
   HV_VNET_HDR: VTYPE_BOOL,
+  HV_KVM_MIGRATION_AUTO_CONVERGE: VTYPE_BOOL,
+  HV_KVM_MIGRATION_MULTIFD_CHANNELS: VTYPE_INT,
+  HV_KVM_MIGRATION_COMPRESSION: VTYPE_STRING,
+  HV_KVM_MIGRATION_POSTCOPY: VTYPE_BOOL,
   }
 
 HVS_PARAMETERS = frozenset(HVS_PARAMETER_TYPES.keys())
@@ -1575,6 +1643,16 @@ HT_MIGRATION_MODES = compat.UniqueFrozenset([
   HT_MIGRATION_NONLIVE,
   ])
 
+# KVM migration compression
+HT_KVM_MIGRATION_COMPRESSION_NONE = "none"
+HT_KVM_MIGRATION_COMPRESSION_XBZRLE = "xbzrle"
+HT_KVM_MIGRATION_COMPRESSION_COMPRESS = "compress"
+HT_KVM_VALID_MIGRATION_COMPRESSION_TYPES = compat.UniqueFrozenset([
+  HT_KVM_MIGRATION_COMPRESSION_NONE,
+  HT_KVM_MIGRATION_COMPRESSION_XBZRLE,
+  HT_KVM_MIGRATION_COMPRESSION_COMPRESS,
+  ])
+
 # Cluster Verify steps
 VERIFY_NPLUSONE_MEM = "nplusone_mem"
 VERIFY_OPTIONAL_CHECKS = compat.UniqueFrozenset([VERIFY_NPLUSONE_MEM])
@@ -1715,6 +1793,7 @@ CV_ALL_ECODES_STRINGS = \
 
 # Node verify constants
 NV_BRIDGES = "bridges"
+NV_CHECK_TIMES = "check-times"
 NV_DRBDHELPER = "drbd-helper"
 NV_DRBDVERSION = "drbd-version"
 NV_DRBDLIST = "drbd-list"
@@ -1736,11 +1815,17 @@ NV_OOB_PATHS = "oob-paths"
 NV_OSLIST = "oslist"
 NV_PVLIST = "pvlist"
 NV_TIME = "time"
+NV_TIMED_OUT_CHECKS = "timed-out-checks"
 NV_USERSCRIPTS = "user-scripts"
 NV_VERSION = "version"
 NV_VGLIST = "vglist"
 NV_VMNODES = "vmnodes"
 
+#: Timeout for each group of checks done by the node verification RPC, in
+#: seconds; the groups run concurrently, so this must stay below the timeout
+#: of the RPC itself
+NODE_VERIFY_CHECK_TIMEOUT = 10 * 60
+
 # Instance status
 INSTST_RUNNING = "running"
 INSTST_ADMINDOWN = "ADMIN_down"
@@ -2152,6 +2237,10 @@ HVC_DEFAULTS = {
     HV_MIGRATION_BANDWIDTH: 32, # MiB/s
     HV_MIGRATION_DOWNTIME: 30,  # ms
     HV_MIGRATION_MODE: HT_MIGRATION_LIVE,
+    HV_KVM_MIGRATION_AUTO_CONVERGE: False,
+    HV_KVM_MIGRATION_MULTIFD_CHANNELS: 0,
+    HV_KVM_MIGRATION_COMPRESSION: HT_KVM_MIGRATION_COMPRESSION_NONE,
+    HV_KVM_MIGRATION_POSTCOPY: False,
     HV_USE_LOCALTIME: False,
     HV_DISK_CACHE: HT_CACHE_DEFAULT,
     HV_SECURITY_MODEL: HT_SM_NONE,
@@ -2343,6 +2432,7 @@ CONFD_REQ_MC_PIP_LIST = 5
 CONFD_REQ_INSTANCES_IPS_LIST = 6
 CONFD_REQ_NODE_DRBD = 7
 CONFD_REQ_NODE_INSTANCES = 8
+CONFD_REQ_BATCH = 9
 
 # Confd request query fields. These are used to narrow down queries.
 # These must be strings rather than integers, because json-encoding
@@ -2365,6 +2455,7 @@ CONFD_REQS = compat.UniqueFrozenset([
   CONFD_REQ_MC_PIP_LIST,
   CONFD_REQ_INSTANCES_IPS_LIST,
   CONFD_REQ_NODE_DRBD,
+  CONFD_REQ_BATCH,
   ])
 
 CONFD_REPL_STATUS_OK = 0
@@ -2421,6 +2512,14 @@ CONFD_DEFAULT_REQ_COVERAGE = 6
 # sent a request.
 CONFD_CLIENT_EXPIRE_TIMEOUT = 10
 
+# Time in seconds for which the confd client library keeps answers to queries
+# in its cache.
+CONFD_CLIENT_CACHE_TTL = 5
+
+# Maximum size of a confd request; the server doesn't read more than this from
+# a single datagram, so batch requests are split to stay below it.
+CONFD_MAX_REQUEST_SIZE = 4096
+
 # Maximum UDP datagram size.
 # On IPv4: 64K - 20 (ip header size) - 8 (udp header size) = 65507
 # On IPv6: 64K - 40 (ip6 header size) - 8 (udp header size) = 65487
@@ -23,6 +23,9 @@
 
 """
 
+import logging
+import threading
+
 from ganeti import constants
 from ganeti import errors
 from ganeti import utils
@@ -47,7 +50,7 @@ def _RpcResultsToHooksResults(rpc_results):
 class HooksMaster(object):
   def __init__(self, opcode, hooks_path, nodes, hooks_execution_fn,
                hooks_results_adapt_fn, build_env_fn, log_fn, htype=None,
-               cluster_name=None, master_name=None):
+               cluster_name=None, master_name=None, async_post=False):
     """Base class for hooks masters.
 
     This class invokes the execution of hooks according to the behaviour
@@ -79,6 +82,9 @@ class HooksMaster(object):
     @param cluster_name: name of the cluster
     @type master_name: string
     @param master_name: name of the master
+    @type async_post: boolean
+    @param async_post: whether to run the post-hooks in the background,
+      without waiting for their results
 
     """
     self.opcode = opcode
@@ -90,6 +96,7 @@ class HooksMaster(object):
     self.htype = htype
     self.cluster_name = cluster_name
     self.master_name = master_name
+    self.async_post = async_post
 
     self.pre_env = self._BuildEnv(constants.HOOKS_PHASE_PRE)
     (self.pre_nodes, self.post_nodes) = nodes
@@ -183,7 +190,8 @@ class HooksMaster(object):
         L{constants.HOOKS_PHASE_PRE}; it denotes the hooks phase
     @param node_names: overrides the predefined list of nodes for the given
         phase
-    @return: the processed results of the hooks multi-node rpc call
+    @return: the processed results of the hooks multi-node rpc call, or None
+        if the post-hooks are run asynchronously
     @raise errors.HooksFailure: on communication failure to the nodes
     @raise errors.HooksAbort: on failure of one of the hooks
 
@@ -205,14 +213,45 @@ class HooksMaster(object):
       # even attempt to run, or this LU doesn't do hooks at all
       return
 
+    if phase == constants.HOOKS_PHASE_POST and self.async_post:
+      # The opcode may have finished by the time the results arrive, so they
+      # can only be logged
+      thread = threading.Thread(target=self._RunAsyncPhase,
+                                args=(node_names, phase, env))
+      thread.setDaemon(True)
+      thread.start()
+      return None
+
     results = self._RunWrapper(node_names, self.hooks_path, phase, env)
+    self._ProcessResults(phase, results, self.log_fn)
+
+    return results
+
+  def _RunAsyncPhase(self, node_names, phase, env):
+    """Runs a hooks phase in the background, logging its results.
+
+    """
+    try:
+      results = self._RunWrapper(node_names, self.hooks_path, phase, env)
+      self._ProcessResults(phase, results, logging.warning)
+    except Exception: # pylint: disable=W0703
+      logging.exception("Error while running %s hooks '%s' for %s",
+                        phase, self.hooks_path, self.opcode)
+
+  def _ProcessResults(self, phase, results, log_fn):
+    """Checks the results of a hooks phase.
+
+    @raise errors.HooksFailure: on communication failure to the nodes
+    @raise errors.HooksAbort: on failure of one of the hooks
+
+    """
     if not results:
       msg = "Communication Failure"
       if phase == constants.HOOKS_PHASE_PRE:
         raise errors.HooksFailure(msg)
       else:
-        self.log_fn(msg)
-        return results
+        log_fn(msg)
+        return
 
     converted_res = results
     if self.hooks_results_adapt_fn:
@@ -224,24 +263,28 @@ class HooksMaster(object):
         continue
 
       if fail_msg:
-        self.log_fn("Communication failure to node %s: %s", node_name, fail_msg)
+        log_fn("Communication failure to node %s: %s", node_name, fail_msg)
         continue
 
-      for script, hkr, output in hooks_results:
+      for script_result in hooks_results:
+        # Nodes of older versions don't report the run time of scripts
+        (script, hkr, output) = script_result[:3]
+        if len(script_result) > 3 and script_result[3] is not None:
+          logging.debug("Hook script %s on node %s ran for %.3f seconds",
+                        script, node_name, script_result[3])
+
         if hkr == constants.HKR_FAIL:
           if phase == constants.HOOKS_PHASE_PRE:
             errs.append((node_name, script, output))
           else:
             if not output:
               output = "(no output)"
-            self.log_fn("On %s script %s failed, output: %s" %
-                        (node_name, script, output))
+            log_fn("On %s script %s failed, output: %s" %
+                   (node_name, script, output))
 
     if errs and phase == constants.HOOKS_PHASE_PRE:
       raise errors.HooksAbort(errs)
 
-    return results
-
   def RunConfigUpdate(self):
     """Run the special configuration update hook
 
@@ -277,4 +320,5 @@ class HooksMaster(object):
 
     return HooksMaster(lu.op.OP_ID, lu.HPATH, nodes, hooks_execution_fn,
                        _RpcResultsToHooksResults, lu.BuildHooksEnv,
-                       lu.LogWarning, lu.HTYPE, cluster_name, master_name)
+                       lu.LogWarning, lu.HTYPE, cluster_name, master_name,
+                       async_post=lu.HOOKS_ASYNC_POST)
@@ -34,9 +34,9 @@ import pwd
 import struct
 import fcntl
 import shutil
+import select
 import socket
 import stat
-import StringIO
 try:
   import affinity   # pylint: disable=F0401
 except ImportError:
@@ -250,7 +250,12 @@ class QmpConnection:
     # in a reasonable amount of time
     self.sock.settimeout(self._SOCKET_TIMEOUT)
     self._connected = False
+    self._handshake_pending = False
+    # Received data not yet parsed, and parsed messages not yet consumed
     self._buf = ""
+    self._messages = []
+    # Number of greeting and response messages still to be received
+    self._pending_replies = 0
 
   def _check_socket(self):
     sock_stat = None
@@ -273,12 +278,32 @@ class QmpConnection:
       raise errors.ProgrammerError("To use a QmpConnection you need to first"
                                    " invoke connect() on it")
 
-  def connect(self):
+  def close(self):
+    """Closes the connection to the QMP monitor.
+
+    """
+    self._connected = False
+    self._handshake_pending = False
+    self._buf = ""
+    self._messages = []
+    self.sock.close()
+
+  def fileno(self):
+    """Returns the file descriptor of the socket, for use with select.
+
+    """
+    return self.sock.fileno()
+
+  def connect(self, wait=True):
     """Connects to the QMP monitor.
 
     Connects to the UNIX socket and makes sure that we can actually send and
     receive data to the kvm instance via QMP.
 
+    @type wait: bool
+    @param wait: whether to wait for the end of the handshake; if False,
+                 commands can be sent right away, but L{FinishConnect} must
+                 be called before receiving their responses
     @raise errors.HypervisorError: when there are communication errors
     @raise errors.ProgrammerError: when there are data serialization errors
 
@@ -294,19 +319,119 @@ class QmpConnection:
     except EnvironmentError:
       raise errors.HypervisorError("Can't connect to qmp socket")
     self._connected = True
-
-    # Check if we receive a correct greeting message from the server
-    # (As per the QEMU Protocol Specification 0.1 - section 2.2)
-    greeting = self._Recv()
-    if not greeting[self._FIRST_MESSAGE_KEY]:
-      self._connected = False
-      raise errors.HypervisorError("kvm: QMP communication error (wrong"
-                                   " server greeting")
+    self._pending_replies = 1
 
     # Let's put the monitor in command mode using the qmp_capabilities
     # command, or else no command will be executable.
     # (As per the QEMU Protocol Specification 0.1 - section 4)
-    self.Execute(self._CAPABILITIES_COMMAND)
+    # The server only reads it after sending its greeting, so it can be sent
+    # without waiting.
+    self.SendCommand(self._CAPABILITIES_COMMAND)
+    self._handshake_pending = True
+
+    if wait:
+      self.FinishConnect()
+
+  def FinishConnect(self):
+    """Receives the greeting and the response to qmp_capabilities.
+
+    @raise errors.HypervisorError: when there are communication errors
+
+    """
+    if not self._handshake_pending:
+      return
+    self._handshake_pending = False
+
+    try:
+      # Check if we receive a correct greeting message from the server
+      # (As per the QEMU Protocol Specification 0.1 - section 2.2)
+      greeting = self._Recv()
+      if not greeting[self._FIRST_MESSAGE_KEY]:
+        raise errors.HypervisorError("kvm: QMP communication error (wrong"
+                                     " server greeting")
+
+      self.RecvResponse(self._CAPABILITIES_COMMAND)
+    except errors.HypervisorError:
+      # Without the handshake no response can be trusted
+      self._connected = False
+      raise
+
+  @staticmethod
+  def WaitForReplies(connections, timeout):
+    """Waits for several connections to receive all their pending replies.
+
+    The data is read from all connections as it arrives, so that they don't
+    have to be waited for one after the other.
+
+    @type connections: list of L{QmpConnection}
+    @param connections: connections on which commands have been sent
+    @type timeout: float
+    @param timeout: maximum time to wait, in seconds
+    @rtype: list of L{QmpConnection}
+    @return: the connections that received the greeting and the responses to
+             all commands sent so far; other connections are left as they are
+
+    """
+    end_time = time.time() + timeout
+    waiting = [qmp for qmp in connections if qmp._pending_replies > 0]
+    done = [qmp for qmp in connections if qmp._pending_replies <= 0]
+    while waiting:
+      remaining = end_time - time.time()
+      if remaining <= 0:
+        break
+      try:
+        ready = select.select(waiting, [], [], remaining)[0]
+      except select.error, err:
+        logging.warning("Error while waiting for QMP replies: %s", err)
+        break
+      for qmp in ready:
+        try:
+          qmp._ReadData()
+        except errors.HypervisorError, err:
+          logging.debug("Can't receive QMP replies: %s", err)
+          waiting.remove(qmp)
+          continue
+        if qmp._pending_replies <= 0:
+          waiting.remove(qmp)
+          done.append(qmp)
+
+    return [qmp for qmp in connections if qmp in done]
+
+  def WaitForEvent(self, events, timeout):
+    """Waits for one of the given asynchronous events.
+
+    Other messages received in the meantime are discarded, so this must not
+    be used while responses to commands are still pending.
+
+    @type events: list of strings
+    @param events: names of the events to wait for
+    @type timeout: float
+    @param timeout: maximum time to wait, in seconds
+    @rtype: L{QmpMessage} or None
+    @return: the received event, or None if none arrived in time
+    @raise errors.HypervisorError: when there are communication errors
+
+    """
+    self._check_connection()
+    end_time = time.time() + timeout
+    while True:
+      if not self._messages:
+        remaining = end_time - time.time()
+        if remaining <= 0:
+          return None
+        try:
+          ready = select.select([self.sock], [], [], remaining)[0]
+        except select.error, err:
+          raise errors.HypervisorError("Error while waiting for QMP events: %s"
+                                       % err)
+        if not ready:
+          return None
+        self._ReadData()
+        continue
+
+      message = self._messages.pop(0)
+      if message[self._EVENT_KEY] in events:
+        return message
 
   def _ParseMessage(self, buf):
     """Extract and parse a QMP message from the given buffer.
@@ -342,31 +467,45 @@ class QmpConnection:
     """
     self._check_connection()
 
-    # Check if there is already a message in the buffer
-    (message, self._buf) = self._ParseMessage(self._buf)
-    if message:
-      return message
+    while not self._messages:
+      self._ReadData()
 
-    recv_buffer = StringIO.StringIO(self._buf)
-    recv_buffer.seek(len(self._buf))
-    try:
-      while True:
-        data = self.sock.recv(4096)
-        if not data:
-          break
-        recv_buffer.write(data)
+    return self._messages.pop(0)
+
+  def _ReadData(self):
+    """Receives data once from the socket and parses the complete messages.
 
-        (message, self._buf) = self._ParseMessage(recv_buffer.getvalue())
-        if message:
-          return message
+    Only the data following the last complete message is kept in the buffer.
 
+    @raise errors.HypervisorError: when there are communication errors
+    @raise errors.ProgrammerError: when there are data serialization errors
+
+    """
+    try:
+      data = self.sock.recv(4096)
     except socket.timeout, err:
+      # The reply may still arrive later, so the stream can't be trusted
+      self._connected = False
       raise errors.HypervisorError("Timeout while receiving a QMP message: "
                                    "%s" % (err))
     except socket.error, err:
+      self._connected = False
       raise errors.HypervisorError("Unable to receive data from KVM using the"
                                    " QMP protocol: %s" % err)
 
+    if not data:
+      self._connected = False
+      raise errors.HypervisorError("QMP connection closed by the KVM instance")
+
+    self._buf += data
+    while True:
+      (message, self._buf) = self._ParseMessage(self._buf)
+      if message is None:
+        break
+      if not message[self._EVENT_KEY]:
+        self._pending_replies -= 1
+      self._messages.append(message)
+
   def _Send(self, message):
     """Encodes and sends a message to KVM using QMP.
 
@@ -385,9 +524,11 @@ class QmpConnection:
     try:
       self.sock.sendall(message_str)
     except socket.timeout, err:
+      self._connected = False
       raise errors.HypervisorError("Timeout while sending a QMP message: "
                                    "%s (%s)" % (err.string, err.errno))
     except socket.error, err:
+      self._connected = False
       raise errors.HypervisorError("Unable to send data from KVM using the"
                                    " QMP protocol: %s" % err)
 
@@ -403,13 +544,44 @@ class QmpConnection:
     @raise errors.HypervisorError: when there are communication errors
     @raise errors.ProgrammerError: when there are data serialization errors
 
+    """
+    self.SendCommand(command, arguments)
+    return self.RecvResponse(command)
+
+  def SendCommand(self, command, arguments=None):
+    """Sends a QMP command without waiting for its response.
+
+    QMP answers commands in the order they were received, so several
+    commands can be sent before collecting their responses with
+    L{RecvResponse}, in the same order.
+
+    @type command: str
+    @param command: the command to execute
+    @type arguments: dict
+    @param arguments: dictionary of arguments to be passed to the command
+    @raise errors.HypervisorError: when there are communication errors
+    @raise errors.ProgrammerError: when there are data serialization errors
+
     """
     self._check_connection()
     message = QmpMessage({self._EXECUTE_KEY: command})
     if arguments:
       message[self._ARGUMENTS_KEY] = arguments
     self._Send(message)
+    self._pending_replies += 1
+
+  def RecvResponse(self, command):
+    """Receives the response to a command sent with L{SendCommand}.
 
+    @type command: str
+    @param command: the command whose response is expected, used for error
+                    reporting only
+    @rtype: dict
+    @return: dictionary representing the received JSON object
+    @raise errors.HypervisorError: when there are communication errors or the
+                                   command failed
+
+    """
     # Events can occur between the sending of the command and the reception
     # of the response, so we need to filter out messages with the event key.
     while True:
@@ -506,6 +678,13 @@ class KVMHypervisor(hv_base.BaseHypervisor):
     constants.HV_MIGRATION_BANDWIDTH: hv_base.REQ_NONNEGATIVE_INT_CHECK,
     constants.HV_MIGRATION_DOWNTIME: hv_base.REQ_NONNEGATIVE_INT_CHECK,
     constants.HV_MIGRATION_MODE: hv_base.MIGRATION_MODE_CHECK,
+    constants.HV_KVM_MIGRATION_AUTO_CONVERGE: hv_base.NO_CHECK,
+    constants.HV_KVM_MIGRATION_MULTIFD_CHANNELS:
+      hv_base.OPT_NONNEGATIVE_INT_CHECK,
+    constants.HV_KVM_MIGRATION_COMPRESSION:
+      hv_base.ParamInSet(True,
+                         constants.HT_KVM_VALID_MIGRATION_COMPRESSION_TYPES),
+    constants.HV_KVM_MIGRATION_POSTCOPY: hv_base.NO_CHECK,
     constants.HV_USE_LOCALTIME: hv_base.NO_CHECK,
     constants.HV_DISK_CACHE:
       hv_base.ParamInSet(True, constants.HT_VALID_CACHE_TYPES),
@@ -532,6 +711,19 @@ class KVMHypervisor(hv_base.BaseHypervisor):
     constants.HV_VNET_HDR: hv_base.NO_CHECK,
     }
 
+  # Information parsed from the command line of running instances, keyed by
+  # pid and validated against the file ID of the process' /proc directory
+  _pid_info_cache = {}
+
+  # Pids read from the pidfiles of instances, keyed by instance name and
+  # validated against the file ID of the pidfile; the node daemon keeps this
+  # and L{_pid_info_cache} up to date (see L{WatchInstances})
+  _pidfile_cache = {}
+
+  # Whether the pidfile directory is watched; the pidfile cache is only used
+  # while it is, as a pidfile can be rewritten without changing its file ID
+  _watching_instances = False
+
   _VIRTIO = "virtio"
   _VIRTIO_NET_PCI = "virtio-net-pci"
 
@@ -545,11 +737,51 @@ class KVMHypervisor(hv_base.BaseHypervisor):
   _MIGRATION_INFO_MAX_BAD_ANSWERS = 5
   _MIGRATION_INFO_RETRY_DELAY = 2
 
+  # How long to wait for a MIGRATION event while a migration is active, so
+  # that status changes are reported as soon as they happen
+  _MIGRATION_EVENT_TIMEOUT = 1.0
+  _MIGRATION_EVENT = "MIGRATION"
+
+  # How long to wait for all instances to answer the QMP queries of
+  # L{GetAllInstancesInfo}, in total
+  _QMP_QUERY_TIMEOUT = 5.0
+
+  # Map of QMP migration statuses to the statuses known to Ganeti; the
+  # intermediate states of QEMU are all reported as active
+  _QMP_MIGRATION_STATUSES = {
+    "setup": constants.HV_MIGRATION_ACTIVE,
+    "active": constants.HV_MIGRATION_ACTIVE,
+    "pre-switchover": constants.HV_MIGRATION_ACTIVE,
+    "device": constants.HV_MIGRATION_ACTIVE,
+    "cancelling": constants.HV_MIGRATION_ACTIVE,
+    "postcopy-active": constants.HV_MIGRATION_ACTIVE,
+    "postcopy-paused": constants.HV_MIGRATION_ACTIVE,
+    "postcopy-recover": constants.HV_MIGRATION_ACTIVE,
+    "completed": constants.HV_MIGRATION_COMPLETED,
+    "failed": constants.HV_MIGRATION_FAILED,
+    "cancelled": constants.HV_MIGRATION_CANCELLED,
+    }
+
+  # Switch a postcopy migration over to the target once all memory has been
+  # copied at least once, i.e. after the second dirty bitmap sync
+  _POSTCOPY_MIN_DIRTY_SYNCS = 2
+  # Run state of a source instance whose execution has moved to the target
+  _POSTMIGRATE_RUN_STATE = "postmigrate"
+
+  # Minimum QEMU version (major, minor) needed by migration features; all of
+  # them require deferred incoming migrations, which are available since 2.3
+  _MIGRATION_FEATURE_MIN_VERSIONS = {
+    constants.HV_KVM_MIGRATION_MULTIFD_CHANNELS: (4, 0),
+    constants.HV_KVM_MIGRATION_COMPRESSION: (2, 3),
+    constants.HV_KVM_MIGRATION_POSTCOPY: (2, 6),
+    }
+
   _VERSION_RE = re.compile(r"\b(\d+)\.(\d+)(\.(\d+))?\b")
 
   _CPU_INFO_RE = re.compile(r"cpu\s+\#(\d+).*thread_id\s*=\s*(\d+)", re.I)
   _CPU_INFO_CMD = "info cpus"
   _CONT_CMD = "cont"
+  _HUMAN_MONITOR_CMD = "human-monitor-command"
 
   _DEFAULT_MACHINE_VERSION_RE = re.compile(r"^(\S+).*\(default\)", re.M)
   _CHECK_MACHINE_VERSION_RE = \
@@ -568,6 +800,8 @@ class KVMHypervisor(hv_base.BaseHypervisor):
   # dashes not preceeded by a new line (which would mean another option
   # different than -drive is starting)
   _BOOT_RE = re.compile(r"^-drive\s([^-]|(?<!^)-)*,boot=on\|off", re.M | re.S)
+  _DISCARD_RE = re.compile(r"^-drive\s([^-]|(?<!^)-)*,discard=ignore\|unmap",
+                           re.M | re.S)
   _UUID_RE = re.compile(r"^-uuid\s", re.M)
 
   ANCILLARY_FILES = [
@@ -618,6 +852,9 @@ class KVMHypervisor(hv_base.BaseHypervisor):
     Check that a pid file is associated with an instance, and retrieve
     information from its command line.
 
+    The command line of a process never changes, so the parsed result is
+    cached for as long as the process' /proc entry stays the same.
+
     @type pid: string or int
     @param pid: process id of the instance to check
     @rtype: tuple
@@ -629,7 +866,18 @@ class KVMHypervisor(hv_base.BaseHypervisor):
     if not alive:
       raise errors.HypervisorError("Cannot get info for pid %s" % pid)
 
-    cmdline_file = utils.PathJoin("/proc", str(pid), "cmdline")
+    proc_dir = utils.PathJoin("/proc", str(pid))
+    try:
+      proc_id = utils.GetFileID(path=proc_dir)
+    except EnvironmentError, err:
+      raise errors.HypervisorError("Cannot get info for pid %s: %s" %
+                                   (pid, err))
+
+    cached = cls._pid_info_cache.get(pid, None)
+    if cached is not None and cached[0] == proc_id:
+      return cached[1]
+
+    cmdline_file = utils.PathJoin(proc_dir, "cmdline")
     try:
       cmdline = utils.ReadFile(cmdline_file)
     except EnvironmentError, err:
@@ -654,7 +902,92 @@ class KVMHypervisor(hv_base.BaseHypervisor):
       raise errors.HypervisorError("Pid %s doesn't contain a ganeti kvm"
                                    " instance" % pid)
 
-    return (instance, memory, vcpus)
+    result = (instance, memory, vcpus)
+    cls._pid_info_cache[pid] = (proc_id, result)
+    return result
+
+  @classmethod
+  def _ReadInstancePid(cls, instance_name):
+    """Returns the pid written to an instance's pidfile.
+
+    While the pidfile directory is watched (see L{WatchInstances}), the pid
+    is cached for as long as the pidfile stays the same.
+
+    @type instance_name: string
+    @param instance_name: instance name
+    @rtype: int
+    @return: the pid, or zero if the pidfile doesn't exist or is invalid
+
+    """
+    pidfile = cls._InstancePidFile(instance_name)
+    if not cls._watching_instances:
+      return utils.ReadPidFile(pidfile)
+
+    try:
+      file_id = utils.GetFileID(path=pidfile)
+    except EnvironmentError:
+      cls._pidfile_cache.pop(instance_name, None)
+      return utils.ReadPidFile(pidfile)
+
+    cached = cls._pidfile_cache.get(instance_name, None)
+    if cached is not None and cached[0] == file_id:
+      return cached[1]
+
+    # The file ID is taken before reading, so a pidfile changed while being
+    # read is never cached with its new ID
+    pid = utils.ReadPidFile(pidfile)
+    cls._pidfile_cache[instance_name] = (file_id, pid)
+    return pid
+
+  @classmethod
+  def RefreshInstanceCache(cls, instance_names=None):
+    """Updates the cached pids and command lines of instances.
+
+    Used by the node daemon, whose request handlers are forked and inherit
+    up-to-date caches instead of reading every pidfile and command line
+    again. Whether instances are alive is still checked on every use.
+
+    @type instance_names: list of strings or None
+    @param instance_names: the instances whose pidfile changed, or None to
+      rescan all of them
+
+    """
+    if instance_names is None:
+      try:
+        instance_names = os.listdir(cls._PIDS_DIR)
+      except EnvironmentError, err:
+        logging.warning("Can't list KVM pidfiles: %s", err)
+        instance_names = []
+      for name in set(cls._pidfile_cache) - set(instance_names):
+        del cls._pidfile_cache[name]
+
+    for name in instance_names:
+      pid = cls._ReadInstancePid(name)
+      if pid:
+        try:
+          cls._InstancePidInfo(pid)
+        except errors.HypervisorError:
+          pass
+
+    # Forget processes which no longer belong to an instance
+    pids = frozenset(pid for (_, pid) in cls._pidfile_cache.values())
+    for pid in set(cls._pid_info_cache) - pids:
+      del cls._pid_info_cache[pid]
+
+  @classmethod
+  def WatchInstances(cls, watch_fn):
+    """Keeps the caches of this process up to date.
+
+    @type watch_fn: callable
+    @param watch_fn: function called with a directory and a callback, which
+      must arrange for the callback to be called with the names of changed
+      files in the directory, or None if they are unknown
+
+    """
+    utils.EnsureDirs([(cls._PIDS_DIR, constants.RUN_DIRS_MODE)])
+    watch_fn(cls._PIDS_DIR, cls.RefreshInstanceCache)
+    cls._watching_instances = True
+    cls.RefreshInstanceCache()
 
   def _InstancePidAlive(self, instance_name):
     """Returns the instance pidfile, pid, and liveness.
@@ -666,7 +999,7 @@ class KVMHypervisor(hv_base.BaseHypervisor):
 
     """
     pidfile = self._InstancePidFile(instance_name)
-    pid = utils.ReadPidFile(pidfile)
+    pid = self._ReadInstancePid(instance_name)
 
     alive = False
     try:
@@ -707,6 +1040,41 @@ class KVMHypervisor(hv_base.BaseHypervisor):
     """
     return utils.PathJoin(cls._CTRL_DIR, "%s.qmp" % instance_name)
 
+  @classmethod
+  def _OpenQmpConnection(cls, instance_name):
+    """Opens a new QMP connection to an instance.
+
+    Connections are not kept across calls, as the node daemon forks a new
+    process for every request; the caller must close the connection.
+
+    @type instance_name: string
+    @param instance_name: instance name
+    @rtype: L{QmpConnection}
+    @raise errors.HypervisorError: when the monitor can't be reached
+
+    """
+    qmp = QmpConnection(cls._InstanceQmpMonitor(instance_name))
+    try:
+      qmp.connect()
+    except:
+      qmp.close()
+      raise
+    return qmp
+
+  def _CallQmpCommand(self, instance_name, command, arguments=None):
+    """Executes a QMP command over a new connection to the instance.
+
+    @rtype: L{QmpMessage}
+    @return: the response of the server
+    @raise errors.HypervisorError: when the command fails
+
+    """
+    qmp = self._OpenQmpConnection(instance_name)
+    try:
+      return qmp.Execute(command, arguments)
+    finally:
+      qmp.close()
+
   @staticmethod
   def _SocatUnixConsoleParams():
     """Returns the correct parameters for socat
@@ -776,6 +1144,7 @@ class KVMHypervisor(hv_base.BaseHypervisor):
 
     """
     utils.RemoveFile(pidfile)
+    cls._pidfile_cache.pop(instance_name, None)
     utils.RemoveFile(cls._InstanceMonitor(instance_name))
     utils.RemoveFile(cls._InstanceSerial(instance_name))
     utils.RemoveFile(cls._InstanceQmpMonitor(instance_name))
@@ -987,39 +1356,93 @@ class KVMHypervisor(hv_base.BaseHypervisor):
       return None
 
     _, memory, vcpus = self._InstancePidInfo(pid)
-    istat = "---b-"
-    times = "0"
-
-    try:
-      qmp = QmpConnection(self._InstanceQmpMonitor(instance_name))
-      qmp.connect()
-      vcpus = len(qmp.Execute("query-cpus")[qmp.RETURN_KEY])
-      # Will fail if ballooning is not enabled, but we can then just resort to
-      # the value above.
-      mem_bytes = qmp.Execute("query-balloon")[qmp.RETURN_KEY][qmp.ACTUAL_KEY]
-      memory = mem_bytes / 1048576
-    except errors.HypervisorError:
-      pass
-
-    return (instance_name, pid, memory, vcpus, istat, times)
+    return self._QueryInstancesInfo([(instance_name, pid, memory, vcpus)])[0]
 
   def GetAllInstancesInfo(self, hvparams=None):
     """Get properties of all instances.
 
+    All instances are queried at once: the QMP commands are first sent to
+    every instance and only then are the responses collected, so that the
+    instances answer concurrently.
+
     @type hvparams: dict of strings
     @param hvparams: hypervisor parameter
     @return: list of tuples (name, id, memory, vcpus, stat, times)
 
     """
-    data = []
+    static_info = []
     for name in os.listdir(self._PIDS_DIR):
       try:
-        info = self.GetInstanceInfo(name)
+        _, pid, alive = self._InstancePidAlive(name)
+        if not alive:
+          continue
+        _, memory, vcpus = self._InstancePidInfo(pid)
       except errors.HypervisorError:
         # Ignore exceptions due to instances being shut down
         continue
-      if info:
-        data.append(info)
+      static_info.append((name, pid, memory, vcpus))
+
+    return self._QueryInstancesInfo(static_info)
+
+  def _QueryInstancesInfo(self, static_info):
+    """Completes instance information with runtime data from QMP.
+
+    The number of vCPUs and the current (ballooned) memory size are queried
+    from QMP; if that fails, the values from the command line are used.
+    The QMP handshake and the queries are sent to all instances first, and
+    the replies are then received from all of them at once.
+
+    @type static_info: list of tuples
+    @param static_info: (name, pid, memory, vcpus) for each running instance,
+                        as parsed from the command line
+    @return: list of tuples (name, id, memory, vcpus, stat, times)
+
+    """
+    istat = "---b-"
+    times = "0"
+
+    pending = []
+    for (name, pid, memory, vcpus) in static_info:
+      qmp = QmpConnection(self._InstanceQmpMonitor(name))
+      try:
+        qmp.connect(wait=False)
+        qmp.SendCommand("query-cpus")
+        qmp.SendCommand("query-balloon")
+      except errors.HypervisorError:
+        qmp.close()
+        qmp = None
+      pending.append((name, pid, memory, vcpus, qmp))
+
+    answered = QmpConnection.WaitForReplies([p[4] for p in pending
+                                             if p[4] is not None],
+                                            self._QMP_QUERY_TIMEOUT)
+
+    data = []
+    for (name, pid, memory, vcpus, qmp) in pending:
+      if qmp in answered:
+        # All replies have been received, so none of these calls block
+        try:
+          qmp.FinishConnect()
+        except errors.HypervisorError, err:
+          logging.debug("QMP handshake with %s failed: %s", name, err)
+        else:
+          try:
+            vcpus = len(qmp.RecvResponse("query-cpus")[qmp.RETURN_KEY])
+          except errors.HypervisorError:
+            pass
+          # Will fail if ballooning is not enabled, but we can then just
+          # resort to the value from the command line.
+          try:
+            mem_bytes = (qmp.RecvResponse("query-balloon")
+                         [qmp.RETURN_KEY][qmp.ACTUAL_KEY])
+            memory = mem_bytes / 1048576
+          except errors.HypervisorError:
+            pass
+      if qmp is not None:
+        qmp.close()
+
+      data.append((name, pid, memory, vcpus, istat, times))
+
     return data
 
   def _GenerateKVMRuntime(self, instance, block_devices, startup_paused,
@@ -1114,6 +1537,15 @@ class KVMHypervisor(hv_base.BaseHypervisor):
       if_val = ",if=%s" % disk_type
     # Cache mode
     disk_cache = hvp[constants.HV_DISK_CACHE]
+    # librbd keeps its cache coherent across live migrations (it is flushed
+    # before the destination takes over), so userspace disks can use it
+    if disk_cache == constants.HT_CACHE_DEFAULT:
+      userspace_val = ",cache=%s" % constants.HT_CACHE_WBACK
+    else:
+      userspace_val = ",cache=%s" % disk_cache
+    # let guest discards free space in the backing storage pool
+    if self._DISCARD_RE.search(kvmhelp):
+      userspace_val += ",discard=unmap"
     if instance.disk_template in constants.DTS_EXT_MIRROR:
       if disk_cache != "none":
         # TODO: make this a hard error, instead of a silent overwrite
@@ -1137,11 +1569,14 @@ class KVMHypervisor(hv_base.BaseHypervisor):
         if needs_boot_flag and disk_type != constants.HT_DISK_IDE:
           boot_val = ",boot=on"
 
-      if cfdev.params[constants.LDP_ACCESS] == constants.DISK_USERSPACE:
-        dev_path = device.GetUserspaceAccessUri(constants.HT_KVM)
-
-      drive_val = "file=%s,format=raw%s%s%s" % (dev_path, if_val,
-                                                  boot_val, cache_val)
+      if cfdev.params.get(constants.LDP_ACCESS) == constants.DISK_USERSPACE:
+        # librbd does its own asynchronous I/O, so no aio mode is passed
+        drive_val = "file=%s,format=raw%s%s%s" % \
+          (device.GetUserspaceAccessUri(constants.HT_KVM), if_val, boot_val,
+           userspace_val)
+      else:
+        drive_val = "file=%s,format=raw%s%s%s" % (dev_path, if_val,
+                                                    boot_val, cache_val)
       kvm_cmd.extend(["-drive", drive_val])
 
     #Now we can specify a different device type for CDROM devices.
@@ -1473,6 +1908,9 @@ class KVMHypervisor(hv_base.BaseHypervisor):
     if result.failed:
       raise errors.HypervisorError("Failed to start instance %s: %s (%s)" %
                                    (name, result.fail_reason, result.output))
+    # The pidfile may have been rewritten since the watch last updated the
+    # cache inherited by this process
+    self._pidfile_cache.pop(name, None)
     if not self._InstancePidAlive(name)[2]:
       raise errors.HypervisorError("Failed to start instance %s" % name)
 
@@ -1569,9 +2007,18 @@ class KVMHypervisor(hv_base.BaseHypervisor):
           tap_val = "tap,vlan=%s,fd=%d" % (nic_seq, tapfd)
           kvm_cmd.extend(["-net", tap_val, "-net", nic_val])
 
+    # The migration capabilities affecting the format of the migration stream
+    # must be the same on the source and on the target. They have to be set
+    # before the incoming migration starts, so in that case KVM only starts
+    # listening once told to do so.
+    defer_incoming = bool(incoming and
+                          self._GetMigrationCapabilities(conf_hvp))
     if incoming:
       target, port = incoming
-      kvm_cmd.extend(["-incoming", "tcp:%s:%s" % (target, port)])
+      if defer_incoming:
+        kvm_cmd.extend(["-incoming", "defer"])
+      else:
+        kvm_cmd.extend(["-incoming", "tcp:%s:%s" % (target, port)])
 
     # Changing the vnc password doesn't bother the guest that much. At most it
     # will surprise people who connect to it. Whether positively or negatively
@@ -1641,6 +2088,11 @@ class KVMHypervisor(hv_base.BaseHypervisor):
       utils.WriteFile(self._InstanceNICFile(instance.name, nic_seq),
                       data=tap)
 
+    if defer_incoming:
+      self._SetMigrationParameters(name, conf_hvp, {})
+      self._CallMonitorCommand(name, "migrate_incoming tcp:%s:%s" %
+                               (target, port))
+
     if vnc_pwd:
       change_cmd = "change vnc password %s" % vnc_pwd
       self._CallMonitorCommand(instance.name, change_cmd)
@@ -1659,13 +2111,11 @@ class KVMHypervisor(hv_base.BaseHypervisor):
         raise errors.HypervisorError("Failed to open SPICE password file %s: %s"
                                      % (spice_password_file, err))
 
-      qmp = QmpConnection(self._InstanceQmpMonitor(instance.name))
-      qmp.connect()
       arguments = {
           "protocol": "spice",
           "password": spice_pwd,
       }
-      qmp.Execute("set_password", arguments)
+      self._CallQmpCommand(instance.name, "set_password", arguments)
 
     for filename in temp_files:
       utils.RemoveFile(filename)
@@ -1699,14 +2149,30 @@ class KVMHypervisor(hv_base.BaseHypervisor):
   def _CallMonitorCommand(self, instance_name, command):
     """Invoke a command on the instance monitor.
 
+    If the instance has a QMP monitor, the command is passed to the human
+    monitor through QMP's C{human-monitor-command}, reusing the cached QMP
+    connection. Otherwise socat is used to talk to the monitor socket.
+
+    @rtype: L{utils.RunResult}
+    @return: the result of the command; its C{stdout} holds the monitor output
+
     """
-    # TODO: Replace monitor calls with QMP once KVM >= 0.14 is the minimum
-    # version. The monitor protocol is designed for human consumption, whereas
-    # QMP is made for programmatic usage. In the worst case QMP can also
-    # execute monitor commands. As it is, all calls to socat take at least
-    # 500ms and likely more: socat can't detect the end of the reply and waits
-    # for 500ms of no data received before exiting (500 ms is the default for
-    # the "-t" parameter).
+    if os.path.exists(self._InstanceQmpMonitor(instance_name)):
+      try:
+        response = self._CallQmpCommand(instance_name,
+                                        self._HUMAN_MONITOR_CMD,
+                                        {"command-line": command})
+      except errors.HypervisorError, err:
+        raise errors.HypervisorError("Failed to send command '%s' to instance"
+                                     " '%s': %s" % (command, instance_name,
+                                                    err))
+      output = response[QmpConnection.RETURN_KEY] or ""
+      return utils.RunResult(0, None, output, "", command, None, None)
+
+    # Instances started with an old KVM version (< 0.14) have no QMP
+    # monitor. All calls to socat take at least 500ms and likely more: socat
+    # can't detect the end of the reply and waits for 500ms of no data
+    # received before exiting (500 ms is the default for the "-t" parameter).
     socat = ("echo %s | %s STDIO UNIX-CONNECT:%s" %
              (utils.ShellQuote(command),
               constants.SOCAT_PATH,
@@ -1931,6 +2397,16 @@ class KVMHypervisor(hv_base.BaseHypervisor):
                        instance.hvparams[constants.HV_MIGRATION_DOWNTIME])
     self._CallMonitorCommand(instance_name, migrate_command)
 
+    # Status changes are then signalled by MIGRATION events, which
+    # GetMigrationStatus waits for (QEMU >= 2.4; ignored by older versions)
+    source_capabilities = {
+      "events": True,
+      "auto-converge":
+        instance.hvparams[constants.HV_KVM_MIGRATION_AUTO_CONVERGE],
+      }
+    self._SetMigrationParameters(instance_name, instance.hvparams,
+                                 source_capabilities)
+
     migrate_command = "migrate -d tcp:%s:%s" % (target, port)
     self._CallMonitorCommand(instance_name, migrate_command)
 
@@ -1950,8 +2426,154 @@ class KVMHypervisor(hv_base.BaseHypervisor):
       utils.KillProcess(pid)
       self._RemoveInstanceRuntimeFiles(pidfile, instance.name)
     elif live:
+      if instance.hvparams.get(constants.HV_KVM_MIGRATION_POSTCOPY, False):
+        # Once a postcopy migration has switched over, the guest has been
+        # running on the target and the memory of the source is stale
+        status = self._CallQmpCommand(instance.name, "query-status")
+        if (status[QmpConnection.RETURN_KEY].get("status", None) ==
+            self._POSTMIGRATE_RUN_STATE):
+          raise errors.HypervisorError("Postcopy migration of instance %s"
+                                       " failed after switching over to the"
+                                       " target node, the instance can't be"
+                                       " resumed on the source node" %
+                                       instance.name)
       self._CallMonitorCommand(instance.name, self._CONT_CMD)
 
+  @staticmethod
+  def _GetMigrationCapabilities(hvparams):
+    """Returns the migration capabilities to set on both migration ends.
+
+    Only capabilities which are enabled are returned, so that nothing is
+    sent to QEMU versions not knowing them unless they are actually used.
+
+    @type hvparams: dict
+    @param hvparams: the instance's hypervisor parameters
+    @rtype: dict
+    @return: capability names mapped to the desired state
+
+    """
+    capabilities = {}
+    if hvparams[constants.HV_KVM_MIGRATION_MULTIFD_CHANNELS]:
+      capabilities["multifd"] = True
+    compression = hvparams[constants.HV_KVM_MIGRATION_COMPRESSION]
+    if compression != constants.HT_KVM_MIGRATION_COMPRESSION_NONE:
+      # The compression types are named after the QEMU capabilities
+      capabilities[compression] = True
+    if hvparams[constants.HV_KVM_MIGRATION_POSTCOPY]:
+      capabilities["postcopy-ram"] = True
+    return capabilities
+
+  def _SetMigrationParameters(self, instance_name, hvparams,
+                              extra_capabilities):
+    """Configures the migration capabilities and parameters of an instance.
+
+    @type hvparams: dict
+    @param hvparams: the instance's hypervisor parameters
+    @type extra_capabilities: dict
+    @param extra_capabilities: additional capabilities to set, mapped to the
+                               desired state
+
+    """
+    capabilities = self._GetMigrationCapabilities(hvparams)
+    capabilities.update(extra_capabilities)
+    for (name, enabled) in sorted(capabilities.items()):
+      if enabled:
+        state = "on"
+      else:
+        state = "off"
+      self._CallMonitorCommand(instance_name,
+                               "migrate_set_capability %s %s" % (name, state))
+
+    channels = hvparams[constants.HV_KVM_MIGRATION_MULTIFD_CHANNELS]
+    if channels:
+      self._CallMonitorCommand(instance_name,
+                               "migrate_set_parameter multifd-channels %d" %
+                               channels)
+
+  @classmethod
+  def _ParseQmpMigrationStatus(cls, info):
+    """Builds a migration status from the result of C{query-migrate}.
+
+    RAM sizes are given in KiB, as they were by the human monitor, the dirty
+    pages rate in pages per second and the expected downtime in ms.
+
+    @type info: dict
+    @param info: the result of the C{query-migrate} QMP command
+    @rtype: L{objects.MigrationStatus} or None
+    @return: the migration status, or None if the status is unknown
+
+    """
+    status = cls._QMP_MIGRATION_STATUSES.get(info.get("status", None), None)
+    if status is None:
+      return None
+
+    migration_status = objects.MigrationStatus(status=status)
+    ram = info.get("ram", None)
+    if ram:
+      migration_status.transferred_ram = ram["transferred"] / 1024
+      migration_status.remaining_ram = ram["remaining"] / 1024
+      migration_status.total_ram = ram["total"] / 1024
+      migration_status.dirty_pages_rate = ram.get("dirty-pages-rate", None)
+    migration_status.expected_downtime = info.get("expected-downtime", None)
+
+    return migration_status
+
+  def _GetQmpMigrationStatus(self, instance):
+    """Get the migration status using QMP.
+
+    If the migration is active, this waits shortly for a MIGRATION event
+    signalling a change of the status, so that the end of a migration is
+    reported without waiting for the next poll. For postcopy migrations,
+    this is also where the switch to postcopy mode is triggered.
+
+    @type instance: L{objects.Instance}
+    @param instance: the instance that is being migrated
+    @rtype: L{objects.MigrationStatus} or None
+    @return: the migration status, or None if the status is unknown
+    @raise errors.HypervisorError: when QMP can't be used
+
+    """
+    # A single connection is used, so that no MIGRATION event sent after the
+    # first query can be missed
+    qmp = self._OpenQmpConnection(instance.name)
+    try:
+      return self._QueryQmpMigrationStatus(instance, qmp)
+    finally:
+      qmp.close()
+
+  def _QueryQmpMigrationStatus(self, instance, qmp):
+    """Get the migration status over the given QMP connection.
+
+    @see: L{_GetQmpMigrationStatus}
+
+    """
+    instance_name = instance.name
+    info = qmp.Execute("query-migrate")[QmpConnection.RETURN_KEY]
+    migration_status = self._ParseQmpMigrationStatus(info)
+
+    if (instance.hvparams.get(constants.HV_KVM_MIGRATION_POSTCOPY, False) and
+        info.get("status", None) == "active" and
+        info.get("ram", {}).get("dirty-sync-count", 0) >=
+          self._POSTCOPY_MIN_DIRTY_SYNCS):
+      logging.info("KVM: switching migration of %s to postcopy mode",
+                   instance_name)
+      try:
+        qmp.Execute("migrate-start-postcopy")
+      except errors.HypervisorError, err:
+        # The switch may already have been requested by a previous poll
+        logging.debug("KVM: can't start postcopy mode: %s", err)
+    if (migration_status is None or
+        migration_status.status != constants.HV_MIGRATION_ACTIVE):
+      return migration_status
+
+    if qmp.WaitForEvent([self._MIGRATION_EVENT],
+                        self._MIGRATION_EVENT_TIMEOUT):
+      info = qmp.Execute("query-migrate")
+      migration_status = \
+        self._ParseQmpMigrationStatus(info[QmpConnection.RETURN_KEY])
+
+    return migration_status
+
   def GetMigrationStatus(self, instance):
     """Get the migration status
 
@@ -1963,6 +2585,22 @@ class KVMHypervisor(hv_base.BaseHypervisor):
              progress info that can be retrieved from the hypervisor
 
     """
+    if os.path.exists(self._InstanceQmpMonitor(instance.name)):
+      for _ in range(self._MIGRATION_INFO_MAX_BAD_ANSWERS):
+        try:
+          migration_status = self._GetQmpMigrationStatus(instance)
+        except errors.HypervisorError, err:
+          logging.warning("KVM: failed to query the migration status: %s",
+                          err)
+        else:
+          if migration_status is not None:
+            return migration_status
+          logging.warning("KVM: unknown migration status")
+
+        time.sleep(self._MIGRATION_INFO_RETRY_DELAY)
+
+      return objects.MigrationStatus(status=constants.HV_MIGRATION_FAILED)
+
     info_command = "info migrate"
     for _ in range(self._MIGRATION_INFO_MAX_BAD_ANSWERS):
       result = self._CallMonitorCommand(instance.name, info_command)
@@ -2130,6 +2768,21 @@ class KVMHypervisor(hv_base.BaseHypervisor):
         raise errors.HypervisorError("Cannot have a security domain when the"
                                      " security model is 'none' or 'pool'")
 
+    compression = hvparams[constants.HV_KVM_MIGRATION_COMPRESSION]
+    multifd_channels = constants.HV_KVM_MIGRATION_MULTIFD_CHANNELS
+    if (hvparams[multifd_channels] and
+        compression != constants.HT_KVM_MIGRATION_COMPRESSION_NONE):
+      raise errors.HypervisorError("%s can't be used together with %s" %
+                                   (constants.HV_KVM_MIGRATION_COMPRESSION,
+                                    multifd_channels))
+
+    if (hvparams[constants.HV_KVM_MIGRATION_POSTCOPY] and
+        hvparams[constants.HV_MIGRATION_MODE] != constants.HT_MIGRATION_LIVE):
+      raise errors.HypervisorError("%s requires %s to be '%s'" %
+                                   (constants.HV_KVM_MIGRATION_POSTCOPY,
+                                    constants.HV_MIGRATION_MODE,
+                                    constants.HT_MIGRATION_LIVE))
+
     spice_bind = hvparams[constants.HV_KVM_SPICE_BIND]
     spice_ip_version = hvparams[constants.HV_KVM_SPICE_IP_VERSION]
     if spice_bind:
@@ -2216,6 +2869,24 @@ class KVMHypervisor(hv_base.BaseHypervisor):
         raise errors.HypervisorError("Unsupported machine version: %s" %
                                      machine_version)
 
+    used_features = []
+    if hvparams[constants.HV_KVM_MIGRATION_MULTIFD_CHANNELS]:
+      used_features.append(constants.HV_KVM_MIGRATION_MULTIFD_CHANNELS)
+    if (hvparams[constants.HV_KVM_MIGRATION_COMPRESSION] !=
+        constants.HT_KVM_MIGRATION_COMPRESSION_NONE):
+      used_features.append(constants.HV_KVM_MIGRATION_COMPRESSION)
+    if hvparams[constants.HV_KVM_MIGRATION_POSTCOPY]:
+      used_features.append(constants.HV_KVM_MIGRATION_POSTCOPY)
+
+    if used_features:
+      (version, v_major, v_min, _) = cls._GetKVMVersion(kvm_path)
+      for param in used_features:
+        min_version = cls._MIGRATION_FEATURE_MIN_VERSIONS[param]
+        if (v_major, v_min) < min_version:
+          raise errors.HypervisorError("%s requires KVM version %d.%d or"
+                                       " newer, found %s" %
+                                       ((param, ) + min_version + (version, )))
+
   @classmethod
   def PowercycleNode(cls, hvparams=None):
     """KVM powercycle, just a wrapper over Linux powercycle.
@@ -89,6 +89,19 @@ if constants.SOCAT_USE_COMPRESS:
 
 SOCAT_OPTION_MAXLEN = 400
 
+#: Commands used for compression and decompression, and the programs which
+#: need to be available for a compression method to be usable; pigz(1) is
+#: used instead of gzip(1) when installed, its output is compatible
+COMPRESSION_COMMANDS = {
+  constants.IEC_GZIP: ("$(type -P pigz || echo gzip) -c", "gunzip -c",
+                       ["gzip", "gunzip"]),
+  constants.IEC_LZ4: ("lz4 -q -c", "lz4 -q -d -c", ["lz4"]),
+  constants.IEC_ZSTD: ("zstd -q -T0 -c", "zstd -q -d -c", ["zstd"]),
+  }
+
+#: Directories searched for compression programs
+COMPRESSION_SEARCH_PATH = ["/usr/local/bin", "/usr/bin", "/bin"]
+
 (PROG_OTHER,
  PROG_SOCAT,
  PROG_DD,
@@ -295,19 +308,24 @@ class CommandBuilder(object):
 
     parts = []
 
+    if compr == constants.IEC_NONE:
+      (compr_cmd, decompr_cmd) = (None, None)
+    else:
+      (compr_cmd, decompr_cmd, _) = COMPRESSION_COMMANDS[compr]
+
     if self._mode == constants.IEM_IMPORT:
       parts.append(socat_cmd)
 
-      if compr == constants.IEC_GZIP:
-        parts.append("gunzip -c")
+      if decompr_cmd:
+        parts.append(decompr_cmd)
 
       parts.append(dd_cmd)
 
     elif self._mode == constants.IEM_EXPORT:
       parts.append(dd_cmd)
 
-      if compr == constants.IEC_GZIP:
-        parts.append("gzip -c")
+      if compr_cmd:
+        parts.append(compr_cmd)
 
       parts.append(socat_cmd)
 
@@ -340,6 +358,31 @@ class CommandBuilder(object):
     return self.GetBashCommand(buf.getvalue())
 
 
+def _FindProgram(name, is_executable_fn):
+  """Checks whether a program is installed in L{COMPRESSION_SEARCH_PATH}.
+
+  """
+  return compat.any(is_executable_fn(utils.PathJoin(path, name))
+                    for path in COMPRESSION_SEARCH_PATH)
+
+
+def GetCompressionMethods(_is_executable_fn=utils.IsExecutable):
+  """Returns the compression methods usable on this machine.
+
+  @rtype: list
+  @return: List of compression methods (from L{constants.IEC_ALL}) whose
+      programs are installed; L{constants.IEC_NONE} is always included
+
+  """
+  result = [constants.IEC_NONE]
+
+  for (method, (_, _, programs)) in COMPRESSION_COMMANDS.items():
+    if compat.all(_FindProgram(name, _is_executable_fn) for name in programs):
+      result.append(method)
+
+  return sorted(result)
+
+
 def _VerifyListening(family, address, port):
   """Verify address given as listening address by socat.
 
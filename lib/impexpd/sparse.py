@@ -0,0 +1,405 @@
+#
+#
+
+# Copyright (C) 2014 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Sparse stream format for disk transfers.
+
+A sparse stream describes the contents of a file or block device as a
+sequence of contiguous extents, each of which is either data or a hole (a
+region containing only zeros). Holes are sent as a single record, so that
+mostly empty disks don't have to be transferred byte by byte.
+
+The stream starts with L{MAGIC}, followed by records. Each record has a
+header consisting of its type, offset and length (see L{_RECORD_HEADER}).
+Data records are followed by their data. The stream is terminated by an end
+record, whose offset is the end of the transferred range and which is
+followed by the SHA1 digest of all preceding records (including the data).
+
+A stream can describe only a range of a file, starting at a given offset;
+this is used to transfer a disk over several streams in parallel.
+
+"""
+
+import os
+import stat
+import errno
+import fcntl
+import struct
+
+from ganeti import errors
+from ganeti import compat
+
+
+#: Stream identifier, also the format version
+MAGIC = "GNT-SPARSE-1\n"
+
+(REC_DATA,
+ REC_HOLE,
+ REC_END) = range(1, 4)
+
+_RECORD_HEADER = struct.Struct("!BQQ")
+
+#: Granularity of zero-block detection; smaller blocks find more holes at the
+#: expense of more records
+BLOCK_SIZE = 64 * 1024
+
+#: At most this many bytes are read or written at once
+BUFSIZE = 1024 * 1024
+
+# lseek(2) whence values to find data and holes in a file, not provided by
+# the os module of Python 2
+_SEEK_DATA = 3
+_SEEK_HOLE = 4
+
+# ioctl(2) to zero out a range of a block device, see linux/fs.h
+_BLKZEROOUT = 0x127f
+
+_ZERO_BLOCK = "\0" * BLOCK_SIZE
+
+assert BUFSIZE % BLOCK_SIZE == 0
+
+
+class SparseStreamError(errors.GenericError):
+  """Error while reading or writing a sparse stream.
+
+  """
+
+
+def _FindDataExtents(fd, start, end):
+  """Finds regions of a file containing data using C{SEEK_DATA}/C{SEEK_HOLE}.
+
+  If the operating system or the file doesn't support finding holes (e.g.
+  block devices), the whole range is reported as data.
+
+  @type fd: int
+  @param fd: File descriptor
+  @type start: int
+  @param start: Start of the range to examine
+  @type end: int
+  @param end: End of the range to examine
+  @return: Generator of (offset, length) tuples
+
+  """
+  pos = start
+
+  while pos < end:
+    try:
+      data = os.lseek(fd, pos, _SEEK_DATA)
+    except OSError, err:
+      if err.errno == errno.ENXIO:
+        # No more data after this position
+        break
+      if pos == start and err.errno == errno.EINVAL:
+        # Not supported
+        yield (start, end - start)
+        break
+      raise
+
+    if data >= end:
+      break
+
+    hole = min(os.lseek(fd, data, _SEEK_HOLE), end)
+
+    if hole > data:
+      yield (data, hole - data)
+
+    pos = hole
+
+
+def _SplitZeroBlocks(offset, buf):
+  """Splits a buffer into data and zero regions.
+
+  @type offset: int
+  @param offset: Offset of the buffer in the file
+  @type buf: string
+  @param buf: Data
+  @return: Generator of (is_data, offset, value) tuples, where value is the
+      data for data regions and the length for zero regions
+
+  """
+  start = 0
+  start_is_data = None
+
+  for pos in range(0, len(buf), BLOCK_SIZE):
+    block = buf[pos:pos + BLOCK_SIZE]
+    if len(block) == BLOCK_SIZE:
+      is_data = (block != _ZERO_BLOCK)
+    else:
+      is_data = (block.count("\0") != len(block))
+
+    if start_is_data is None:
+      start_is_data = is_data
+    elif is_data != start_is_data:
+      if start_is_data:
+        yield (True, offset + start, buf[start:pos])
+      else:
+        yield (False, offset + start, pos - start)
+      (start, start_is_data) = (pos, is_data)
+
+  if start < len(buf):
+    if start_is_data:
+      yield (True, offset + start, buf[start:])
+    else:
+      yield (False, offset + start, len(buf) - start)
+
+
+class _StreamWriter(object):
+  def __init__(self, outfile, offset):
+    """Initializes this class.
+
+    @param outfile: File object to write the stream to
+    @type offset: int
+    @param offset: Offset of the first extent
+
+    """
+    self._outfile = outfile
+    self._hash = compat.sha1_hash()
+    self._offset = offset
+    self._hole_start = None
+
+    self.data_bytes = 0
+    self.hole_bytes = 0
+
+    self._outfile.write(MAGIC)
+
+  def _Write(self, data):
+    """Writes and hashes data.
+
+    """
+    self._hash.update(data)
+    self._outfile.write(data)
+
+  def _FlushHole(self):
+    """Writes a pending hole record.
+
+    """
+    if self._hole_start is not None:
+      length = self._offset - self._hole_start
+      self._Write(_RECORD_HEADER.pack(REC_HOLE, self._hole_start, length))
+      self.hole_bytes += length
+      self._hole_start = None
+
+  def AddData(self, offset, data):
+    """Adds a data extent.
+
+    """
+    assert offset == self._offset
+    self._FlushHole()
+    self._Write(_RECORD_HEADER.pack(REC_DATA, offset, len(data)))
+    self._Write(data)
+    self._offset += len(data)
+    self.data_bytes += len(data)
+
+  def AddHole(self, offset, length):
+    """Adds a hole; adjacent holes are merged into one record.
+
+    """
+    assert offset == self._offset
+    if self._hole_start is None:
+      self._hole_start = offset
+    self._offset += length
+
+  def Finish(self):
+    """Writes the end record.
+
+    """
+    self._FlushHole()
+    self._Write(_RECORD_HEADER.pack(REC_END, self._offset, 0))
+    self._outfile.write(self._hash.digest())
+    self._outfile.flush()
+
+
+def _ReadRegion(fd, offset, length, writer):
+  """Reads a region of a file and adds it to the stream.
+
+  """
+  os.lseek(fd, offset, os.SEEK_SET)
+
+  end = offset + length
+  while offset < end:
+    buf = os.read(fd, min(BUFSIZE, end - offset))
+    if not buf:
+      raise SparseStreamError("Unexpected end of file at offset %s" % offset)
+
+    for (is_data, part_offset, value) in _SplitZeroBlocks(offset, buf):
+      if is_data:
+        writer.AddData(part_offset, value)
+      else:
+        writer.AddHole(part_offset, value)
+
+    offset += len(buf)
+
+
+def _GetSize(fd):
+  """Returns the size of a regular file or block device.
+
+  """
+  st = os.fstat(fd)
+  if stat.S_ISREG(st.st_mode):
+    return st.st_size
+
+  # Works for block devices
+  return os.lseek(fd, 0, os.SEEK_END)
+
+
+def Encode(fd, outfile, offset=0, size=None):
+  """Writes the contents of a file or block device as a sparse stream.
+
+  @type fd: int
+  @param fd: File descriptor to read from, must be seekable
+  @param outfile: File object to write the stream to
+  @type offset: int
+  @param offset: Offset of the range to transfer
+  @type size: int or None
+  @param size: Number of bytes to transfer, up to the end of the file if
+      None
+  @rtype: tuple
+  @return: Number of data and hole bytes
+
+  """
+  if size is None:
+    size = _GetSize(fd) - offset
+
+  end = offset + size
+
+  writer = _StreamWriter(outfile, offset)
+
+  pos = offset
+  for (data_offset, length) in _FindDataExtents(fd, offset, end):
+    if data_offset > pos:
+      writer.AddHole(pos, data_offset - pos)
+    _ReadRegion(fd, data_offset, length, writer)
+    pos = data_offset + length
+
+  if end > pos:
+    writer.AddHole(pos, end - pos)
+
+  writer.Finish()
+
+  return (writer.data_bytes, writer.hole_bytes)
+
+
+def _ZeroOut(fd, offset, length, is_blockdev):
+  """Ensures a region of the output reads as zeros.
+
+  Block devices are zeroed out using C{BLKZEROOUT}, which lets the kernel
+  discard or unmap the range where supported. Zeros are written if the
+  ioctl fails. Regular files are created empty, so holes are left by
+  seeking.
+
+  """
+  if not is_blockdev:
+    return
+
+  try:
+    fcntl.ioctl(fd, _BLKZEROOUT, struct.pack("QQ", offset, length))
+    return
+  except IOError:
+    pass
+
+  os.lseek(fd, offset, os.SEEK_SET)
+  end = offset + length
+  zeros = "\0" * BUFSIZE
+  while offset < end:
+    offset += os.write(fd, zeros[:min(BUFSIZE, end - offset)])
+
+
+def _ReadExact(infile, length, hashobj):
+  """Reads and hashes an exact number of bytes from the stream.
+
+  """
+  data = infile.read(length)
+  if len(data) != length:
+    raise SparseStreamError("Unexpected end of stream")
+  if hashobj:
+    hashobj.update(data)
+  return data
+
+
+def _WriteAll(fd, offset, data):
+  """Writes data at the given offset.
+
+  """
+  os.lseek(fd, offset, os.SEEK_SET)
+  pos = 0
+  while pos < len(data):
+    pos += os.write(fd, data[pos:])
+
+
+def Decode(infile, fd, offset=0):
+  """Writes the contents described by a sparse stream to a file.
+
+  @param infile: File object to read the stream from
+  @type fd: int
+  @param fd: File descriptor to write to; the range of regular files
+      must not contain data, e.g. because the file has just been created
+  @type offset: int
+  @param offset: Offset at which the stream must start
+  @rtype: tuple
+  @return: Number of data and hole bytes
+
+  """
+  if _ReadExact(infile, len(MAGIC), None) != MAGIC:
+    raise SparseStreamError("Not a sparse stream or unsupported version")
+
+  is_blockdev = stat.S_ISBLK(os.fstat(fd).st_mode)
+  hashobj = compat.sha1_hash()
+  pos = offset
+  data_bytes = 0
+  hole_bytes = 0
+
+  while True:
+    (rectype, offset, length) = \
+      _RECORD_HEADER.unpack(_ReadExact(infile, _RECORD_HEADER.size, hashobj))
+
+    if offset != pos:
+      raise SparseStreamError("Record at offset %s, expected %s" %
+                              (offset, pos))
+
+    if rectype == REC_DATA:
+      while length > 0:
+        data = _ReadExact(infile, min(BUFSIZE, length), hashobj)
+        _WriteAll(fd, pos, data)
+        pos += len(data)
+        length -= len(data)
+        data_bytes += len(data)
+
+    elif rectype == REC_HOLE:
+      _ZeroOut(fd, pos, length, is_blockdev)
+      pos += length
+      hole_bytes += length
+
+    elif rectype == REC_END:
+      digest = _ReadExact(infile, hashobj.digest_size, None)
+      if digest != hashobj.digest():
+        raise SparseStreamError("Checksum mismatch, stream is corrupted")
+      break
+
+    else:
+      raise SparseStreamError("Unknown record type %s" % rectype)
+
+  if not is_blockdev and os.fstat(fd).st_size < pos:
+    # Trailing holes don't extend the file; other parts of the file may be
+    # written by other streams, so it's never shrunk
+    os.ftruncate(fd, pos)
+
+  os.fsync(fd)
+
+  return (data_bytes, hole_bytes)
@@ -21,6 +21,11 @@
 
 """Module implementing the iallocator code."""
 
+import logging
+import threading
+import time
+import weakref
+
 from ganeti import compat
 from ganeti import constants
 from ganeti import errors
@@ -60,6 +65,121 @@ _NEVAC_RESULT = ht.TAnd(ht.TIsLength(3),
 _INST_NAME = ("name", ht.TNonEmptyString)
 _INST_UUID = ("inst_uuid", ht.TNonEmptyString)
 
+#: Maximum age of cached node information used as iallocator input, in
+#: seconds
+NODE_INFO_MAX_AGE = 10.0
+
+
+class _ClusterModelCache(object):
+  """Iallocator input data kept between requests.
+
+  @ivar instances: dictionary indexed by instance UUID, containing tuples of
+      (cache key, instance data)
+  @ivar node_info: tuple of (cache key, timestamp, dictionary of instance
+      UUIDs and serial numbers, node info RPC result, instance info RPC
+      result) or C{None}
+
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.instances = {}
+    self.node_info = None
+
+  def GetNodeInfo(self, key, now, max_age, instances):
+    """Returns the cached node information if it can still be used.
+
+    The node information can't be used once it's older than C{max_age}
+    seconds or if any instance known when it was gathered has been modified
+    since, e.g. by moving it to other nodes or by growing its disks.
+
+    @type key: string
+    @param key: cache key, see L{IAllocator._GetNodeInfo}
+    @type now: float
+    @param now: current time
+    @type max_age: float
+    @param max_age: maximum age of the node information, in seconds
+    @type instances: list of L{objects.Instance}
+    @param instances: all instances in the configuration
+    @rtype: tuple or None
+    @return: (node info RPC result, instance info RPC result, list of
+        instances added since the node info was gathered) or None
+
+    """
+    self.lock.acquire()
+    try:
+      cached = self.node_info
+    finally:
+      self.lock.release()
+
+    if cached is None:
+      return None
+
+    (cached_key, timestamp, known_instances, node_data, node_iinfo) = cached
+
+    if cached_key != key or not 0 <= now - timestamp < max_age:
+      return None
+
+    new_instances = []
+    for inst in instances:
+      serial_no = known_instances.get(inst.uuid, None)
+      if serial_no is None:
+        new_instances.append(inst)
+      elif serial_no != inst.serial_no:
+        logging.debug("Instance %s was modified, not using cached node"
+                      " information", inst.name)
+        self.InvalidateNodeInfo()
+        return None
+
+    logging.debug("Using node information gathered %.1f seconds ago",
+                  now - timestamp)
+
+    return (node_data, node_iinfo, new_instances)
+
+  def SetNodeInfo(self, key, now, instances, node_data, node_iinfo):
+    """Stores node information for use by later requests.
+
+    @type instances: list of L{objects.Instance}
+    @param instances: all instances in the configuration at the time the
+        node information was gathered
+
+    """
+    known_instances = dict((inst.uuid, inst.serial_no) for inst in instances)
+
+    self.lock.acquire()
+    try:
+      self.node_info = (key, now, known_instances, node_data, node_iinfo)
+    finally:
+      self.lock.release()
+
+  def InvalidateNodeInfo(self):
+    """Drops the cached node information.
+
+    """
+    self.lock.acquire()
+    try:
+      self.node_info = None
+    finally:
+      self.lock.release()
+
+
+_MODEL_CACHE = weakref.WeakKeyDictionary()
+_MODEL_CACHE_LOCK = threading.Lock()
+
+
+def _GetModelCache(cfg):
+  """Returns the iallocator input cache for a configuration.
+
+  """
+  _MODEL_CACHE_LOCK.acquire()
+  try:
+    try:
+      return _MODEL_CACHE[cfg]
+    except KeyError:
+      cache = _MODEL_CACHE[cfg] = _ClusterModelCache()
+      return cache
+  finally:
+    _MODEL_CACHE_LOCK.release()
+
 
 class _AutoReqParam(outils.AutoSlots):
   """Meta class for request definitions.
@@ -383,21 +503,34 @@ class IAllocator(object):
       and the output from it, again in two formats
     - the result variables from the script (success, info, nodes) for
       easy usage
+    - the time spent building the input data and running the script
+      (build_time, run_time)
+
+  The input data is built from a per-configuration cache: instance data is
+  only recomputed for instances changed since the last request, and for
+  allocation requests node information gathered by RPC is reused for up to
+  C{node_info_max_age} seconds.
 
   """
   # pylint: disable=R0902
   # lots of instance attributes
 
-  def __init__(self, cfg, rpc_runner, req):
+  def __init__(self, cfg, rpc_runner, req, node_info_max_age=NODE_INFO_MAX_AGE):
     self.cfg = cfg
     self.rpc = rpc_runner
     self.req = req
+    self._node_info_max_age = node_info_max_age
+    self._cache = _GetModelCache(cfg)
     # init buffer variables
     self.in_text = self.out_text = self.in_data = self.out_data = None
     # init result fields
     self.success = self.info = self.result = None
+    # init timing fields
+    self.build_time = self.run_time = None
 
+    start = time.time()
     self._BuildInputData(req)
+    self.build_time = time.time() - start
 
   def _ComputeClusterDataNodeInfo(self, node_list, cluster_info,
                                    hypervisor_name):
@@ -420,6 +553,87 @@ class IAllocator(object):
     hvspecs = [(hypervisor_name, cluster_info.hvparams[hypervisor_name])]
     return self.rpc.call_node_info(node_list, storage_units, hvspecs)
 
+  def _GetNodeInfo(self, node_list, cluster_info, hypervisor_name, i_list):
+    """Returns node and instance information of the nodes.
+
+    For allocation requests, the results of the RPC calls are reused if they
+    were gathered for the same nodes and parameters less than
+    C{node_info_max_age} seconds ago, all calls succeeded and no existing
+    instance has been modified since (see L{_ClusterModelCache.GetNodeInfo}).
+    Other requests move instances and always use fresh information.
+
+    @type node_list: list of strings
+    @param node_list: list of nodes' UUIDs
+    @type cluster_info: L{objects.Cluster}
+    @param cluster_info: the cluster's information from the config
+    @type hypervisor_name: string
+    @param hypervisor_name: the hypervisor name
+    @param i_list: list of (instance, filled beparams) tuples
+    @rtype: tuple
+    @return: (node info RPC result, instance info RPC result, list of
+        instances added since the node info was gathered)
+
+    """
+    storage_units = rpc.PrepareStorageUnitsForNodes(
+      self.cfg, utils.storage.GetStorageUnitsOfCluster(self.cfg,
+                                                       include_spindles=True),
+      node_list)
+    key = serializer.DumpJson([hypervisor_name, sorted(node_list),
+                               sorted(storage_units.items()),
+                               cluster_info.enabled_hypervisors,
+                               cluster_info.hvparams])
+    now = time.time()
+    instances = [iinfo for (iinfo, _) in i_list]
+
+    if isinstance(self.req, (IAReqInstanceAlloc, IAReqMultiInstanceAlloc)):
+      cached = self._cache.GetNodeInfo(key, now, self._node_info_max_age,
+                                       instances)
+      if cached is not None:
+        return cached
+
+    node_data = self._ComputeClusterDataNodeInfo(node_list, cluster_info,
+                                                 hypervisor_name)
+    node_iinfo = \
+      self.rpc.call_all_instances_info(node_list,
+                                       cluster_info.enabled_hypervisors,
+                                       cluster_info.hvparams)
+
+    if compat.any(result.fail_msg and not result.offline
+                  for result in node_data.values() + node_iinfo.values()):
+      self._cache.InvalidateNodeInfo()
+    else:
+      self._cache.SetNodeInfo(key, now, instances, node_data, node_iinfo)
+
+    return (node_data, node_iinfo, [])
+
+  @staticmethod
+  def _AccountNewInstances(cfg, node_results, new_instances):
+    """Subtracts the storage of new instances from cached node data.
+
+    Node information taken from the cache does not yet reflect the disks of
+    instances created after it was gathered. Removed instances are not
+    accounted for, which only makes the data more conservative, and modified
+    instances cause the cached information to be discarded.
+
+    @param node_results: node data as computed by
+        L{_ComputeDynamicNodeData}, modified in place
+
+    """
+    for iinfo in new_instances:
+      if iinfo.disk_template in constants.DTS_NOT_LVM:
+        continue
+
+      disks = [{constants.IDISK_SIZE: dsk.size} for dsk in iinfo.disks]
+      disk_size = gmi.ComputeDiskSize(iinfo.disk_template, disks)
+      spindles = sum(dsk.spindles or 0 for dsk in iinfo.disks)
+
+      for node_uuid in [iinfo.primary_node] + list(iinfo.secondary_nodes):
+        nresult = node_results.get(cfg.GetNodeName(node_uuid))
+        if nresult is None or "free_disk" not in nresult:
+          continue
+        nresult["free_disk"] -= disk_size
+        nresult["free_spindles"] -= spindles
+
   def _ComputeClusterData(self):
     """Compute the generic allocator input data.
 
@@ -453,13 +667,8 @@ class IAllocator(object):
       node_whitelist = None
 
     has_lvm = utils.storage.IsLvmEnabled(cluster_info.enabled_disk_templates)
-    node_data = self._ComputeClusterDataNodeInfo(node_list, cluster_info,
-                                                 hypervisor_name)
-
-    node_iinfo = \
-      self.rpc.call_all_instances_info(node_list,
-                                       cluster_info.enabled_hypervisors,
-                                       cluster_info.hvparams)
+    (node_data, node_iinfo, new_instances) = \
+      self._GetNodeInfo(node_list, cluster_info, hypervisor_name, i_list)
 
     data["nodegroups"] = self._ComputeNodeGroupData(self.cfg)
 
@@ -468,9 +677,10 @@ class IAllocator(object):
                                                  i_list, config_ndata, has_lvm)
     assert len(data["nodes"]) == len(ninfo), \
         "Incomplete node data computed"
+    if has_lvm:
+      self._AccountNewInstances(self.cfg, data["nodes"], new_instances)
 
-    data["instances"] = self._ComputeInstanceData(self.cfg, cluster_info,
-                                                  i_list)
+    data["instances"] = self._GetInstanceData(cluster_info, i_list)
 
     self.in_data = data
 
@@ -711,6 +921,53 @@ class IAllocator(object):
 
     return instance_data
 
+  def _GetInstanceData(self, cluster_info, i_list):
+    """Compute global instance data, reusing cached per-instance data.
+
+    Data for an instance is recomputed only if the instance, the names of
+    its nodes, or the cluster-level NIC and backend parameters changed.
+
+    """
+    params = serializer.DumpJson([cluster_info.nicparams,
+                                  cluster_info.beparams])
+
+    self._cache.lock.acquire()
+    try:
+      cached = dict(self._cache.instances)
+    finally:
+      self._cache.lock.release()
+
+    entries = {}
+    changed = []
+    for (iinfo, beinfo) in i_list:
+      key = (iinfo.name, iinfo.serial_no, iinfo.mtime, params,
+             tuple(self.cfg.GetNodeNames([iinfo.primary_node] +
+                                         list(iinfo.secondary_nodes))))
+      try:
+        (cached_key, pir) = cached[iinfo.uuid]
+      except KeyError:
+        cached_key = None
+      if cached_key == key:
+        entries[iinfo.uuid] = (key, pir)
+      else:
+        entries[iinfo.uuid] = (key, None)
+        changed.append((iinfo, beinfo))
+
+    new_data = self._ComputeInstanceData(self.cfg, cluster_info, changed)
+    for (iinfo, _) in changed:
+      entries[iinfo.uuid] = (entries[iinfo.uuid][0], new_data[iinfo.name])
+
+    self._cache.lock.acquire()
+    try:
+      self._cache.instances = entries
+    finally:
+      self._cache.lock.release()
+
+    logging.debug("Computed data for %s of %s instances", len(changed),
+                  len(entries))
+
+    return dict((iinfo.name, entries[iinfo.uuid][1]) for (iinfo, _) in i_list)
+
   def _BuildInputData(self, req):
     """Build input data structures.
 
@@ -730,7 +987,13 @@ class IAllocator(object):
     if call_fn is None:
       call_fn = self.rpc.call_iallocator_runner
 
+    start = time.time()
     result = call_fn(self.cfg.GetMasterNode(), name, self.in_text)
+    self.run_time = time.time() - start
+
+    logging.info("Iallocator '%s': input built in %.3f seconds, ran in %.3f"
+                 " seconds", name, self.build_time, self.run_time)
+
     result.Raise("Failure while running the iallocator script")
 
     self.out_text = result.payload
@@ -34,6 +34,7 @@ from ganeti import utils
 from ganeti import objects
 from ganeti import netutils
 from ganeti import pathutils
+from ganeti import rpc
 
 
 class _ImportExportError(Exception):
@@ -219,6 +220,40 @@ class _DiskImportExportBase(object):
     """
     return self._opts.magic
 
+  @property
+  def throughput(self):
+    """Returns the overall throughput of a finished transfer.
+
+    @rtype: tuple or None
+    @return: (amount of data in MiB, duration in seconds, throughput in
+        MiB/s) or None if not known
+
+    """
+    if not (self._daemon and self._daemon.progress_mbytes is not None and
+            self._ts_connected is not None and self._ts_finished is not None):
+      return None
+
+    duration = max(self._ts_finished - self._ts_connected, 0.001)
+    mbytes = self._daemon.progress_mbytes
+
+    return (mbytes, duration, mbytes / duration)
+
+  def FormatThroughput(self):
+    """Formats the overall throughput for user consumption.
+
+    @rtype: string
+
+    """
+    throughput = self.throughput
+    if throughput is None:
+      return "compression %s" % self._opts.compress
+
+    (mbytes, duration, mbps) = throughput
+
+    return ("%s in %s, %0.1f MiB/s, compression %s" %
+            (utils.FormatUnit(mbytes, "h"), utils.FormatSeconds(duration),
+             mbps, self._opts.compress))
+
   @property
   def active(self):
     """Determines whether this transport is still active.
@@ -440,8 +475,8 @@ class _DiskImportExportBase(object):
     self.final_message = message
 
     if success:
-      logging.info("%s '%s' on %s succeeded", self.MODE_TEXT,
-                   self._daemon_name, self.node_uuid)
+      logging.info("%s '%s' on %s succeeded (%s)", self.MODE_TEXT,
+                   self._daemon_name, self.node_uuid, self.FormatThroughput())
     elif self._daemon_name:
       self._lu.LogWarning("%s '%s' on %s failed: %s",
                           self.MODE_TEXT, self._daemon_name,
@@ -852,13 +887,25 @@ class _TransferInstSourceCb(_TransferInstCbBase):
     assert dtp.dest_import
 
     self.feedback_fn("%s is sending data on %s" %
-                     (dtp.data.name, ie.node_name))
+                     (dtp.name, ie.node_name))
 
   def ReportProgress(self, ie, dtp):
     """Called when new progress information should be reported.
 
+    If a disk is transferred over multiple streams, the combined progress is
+    reported by the first active stream only.
+
     """
-    progress = ie.progress
+    if len(dtp.group) > 1:
+      active = [i for i in dtp.group
+                if i.src_export is not None and i.src_export.active]
+      if not active or active[0] is not dtp:
+        return
+
+      progress = CombineProgress([i.GetProgress() for i in dtp.group])
+    else:
+      progress = ie.progress
+
     if not progress:
       return
 
@@ -873,15 +920,18 @@ class _TransferInstSourceCb(_TransferInstCbBase):
     assert dtp.dest_import
 
     if ie.success:
-      self.feedback_fn("%s finished sending data" % dtp.data.name)
+      self.feedback_fn("%s finished sending data (%s)" %
+                       (dtp.name, ie.FormatThroughput()))
     else:
       self.feedback_fn("%s failed to send data: %s (recent output: %s)" %
-                       (dtp.data.name, ie.final_message, ie.recent_output))
+                       (dtp.name, ie.final_message, ie.recent_output))
 
     dtp.RecordResult(ie.success)
+    dtp.finished = True
 
+    # Only call the callback once all streams of a disk have finished
     cb = dtp.data.finished_fn
-    if cb:
+    if cb and compat.all(i.finished for i in dtp.group):
       cb()
 
     # TODO: Check whether sending SIGTERM right away is okay, maybe we should
@@ -900,7 +950,7 @@ class _TransferInstDestCb(_TransferInstCbBase):
     assert dtp.dest_import
     assert dtp.export_opts
 
-    self.feedback_fn("%s is now listening, starting export" % dtp.data.name)
+    self.feedback_fn("%s is now listening, starting export" % dtp.name)
 
     # Start export on source node
     de = DiskExport(self.lu, self.src_node_uuid, dtp.export_opts,
@@ -916,7 +966,7 @@ class _TransferInstDestCb(_TransferInstCbBase):
 
     """
     self.feedback_fn("%s is receiving data on %s" %
-                     (dtp.data.name,
+                     (dtp.name,
                       self.lu.cfg.GetNodeName(self.dest_node_uuid)))
 
   def ReportFinished(self, ie, dtp):
@@ -924,10 +974,11 @@ class _TransferInstDestCb(_TransferInstCbBase):
 
     """
     if ie.success:
-      self.feedback_fn("%s finished receiving data" % dtp.data.name)
+      self.feedback_fn("%s finished receiving data (%s)" %
+                       (dtp.name, ie.FormatThroughput()))
     else:
       self.feedback_fn("%s failed to receive data: %s (recent output: %s)" %
-                       (dtp.data.name, ie.final_message, ie.recent_output))
+                       (dtp.name, ie.final_message, ie.recent_output))
 
     dtp.RecordResult(ie.success)
 
@@ -964,19 +1015,47 @@ class DiskTransfer(object):
 
 
 class _DiskTransferPrivate(object):
-  def __init__(self, data, success, export_opts):
+  def __init__(self, data, success, export_opts, name=None):
     """Initializes this class.
 
     @type data: L{DiskTransfer}
     @type success: bool
+    @type name: string
+    @param name: User-visible name for this stream, defaults to the name of
+      the transfer
 
     """
     self.data = data
     self.success = success
     self.export_opts = export_opts
 
+    if name is None and data:
+      self.name = data.name
+    else:
+      self.name = name
+
     self.src_export = None
     self.dest_import = None
+    self.finished = False
+
+    # All streams transferring parts of the same disk, including this one
+    self.group = [self]
+
+  def GetProgress(self):
+    """Returns the progress of this stream's export.
+
+    @return: Progress tuple as used by L{FormatProgress} or None if unknown
+
+    """
+    if self.src_export is None:
+      return None
+
+    progress = self.src_export.progress
+    if progress and self.finished:
+      (mbytes, _, _, _) = progress
+      return (mbytes, 0.0, 100, 0)
+
+    return progress
 
   def RecordResult(self, success):
     """Updates the status.
@@ -1006,8 +1085,195 @@ def _GetInstDiskMagic(base, instance_name, index):
   return h.hexdigest()
 
 
+def SplitDiskRanges(size, streams):
+  """Splits a disk into ranges to be transferred in parallel.
+
+  Disks are only split into ranges of at least
+  L{constants.IE_MIN_STREAM_SIZE}, as each stream requires its own daemons
+  and connection.
+
+  @type size: int
+  @param size: Disk size in MiB
+  @type streams: int
+  @param streams: Maximum number of ranges
+  @rtype: list of tuples
+  @return: List of (offset, size) tuples in MiB
+
+  """
+  count = max(1, min(streams, size // constants.IE_MIN_STREAM_SIZE))
+
+  (chunk, remainder) = divmod(size, count)
+
+  result = []
+  offset = 0
+  for idx in range(count):
+    length = chunk
+    if idx < remainder:
+      length += 1
+    result.append((offset, length))
+    offset += length
+
+  assert offset == size
+
+  return result
+
+
+def CombineProgress(all_progress):
+  """Combines the progress of streams transferring parts of one disk.
+
+  Amounts of data and throughput are summed up. As the streams transfer
+  ranges of about the same size, the percentage is their average. It and
+  the time remaining are only reported if known for all streams.
+
+  @type all_progress: list
+  @param all_progress: Progress tuples as used by L{FormatProgress}, None for
+    streams whose progress is unknown
+  @return: Progress tuple or None if no progress is known
+
+  """
+  known = [i for i in all_progress if i]
+  if not known:
+    return None
+
+  mbytes = sum(i[0] or 0 for i in known)
+  throughput = sum(i[1] or 0.0 for i in known)
+
+  if (len(known) == len(all_progress) and
+      compat.all(i[2] is not None for i in known)):
+    percent = sum(i[2] for i in known) / len(known)
+  else:
+    percent = None
+
+  if (len(known) == len(all_progress) and
+      compat.all(i[3] is not None for i in known)):
+    eta = max(i[3] for i in known)
+  else:
+    eta = None
+
+  return (mbytes, throughput, percent, eta)
+
+
+def GetRbdSnapshotNames(magic):
+  """Returns the names of the snapshots used to transfer an RBD volume.
+
+  RBD volumes are sent to remote clusters in two passes: a diff of a base
+  snapshot, taken while the instance is still running, and a diff of the
+  changes made until the final snapshot. Both sides of a transfer know the
+  magic value, which lets the destination remove the snapshots created when
+  applying the diffs.
+
+  @type magic: string
+  @param magic: Magic value of the transfer
+  @rtype: tuple
+  @return: names of the base and the final snapshot
+
+  """
+  prefix = "ganeti-transfer-%s" % magic[:16]
+
+  return ("%s-base" % prefix, "%s-final" % prefix)
+
+
+def _GetRbdDeltaMagic(magic):
+  """Returns the magic value for sending the changes of an RBD volume.
+
+  The changes are sent to the same port as the base, but a different magic
+  value makes sure they're not applied in its place.
+
+  @type magic: string
+  @param magic: Magic value of the transfer
+
+  """
+  return "%s-delta" % magic
+
+
+def _GetRbdDiffDisk(lu, instance, disk):
+  """Returns an RBD disk annotated with its parameters.
+
+  Unlike other RPC arguments, disks passed as import/export I/O arguments are
+  not annotated by the RPC layer, but the node needs the disk's pool to read
+  or apply a diff.
+
+  @param lu: Logical unit instance
+  @type instance: L{objects.Instance}
+  @type disk: L{objects.Disk}
+  @rtype: L{objects.Disk}
+
+  """
+  (disk, ) = rpc.AnnotateDiskParams(instance.disk_template, [disk],
+                                    lu.cfg.GetInstanceDiskParams(instance))
+  return disk
+
+
+def ChooseCompression(preference, all_methods):
+  """Chooses the best compression method supported by all peers.
+
+  @type preference: list
+  @param preference: Compression methods to consider, best first
+  @type all_methods: list of lists
+  @param all_methods: Compression methods supported by each peer
+  @rtype: string
+  @return: Compression method, L{constants.IEC_NONE} if no preferred
+      method is supported by all peers
+
+  """
+  for method in preference:
+    if compat.all(method in methods for methods in all_methods):
+      return method
+
+  return constants.IEC_NONE
+
+
+def GetCompressionMethods(lu, node_uuids):
+  """Queries the compression methods usable on nodes.
+
+  @param lu: Logical unit instance
+  @type node_uuids: list of string
+  @param node_uuids: Node UUIDs
+  @rtype: list of lists
+  @return: Compression methods for each node, in the same order as
+      C{node_uuids}; nodes which couldn't be queried only support
+      L{constants.IEC_NONE}
+
+  """
+  result = lu.rpc.call_impexp_compressions(node_uuids)
+
+  all_methods = []
+  for node_uuid in node_uuids:
+    nres = result[node_uuid]
+    if nres.fail_msg:
+      lu.LogWarning("Can't query compression methods on node %s, disabling"
+                    " compression: %s", lu.cfg.GetNodeName(node_uuid),
+                    nres.fail_msg)
+      all_methods.append([constants.IEC_NONE])
+    else:
+      all_methods.append(nres.payload)
+
+  return all_methods
+
+
+def NegotiateCompression(lu, node_uuids, preference, peer_methods=None):
+  """Chooses the compression method for a transfer.
+
+  @param lu: Logical unit instance
+  @type node_uuids: list of string
+  @param node_uuids: UUIDs of the nodes taking part in the transfer
+  @type preference: list
+  @param preference: Compression methods to consider, best first
+  @type peer_methods: list or None
+  @param peer_methods: Compression methods supported by a remote peer
+  @rtype: string
+
+  """
+  all_methods = GetCompressionMethods(lu, node_uuids)
+
+  if peer_methods is not None:
+    all_methods.append(peer_methods)
+
+  return ChooseCompression(preference, all_methods)
+
+
 def TransferInstanceData(lu, feedback_fn, src_node_uuid, dest_node_uuid,
-                         dest_ip, instance, all_transfers):
+                         dest_ip, instance, all_transfers, streams=1):
   """Transfers an instance's data from one node to another.
 
   @param lu: Logical unit instance
@@ -1022,13 +1288,18 @@ def TransferInstanceData(lu, feedback_fn, src_node_uuid, dest_node_uuid,
   @param instance: Instance object
   @type all_transfers: list of L{DiskTransfer} instances
   @param all_transfers: List of all disk transfers to be made
+  @type streams: int
+  @param streams: Maximum number of parallel streams per disk; only transfers
+      between raw disks can be split (see L{SplitDiskRanges})
   @rtype: list
   @return: List with a boolean (True=successful, False=failed) for success for
            each transfer
 
   """
-  # Disable compression for all moves as these are all within the same cluster
-  compress = constants.IEC_NONE
+  # Nodes within a cluster are usually well connected, so only fast
+  # compression methods are considered
+  compress = NegotiateCompression(lu, [src_node_uuid, dest_node_uuid],
+                                  constants.IEC_INTRA_CLUSTER_PREFERENCE)
 
   src_node_name = lu.cfg.GetNodeName(src_node_uuid)
   dest_node_name = lu.cfg.GetNodeName(dest_node_uuid)
@@ -1050,15 +1321,50 @@ def TransferInstanceData(lu, feedback_fn, src_node_uuid, dest_node_uuid,
   ieloop = ImportExportLoop(lu)
   try:
     for idx, transfer in enumerate(all_transfers):
-      if transfer:
+      if not transfer:
+        all_dtp.append([_DiskTransferPrivate(None, False, None)])
+        continue
+
+      if (streams > 1 and transfer.src_io == constants.IEIO_RAW_DISK and
+          transfer.dest_io == constants.IEIO_RAW_DISK):
+        (src_disk, ) = transfer.src_ioargs
+        ranges = SplitDiskRanges(src_disk.size, streams)
+      else:
+        ranges = [None]
+
+      if len(ranges) > 1:
+        feedback_fn("Exporting %s from %s to %s using %d streams" %
+                    (transfer.name, src_node_name, dest_node_name,
+                     len(ranges)))
+      else:
         feedback_fn("Exporting %s from %s to %s" %
                     (transfer.name, src_node_name, dest_node_name))
 
-        magic = _GetInstDiskMagic(base_magic, instance.name, idx)
+      group = []
+
+      for disk_range in ranges:
+        if disk_range is None:
+          name = transfer.name
+          magic = _GetInstDiskMagic(base_magic, instance.name, idx)
+        else:
+          name = "%s (range %s+%s MiB)" % ((transfer.name, ) + disk_range)
+          magic = _GetInstDiskMagic(base_magic, instance.name,
+                                    "%s-%s" % (idx, disk_range[0]))
+
         opts = objects.ImportExportOptions(key_name=None, ca_pem=None,
                                            compress=compress, magic=magic)
 
-        dtp = _DiskTransferPrivate(transfer, True, opts)
+        # Skip zero regions if both sides read or write the data directly
+        if (transfer.src_io in constants.IEIO_SPARSE and
+            transfer.dest_io in constants.IEIO_SPARSE):
+          opts.sparse = True
+
+        if disk_range is not None:
+          opts.disk_range = disk_range
+
+        dtp = _DiskTransferPrivate(transfer, True, opts, name=name)
+        dtp.group = group
+        group.append(dtp)
 
         di = DiskImport(lu, dest_node_uuid, opts, instance, "disk%d" % idx,
                         transfer.dest_io, transfer.dest_ioargs,
@@ -1066,10 +1372,8 @@ def TransferInstanceData(lu, feedback_fn, src_node_uuid, dest_node_uuid,
         ieloop.Add(di)
 
         dtp.dest_import = di
-      else:
-        dtp = _DiskTransferPrivate(None, False, None)
 
-      all_dtp.append(dtp)
+      all_dtp.append(group)
 
     ieloop.Run()
   finally:
@@ -1080,10 +1384,13 @@ def TransferInstanceData(lu, feedback_fn, src_node_uuid, dest_node_uuid,
                       dtp.src_export.success is not None) and
                      (dtp.dest_import is None or
                       dtp.dest_import.success is not None)
-                     for dtp in all_dtp), \
+                     for group in all_dtp
+                     for dtp in group), \
          "Not all imports/exports are finalized"
 
-  return [bool(dtp.success) for dtp in all_dtp]
+  # A disk was only transferred successfully if all its streams succeeded
+  return [compat.all(bool(dtp.success) for dtp in group)
+          for group in all_dtp]
 
 
 class _RemoteExportCb(ImportExportCbBase):
@@ -1129,7 +1436,8 @@ class _RemoteExportCb(ImportExportCbBase):
     (idx, finished_fn) = private
 
     if ie.success:
-      self._feedback_fn("Disk %s finished sending data" % idx)
+      self._feedback_fn("Disk %s finished sending data (%s)" %
+                        (idx, ie.FormatThroughput()))
     else:
       self._feedback_fn("Disk %s failed to send data: %s (recent output: %s)" %
                         (idx, ie.final_message, ie.recent_output))
@@ -1155,11 +1463,20 @@ class ExportInstanceHelper:
     self._instance = instance
 
     self._snap_disks = []
+    self._rbd_base_snaps = [None] * len(instance.disks)
+    self._rbd_snaps = [None] * len(instance.disks)
     self._removed_snaps = [False] * len(instance.disks)
 
-  def CreateSnapshots(self):
+  def CreateSnapshots(self, disk_info=None):
     """Creates an LVM snapshot for every disk of the instance.
 
+    Disks sent to a remote cluster as RBD diffs get their final snapshot
+    from the rbd tool instead, see L{RemoteExportBase}.
+
+    @type disk_info: list or None
+    @param disk_info: Per-disk destination information for remote exports,
+        as returned by L{CheckRemoteExportDiskInfo}
+
     """
     assert not self._snap_disks
 
@@ -1170,6 +1487,11 @@ class ExportInstanceHelper:
       self._feedback_fn("Creating a snapshot of disk/%s on node %s" %
                         (idx, src_node))
 
+      if disk_info and disk_info[idx][4] == constants.IEIO_RBD_DIFF:
+        self._CreateRbdSnapshot(idx, disk, disk_info[idx][2])
+        self._snap_disks.append(False)
+        continue
+
       # result.payload will be a snapshot of an lvm leaf of the one we
       # passed
       result = self._lu.rpc.call_blockdev_snapshot(src_node, (disk, instance))
@@ -1195,14 +1517,69 @@ class ExportInstanceHelper:
     assert len(self._snap_disks) == len(instance.disks)
     assert len(self._removed_snaps) == len(instance.disks)
 
+  def _CreateRbdSnapshot(self, disk_index, disk, magic):
+    """Creates the final snapshot of an RBD volume exported as a diff.
+
+    @type disk_index: number
+    @param disk_index: Disk index
+    @type disk: L{objects.Disk}
+    @param disk: Disk to be snapshotted
+    @type magic: string
+    @param magic: Magic value of the transfer, see L{GetRbdSnapshotNames}
+
+    """
+    src_node = self._instance.primary_node
+    (_, snap_name) = GetRbdSnapshotNames(magic)
+
+    result = self._lu.rpc.call_blockdev_rbd_snapshot(src_node,
+                                                     (disk, self._instance),
+                                                     snap_name)
+    if result.fail_msg:
+      self._lu.LogWarning("Could not snapshot disk/%s on node %s, the changes"
+                          " will be exported while the volume is in use: %s",
+                          disk_index, src_node, result.fail_msg)
+    else:
+      self._rbd_snaps[disk_index] = snap_name
+
   def _RemoveSnapshot(self, disk_index):
-    """Removes an LVM snapshot.
+    """Removes an LVM snapshot or the RBD snapshots of a disk.
 
     @type disk_index: number
     @param disk_index: Index of the snapshot to be removed
 
     """
-    disk = self._snap_disks[disk_index]
+    rbd_snaps = [snap_name for snap_name in [self._rbd_snaps[disk_index],
+                                             self._rbd_base_snaps[disk_index]]
+                 if snap_name]
+    if rbd_snaps:
+      if self._removed_snaps[disk_index]:
+        return
+
+      src_node = self._instance.primary_node
+      disk = self._instance.disks[disk_index]
+
+      self._feedback_fn("Removing snapshots of disk/%s on node %s" %
+                        (disk_index, src_node))
+
+      removed = True
+      for snap_name in rbd_snaps:
+        result = self._lu.rpc.call_blockdev_rbd_remove_snapshot(
+          src_node, (disk, self._instance), snap_name)
+        if result.fail_msg:
+          self._lu.LogWarning("Could not remove snapshot %s of disk/%d: %s",
+                              snap_name, disk_index, result.fail_msg)
+          removed = False
+
+      self._removed_snaps[disk_index] = removed
+
+      return
+
+    if disk_index < len(self._snap_disks):
+      disk = self._snap_disks[disk_index]
+    else:
+      # Not snapshotted yet
+      disk = None
+
     if disk and not self._removed_snaps[disk_index]:
       src_node = self._instance.primary_node
 
@@ -1266,11 +1643,80 @@ class ExportInstanceHelper:
 
     return (fin_resu, dresults)
 
+  def RemoteExportBase(self, disk_info, key_name, dest_ca_pem, timeouts):
+    """Sends the base of RBD volumes to a remote cluster.
+
+    Disks sent as RBD diffs are snapshotted and sent while the instance is
+    still running. Only the changes made since then are sent by
+    L{RemoteExport}, which keeps the time the instance is stopped short.
+    All other disks are skipped.
+
+    @type disk_info: list
+    @param disk_info: Per-disk destination information, as returned by
+        L{CheckRemoteExportDiskInfo}
+    @type key_name: string
+    @param key_name: Name of X509 key to use
+    @type dest_ca_pem: string
+    @param dest_ca_pem: Destination X509 CA in PEM format
+    @type timeouts: L{ImportExportTimeouts}
+    @param timeouts: Timeouts for this export
+    @rtype: bool
+    @return: Whether the bases of all RBD volumes were sent; if not, their
+        snapshots have been removed
+
+    """
+    instance = self._instance
+    src_node = instance.primary_node
+
+    assert len(disk_info) == len(instance.disks)
+
+    transfers = []
+    sent = []
+    success = False
+    try:
+      for idx, (dev, (host, port, magic, compress, ieio)) in \
+          enumerate(zip(instance.disks, disk_info)):
+        if ieio != constants.IEIO_RBD_DIFF:
+          continue
+
+        (snap_name, _) = GetRbdSnapshotNames(magic)
+
+        self._feedback_fn("Creating a base snapshot of disk/%s on node %s" %
+                          (idx, src_node))
+
+        # Set before creating the snapshot, removing it is idempotent
+        self._rbd_base_snaps[idx] = snap_name
+
+        result = self._lu.rpc.call_blockdev_rbd_snapshot(src_node,
+                                                         (dev, instance),
+                                                         snap_name)
+        result.Raise("Could not snapshot disk/%s on node %s" %
+                     (idx, result.node))
+
+        ioargs = (_GetRbdDiffDisk(self._lu, instance, dev), None, snap_name)
+        transfers.append((idx, host, port, magic, compress, None, ieio,
+                          ioargs, None))
+        sent.append(idx)
+
+      dresults = self._SendDisks(transfers, key_name, dest_ca_pem, timeouts)
+      success = compat.all(dresults[idx] for idx in sent)
+    finally:
+      if not success:
+        for (idx, snap_name) in enumerate(self._rbd_base_snaps):
+          if snap_name:
+            self._RemoveSnapshot(idx)
+
+    return success
+
   def RemoteExport(self, disk_info, key_name, dest_ca_pem, timeouts):
     """Inter-cluster instance export.
 
+    The bases of disks sent as RBD diffs must have been sent by
+    L{RemoteExportBase}, only their changes are sent.
+
     @type disk_info: list
-    @param disk_info: Per-disk destination information
+    @param disk_info: Per-disk destination information, as returned by
+        L{CheckRemoteExportDiskInfo}
     @type key_name: string
     @param key_name: Name of X509 key to use
     @type dest_ca_pem: string
@@ -1283,31 +1729,77 @@ class ExportInstanceHelper:
 
     assert len(disk_info) == len(instance.disks)
 
+    transfers = []
+    for idx, (dev, (host, port, magic, compress, ieio)) in \
+        enumerate(zip(instance.disks, disk_info)):
+      finished_fn = compat.partial(self._TransferFinished, idx)
+
+      if ieio == constants.IEIO_RBD_DIFF:
+        assert self._rbd_base_snaps[idx]
+
+        # The destination listens on the same port once it has applied the
+        # bases of all volumes; without a final snapshot, the changes are
+        # read from the volume itself
+        ioargs = (_GetRbdDiffDisk(self._lu, instance, dev),
+                  self._rbd_base_snaps[idx], self._rbd_snaps[idx])
+        transfers.append((idx, host, port, _GetRbdDeltaMagic(magic), compress,
+                          constants.RIE_RBD_DELTA_CONNECT_RETRIES, ieio,
+                          ioargs, finished_fn))
+      else:
+        assert ieio == constants.IEIO_SCRIPT
+        transfers.append((idx, host, port, magic, compress, None, ieio,
+                          (dev, idx), finished_fn))
+
+    return (True,
+            self._SendDisks(transfers, key_name, dest_ca_pem, timeouts))
+
+  def _SendDisks(self, transfers, key_name, dest_ca_pem, timeouts):
+    """Sends disks to a remote cluster.
+
+    @type transfers: list
+    @param transfers: List of tuples of disk index, destination host and
+        port, magic value, compression method, number of connection attempts
+        (None for the default), I/O type and arguments, and the function to
+        be called once the transfer has finished (or None)
+    @type key_name: string
+    @param key_name: Name of X509 key to use
+    @type dest_ca_pem: string
+    @param dest_ca_pem: Destination X509 CA in PEM format
+    @type timeouts: L{ImportExportTimeouts}
+    @param timeouts: Timeouts for the exports
+    @rtype: list
+    @return: Per-disk results, None for disks which weren't sent
+
+    """
+    instance = self._instance
+
     cbs = _RemoteExportCb(self._feedback_fn, len(instance.disks))
 
     ieloop = ImportExportLoop(self._lu)
     try:
-      for idx, (dev, (host, port, magic)) in enumerate(zip(instance.disks,
-                                                           disk_info)):
+      for (idx, host, port, magic, compress, connect_retries, ieio, ioargs,
+           finished_fn) in transfers:
         # Decide whether to use IPv6
         ipv6 = netutils.IP6Address.IsValid(host)
 
         opts = objects.ImportExportOptions(key_name=key_name,
                                            ca_pem=dest_ca_pem,
-                                           magic=magic, ipv6=ipv6)
+                                           magic=magic, ipv6=ipv6,
+                                           compress=compress,
+                                           connect_retries=connect_retries)
 
-        self._feedback_fn("Sending disk %s to %s:%s" % (idx, host, port))
-        finished_fn = compat.partial(self._TransferFinished, idx)
+        self._feedback_fn("Sending disk %s to %s:%s (compression %s, %s)" %
+                          (idx, host, port, compress, ieio))
         ieloop.Add(DiskExport(self._lu, instance.primary_node,
                               opts, host, port, instance, "disk%d" % idx,
-                              constants.IEIO_SCRIPT, (dev, idx),
+                              ieio, ioargs,
                               timeouts, cbs, private=(idx, finished_fn)))
 
       ieloop.Run()
     finally:
       ieloop.FinalizeAll()
 
-    return (True, cbs.disk_results)
+    return cbs.disk_results
 
   def _TransferFinished(self, idx):
     """Called once a transfer has finished.
@@ -1330,7 +1822,7 @@ class ExportInstanceHelper:
 
 class _RemoteImportCb(ImportExportCbBase):
   def __init__(self, feedback_fn, cds, x509_cert_pem, disk_count,
-               external_address):
+               external_address, compress, ieios):
     """Initializes this class.
 
     @type cds: string
@@ -1341,6 +1833,12 @@ class _RemoteImportCb(ImportExportCbBase):
     @param disk_count: Number of disks
     @type external_address: string
     @param external_address: External address of destination node
+    @type compress: string or None
+    @param compress: Negotiated compression method, None if the source
+        didn't announce its compression methods
+    @type ieios: list
+    @param ieios: I/O type to be announced for every disk, None for the OS
+        scripts
 
     """
     ImportExportCbBase.__init__(self)
@@ -1349,9 +1847,12 @@ class _RemoteImportCb(ImportExportCbBase):
     self._x509_cert_pem = x509_cert_pem
     self._disk_count = disk_count
     self._external_address = external_address
+    self._compress = compress
+    self._ieios = ieios
 
     self._dresults = [None] * disk_count
     self._daemon_port = [None] * disk_count
+    self._listen_ports = [None] * disk_count
 
     self._salt = utils.GenerateSecret(8)
 
@@ -1362,6 +1863,13 @@ class _RemoteImportCb(ImportExportCbBase):
     """
     return self._dresults
 
+  @property
+  def listen_ports(self):
+    """Returns the ports the daemons listened on.
+
+    """
+    return self._listen_ports
+
   def _CheckAllListening(self):
     """Checks whether all daemons are listening.
 
@@ -1376,7 +1884,9 @@ class _RemoteImportCb(ImportExportCbBase):
     disks = []
     for idx, (port, magic) in enumerate(self._daemon_port):
       disks.append(ComputeRemoteImportDiskInfo(self._cds, self._salt,
-                                               idx, host, port, magic))
+                                               idx, host, port, magic,
+                                               compress=self._compress,
+                                               ieio=self._ieios[idx]))
 
     assert len(disks) == self._disk_count
 
@@ -1396,6 +1906,7 @@ class _RemoteImportCb(ImportExportCbBase):
     assert self._daemon_port[idx] is None
 
     self._daemon_port[idx] = (ie.listen_port, ie.magic)
+    self._listen_ports[idx] = ie.listen_port
 
     self._CheckAllListening()
 
@@ -1417,7 +1928,8 @@ class _RemoteImportCb(ImportExportCbBase):
     self._daemon_port[idx] = None
 
     if ie.success:
-      self._feedback_fn("Disk %s finished receiving data" % idx)
+      self._feedback_fn("Disk %s finished receiving data (%s)" %
+                        (idx, ie.FormatThroughput()))
     else:
       self._feedback_fn(("Disk %s failed to receive data: %s"
                          " (recent output: %s)") %
@@ -1426,8 +1938,54 @@ class _RemoteImportCb(ImportExportCbBase):
     self._dresults[idx] = bool(ie.success)
 
 
+class _RemoteImportDeltaCb(ImportExportCbBase):
+  def __init__(self, feedback_fn, dresults):
+    """Initializes this class.
+
+    @type dresults: list
+    @param dresults: Per-disk results, updated with the results of receiving
+        the changes of RBD volumes
+
+    """
+    ImportExportCbBase.__init__(self)
+    self._feedback_fn = feedback_fn
+    self._dresults = dresults
+
+  def ReportListening(self, ie, private, _):
+    """Called when daemon started listening.
+
+    """
+    (idx, ) = private
+
+    self._feedback_fn("Disk %s is now listening for changes" % idx)
+
+  def ReportConnected(self, ie, private):
+    """Called when a connection has been established.
+
+    """
+    (idx, ) = private
+
+    self._feedback_fn("Disk %s is now receiving changes" % idx)
+
+  def ReportFinished(self, ie, private):
+    """Called when a transfer has finished.
+
+    """
+    (idx, ) = private
+
+    if ie.success:
+      self._feedback_fn("Disk %s finished receiving changes (%s)" %
+                        (idx, ie.FormatThroughput()))
+    else:
+      self._feedback_fn(("Disk %s failed to receive changes: %s"
+                         " (recent output: %s)") %
+                        (idx, ie.final_message, ie.recent_output))
+
+    self._dresults[idx] = bool(ie.success)
+
+
 def RemoteImport(lu, feedback_fn, instance, pnode, source_x509_ca,
-                 cds, timeouts):
+                 cds, timeouts, source_compressions=None, source_ieios=None):
   """Imports an instance from another cluster.
 
   @param lu: Logical unit instance
@@ -1442,6 +2000,13 @@ def RemoteImport(lu, feedback_fn, instance, pnode, source_x509_ca,
   @param cds: Cluster domain secret
   @type timeouts: L{ImportExportTimeouts}
   @param timeouts: Timeouts for this import
+  @type source_compressions: list or None
+  @param source_compressions: Compression methods announced by the source,
+      see L{GetRemoteExportCompressions}
+  @type source_ieios: list or None
+  @param source_ieios: I/O types announced by the source, see
+      L{GetRemoteExportIoTypes}; RBD volumes are transferred as diffs if
+      the source can send them, see L{GetRbdSnapshotNames}
 
   """
   source_ca_pem = OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM,
@@ -1449,6 +2014,29 @@ def RemoteImport(lu, feedback_fn, instance, pnode, source_x509_ca,
 
   magic_base = utils.GenerateSecret(6)
 
+  if source_compressions is None:
+    # The source doesn't support negotiation and uses the default method
+    compress = constants.IEC_DEFAULT
+    announced_compress = None
+  else:
+    compress = NegotiateCompression(lu, [instance.primary_node],
+                                    constants.IEC_INTER_CLUSTER_PREFERENCE,
+                                    peer_methods=source_compressions)
+    announced_compress = compress
+
+  feedback_fn("Using compression method '%s'" % compress)
+
+  # RBD diffs only contain allocated extents and are applied directly to the
+  # volumes, the OS scripts are used for all other instances; the source
+  # only sends the changes of RBD volumes once all bases have been sent
+  if (source_ieios and constants.IEIO_RBD_DIFF in source_ieios and
+      instance.disks and
+      compat.all(dev.dev_type == constants.LD_RBD for dev in instance.disks)):
+    assert announced_compress is not None
+    ieios = [constants.IEIO_RBD_DIFF] * len(instance.disks)
+  else:
+    ieios = [None] * len(instance.disks)
+
   # Decide whether to use IPv6
   ipv6 = netutils.IP6Address.IsValid(pnode.primary_ip)
 
@@ -1468,26 +2056,49 @@ def RemoteImport(lu, feedback_fn, instance, pnode, source_x509_ca,
       utils.SignX509Certificate(x509_cert, cds, utils.GenerateSecret(8))
 
     cbs = _RemoteImportCb(feedback_fn, cds, signed_x509_cert_pem,
-                          len(instance.disks), pnode.primary_ip)
+                          len(instance.disks), pnode.primary_ip,
+                          announced_compress, ieios)
+
+    magics = []
 
     ieloop = ImportExportLoop(lu)
     try:
-      for idx, dev in enumerate(instance.disks):
+      for idx, (dev, ieio) in enumerate(zip(instance.disks, ieios)):
         magic = _GetInstDiskMagic(magic_base, instance.name, idx)
+        magics.append(magic)
 
         # Import daemon options
         opts = objects.ImportExportOptions(key_name=x509_key_name,
                                            ca_pem=source_ca_pem,
-                                           magic=magic, ipv6=ipv6)
+                                           magic=magic, ipv6=ipv6,
+                                           compress=compress)
+
+        if ieio == constants.IEIO_RBD_DIFF:
+          ioargs = (_GetRbdDiffDisk(lu, instance, dev), )
+        else:
+          (ieio, ioargs) = (constants.IEIO_SCRIPT, (dev, idx))
 
         ieloop.Add(DiskImport(lu, instance.primary_node, opts, instance,
-                              "disk%d" % idx,
-                              constants.IEIO_SCRIPT, (dev, idx),
+                              "disk%d" % idx, ieio, ioargs,
                               timeouts, cbs, private=(idx, )))
 
       ieloop.Run()
     finally:
       ieloop.FinalizeAll()
+
+    if constants.IEIO_RBD_DIFF in ieios:
+      try:
+        _RemoteImportRbdDeltas(lu, feedback_fn, instance, x509_key_name,
+                               source_ca_pem, ipv6, compress, timeouts,
+                               magics, cbs.listen_ports, cbs.disk_results)
+      finally:
+        # Applying a diff exported from a snapshot creates the same snapshot
+        for (idx, (dev, magic)) in enumerate(zip(instance.disks, magics)):
+          for snap_name in GetRbdSnapshotNames(magic):
+            result = lu.rpc.call_blockdev_rbd_remove_snapshot(
+              instance.primary_node, (dev, instance), snap_name)
+            result.Warn("Could not remove transfer snapshot %s of disk/%s" %
+                        (snap_name, idx), lu.LogWarning)
   finally:
     # Remove crypto key and certificate
     result = lu.rpc.call_x509_cert_remove(instance.primary_node, x509_key_name)
@@ -1496,25 +2107,117 @@ def RemoteImport(lu, feedback_fn, instance, pnode, source_x509_ca,
   return cbs.disk_results
 
 
-def _GetImportExportHandshakeMessage(version):
+def _RemoteImportRbdDeltas(lu, feedback_fn, instance, key_name, source_ca_pem,
+                           ipv6, compress, timeouts, magics, ports, dresults):
+  """Receives the changes of RBD volumes imported from another cluster.
+
+  The source sends the changes made since the base snapshots once the bases
+  of all volumes have been sent, to the same ports.
+
+  @param lu: Logical unit instance
+  @param feedback_fn: Feedback function
+  @type instance: L{objects.Instance}
+  @param instance: Instance object
+  @type key_name: string
+  @param key_name: Name of X509 key to use
+  @type source_ca_pem: string
+  @param source_ca_pem: Source X509 CA in PEM format
+  @type ipv6: bool
+  @param ipv6: Whether to use IPv6
+  @type compress: string
+  @param compress: Compression method
+  @type timeouts: L{ImportExportTimeouts}
+  @param timeouts: Timeouts for the imports
+  @type magics: list
+  @param magics: Magic values used for the bases
+  @type ports: list
+  @param ports: Ports the bases were received on
+  @type dresults: list
+  @param dresults: Per-disk results of receiving the bases, updated with the
+      results of receiving the changes
+
+  """
+  if not compat.all(dresults):
+    # The source doesn't send any changes if sending a base failed
+    feedback_fn("Not all bases were received, not waiting for changes")
+    for idx in range(len(dresults)):
+      dresults[idx] = False
+    return
+
+  cbs = _RemoteImportDeltaCb(feedback_fn, dresults)
+
+  ieloop = ImportExportLoop(lu)
+  try:
+    for idx, (dev, magic, port) in enumerate(zip(instance.disks, magics,
+                                                 ports)):
+      opts = objects.ImportExportOptions(key_name=key_name,
+                                         ca_pem=source_ca_pem,
+                                         magic=_GetRbdDeltaMagic(magic),
+                                         ipv6=ipv6, compress=compress,
+                                         listen_port=port)
+
+      ieloop.Add(DiskImport(lu, instance.primary_node, opts, instance,
+                            "disk%d" % idx, constants.IEIO_RBD_DIFF,
+                            (_GetRbdDiffDisk(lu, instance, dev), ),
+                            timeouts, cbs, private=(idx, )))
+
+    ieloop.Run()
+  finally:
+    ieloop.FinalizeAll()
+
+
+def _GetImportExportHandshakeMessage(version, compressions=None,
+                                     ieios=None):
   """Returns the handshake message for a RIE protocol version.
 
   @type version: number
+  @type compressions: list or None
+  @param compressions: Compression methods announced by the source
+  @type ieios: list or None
+  @param ieios: Additional I/O types announced by the source
 
   """
-  return "%s:%s" % (version, constants.RIE_HANDSHAKE)
+  msg = "%s:%s" % (version, constants.RIE_HANDSHAKE)
+
+  if compressions is not None:
+    msg = "%s:%s" % (msg, ",".join(compressions))
 
+    if ieios is not None:
+      msg = "%s:%s" % (msg, ",".join(ieios))
 
-def ComputeRemoteExportHandshake(cds):
+  return msg
+
+
+def ComputeRemoteExportHandshake(cds, compressions=None, ieios=None):
   """Computes the remote import/export handshake.
 
   @type cds: string
   @param cds: Cluster domain secret
+  @type compressions: list or None
+  @param compressions: Compression methods usable on the source node; if
+      given, they are announced to the destination. Destinations of older
+      versions only accept handshakes without announcements, see
+      L{rapi.client.INST_REMOTE_IMPORT_EXT}.
+  @type ieios: list or None
+  @param ieios: I/O types the source can use for all disks of the instance
+      besides L{constants.IEIO_SCRIPT}; can only be announced together with
+      compression methods
 
   """
+  assert ieios is None or compressions is not None
+
   salt = utils.GenerateSecret(8)
-  msg = _GetImportExportHandshakeMessage(constants.RIE_VERSION)
-  return (constants.RIE_VERSION, utils.Sha1Hmac(cds, msg, salt=salt), salt)
+  msg = _GetImportExportHandshakeMessage(constants.RIE_VERSION, compressions,
+                                         ieios)
+  hs = (constants.RIE_VERSION, utils.Sha1Hmac(cds, msg, salt=salt), salt)
+
+  if compressions is not None:
+    hs += (list(compressions), )
+
+    if ieios is not None:
+      hs += (list(ieios), )
+
+  return hs
 
 
 def CheckRemoteExportHandshake(cds, handshake):
@@ -1527,11 +2230,19 @@ def CheckRemoteExportHandshake(cds, handshake):
 
   """
   try:
-    (version, hmac_digest, hmac_salt) = handshake
+    (version, hmac_digest, hmac_salt) = handshake[:3]
+    compressions = GetRemoteExportCompressions(handshake)
+    ieios = GetRemoteExportIoTypes(handshake)
   except (TypeError, ValueError), err:
     return "Invalid data: %s" % err
 
-  if not utils.VerifySha1Hmac(cds, _GetImportExportHandshakeMessage(version),
+  if len(handshake) not in (3, 4, 5):
+    return "Invalid data: handshake has %s elements" % len(handshake)
+
+  if not utils.VerifySha1Hmac(cds,
+                              _GetImportExportHandshakeMessage(version,
+                                                               compressions,
+                                                               ieios),
                               hmac_digest, salt=hmac_salt):
     return "Hash didn't match, clusters don't share the same domain secret"
 
@@ -1543,7 +2254,54 @@ def CheckRemoteExportHandshake(cds, handshake):
   return None
 
 
-def _GetRieDiskInfoMessage(disk_index, host, port, magic):
+def GetRemoteExportCompressions(handshake):
+  """Returns the compression methods announced in a handshake.
+
+  Only use on handshakes verified with L{CheckRemoteExportHandshake}.
+
+  @type handshake: sequence
+  @param handshake: Handshake sent by remote peer
+  @rtype: list or None
+  @return: Compression methods, None if the source didn't announce any
+
+  """
+  if len(handshake) < 4:
+    return None
+
+  compressions = handshake[3]
+
+  if not (isinstance(compressions, (list, tuple)) and
+          compat.all(isinstance(i, basestring) for i in compressions)):
+    raise ValueError("Compression methods must be a list of strings")
+
+  return list(compressions)
+
+
+def GetRemoteExportIoTypes(handshake):
+  """Returns the additional I/O types announced in a handshake.
+
+  Only use on handshakes verified with L{CheckRemoteExportHandshake}.
+
+  @type handshake: sequence
+  @param handshake: Handshake sent by remote peer
+  @rtype: list or None
+  @return: I/O types, None if the source didn't announce any
+
+  """
+  if len(handshake) < 5:
+    return None
+
+  ieios = handshake[4]
+
+  if not (isinstance(ieios, (list, tuple)) and
+          compat.all(isinstance(i, basestring) for i in ieios)):
+    raise ValueError("I/O types must be a list of strings")
+
+  return list(ieios)
+
+
+def _GetRieDiskInfoMessage(disk_index, host, port, magic, compress=None,
+                           ieio=None):
   """Returns the hashed text for import/export disk information.
 
   @type disk_index: number
@@ -1554,9 +2312,21 @@ def _GetRieDiskInfoMessage(disk_index, host, port, magic):
   @param port: Daemon port
   @type magic: string
   @param magic: Magic value
+  @type compress: string or None
+  @param compress: Compression method
+  @type ieio: string or None
+  @param ieio: I/O type
 
   """
-  return "%s:%s:%s:%s" % (disk_index, host, port, magic)
+  msg = "%s:%s:%s:%s" % (disk_index, host, port, magic)
+
+  if compress is not None:
+    msg = "%s:%s" % (msg, compress)
+
+    if ieio is not None:
+      msg = "%s:%s" % (msg, ieio)
+
+  return msg
 
 
 def CheckRemoteExportDiskInfo(cds, disk_index, disk_info):
@@ -1568,17 +2338,37 @@ def CheckRemoteExportDiskInfo(cds, disk_index, disk_info):
   @param disk_index: Index of disk (included in hash)
   @type disk_info: sequence
   @param disk_info: Disk information sent by remote peer
+  @rtype: tuple
+  @return: (destination, port, magic, compression method, I/O type);
+      destinations which didn't announce a compression method use
+      L{constants.IEC_DEFAULT}, those which didn't announce an I/O type
+      L{constants.IEIO_SCRIPT}
 
   """
   try:
-    (host, port, magic, hmac_digest, hmac_salt) = disk_info
+    if len(disk_info) == 7:
+      (host, port, magic, hmac_digest, hmac_salt, compress, ieio) = disk_info
+    elif len(disk_info) == 6:
+      (host, port, magic, hmac_digest, hmac_salt, compress) = disk_info
+      ieio = None
+    else:
+      (host, port, magic, hmac_digest, hmac_salt) = disk_info
+      compress = None
+      ieio = None
   except (TypeError, ValueError), err:
     raise errors.GenericError("Invalid data: %s" % err)
 
   if not (host and port and magic):
     raise errors.GenericError("Missing destination host, port or magic")
 
-  msg = _GetRieDiskInfoMessage(disk_index, host, port, magic)
+  if not (compress is None or compress in constants.IEC_ALL):
+    raise errors.GenericError("Unknown compression method '%s'" % compress)
+
+  if not (ieio is None or ieio in constants.RIE_IEIO_ALL):
+    raise errors.GenericError("Unsupported I/O type '%s'" % ieio)
+
+  msg = _GetRieDiskInfoMessage(disk_index, host, port, magic,
+                               compress=compress, ieio=ieio)
 
   if not utils.VerifySha1Hmac(cds, msg, hmac_digest, salt=hmac_salt):
     raise errors.GenericError("HMAC is wrong")
@@ -1588,12 +2378,21 @@ def CheckRemoteExportDiskInfo(cds, disk_index, disk_info):
   else:
     destination = netutils.Hostname.GetNormalizedName(host)
 
+  if compress is None:
+    compress = constants.IEC_DEFAULT
+
+  if ieio is None:
+    ieio = constants.IEIO_SCRIPT
+
   return (destination,
           utils.ValidateServiceName(port),
-          magic)
+          magic,
+          compress,
+          ieio)
 
 
-def ComputeRemoteImportDiskInfo(cds, salt, disk_index, host, port, magic):
+def ComputeRemoteImportDiskInfo(cds, salt, disk_index, host, port, magic,
+                                compress=None, ieio=None):
   """Computes the signed disk information for a remote import.
 
   @type cds: string
@@ -1608,11 +2407,27 @@ def ComputeRemoteImportDiskInfo(cds, salt, disk_index, host, port, magic):
   @param port: Daemon port
   @type magic: string
   @param magic: Magic value
+  @type compress: string or None
+  @param compress: Compression method, only included if not None
+  @type ieio: string or None
+  @param ieio: I/O type, only included if not None; requires a compression
+      method
 
   """
-  msg = _GetRieDiskInfoMessage(disk_index, host, port, magic)
+  assert ieio is None or compress is not None
+
+  msg = _GetRieDiskInfoMessage(disk_index, host, port, magic,
+                               compress=compress, ieio=ieio)
   hmac_digest = utils.Sha1Hmac(cds, msg, salt=salt)
-  return (host, port, magic, hmac_digest, salt)
+  result = (host, port, magic, hmac_digest, salt)
+
+  if compress is not None:
+    result += (compress, )
+
+    if ieio is not None:
+      result += (ieio, )
+
+  return result
 
 
 def CalculateGroupIPolicy(cluster, group):
@@ -383,7 +383,12 @@ class Processor(object):
     return result
 
   def BuildHooksManager(self, lu):
-    return self.hmclass.BuildFromLu(lu.rpc.call_hooks_runner, lu)
+    # Nodes only report the run time of hook scripts when asked to, as
+    # masters of older versions expect results without it
+    hooks_execution_fn = \
+      lambda node_list, hpath, phase, env: \
+        lu.rpc.call_hooks_runner(node_list, hpath, phase, env, True)
+    return self.hmclass.BuildFromLu(hooks_execution_fn, lu)
 
   def _LockAndExecLU(self, lu, level, calc_timeout):
     """Execute a Logical Unit, with the needed locks.
@@ -1956,6 +1956,13 @@ class ImportExportOptions(ConfigObject):
   @ivar magic: Used to ensure the connection goes to the right disk
   @ivar ipv6: Whether to use IPv6
   @ivar connect_timeout: Number of seconds for establishing connection
+  @ivar connect_retries: Number of connection attempts for exports (None for
+    the default)
+  @ivar listen_port: Port to listen on for imports (None for any free port)
+  @ivar sparse: Whether to transfer the data as a sparse stream, skipping
+    zero regions (only for raw disk and file I/O)
+  @ivar disk_range: Offset and size in MiB of the part of the disk to
+    transfer, None for the whole disk (only for raw disk I/O)
 
   """
   __slots__ = [
@@ -1965,6 +1972,10 @@ class ImportExportOptions(ConfigObject):
     "magic",
     "ipv6",
     "connect_timeout",
+    "connect_retries",
+    "listen_port",
+    "sparse",
+    "disk_range",
     ]
 
 
@@ -2082,6 +2093,9 @@ class MigrationStatus(ConfigObject):
     "status",
     "transferred_ram",
     "total_ram",
+    "remaining_ram",
+    "dirty_pages_rate",
+    "expected_downtime",
     ]
 
 
@@ -973,6 +973,11 @@ class OpClusterRedistConf(OpCode):
   """Force a full push of the cluster configuration.
 
   """
+  OP_PARAMS = [
+    ("skip_unchanged", False, ht.TBool,
+     "Whether to skip ancillary files whose contents are already up to date"
+     " on a node"),
+    ]
   OP_RESULT = ht.TNone
 
 
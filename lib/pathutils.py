@@ -53,6 +53,7 @@ KVM_CONSOLE_WRAPPER = _autoconf.PKGLIBDIR + "/tools/kvm-console-wrapper"
 KVM_IFUP = _autoconf.PKGLIBDIR + "/kvm-ifup"
 PREPARE_NODE_JOIN = _autoconf.PKGLIBDIR + "/prepare-node-join"
 NODE_DAEMON_SETUP = _autoconf.PKGLIBDIR + "/node-daemon-setup"
+SPARSE_TRANSFER = _autoconf.PKGLIBDIR + "/sparse-transfer"
 XEN_CONSOLE_WRAPPER = _autoconf.PKGLIBDIR + "/tools/xen-console-wrapper"
 ETC_HOSTS = vcluster.ETC_HOSTS
 
@@ -77,6 +78,9 @@ CRYPTO_KEYS_DIR = RUN_DIR + "/crypto"
 IMPORT_EXPORT_DIR = RUN_DIR + "/import-export"
 INSTANCE_STATUS_FILE = RUN_DIR + "/instance-status"
 INSTANCE_REASON_DIR = RUN_DIR + "/instance-reason"
+LVM_INVENTORY_FILE = RUN_DIR + "/lvm-inventory"
+LVM_INVENTORY_STAMP_FILE = RUN_DIR + "/lvm-inventory-invalidated"
+FINGERPRINT_CACHE_FILE = RUN_DIR + "/file-fingerprints"
 #: User-id pool lock directory (used user IDs have a corresponding lock file in
 #: this directory)
 UIDPOOL_LOCKDIR = RUN_DIR + "/uid-pool"
@@ -119,6 +123,10 @@ WATCHER_GROUP_STATE_FILE = DATA_DIR + "/watcher.%s.data"
 #: per-group processes
 WATCHER_GROUP_INSTANCE_STATUS_FILE = DATA_DIR + "/watcher.%s.instance-status"
 
+#: Instance and node data of all node groups, written by the global watcher
+#: for the per-group processes
+WATCHER_GROUPS_DATA_FILE = DATA_DIR + "/watcher.groups-data"
+
 #: File containing Unix timestamp until which watcher should be paused
 WATCHER_PAUSEFILE = DATA_DIR + "/watcher.pause"
 
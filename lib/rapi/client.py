@@ -107,6 +107,7 @@ INST_CREATE_REQV1 = "instance-create-reqv1"
 INST_REINSTALL_REQV1 = "instance-reinstall-reqv1"
 NODE_MIGRATE_REQV1 = "node-migrate-reqv1"
 NODE_EVAC_RES1 = "node-evac-res1"
+INST_REMOTE_IMPORT_EXT = "instance-remote-import-ext"
 
 # Old feature constant names in case they're references by users of this module
 _INST_CREATE_REQV1 = INST_CREATE_REQV1
@@ -156,11 +156,15 @@ _NODE_MIGRATE_REQV1 = "node-migrate-reqv1"
 # Feature string for node evacuation with LU-generated jobs
 _NODE_EVAC_RES1 = "node-evac-res1"
 
+# Feature string for remote imports accepting extended source handshakes
+_INST_REMOTE_IMPORT_EXT = "instance-remote-import-ext"
+
 ALL_FEATURES = compat.UniqueFrozenset([
   _INST_CREATE_REQV1,
   _INST_REINSTALL_REQV1,
   _NODE_MIGRATE_REQV1,
   _NODE_EVAC_RES1,
+  _INST_REMOTE_IMPORT_EXT,
   ])
 
 # Timeout for /2/jobs/[job_id]/wait. Gives job up to 10 seconds to change.
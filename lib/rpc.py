@@ -582,6 +582,9 @@ def _EncodeImportExportIO((ieio, ieioargs)):
     assert len(ieioargs) == 2
     return (ieio, (ieioargs[0].ToDict(), ieioargs[1]))
 
+  if ieio == constants.IEIO_RBD_DIFF:
+    return (ieio, (ieioargs[0].ToDict(), ) + tuple(ieioargs[1:]))
+
   return (ieio, ieioargs)
 
 
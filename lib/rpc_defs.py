@@ -120,6 +120,16 @@ def _BlockdevGetMirrorStatusMultiPreProc(node, args):
   return [args[0][node]]
 
 
+def _BlockdevAssembleMultiPreProc(node, args):
+  """Prepares the appropriate node values for blockdev_assemble_multi.
+
+  """
+  # both arguments are dictionaries indexed by node, we just need to extract
+  # the values for the current node
+  assert len(args) == 2
+  return [args[0][node], args[1][node]]
+
+
 def _BlockdevGetMirrorStatusMultiPostProc(result):
   """Post-processor for L{rpc.RpcRunner.call_blockdev_getmirrorstatus_multi}.
 
@@ -313,6 +323,8 @@ _IMPEXP_CALLS = [
     ("component", None, None),
     ("source", ED_IMPEXP_IO, "Export source"),
     ], None, None, "Starts an export daemon"),
+  ("impexp_compressions", MULTI, None, constants.RPC_TMO_FAST, [], None, None,
+   "Gets the compression methods usable for imports and exports"),
   ("impexp_status", SINGLE, None, constants.RPC_TMO_FAST, [
     ("names", None, "Import/export names"),
     ], None, _ImpExpStatusPostProc, "Gets the status of an import or export"),
@@ -377,6 +389,11 @@ _BLOCKDEV_CALLS = [
     ("on_primary", None, None),
     ("idx", None, None),
     ], None, None, "Request assembling of a given block device"),
+  ("blockdev_assemble_multi", MULTI, None, constants.RPC_TMO_NORMAL, [
+    ("node_disks", ED_NODE_TO_DISK_DICT, None),
+    ("node_params", None, "Node to list of (owner, on_primary, idx)"),
+    ], _BlockdevAssembleMultiPreProc, None,
+    "Request assembling of block devices on multiple nodes"),
   ("blockdev_shutdown", SINGLE, None, constants.RPC_TMO_NORMAL, [
     ("disk", ED_SINGLE_DISK_DICT_DP, None),
     ], None, None, "Request shutdown of a given block device"),
@@ -435,6 +452,14 @@ _BLOCKDEV_CALLS = [
   ("blockdev_snapshot", SINGLE, None, constants.RPC_TMO_NORMAL, [
     ("cf_bdev", ED_SINGLE_DISK_DICT_DP, None),
     ], None, None, "Export a given disk to another node"),
+  ("blockdev_rbd_snapshot", SINGLE, None, constants.RPC_TMO_NORMAL, [
+    ("cf_bdev", ED_SINGLE_DISK_DICT_DP, None),
+    ("snap_name", None, None),
+    ], None, None, "Creates a snapshot of an RBD volume"),
+  ("blockdev_rbd_remove_snapshot", SINGLE, None, constants.RPC_TMO_NORMAL, [
+    ("cf_bdev", ED_SINGLE_DISK_DICT_DP, None),
+    ("snap_name", None, None),
+    ], None, None, "Removes a snapshot of an RBD volume"),
   ("blockdev_rename", SINGLE, None, constants.RPC_TMO_NORMAL, [
     ("devlist", ED_BLOCKDEV_RENAME, None),
     ], None, None, "Request rename of the given block devices"),
@@ -534,6 +559,7 @@ _MISC_CALLS = [
     ("hpath", None, None),
     ("phase", None, None),
     ("env", None, None),
+    ("with_durations", None, "Whether to report the run time of scripts"),
     ], None, None, "Call the hooks runner"),
   ("iallocator_runner", SINGLE, None, constants.RPC_TMO_NORMAL, [
     ("name", None, "Iallocator name"),
@@ -37,6 +37,13 @@ import codecs
 
 from optparse import OptionParser
 
+try:
+  # pylint: disable=E0611
+  from pyinotify import pyinotify
+except ImportError:
+  import pyinotify
+
+from ganeti import asyncnotifier
 from ganeti import backend
 from ganeti import constants
 from ganeti import objects
@@ -50,6 +57,7 @@ from ganeti import serializer
 from ganeti import netutils
 from ganeti import pathutils
 from ganeti import ssconf
+from ganeti.hypervisor import hv_kvm
 
 import ganeti.http.server # pylint: disable=W0611
 
@@ -86,6 +94,80 @@ def _PrepareQueueLock():
     return err
 
 
+class _DirEventHandler(asyncnotifier.FileEventHandlerBase):
+  def __init__(self, wm, path, cb):
+    """Initializes this class.
+
+    @param wm: Inotify watch manager
+    @type path: string
+    @param path: Directory to watch
+    @type cb: callable
+    @param cb: Function called with the names of changed files, or None if
+      events were lost
+
+    """
+    asyncnotifier.FileEventHandlerBase.__init__(self, wm)
+
+    self._cb = cb
+
+    # Processes may keep their pidfile open, so modifications are watched
+    # too and not only closed files
+    mask = (pyinotify.EventsCodes.ALL_FLAGS["IN_MODIFY"] |
+            pyinotify.EventsCodes.ALL_FLAGS["IN_CLOSE_WRITE"] |
+            pyinotify.EventsCodes.ALL_FLAGS["IN_DELETE"] |
+            pyinotify.EventsCodes.ALL_FLAGS["IN_MOVED_FROM"] |
+            pyinotify.EventsCodes.ALL_FLAGS["IN_MOVED_TO"])
+
+    self.AddWatch(path, mask)
+
+  def _Notify(self, names):
+    try:
+      self._cb(names)
+    except Exception: # pylint: disable=W0703
+      # Errors must not stop the main loop
+      logging.exception("Error while handling changed files %s", names)
+
+  def process_IN_Q_OVERFLOW(self, _):
+    logging.warning("Inotify events were lost, rescanning all files")
+    self._Notify(None)
+
+  def process_default(self, event):
+    if event.name:
+      self._Notify([event.name])
+
+
+def _WatchDirectory(path, cb):
+  """Calls a function whenever files in a directory change.
+
+  """
+  wm = pyinotify.WatchManager()
+  handler = _DirEventHandler(wm, path, cb)
+  asyncnotifier.AsyncNotifier(wm, default_proc_fun=handler)
+
+
+def _WatchInstances():
+  """Keeps hypervisor caches up to date.
+
+  Requests are handled in forked processes, which inherit the caches of the
+  main process; keeping these up to date saves every request from reading
+  the runtime files of all instances again.
+
+  """
+  try:
+    hypervisors = ssconf.SimpleStore().GetHypervisorList()
+  except errors.ConfigurationError:
+    # Not part of a cluster yet
+    return
+
+  if constants.HT_KVM in hypervisors:
+    # The caches are only an optimization and must never prevent the node
+    # daemon from starting
+    try:
+      hv_kvm.KVMHypervisor.WatchInstances(_WatchDirectory)
+    except Exception: # pylint: disable=W0703
+      logging.exception("Can't watch KVM instances")
+
+
 def _RequireJobQueueLock(fn):
   """Decorator for job queue manipulating functions.
 
@@ -119,6 +201,9 @@ def _DecodeImportExportIO(ieio, ieioargs):
     assert len(ieioargs) == 2
     return (objects.Disk.FromDict(ieioargs[0]), ieioargs[1])
 
+  if ieio == constants.IEIO_RBD_DIFF:
+    return (objects.Disk.FromDict(ieioargs[0]), ) + tuple(ieioargs[1:])
+
   return ieioargs
 
 
@@ -259,6 +344,17 @@ class NodeRequestHandler(http.server.HttpServerHandler):
       raise ValueError("can't unserialize data!")
     return backend.BlockdevAssemble(bdev, owner, on_primary, idx)
 
+  @staticmethod
+  def perspective_blockdev_assemble_multi(params):
+    """Assemble a list of block devices.
+
+    """
+    (node_disks, node_params) = params
+    disks = [(objects.Disk.FromDict(bdev_s), owner, on_primary, idx)
+             for (bdev_s, (owner, on_primary, idx)) in zip(node_disks,
+                                                           node_params)]
+    return backend.BlockdevAssembleMulti(disks)
+
   @staticmethod
   def perspective_blockdev_shutdown(params):
     """Shutdown a block device.
@@ -356,6 +452,24 @@ class NodeRequestHandler(http.server.HttpServerHandler):
     cfbd = objects.Disk.FromDict(params[0])
     return backend.BlockdevSnapshot(cfbd)
 
+  @staticmethod
+  def perspective_blockdev_rbd_snapshot(params):
+    """Create a snapshot of an RBD volume.
+
+    """
+    (disk, snap_name) = params
+    cfbd = objects.Disk.FromDict(disk)
+    return backend.BlockdevRbdSnapshot(cfbd, snap_name)
+
+  @staticmethod
+  def perspective_blockdev_rbd_remove_snapshot(params):
+    """Remove a snapshot of an RBD volume.
+
+    """
+    (disk, snap_name) = params
+    cfbd = objects.Disk.FromDict(disk)
+    return backend.BlockdevRbdRemoveSnapshot(cfbd, snap_name)
+
   @staticmethod
   def perspective_blockdev_grow(params):
     """Grow a stack of devices.
@@ -943,9 +1057,14 @@ class NodeRequestHandler(http.server.HttpServerHandler):
     """Run hook scripts.
 
     """
-    hpath, phase, env = params
+    if len(params) > 3:
+      (hpath, phase, env, with_durations) = params
+    else:
+      # Masters of older versions expect results without the run times
+      (hpath, phase, env) = params
+      with_durations = False
     hr = backend.HooksRunner()
-    return hr.RunHooks(hpath, phase, env)
+    return hr.RunHooks(hpath, phase, env, with_durations=with_durations)
 
   # iallocator -----------------
 
@@ -1099,6 +1218,13 @@ class NodeRequestHandler(http.server.HttpServerHandler):
                                            _DecodeImportExportIO(source,
                                                                  source_args))
 
+  @staticmethod
+  def perspective_impexp_compressions(params):
+    """Returns the compression methods usable for imports and exports.
+
+    """
+    return backend.GetImportExportCompressionMethods()
+
   @staticmethod
   def perspective_impexp_status(params):
     """Retrieves the status of an import or export daemon.
@@ -1166,6 +1292,8 @@ def PrepNoded(options, _):
     # startup of the whole node daemon because of this
     logging.critical("Can't init/verify the queue, proceeding anyway: %s", err)
 
+  _WatchInstances()
+
   handler = NodeRequestHandler()
 
   mainloop = daemon.Mainloop()
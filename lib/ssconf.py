@@ -36,6 +36,7 @@ from ganeti import constants
 from ganeti import utils
 from ganeti import netutils
 from ganeti import pathutils
+from ganeti import serializer
 
 
 SSCONF_LOCK_TIMEOUT = 10
@@ -76,6 +77,19 @@ _VALID_KEYS = compat.UniqueFrozenset([
 #: Maximum size for ssconf files
 _MAX_SIZE = 128 * 1024
 
+#: Name of the file containing a snapshot of all ssconf values
+_SNAPSHOT_FILENAME = constants.SSCONF_FILEPREFIX + "snapshot"
+
+#: Version of the snapshot file format
+_SNAPSHOT_VERSION = 1
+
+#: Maximum size for the snapshot file (values may grow by JSON escaping)
+_MAX_SNAPSHOT_SIZE = 2 * len(_VALID_KEYS) * _MAX_SIZE
+
+#: Process-wide cache of ssconf file contents; file name as key, tuple of file
+#: ID (see L{utils.GetFileID}) and contents as value
+_cache = {}
+
 
 def ReadSsconfFile(filename):
   """Reads an ssconf file and verifies its size.
@@ -99,6 +113,75 @@ def ReadSsconfFile(filename):
   return data.rstrip("\n")
 
 
+def ReadSnapshotFile(filename):
+  """Reads and verifies an ssconf snapshot file.
+
+  @type filename: string
+  @param filename: Path to file
+  @rtype: tuple
+  @return: tuple of (serial, dictionary with ssconf key as key and value as
+    value)
+  @raise errors.ConfigurationError: When the file is not a valid snapshot
+
+  """
+  try:
+    data = serializer.LoadJson(utils.ReadFile(filename,
+                                              size=_MAX_SNAPSHOT_SIZE))
+    version = data["version"]
+    serial = int(data["serial"])
+    values = data["values"]
+  except (ValueError, TypeError, KeyError), err:
+    raise errors.ConfigurationError("Can't parse ssconf snapshot %s: %s" %
+                                    (filename, err))
+
+  if version != _SNAPSHOT_VERSION:
+    raise errors.ConfigurationError("Unsupported ssconf snapshot version %s"
+                                    " in %s" % (version, filename))
+
+  return (serial, dict((str(key), value.encode("utf-8"))
+                       for (key, value) in values.items()))
+
+
+def _ReadCachedFileWithID(filename, read_fn, _cache=_cache):
+  """Reads a file through the process-wide cache.
+
+  The file is only read if its file ID changed since it was cached; as
+  ssconf files are always replaced atomically, this is enough to detect
+  changes.
+
+  @type filename: string
+  @param filename: Path to file
+  @type read_fn: callable
+  @param read_fn: Function reading the file, called with the file name
+  @rtype: tuple
+  @return: tuple of (file ID as returned by L{utils.GetFileID}, result of
+    C{read_fn})
+
+  """
+  file_id = utils.GetFileID(path=filename)
+
+  cached = _cache.get(filename)
+  if cached is not None and cached[0] == file_id:
+    return cached
+
+  # If the file is replaced between getting its ID and reading it, the new
+  # contents are stored with the old ID and will be re-read the next time
+  data = read_fn(filename)
+  _cache[filename] = (file_id, data)
+
+  return (file_id, data)
+
+
+def _ReadCachedFile(filename, read_fn, _cache=_cache):
+  """Reads a file through the process-wide cache.
+
+  @see: L{_ReadCachedFileWithID}
+  @return: The result of C{read_fn}
+
+  """
+  return _ReadCachedFileWithID(filename, read_fn, _cache=_cache)[1]
+
+
 class SimpleStore(object):
   """Interface to static cluster data.
 
@@ -118,6 +201,56 @@ class SimpleStore(object):
 
     self._lockfile = _lockfile
 
+  def GetSnapshotFilename(self):
+    """Returns the path of the snapshot file.
+
+    """
+    return self._cfg_dir + "/" + _SNAPSHOT_FILENAME
+
+  def _ReadSnapshot(self):
+    """Reads the snapshot of all ssconf values.
+
+    @rtype: tuple or None
+    @return: tuple of (serial, dictionary with ssconf key as key and value as
+      value, modification time); C{None} if there is no (valid) snapshot
+
+    """
+    filename = self.GetSnapshotFilename()
+    try:
+      ((_, _, mtime), (serial, values)) = \
+        _ReadCachedFileWithID(filename, ReadSnapshotFile)
+      return (serial, values, mtime)
+    except EnvironmentError, err:
+      if err.errno != errno.ENOENT:
+        logging.warning("Can't read ssconf snapshot %s: %s", filename, err)
+    except errors.ConfigurationError, err:
+      logging.warning("Ignoring ssconf snapshot: %s", err)
+
+    return None
+
+  def _IsSnapshotOutdated(self, snapshot, key):
+    """Checks whether the individual file of a key supersedes the snapshot.
+
+    Individual files can still be written without updating the snapshot,
+    e.g. by an older version. If such a file was modified after the snapshot,
+    or its key is missing from the snapshot, it must be used instead.
+
+    @type snapshot: tuple
+    @param snapshot: Snapshot as returned by L{_ReadSnapshot}
+    @type key: string
+    @param key: ssconf key
+    @rtype: bool
+
+    """
+    (_, values, snapshot_mtime) = snapshot
+
+    try:
+      (_, _, mtime) = utils.GetFileID(path=self.KeyToFilename(key))
+    except EnvironmentError:
+      return False
+
+    return key not in values or mtime > snapshot_mtime
+
   def KeyToFilename(self, key):
     """Convert a given key into filename.
 
@@ -132,63 +265,176 @@ class SimpleStore(object):
   def _ReadFile(self, key, default=None):
     """Generic routine to read keys.
 
-    This will read the file which holds the value requested. Errors
+    The value is taken from the snapshot file if possible, otherwise the
+    file holding the value requested is read. Files are only read if they
+    changed since the last time they were read by this process. Errors
     will be changed into ConfigurationErrors.
 
     """
     filename = self.KeyToFilename(key)
+
+    snapshot = self._ReadSnapshot()
+    if (snapshot is not None and key in snapshot[1] and
+        not self._IsSnapshotOutdated(snapshot, key)):
+      return snapshot[1][key]
+
     try:
-      return ReadSsconfFile(filename)
+      return _ReadCachedFile(filename, ReadSsconfFile)
     except EnvironmentError, err:
       if err.errno == errno.ENOENT and default is not None:
         return default
       raise errors.ConfigurationError("Can't read ssconf file %s: %s" %
                                       (filename, str(err)))
 
-  def ReadAll(self):
-    """Reads all keys and returns their values.
+  def ReadKeys(self, keys):
+    """Reads a consistent snapshot of the given keys.
+
+    If a snapshot file exists and none of the keys' individual files was
+    modified after it, the values are taken from it. Otherwise the ssconf
+    lock is acquired in shared mode once for all keys, so that no
+    L{WriteFiles} call can update them while they are read.
 
+    @type keys: sequence
+    @param keys: ssconf keys to read
     @rtype: dict
-    @return: Dictionary, ssconf key as key, value as value
+    @return: Dictionary, ssconf key as key, value as value; keys whose file
+      doesn't exist are left out
 
     """
-    result = []
+    VerifyKeys(keys)
+
+    snapshot = self._ReadSnapshot()
+    if (snapshot is not None and
+        not compat.any(self._IsSnapshotOutdated(snapshot, key)
+                       for key in keys)):
+      values = snapshot[1]
+      return dict((key, values[key]) for key in keys if key in values)
 
-    for key in _VALID_KEYS:
+    try:
+      ssconf_lock = utils.FileLock.Open(self._lockfile)
+    except EnvironmentError, err:
+      # e.g. readers not running as root can't open the lock file
+      logging.debug("Can't open ssconf lock file %s, reading without it: %s",
+                    self._lockfile, err)
+      ssconf_lock = None
+    else:
       try:
-        value = self._ReadFile(key)
-      except errors.ConfigurationError:
-        # Ignore non-existing files
-        pass
-      else:
-        result.append((key, value))
+        ssconf_lock.Shared(blocking=True, timeout=SSCONF_LOCK_TIMEOUT)
+      except errors.LockError, err:
+        logging.warning("Can't acquire ssconf lock, reading without it: %s",
+                        err)
+
+    try:
+      result = []
+
+      for key in keys:
+        try:
+          value = self._ReadFile(key)
+        except errors.ConfigurationError:
+          # Ignore non-existing files
+          pass
+        else:
+          result.append((key, value))
+
+      return dict(result)
+    finally:
+      if ssconf_lock is not None:
+        ssconf_lock.Close()
+
+  def ReadAll(self):
+    """Reads all keys and returns their values.
 
-    return dict(result)
+    @rtype: dict
+    @return: Dictionary, ssconf key as key, value as value
+
+    """
+    return self.ReadKeys(_VALID_KEYS)
 
   def WriteFiles(self, values, dry_run=False):
     """Writes ssconf files used by external scripts.
 
+    All values, including the ones not being updated, are written to the
+    snapshot file, which is replaced atomically. The individual files are
+    kept for compatibility, but only rewritten if their contents on disk
+    differ from the new value, e.g. because they were written by an older
+    version which didn't update the snapshot.
+
     @type values: dict
     @param values: Dictionary of (name, value)
     @type dry_run boolean
     @param dry_run: Whether to perform a dry run
 
     """
+    for name, value in values.iteritems():
+      # Verify the key
+      self.KeyToFilename(name)
+
+      if value and not value.endswith("\n"):
+        value += "\n"
+
+      if len(value) > _MAX_SIZE:
+        msg = ("Value '%s' has a length of %s bytes, but only up to %s are"
+               " allowed" % (name, len(value), _MAX_SIZE))
+        raise errors.ConfigurationError(msg)
+
     ssconf_lock = utils.FileLock.Open(self._lockfile)
 
     # Get lock while writing files
     ssconf_lock.Exclusive(blocking=True, timeout=SSCONF_LOCK_TIMEOUT)
     try:
-      for name, value in values.iteritems():
-        if value and not value.endswith("\n"):
+      file_data = {}
+      for key in _VALID_KEYS:
+        try:
+          file_data[key] = utils.ReadFile(self.KeyToFilename(key),
+                                          size=_MAX_SIZE)
+        except EnvironmentError:
+          pass
+
+      snapshot = self._ReadSnapshot()
+      if snapshot is None:
+        serial = 0
+        # Keep the values of the individual files
+        old_values = dict((key, data.rstrip("\n"))
+                          for (key, data) in file_data.items())
+      else:
+        (serial, snapshot_values, _) = snapshot
+        old_values = snapshot_values.copy()
+        # Individual files written without updating the snapshot take
+        # precedence
+        old_values.update((key, data.rstrip("\n"))
+                          for (key, data) in file_data.items()
+                          if self._IsSnapshotOutdated(snapshot, key))
+
+      new_values = old_values.copy()
+      new_values.update((name, value.rstrip("\n"))
+                        for (name, value) in values.items())
+
+      # The snapshot is written last, so that its serial is only increased
+      # once all individual files have been updated
+      files_written = False
+      for (name, value) in new_values.items():
+        if value:
           value += "\n"
-
-        if len(value) > _MAX_SIZE:
-          msg = ("Value '%s' has a length of %s bytes, but only up to %s are"
-                 " allowed" % (name, len(value), _MAX_SIZE))
-          raise errors.ConfigurationError(msg)
-
-        utils.WriteFile(self.KeyToFilename(name), data=value,
+        if file_data.get(name) != value:
+          utils.WriteFile(self.KeyToFilename(name), data=value,
+                          mode=constants.SS_FILE_PERMS,
+                          dry_run=dry_run)
+          files_written = True
+
+      # The snapshot must stay newer than the individual files, otherwise
+      # readers would keep using the latter
+      if snapshot is None:
+        write_snapshot = bool(new_values)
+      else:
+        write_snapshot = (files_written or new_values != snapshot_values)
+
+      if write_snapshot:
+        utils.WriteFile(self.GetSnapshotFilename(),
+                        data=serializer.DumpJson({
+                          "version": _SNAPSHOT_VERSION,
+                          "serial": serial + 1,
+                          "values": new_values,
+                          }),
                         mode=constants.SS_FILE_PERMS,
                         dry_run=dry_run)
     finally:
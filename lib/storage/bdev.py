@@ -38,6 +38,7 @@ from ganeti import serializer
 from ganeti.storage import base
 from ganeti.storage import drbd
 from ganeti.storage import filestorage
+from ganeti.storage import lvm_inventory
 
 
 class RbdShowmappedJsonError(Exception):
@@ -58,6 +59,20 @@ def _CheckResult(result):
                     result.cmd, result.fail_reason, result.output)
 
 
+def _RunLvmCmd(cmd):
+  """Runs a command changing LVM objects.
+
+  The LVM inventory is invalidated afterwards, even if the command failed.
+
+  @rtype: L{utils.RunResult}
+
+  """
+  try:
+    return utils.RunCmd(cmd)
+  finally:
+    lvm_inventory.Invalidate()
+
+
 class LogicalVolume(base.BlockDev):
   """Logical Volume block device.
 
@@ -133,6 +148,8 @@ class LogicalVolume(base.BlockDev):
     vg_name, lv_name = unique_id
     cls._ValidateName(vg_name)
     cls._ValidateName(lv_name)
+    # Allocation must be based on current information
+    lvm_inventory.Invalidate()
     pvs_info = cls.GetPVInfo([vg_name])
     if not pvs_info:
       if excl_stor:
@@ -199,7 +216,7 @@ class LogicalVolume(base.BlockDev):
     # stripes
     cmd = ["lvcreate", "-L%dm" % size, "-n%s" % lv_name]
     for stripes_arg in range(stripes, 0, -1):
-      result = utils.RunCmd(cmd + ["-i%d" % stripes_arg] + [vg_name] + pvlist)
+      result = _RunLvmCmd(cmd + ["-i%d" % stripes_arg] + [vg_name] + pvlist)
       if not result.failed:
         break
     if result.failed:
@@ -209,36 +226,23 @@ class LogicalVolume(base.BlockDev):
 
   @staticmethod
   def _GetVolumeInfo(lvm_cmd, fields):
-    """Returns LVM Volume infos using lvm_cmd
+    """Returns LVM Volume infos from the LVM inventory
 
     @param lvm_cmd: Should be one of "pvs", "vgs" or "lvs"
-    @param fields: Fields to return
-    @return: A list of dicts each with the parsed fields
+    @param fields: Fields to return, must be part of the inventory's report
+    @return: A list of lists each with the requested fields
 
     """
     if not fields:
       raise errors.ProgrammerError("No fields specified")
 
-    sep = "|"
-    cmd = [lvm_cmd, "--noheadings", "--nosuffix", "--units=m", "--unbuffered",
-           "--separator=%s" % sep, "-o%s" % ",".join(fields)]
+    missing = set(fields) - set(lvm_inventory.REPORT_FIELDS[lvm_cmd])
+    if missing:
+      raise errors.ProgrammerError("Fields not in the %s report: %s" %
+                                   (lvm_cmd, utils.CommaJoin(missing)))
 
-    result = utils.RunCmd(cmd)
-    if result.failed:
-      raise errors.CommandError("Can't get the volume information: %s - %s" %
-                                (result.fail_reason, result.output))
-
-    data = []
-    for line in result.stdout.splitlines():
-      splitted_fields = line.strip().split(sep)
-
-      if len(fields) != len(splitted_fields):
-        raise errors.CommandError("Can't parse %s output: line '%s'" %
-                                  (lvm_cmd, line))
-
-      data.append(splitted_fields)
-
-    return data
+    return [[row[field] for field in fields]
+            for row in lvm_inventory.GetReport(lvm_cmd)]
 
   @classmethod
   def GetPVInfo(cls, vg_names, filter_allocatable=True, include_lvs=False):
@@ -252,25 +256,19 @@ class LogicalVolume(base.BlockDev):
     @return: list of objects.LvmPvInfo objects
 
     """
-    # We request "lv_name" field only if we care about LVs, so we don't get
-    # a long list of entries with many duplicates unless we really have to.
-    # The duplicate "pv_name" field will be ignored.
-    if include_lvs:
-      lvfield = "lv_name"
-    else:
-      lvfield = "pv_name"
+    # The inventory always reports the "lv_name" field, it's only used if we
+    # care about LVs
     try:
       info = cls._GetVolumeInfo("pvs", ["pv_name", "vg_name", "pv_free",
-                                        "pv_attr", "pv_size", lvfield])
+                                        "pv_attr", "pv_size", "lv_name"])
     except errors.GenericError, err:
       logging.error("Can't get PV information: %s", err)
       return None
 
-    # When asked for LVs, "pvs" may return multiple entries for the same PV-LV
-    # pair. We sort entries by PV name and then LV name, so it's easy to weed
-    # out duplicates.
-    if include_lvs:
-      info.sort(key=(lambda i: (i[0], i[5])))
+    # The report contains one entry per PV segment, so there may be multiple
+    # entries for the same PV or PV-LV pair. We sort entries by PV name and
+    # then LV name, so it's easy to weed out duplicates.
+    info.sort(key=(lambda i: (i[0], i[5])))
     data = []
     lastpvi = None
     for (pv_name, vg_name, pv_free, pv_attr, pv_size, lv_name) in info:
@@ -400,8 +398,8 @@ class LogicalVolume(base.BlockDev):
     if not self.minor and not self.Attach():
       # the LV does not exist
       return
-    result = utils.RunCmd(["lvremove", "-f", "%s/%s" %
-                           (self._vg_name, self._lv_name)])
+    result = _RunLvmCmd(["lvremove", "-f", "%s/%s" %
+                         (self._vg_name, self._lv_name)])
     if result.failed:
       base.ThrowError("Can't lvremove: %s - %s",
                       result.fail_reason, result.output)
@@ -417,7 +415,7 @@ class LogicalVolume(base.BlockDev):
       raise errors.ProgrammerError("Can't move a logical volume across"
                                    " volume groups (from %s to to %s)" %
                                    (self._vg_name, new_vg))
-    result = utils.RunCmd(["lvrename", new_vg, self._lv_name, new_name])
+    result = _RunLvmCmd(["lvrename", new_vg, self._lv_name, new_name])
     if result.failed:
       base.ThrowError("Failed to rename the logical volume: %s", result.output)
     self._lv_name = new_name
@@ -524,7 +522,7 @@ class LogicalVolume(base.BlockDev):
     (also possibly after disk issues).
 
     """
-    result = utils.RunCmd(["lvchange", "-ay", self.dev_path])
+    result = _RunLvmCmd(["lvchange", "-ay", self.dev_path])
     if result.failed:
       base.ThrowError("Can't activate lv %s: %s", self.dev_path, result.output)
 
@@ -600,6 +598,8 @@ class LogicalVolume(base.BlockDev):
     snap = LogicalVolume((self._vg_name, snap_name), None, size, self.params)
     base.IgnoreError(snap.Remove)
 
+    # The free space must be current
+    lvm_inventory.Invalidate()
     vg_info = self.GetVGInfo([self._vg_name], False)
     if not vg_info:
       base.ThrowError("Can't compute VG info for vg %s", self._vg_name)
@@ -608,8 +608,8 @@ class LogicalVolume(base.BlockDev):
       base.ThrowError("Not enough free space: required %s,"
                       " available %s", size, free_size)
 
-    _CheckResult(utils.RunCmd(["lvcreate", "-L%dm" % size, "-s",
-                               "-n%s" % snap_name, self.dev_path]))
+    _CheckResult(_RunLvmCmd(["lvcreate", "-L%dm" % size, "-s",
+                             "-n%s" % snap_name, self.dev_path]))
 
     return (self._vg_name, snap_name)
 
@@ -679,6 +679,7 @@ class LogicalVolume(base.BlockDev):
     if dryrun:
       cmd.append("--test")
     if excl_stor:
+      lvm_inventory.Invalidate()
       free_space = self._GetGrowthAvaliabilityExclStor()
       # amount is in KiB, free_space in MiB
       if amount > free_space * 1024:
@@ -695,8 +696,8 @@ class LogicalVolume(base.BlockDev):
     # they have less constraints); also note that only recent LVM
     # supports 'cling'
     for alloc_policy in "contiguous", "cling", "normal":
-      result = utils.RunCmd(cmd + ["--alloc", alloc_policy, self.dev_path] +
-                            pvlist)
+      result = _RunLvmCmd(cmd + ["--alloc", alloc_policy, self.dev_path] +
+                          pvlist)
       if not result.failed:
         return
     base.ThrowError("Can't grow LV %s: %s", self.dev_path, result.output)
@@ -989,10 +990,20 @@ class RADOSBlockDevice(base.BlockDev):
   the rbd kernel driver, the RADOS Tools and a working RADOS cluster for
   this to be functional.
 
+  If the disk is accessed in userspace (the hypervisor opens the volume
+  directly through librbd), the volume is not mapped into the kernel when
+  attaching; this only happens on L{Open}, i.e. when the node itself needs
+  to do I/O on the device (OS scripts, exports, wipes).
+
   """
-  def __init__(self, unique_id, children, size, params):
+  def __init__(self, unique_id, children, size, params, attach=True):
     """Attaches to an rbd device.
 
+    @type attach: boolean
+    @param attach: whether to attach to the device; objects which aren't
+        attached can only be used for operations on the volume done by the
+        rbd tool, e.g. snapshots and diffs
+
     """
     super(RADOSBlockDevice, self).__init__(unique_id, children, size, params)
     if not isinstance(unique_id, (tuple, list)) or len(unique_id) != 2:
@@ -1000,9 +1011,12 @@ class RADOSBlockDevice(base.BlockDev):
 
     self.driver, self.rbd_name = unique_id
     self.rbd_pool = params[constants.LDP_POOL]
+    self.userspace = (params.get(constants.LDP_ACCESS) ==
+                      constants.DISK_USERSPACE)
 
     self.major = self.minor = None
-    self.Attach()
+    if attach:
+      self.Attach()
 
   @classmethod
   def Create(cls, unique_id, children, size, spindles, params, excl_stor):
@@ -1061,11 +1075,26 @@ class RADOSBlockDevice(base.BlockDev):
     """Attach to an existing rbd device.
 
     This method maps the rbd volume that matches our name with
-    an rbd device and then attaches to this device.
+    an rbd device and then attaches to this device. For userspace
+    access no mapping is done, see L{Open}.
 
     """
     self.attached = False
 
+    if not self.userspace and not self._MapToKernel():
+      return False
+
+    self.attached = True
+
+    return True
+
+  def _MapToKernel(self):
+    """Maps the rbd volume into the kernel and records its block device.
+
+    @rtype: boolean
+    @return: whether the volume was mapped to a valid block device
+
+    """
     # Map the rbd volume to a block device under /dev
     self.dev_path = self._MapVolumeToBlockdev(self.unique_id)
 
@@ -1081,7 +1110,6 @@ class RADOSBlockDevice(base.BlockDev):
 
     self.major = os.major(st.st_rdev)
     self.minor = os.minor(st.st_rdev)
-    self.attached = True
 
     return True
 
@@ -1294,8 +1322,11 @@ class RADOSBlockDevice(base.BlockDev):
   def Open(self, force=False):
     """Make the device ready for I/O.
 
+    For userspace access, this maps the volume into the kernel on demand.
+
     """
-    pass
+    if self.dev_path is None and not self._MapToKernel():
+      base.ThrowError("Can't map rbd volume %s for I/O", self.rbd_name)
 
   def Close(self):
     """Notifies that the device will no longer be used for I/O.
@@ -1303,6 +1334,28 @@ class RADOSBlockDevice(base.BlockDev):
     """
     pass
 
+  def GetActualSize(self):
+    """Return the actual disk size.
+
+    Unmapped volumes are queried through the rbd tool, so that this doesn't
+    require a kernel mapping.
+
+    """
+    assert self.attached, "BlockDevice not attached in GetActualSize()"
+    if self.dev_path is not None:
+      return super(RADOSBlockDevice, self).GetActualSize()
+
+    cmd = [constants.RBD_CMD, "info", "-p", self.rbd_pool, self.rbd_name,
+           "--format", "json"]
+    result = utils.RunCmd(cmd)
+    if result.failed:
+      base.ThrowError("rbd info failed (%s): %s",
+                      result.fail_reason, result.output)
+    try:
+      return int(serializer.LoadJson(result.output)["size"])
+    except (ValueError, TypeError, KeyError), err:
+      base.ThrowError("Failed to parse rbd info output: %s", str(err))
+
   def Grow(self, amount, dryrun, backingstore, excl_stor):
     """Grow the Volume.
 
@@ -1336,6 +1389,96 @@ class RADOSBlockDevice(base.BlockDev):
       base.ThrowError("rbd resize failed (%s): %s",
                       result.fail_reason, result.output)
 
+  def ListSnapshots(self):
+    """Returns the names of the volume's snapshots.
+
+    @rtype: list of strings
+
+    """
+    cmd = [constants.RBD_CMD, "snap", "ls", "-p", self.rbd_pool,
+           self.rbd_name, "--format", "json"]
+    result = utils.RunCmd(cmd)
+    if result.failed:
+      base.ThrowError("rbd snap ls failed (%s): %s",
+                      result.fail_reason, result.output)
+    try:
+      return [snap["name"] for snap in serializer.LoadJson(result.output)]
+    except (ValueError, TypeError, KeyError), err:
+      base.ThrowError("Failed to parse rbd snap ls output: %s", str(err))
+
+  def CreateSnapshot(self, snap_name):
+    """Creates a snapshot of the volume.
+
+    @type snap_name: string
+    @param snap_name: Name of the snapshot
+
+    """
+    cmd = [constants.RBD_CMD, "snap", "create", "-p", self.rbd_pool,
+           "--snap", snap_name, self.rbd_name]
+    result = utils.RunCmd(cmd)
+    if result.failed:
+      base.ThrowError("rbd snap create failed (%s): %s",
+                      result.fail_reason, result.output)
+
+  def RemoveSnapshot(self, snap_name):
+    """Removes a snapshot of the volume.
+
+    This method is idempotent, removing a snapshot which doesn't exist is
+    not an error.
+
+    @type snap_name: string
+    @param snap_name: Name of the snapshot
+
+    """
+    if snap_name not in self.ListSnapshots():
+      return
+
+    cmd = [constants.RBD_CMD, "snap", "rm", "-p", self.rbd_pool,
+           "--snap", snap_name, self.rbd_name]
+    result = utils.RunCmd(cmd)
+    if result.failed:
+      base.ThrowError("rbd snap rm failed (%s): %s",
+                      result.fail_reason, result.output)
+
+  def GetExportDiffCmd(self, snap_name, from_snap=None):
+    """Returns the command writing the volume's data as an rbd diff.
+
+    The diff is written to standard output. Only the extents allocated in
+    the volume, or changed since C{from_snap}, are included.
+
+    @type snap_name: string or None
+    @param snap_name: Snapshot to export, None for the volume itself
+    @type from_snap: string or None
+    @param from_snap: Snapshot the diff is based on, None for a full diff
+    @rtype: list of strings
+
+    """
+    if snap_name is None:
+      image = self.rbd_name
+    else:
+      image = "%s@%s" % (self.rbd_name, snap_name)
+
+    cmd = [constants.RBD_CMD, "export-diff", "-p", self.rbd_pool]
+    if from_snap is not None:
+      cmd.extend(["--from-snap", from_snap])
+    cmd.extend([image, "-"])
+
+    return cmd
+
+  def GetImportDiffCmd(self):
+    """Returns the command applying an rbd diff to the volume.
+
+    The diff is read from standard input. If it was exported from a
+    snapshot, a snapshot of the same name is created on the volume, so that
+    later diffs can be based on it. A diff based on a snapshot can only be
+    applied if the volume has that snapshot.
+
+    @rtype: list of strings
+
+    """
+    return [constants.RBD_CMD, "import-diff", "-p", self.rbd_pool, "-",
+            self.rbd_name]
+
   def GetUserspaceAccessUri(self, hypervisor):
     """ For specific hypervisor type, return the disk URI for userspace
     access.
@@ -37,6 +37,7 @@ import logging
 from ganeti import errors
 from ganeti import constants
 from ganeti import utils
+from ganeti.storage import lvm_inventory
 
 
 def _ParseSize(value):
@@ -183,20 +184,52 @@ class _LvmBase(_Base): # pylint: disable=W0223
     # Get needed LVM fields
     lvm_fields = self._GetLvmFields(self.LIST_FIELDS, wanted_field_names)
 
-    # Build LVM command
-    cmd_args = self._BuildListCommand(self.LIST_COMMAND, self.LIST_SEP,
-                                      lvm_fields, name)
+    if name is None:
+      # Listing everything is served from the LVM inventory
+      rows = self._GetInventoryList(self.LIST_COMMAND, lvm_fields)
+    else:
+      # Build LVM command
+      cmd_args = self._BuildListCommand(self.LIST_COMMAND, self.LIST_SEP,
+                                        lvm_fields, name)
 
-    # Run LVM command
-    cmd_result = self._RunListCommand(cmd_args)
+      # Run LVM command
+      cmd_result = self._RunListCommand(cmd_args)
 
-    # Split and rearrange LVM command output
-    return self._BuildList(self._SplitList(cmd_result, self.LIST_SEP,
-                                           len(lvm_fields)),
-                           self.LIST_FIELDS,
-                           wanted_field_names,
+      # Split LVM command output
+      rows = self._SplitList(cmd_result, self.LIST_SEP, len(lvm_fields))
+
+    # Rearrange LVM output
+    return self._BuildList(rows, self.LIST_FIELDS, wanted_field_names,
                            lvm_fields)
 
+  @staticmethod
+  def _GetInventoryList(report_name, lvm_fields):
+    """Returns the wanted fields from the LVM inventory.
+
+    @type report_name: string
+    @param report_name: LVM inventory report name
+    @type lvm_fields: list
+    @param lvm_fields: Wanted LVM fields
+
+    """
+    try:
+      report = lvm_inventory.GetReport(report_name)
+    except errors.CommandError, err:
+      raise errors.StorageError("Failed to run %r: %s" % (report_name, err))
+
+    # The first field names the object; physical volumes are listed once per
+    # segment
+    name_field = lvm_inventory.REPORT_FIELDS[report_name][0]
+
+    seen = set()
+    rows = []
+    for row in report:
+      if row[name_field] not in seen:
+        seen.add(row[name_field])
+        rows.append([row[field] for field in lvm_fields])
+
+    return rows
+
   @staticmethod
   def _GetLvmFields(fields_def, wanted_field_names):
     """Returns unique list of fields wanted from LVM command.
@@ -382,6 +415,7 @@ class LvmPvStorage(_LvmBase): # pylint: disable=W0223
     args.append(name)
 
     result = utils.RunCmd(args)
+    lvm_inventory.Invalidate()
     if result.failed:
       raise errors.StorageError("Failed to modify physical volume,"
                                 " pvchange output: %s" %
@@ -458,7 +492,10 @@ class LvmVgStorage(_LvmBase):
 
     """
     if op == constants.SO_FIX_CONSISTENCY:
-      return self._RemoveMissing(name)
+      try:
+        return self._RemoveMissing(name)
+      finally:
+        lvm_inventory.Invalidate()
 
     return _LvmBase.Execute(self, name, op)
 
@@ -52,6 +52,11 @@ class DRBD8(object):
 
   _MAX_MINORS = 255
 
+  # Number of active users of the /proc/drbd snapshot and the snapshot
+  # itself, see L{CallWithProcInfoSnapshot}
+  _proc_info_users = 0
+  _proc_info = None
+
   @staticmethod
   def GetUsermodeHelper(filename=_USERMODE_HELPER_FILE):
     """Returns DRBD usermode_helper currently set.
@@ -79,11 +84,40 @@ class DRBD8(object):
   def GetProcInfo():
     """Reads and parses information from /proc/drbd.
 
+    While a snapshot is in use (see L{CallWithProcInfoSnapshot}), the file is
+    only read and parsed on the first call.
+
     @rtype: DRBD8Info
     @return: a L{DRBD8Info} instance containing the current /proc/drbd info
 
     """
-    return DRBD8Info.CreateFromFile()
+    if not DRBD8._proc_info_users:
+      return DRBD8Info.CreateFromFile()
+
+    if DRBD8._proc_info is None:
+      DRBD8._proc_info = DRBD8Info.CreateFromFile()
+
+    return DRBD8._proc_info
+
+  @staticmethod
+  def CallWithProcInfoSnapshot(fn, *args, **kwargs):
+    """Calls a function sharing one parsed copy of /proc/drbd.
+
+    All calls to L{GetProcInfo} made by the function return the same
+    information, read when it's first needed. This must only be used for
+    functions querying the state of DRBD devices, as changes made by the
+    function itself would not be seen. The snapshot is kept in the process,
+    which is fine as the node daemon handles each request in its own
+    process.
+
+    """
+    DRBD8._proc_info_users += 1
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      DRBD8._proc_info_users -= 1
+      if not DRBD8._proc_info_users:
+        DRBD8._proc_info = None
 
   @staticmethod
   def GetUsedDevs():
@@ -174,6 +208,11 @@ class DRBD8Dev(base.BlockDev):
   # timeout constants
   _NET_RECONFIG_TIMEOUT = 60
 
+  # Number of active users of the `drbdsetup show` snapshot and the snapshot
+  # itself, see L{CallWithShowDataSnapshot}
+  _show_data_users = 0
+  _show_data = None
+
   def __init__(self, unique_id, children, size, params):
     if children and children.count(None) > 0:
       children = []
@@ -295,6 +334,66 @@ class DRBD8Dev(base.BlockDev):
     """
     return self._show_info_cls.GetDevInfo(self._GetShowData(minor))
 
+  @staticmethod
+  def CallWithShowDataSnapshot(fn, *args, **kwargs):
+    """Calls a function sharing one `drbdsetup show` run for all minors.
+
+    Used when assembling many devices at once: instead of running `drbdsetup
+    show` for every device, the configuration of all minors is fetched with
+    a single command when first needed (if the DRBD version supports it)
+    and only the parts actually used are parsed. Each minor's data is used
+    at most once, for the initial check in L{_SlowAssemble}; checks after
+    changing a device always run `drbdsetup show` for it.
+
+    """
+    DRBD8Dev._show_data_users += 1
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      DRBD8Dev._show_data_users -= 1
+      if not DRBD8Dev._show_data_users:
+        DRBD8Dev._show_data = None
+
+  def _GetAllShowData(self):
+    """Return the `drbdsetup show` data for all minors.
+
+    @rtype: dict
+    @return: the show data per minor, empty if the DRBD version doesn't
+        support showing all minors at once or the command failed
+
+    """
+    cmd = self._cmd_gen.GenShowAllCmd()
+    if cmd is None:
+      return {}
+
+    result = utils.RunCmd(cmd)
+    if result.failed:
+      logging.error("Can't display the drbd config: %s - %s",
+                    result.fail_reason, result.output)
+      return {}
+
+    return self._show_info_cls.SplitShowData(result.stdout)
+
+  def _GetInitialShowInfo(self, minor):
+    """Return parsed information from `drbdsetup show` before changes.
+
+    Like L{_GetShowInfo}, but uses the data from the snapshot if one is in
+    use (see L{CallWithShowDataSnapshot}). The data is removed from the
+    snapshot, as the caller may change the device.
+
+    """
+    show_data = None
+
+    if DRBD8Dev._show_data_users:
+      if DRBD8Dev._show_data is None:
+        DRBD8Dev._show_data = self._GetAllShowData()
+      show_data = DRBD8Dev._show_data.pop(minor, None)
+
+    if show_data is None:
+      return self._GetShowInfo(minor)
+
+    return self._show_info_cls.GetDevInfo(show_data)
+
   def _MatchesLocal(self, info):
     """Test if our local config matches with an existing device.
 
@@ -811,7 +910,7 @@ class DRBD8Dev(base.BlockDev):
     # pylint: disable=W0631
     net_data = (self._lhost, self._lport, self._rhost, self._rport)
     for minor in (self._aminor,):
-      info = self._GetShowInfo(minor)
+      info = self._GetInitialShowInfo(minor)
       match_l = self._MatchesLocal(info)
       match_r = self._MatchesNet(info)
 
@@ -1039,6 +1138,28 @@ class DRBD8Dev(base.BlockDev):
     return cls(unique_id, children, size, params)
 
 
+def WithProcInfoSnapshot(fn):
+  """Decorator sharing one parsed copy of /proc/drbd during a call.
+
+  @see: L{DRBD8.CallWithProcInfoSnapshot}
+
+  """
+  def wrapper(*args, **kwargs):
+    return DRBD8.CallWithProcInfoSnapshot(fn, *args, **kwargs)
+  return wrapper
+
+
+def WithShowDataSnapshot(fn):
+  """Decorator sharing one `drbdsetup show` run during a call.
+
+  @see: L{DRBD8Dev.CallWithShowDataSnapshot}
+
+  """
+  def wrapper(*args, **kwargs):
+    return DRBD8Dev.CallWithShowDataSnapshot(fn, *args, **kwargs)
+  return wrapper
+
+
 def _CanReadDevice(path):
   """Check if we can read from the given device.
 
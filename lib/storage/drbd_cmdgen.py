@@ -41,6 +41,14 @@ class BaseDRBDCmdGenerator(object):
   def GenShowCmd(self, minor):
     raise NotImplementedError
 
+  def GenShowAllCmd(self):
+    """Returns the command showing the configuration of all minors.
+
+    @return: the command, or C{None} if not supported by the DRBD version
+
+    """
+    raise NotImplementedError
+
   def GenInitMetaCmd(self, minor, meta_dev):
     raise NotImplementedError
 
@@ -102,6 +110,9 @@ class DRBD83CmdGenerator(BaseDRBDCmdGenerator):
   def GenShowCmd(self, minor):
     return ["drbdsetup", self._DevPath(minor), "show"]
 
+  def GenShowAllCmd(self):
+    return None
+
   def GenInitMetaCmd(self, minor, meta_dev):
     return ["drbdmeta", "--force", self._DevPath(minor),
             "v08", meta_dev, "0", "create-md"]
@@ -304,6 +315,9 @@ class DRBD84CmdGenerator(BaseDRBDCmdGenerator):
   def GenShowCmd(self, minor):
     return ["drbdsetup", "show", minor]
 
+  def GenShowAllCmd(self):
+    return ["drbdsetup", "show"]
+
   def GenInitMetaCmd(self, minor, meta_dev):
     return ["drbdmeta", "--force", self._DevPath(minor),
             "v08", meta_dev, "flex-external", "create-md"]
@@ -162,6 +162,9 @@ class DRBD8Info(object):
     self._version = self._ParseVersion(lines)
     self._minors, self._line_per_minor = self._JoinLinesPerMinor(lines)
 
+    # Parsed status per minor, filled on demand
+    self._status_per_minor = {}
+
   def GetVersion(self):
     """Return the DRBD version.
 
@@ -206,7 +209,20 @@ class DRBD8Info(object):
     return minor in self._line_per_minor
 
   def GetMinorStatus(self, minor):
-    return DRBD8Status(self._line_per_minor[minor])
+    """Returns the status of a minor.
+
+    The status is only parsed once per minor.
+
+    @type minor: int
+    @rtype: L{DRBD8Status}
+
+    """
+    try:
+      return self._status_per_minor[minor]
+    except KeyError:
+      status = DRBD8Status(self._line_per_minor[minor])
+      self._status_per_minor[minor] = status
+      return status
 
   def _ParseVersion(self, lines):
     first_line = lines[0].strip()
@@ -356,6 +372,22 @@ class BaseShowInfo(object):
   def _TransformParseResult(cls, parse_result):
     raise NotImplementedError
 
+  @classmethod
+  def SplitShowData(cls, show_data):
+    """Splits the `drbdsetup show` output for all minors.
+
+    The data is only split, not parsed; the parts can be passed to
+    L{GetDevInfo} individually.
+
+    @type show_data: string
+    @param show_data: output of the command returned by
+        L{drbd_cmdgen.BaseDRBDCmdGenerator.GenShowAllCmd}
+    @rtype: dict
+    @return: dictionary containing the show data per minor
+
+    """
+    raise NotImplementedError
+
   @classmethod
   def _GetShowParser(cls):
     """Return a parser for `drbd show` output.
@@ -411,6 +443,9 @@ class DRBD83ShowInfo(BaseShowInfo):
 
 
 class DRBD84ShowInfo(BaseShowInfo):
+  _RESOURCE_RE = re.compile(r"^resource\s+\S+\s*\{", re.M)
+  _MINOR_RE = re.compile(r"^\s*device\s+minor\s+(\d+);", re.M)
+
   @classmethod
   def _ConstructShowParser(cls):
     # an entire section (sections can be nested in DRBD 8.4, and there exist
@@ -434,6 +469,24 @@ class DRBD84ShowInfo(BaseShowInfo):
 
     return resource
 
+  @classmethod
+  def SplitShowData(cls, show_data):
+    """Splits the `drbdsetup show` output for all minors.
+
+    Every resource starts with an unindented "resource" line and is assigned
+    to the minor(s) of its volumes.
+
+    """
+    starts = [m.start() for m in cls._RESOURCE_RE.finditer(show_data)]
+
+    result = {}
+    for (start, end) in zip(starts, starts[1:] + [len(show_data)]):
+      resource = show_data[start:end]
+      for minor in cls._MINOR_RE.findall(resource):
+        result[int(minor)] = resource
+
+    return result
+
   @classmethod
   def _TransformVolumeSection(cls, vol_content, retval):
     for entry in vol_content:
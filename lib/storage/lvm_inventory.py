@@ -0,0 +1,253 @@
+#
+#
+
+# Copyright (C) 2014 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Cached inventory of LVM physical volumes, volume groups and volumes.
+
+Running C{lvs}, C{vgs} or C{pvs} is slow on nodes with many logical
+volumes, and a single cluster verification or node query used to run them
+several times with different options. This module runs one report per kind
+of object, with all the fields needed by the node daemon, and shares it
+between all users for up to L{constants.LVM_INVENTORY_TTL} seconds. Since
+the node daemon forks for every request, reports are also kept in
+L{pathutils.LVM_INVENTORY_FILE}.
+
+Every operation changing logical volumes, volume groups or physical volumes
+must call L{Invalidate} once the change has been made. Reports started
+before the last invalidation are never used.
+
+"""
+
+import time
+import errno
+import logging
+
+from ganeti import constants
+from ganeti import errors
+from ganeti import pathutils
+from ganeti import serializer
+from ganeti import utils
+
+
+REPORT_LVS = "lvs"
+REPORT_VGS = "vgs"
+REPORT_PVS = "pvs"
+
+#: Fields included in each report; reports of logical and physical volumes
+#: contain one row per segment, i.e. objects can be listed more than once
+REPORT_FIELDS = {
+  REPORT_LVS: ["vg_name", "lv_name", "lv_size", "lv_attr", "devices"],
+  REPORT_VGS: ["vg_name", "vg_size", "vg_free", "vg_attr"],
+  REPORT_PVS: ["pv_name", "vg_name", "pv_size", "pv_free", "pv_used",
+               "pv_attr", "lv_name"],
+  }
+
+_SEP = "|"
+
+
+class LvmInventory(object):
+  """Cache for LVM reports.
+
+  """
+  def __init__(self, filename=pathutils.LVM_INVENTORY_FILE,
+               stamp_filename=pathutils.LVM_INVENTORY_STAMP_FILE,
+               ttl=constants.LVM_INVENTORY_TTL,
+               _run_cmd_fn=utils.RunCmd, _time_fn=time.time):
+    """Initializes this class.
+
+    @type filename: string
+    @param filename: File to share reports with other processes
+    @type stamp_filename: string
+    @param stamp_filename: File containing the time of the last invalidation
+    @type ttl: number
+    @param ttl: For how long reports are used, in seconds
+
+    """
+    self._filename = filename
+    self._stamp_filename = stamp_filename
+    self._ttl = ttl
+    self._run_cmd_fn = _run_cmd_fn
+    self._time_fn = _time_fn
+
+    # Reports used by this process, as (start time, rows)
+    self._reports = {}
+
+  def _ReadStamp(self):
+    """Returns the time of the last invalidation.
+
+    """
+    try:
+      return float(utils.ReadFile(self._stamp_filename))
+    except EnvironmentError, err:
+      if err.errno == errno.ENOENT:
+        return 0.0
+      logging.error("Can't read LVM inventory stamp file %s: %s",
+                    self._stamp_filename, err)
+    except ValueError, err:
+      logging.error("Invalid LVM inventory stamp file %s: %s",
+                    self._stamp_filename, err)
+
+    # Don't use any report
+    return self._time_fn()
+
+  def _IsValid(self, report, stamp, now):
+    """Checks whether a report can be used.
+
+    """
+    if not report:
+      return False
+
+    (start, _) = report
+
+    return stamp < start <= now < start + self._ttl
+
+  def _LoadFile(self):
+    """Loads the reports shared by other processes.
+
+    @rtype: dict
+    @return: reports by name
+
+    """
+    try:
+      data = serializer.LoadJson(utils.ReadFile(self._filename))
+      return dict((name, (float(start), rows))
+                  for (name, (start, rows)) in data.items()
+                  if name in REPORT_FIELDS)
+    except EnvironmentError, err:
+      if err.errno != errno.ENOENT:
+        logging.warning("Can't read LVM inventory file %s: %s",
+                        self._filename, err)
+    except (ValueError, TypeError, AttributeError), err:
+      logging.warning("Invalid LVM inventory file %s: %s", self._filename, err)
+
+    return {}
+
+  def _SaveReport(self, name, report, stamp, now):
+    """Shares a report with other processes.
+
+    """
+    reports = dict((other_name, other)
+                   for (other_name, other) in self._LoadFile().items()
+                   if self._IsValid(other, stamp, now))
+    reports[name] = report
+
+    try:
+      utils.WriteFile(self._filename, data=serializer.DumpJson(reports),
+                      mode=0600)
+    except EnvironmentError, err:
+      logging.warning("Can't write LVM inventory file %s: %s",
+                      self._filename, err)
+
+  def _RunReport(self, name):
+    """Runs an LVM report command.
+
+    @rtype: list of lists
+    @return: field values for each row
+
+    """
+    fields = REPORT_FIELDS[name]
+
+    result = self._run_cmd_fn([name, "--noheadings", "--nosuffix",
+                               "--units=m", "--unbuffered",
+                               "--separator=%s" % _SEP,
+                               "-o%s" % ",".join(fields)])
+    if result.failed:
+      raise errors.CommandError("Can't get the volume information: %s - %s" %
+                                (result.fail_reason, result.output))
+
+    rows = []
+    for line in result.stdout.splitlines():
+      values = [value.strip() for value in line.strip().split(_SEP)]
+      if len(values) != len(fields):
+        logging.error("Invalid line returned from %s: '%s'", name, line)
+        continue
+      rows.append(values)
+
+    return rows
+
+  def GetReport(self, name):
+    """Returns an LVM report.
+
+    @type name: string
+    @param name: one of L{REPORT_LVS}, L{REPORT_VGS} and L{REPORT_PVS}
+    @rtype: list of dicts
+    @return: the fields given in L{REPORT_FIELDS} for each row
+    @raise errors.CommandError: if the report command fails
+
+    """
+    fields = REPORT_FIELDS[name]
+
+    now = self._time_fn()
+    stamp = self._ReadStamp()
+
+    report = self._reports.get(name)
+
+    if not self._IsValid(report, stamp, now):
+      report = self._LoadFile().get(name)
+
+      if not self._IsValid(report, stamp, now):
+        report = (now, self._RunReport(name))
+        self._SaveReport(name, report, stamp, now)
+
+      self._reports[name] = report
+
+    (_, rows) = report
+
+    return [dict(zip(fields, values)) for values in rows]
+
+  def Invalidate(self):
+    """Discards all reports made until now.
+
+    """
+    self._reports.clear()
+
+    try:
+      utils.WriteFile(self._stamp_filename,
+                      data="%.6f\n" % self._time_fn(), mode=0600)
+    except EnvironmentError, err:
+      logging.error("Can't write LVM inventory stamp file %s: %s",
+                    self._stamp_filename, err)
+      try:
+        utils.RemoveFile(self._filename)
+      except EnvironmentError, err:
+        logging.error("Can't remove LVM inventory file %s: %s",
+                      self._filename, err)
+
+
+_INVENTORY = LvmInventory()
+
+
+def GetReport(name):
+  """Returns an LVM report.
+
+  @see: L{LvmInventory.GetReport}
+
+  """
+  return _INVENTORY.GetReport(name)
+
+
+def Invalidate():
+  """Discards all LVM reports made until now.
+
+  Must be called after changing logical volumes, volume groups or physical
+  volumes.
+
+  """
+  _INVENTORY.Invalidate()
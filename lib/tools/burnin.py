@@ -594,10 +594,17 @@ class Burner(object):
                  islice(cycle(self.nodes), 1, None),
                  self.instances)
 
+    # Parallel creations using an iallocator are placed all at once
+    multi_alloc = bool(self.opts.iallocator and self.opts.parallel)
+    multi_alloc_ops = []
+
     Log("Creating instances")
     for pnode, snode, instance in mytor:
       Log("instance %s", instance, indent=1)
-      if self.opts.iallocator:
+      if multi_alloc:
+        pnode = snode = None
+        msg = "with iallocator %s (multi-allocation)" % self.opts.iallocator
+      elif self.opts.iallocator:
         pnode = snode = None
         msg = "with iallocator %s" % self.opts.iallocator
       elif self.opts.disk_template not in constants.DTS_INT_MIRROR:
@@ -623,15 +630,61 @@ class Burner(object):
                                     wait_for_sync=True,
                                     file_driver="loop",
                                     file_storage_dir=None,
-                                    iallocator=self.opts.iallocator,
+                                    iallocator=(None if multi_alloc else
+                                                self.opts.iallocator),
                                     beparams=self.bep,
                                     hvparams=self.hvp,
                                     hypervisor=self.hypervisor,
                                     osparams=self.opts.osparams,
                                     )
+      if multi_alloc:
+        multi_alloc_ops.append(op)
+        continue
       remove_instance = lambda name: lambda: self.to_rem.append(name)
       self.ExecOrQueue(instance, [op], post_process=remove_instance(instance))
 
+    if multi_alloc_ops:
+      self.ExecMultiAlloc(multi_alloc_ops)
+
+  def ExecMultiAlloc(self, ops):
+    """Places instances with one iallocator run and waits for their creation.
+
+    @type ops: list of L{opcodes.OpInstanceCreate}
+    @param ops: the instance creation opcodes, without nodes or iallocator
+
+    """
+    cli.SetGenericOpcodeOpts(ops, self.opts)
+    op = opcodes.OpInstanceMultiAlloc(iallocator=self.opts.iallocator,
+                                      instances=ops)
+    result = self.ExecOp(False, op)
+
+    failed = result[opcodes.OpInstanceMultiAlloc.FAILED_KEY]
+    if failed:
+      Log("Allocation failed for instances: %s", utils.CommaJoin(failed))
+      raise BurninFailure()
+
+    self.ClearFeedbackBuf()
+    jex = cli.JobExecutor(cl=self.cl, feedback_fn=self.Feedback)
+    names = result[opcodes.OpInstanceMultiAlloc.ALLOCATABLE_KEY]
+    for (name, (status, job_id)) in zip(names,
+                                        result[constants.JOB_IDS_KEY]):
+      jex.AddJobId(name, status, job_id)
+    try:
+      results = jex.GetResults()
+    except Exception, err: # pylint: disable=W0703
+      Log("Jobs failed: %s", err)
+      raise BurninFailure()
+
+    fail = False
+    for (name, (success, _)) in zip(names, results):
+      if success:
+        self.to_rem.append(name)
+      else:
+        fail = True
+
+    if fail:
+      raise BurninFailure()
+
   @_DoBatch(False)
   def BurnModifyRuntimeMemory(self):
     """Alter the runtime memory."""
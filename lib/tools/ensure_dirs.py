@@ -156,7 +156,7 @@ def GetPaths():
     ]
 
   ss = ssconf.SimpleStore()
-  for ss_path in ss.GetFileList():
+  for ss_path in ss.GetFileList() + [ss.GetSnapshotFilename()]:
     paths.append((ss_path, FILE, constants.SS_FILE_PERMS,
                   getent.noded_uid, getent.noded_gid, False))
 
@@ -83,8 +83,9 @@ def Main():
       (pathutils.CLUSTER_DOMAIN_SECRET_FILE, True),
       ]
     clean_files.extend(map(lambda s: (s, True), pathutils.ALL_CERT_FILES))
+    ss = ssconf.SimpleStore()
     clean_files.extend(map(lambda s: (s, False),
-                           ssconf.SimpleStore().GetFileList()))
+                           ss.GetFileList() + [ss.GetSnapshotFilename()]))
 
     if not opts.yes_do_it:
       cli.ToStderr("Cleaning a node is irreversible. If you really want to"
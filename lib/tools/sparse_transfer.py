@@ -0,0 +1,130 @@
+#
+#
+
+# Copyright (C) 2014 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+"""Tool to read or write disks as sparse streams.
+
+Used by the import/export daemon for sparse transfers, see
+L{ganeti.impexpd.sparse}. When encoding, the stream is written to standard
+output; when decoding, it is read from standard input.
+
+"""
+
+import os
+import stat
+import sys
+import logging
+import optparse
+
+from ganeti import constants
+from ganeti import errors
+from ganeti import utils
+from ganeti.impexpd import sparse
+
+
+MODE_ENCODE = "encode"
+MODE_DECODE = "decode"
+
+_MEBIBYTE = 1024 * 1024
+
+
+def ParseOptions():
+  """Parses the options passed to the program.
+
+  @return: Options and arguments
+
+  """
+  parser = optparse.OptionParser(usage=("%%prog [--debug] {%s|%s} <path>" %
+                                        (MODE_ENCODE, MODE_DECODE)),
+                                 prog=os.path.basename(sys.argv[0]))
+  parser.add_option("--debug", dest="debug", action="store_true",
+                    help="Enable debug messages")
+  parser.add_option("--offset", dest="offset", action="store", type="int",
+                    default=None,
+                    help=("Offset of the transferred range in mebibytes"
+                          " (default: whole file)"))
+  parser.add_option("--size", dest="size", action="store", type="int",
+                    default=None,
+                    help="Number of mebibytes to encode (default: all)")
+  parser.add_option("--create", dest="create", action="store_true",
+                    default=False,
+                    help="Create the output file if it doesn't exist")
+
+  (opts, args) = parser.parse_args()
+
+  if len(args) != 2 or args[0] not in (MODE_ENCODE, MODE_DECODE):
+    parser.error("Expected mode and path")
+
+  return (opts, args)
+
+
+def _Encode(path, offset, size):
+  """Encodes a file or block device to standard output.
+
+  """
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    if size is not None:
+      size *= _MEBIBYTE
+    return sparse.Encode(fd, sys.stdout, offset=(offset or 0) * _MEBIBYTE,
+                         size=size)
+  finally:
+    os.close(fd)
+
+
+def _Decode(path, offset, create):
+  """Decodes standard input to a file or block device.
+
+  """
+  flags = os.O_WRONLY
+  if create:
+    flags |= os.O_CREAT
+
+  fd = os.open(path, flags, 0600)
+  try:
+    if offset is None and stat.S_ISREG(os.fstat(fd).st_mode):
+      # Holes are only left by seeking, so start with an empty file; when
+      # only a range is written, other streams write the rest of the file
+      os.ftruncate(fd, 0)
+    return sparse.Decode(sys.stdin, fd, offset=(offset or 0) * _MEBIBYTE)
+  finally:
+    os.close(fd)
+
+
+def Main():
+  """Main routine.
+
+  """
+  (opts, (mode, path)) = ParseOptions()
+
+  utils.SetupToolLogging(opts.debug, False)
+
+  try:
+    if mode == MODE_ENCODE:
+      (data_bytes, hole_bytes) = _Encode(path, opts.offset, opts.size)
+    else:
+      (data_bytes, hole_bytes) = _Decode(path, opts.offset, opts.create)
+  except (EnvironmentError, errors.GenericError), err:
+    logging.error("Sparse %s of %s failed: %s", mode, path, err)
+    return constants.EXIT_FAILURE
+
+  logging.info("Sparse %s of %s: %s bytes of data, %s bytes in holes",
+               mode, path, data_bytes, hole_bytes)
+
+  return constants.EXIT_SUCCESS
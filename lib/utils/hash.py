@@ -24,8 +24,18 @@
 
 import os
 import hmac
+import stat
+import time
+import errno
+import logging
 
 from ganeti import compat
+from ganeti.utils import io as utils_io
+
+
+#: Files changed less than this many seconds ago are not cached, as further
+#: changes may not update their timestamps
+_FINGERPRINT_CACHE_MIN_AGE = 2.0
 
 
 def Sha1Hmac(key, text, salt=None):
@@ -92,11 +102,65 @@ def _FingerprintFile(filename):
   return fp.hexdigest()
 
 
-def FingerprintFiles(files):
+def _ReadFingerprintCache(cache_file):
+  """Reads cached file fingerprints.
+
+  Each line contains a fingerprint, the device, inode, size, modification
+  and change times of the file it was computed for and the file's name.
+
+  @rtype: dict
+  @return: (file ID, fingerprint) by file name
+
+  """
+  try:
+    data = utils_io.ReadFile(cache_file)
+  except EnvironmentError, err:
+    if err.errno != errno.ENOENT:
+      logging.warning("Can't read fingerprint cache %s: %s", cache_file, err)
+    return {}
+
+  cache = {}
+  for line in data.splitlines():
+    try:
+      (cksum, dev, ino, size, mtime, ctime, filename) = line.split(" ", 6)
+      file_id = (int(dev), int(ino), int(size), float(mtime), float(ctime))
+    except ValueError:
+      logging.warning("Invalid line in fingerprint cache %s: '%s'",
+                      cache_file, line)
+      continue
+    cache[filename] = (file_id, cksum)
+
+  return cache
+
+
+def _WriteFingerprintCache(cache_file, cache):
+  """Writes cached file fingerprints.
+
+  @see: L{_ReadFingerprintCache}
+
+  """
+  data = "".join("%s %d %d %d %r %r %s\n" %
+                 ((cksum, ) + file_id + (filename, ))
+                 for (filename, (file_id, cksum)) in sorted(cache.items())
+                 if "\n" not in filename)
+
+  try:
+    utils_io.WriteFile(cache_file, data=data, mode=0600)
+  except EnvironmentError, err:
+    logging.warning("Can't write fingerprint cache %s: %s", cache_file, err)
+
+
+def FingerprintFiles(files, cache_file=None, _time_fn=time.time):
   """Compute fingerprints for a list of files.
 
+  If a cache file is given, fingerprints are only computed for files whose
+  device, inode, size, modification or change time differ from the cached
+  ones, and the cache is updated afterwards.
+
   @type files: list
   @param files: the list of filename to fingerprint
+  @type cache_file: string
+  @param cache_file: file to keep the fingerprints of unchanged files in
   @rtype: dict
   @return: a dictionary filename: fingerprint, holding only
       existing files
@@ -104,9 +168,45 @@ def FingerprintFiles(files):
   """
   ret = {}
 
+  if cache_file is None:
+    for filename in files:
+      cksum = _FingerprintFile(filename)
+      if cksum:
+        ret[filename] = cksum
+
+    return ret
+
+  cache = _ReadFingerprintCache(cache_file)
+  new_cache = cache.copy()
+  min_time = _time_fn() - _FINGERPRINT_CACHE_MIN_AGE
+
   for filename in files:
-    cksum = _FingerprintFile(filename)
-    if cksum:
-      ret[filename] = cksum
+    new_cache.pop(filename, None)
+
+    try:
+      st = os.stat(filename)
+    except EnvironmentError:
+      continue
+
+    if not stat.S_ISREG(st.st_mode):
+      continue
+
+    file_id = (st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+
+    cached = cache.get(filename, None)
+    if cached is not None and cached[0] == file_id:
+      cksum = cached[1]
+    else:
+      cksum = _FingerprintFile(filename)
+      if not cksum:
+        continue
+
+    ret[filename] = cksum
+
+    if max(st.st_mtime, st.st_ctime) < min_time:
+      new_cache[filename] = (file_id, cksum)
+
+  if new_cache != cache:
+    _WriteFingerprintCache(cache_file, new_cache)
 
   return ret
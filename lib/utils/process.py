@@ -24,13 +24,16 @@
 
 
 import os
+import re
 import sys
+import time
 import subprocess
 import errno
 import select
 import logging
 import signal
 import resource
+import threading
 
 from cStringIO import StringIO
 
@@ -699,17 +702,89 @@ def _RunCmdFile(cmd, env, via_shell, output, cwd, noclose_fds):
   return status
 
 
-def RunParts(dir_name, env=None, reset_env=False):
+#: Leading order number of a script name, see L{RunParts}
+_RUNPARTS_ORDER_RE = re.compile(r"^(\d+)")
+
+
+def _RunPart(fname, env, reset_env, timeout):
+  """Runs a single script for L{RunParts}.
+
+  @rtype: tuple
+  @return: (one of RUNDIR_STATUS, RunResult or error message, run time in
+    seconds)
+
+  """
+  start = time.time()
+  try:
+    result = RunCmd([fname], env=env, reset_env=reset_env, timeout=timeout)
+  except Exception, err: # pylint: disable=W0703
+    (status, result) = (constants.RUNPARTS_ERR, str(err))
+  else:
+    status = constants.RUNPARTS_RUN
+
+  duration = time.time() - start
+
+  logging.info("RunParts: %s finished in %.3f seconds", fname, duration)
+
+  return (status, result, duration)
+
+
+def _GroupRunParts(names):
+  """Groups script names by their leading order number.
+
+  Consecutive names (in sorted order) with the same leading number form a
+  group; names without a leading number are a group on their own.
+
+  @type names: sorted list of strings
+  @rtype: list of lists
+
+  """
+  groups = []
+  prev_order = None
+
+  for name in names:
+    m = _RUNPARTS_ORDER_RE.match(name)
+    if m:
+      order = m.group(1)
+    else:
+      order = None
+
+    if groups and order is not None and order == prev_order:
+      groups[-1].append(name)
+    else:
+      groups.append([name])
+
+    prev_order = order
+
+  return groups
+
+
+def RunParts(dir_name, env=None, reset_env=False, timeout=None,
+             parallel=False, durations=None):
   """Run Scripts or programs in a directory
 
+  Scripts are run in sorted order. If C{parallel} is set, scripts sharing the
+  same leading order number (e.g. C{10-foo} and C{10-bar}) are considered
+  independent and run concurrently; scripts with different numbers are still
+  run one after the other.
+
   @type dir_name: string
   @param dir_name: absolute path to a directory
   @type env: dict
   @param env: The environment to use
   @type reset_env: boolean
   @param reset_env: whether to reset or keep the default os environment
+  @type timeout: int
+  @param timeout: if not None, timeout in seconds for each script
+  @type parallel: boolean
+  @param parallel: whether to run independent scripts concurrently
+  @type durations: dict
+  @param durations: if not None, the run time in seconds of each script which
+    was run is stored here by name
   @rtype: list of tuples
-  @return: list of (name, (one of RUNDIR_STATUS), RunResult)
+  @return: list of (name, (one of RUNDIR_STATUS), RunResult or error
+    message); the run times are not part of the result, but stored in
+    C{durations}
 
   """
   rr = []
@@ -720,18 +795,44 @@ def RunParts(dir_name, env=None, reset_env=False):
     logging.warning("RunParts: skipping %s (cannot list: %s)", dir_name, err)
     return rr
 
+  results = {}
+  runnable = []
+
   for relname in sorted(dir_contents):
     fname = utils_io.PathJoin(dir_name, relname)
     if not (constants.EXT_PLUGIN_MASK.match(relname) is not None and
             utils_wrapper.IsExecutable(fname)):
-      rr.append((relname, constants.RUNPARTS_SKIP, None))
+      results[relname] = (constants.RUNPARTS_SKIP, None)
     else:
-      try:
-        result = RunCmd([fname], env=env, reset_env=reset_env)
-      except Exception, err: # pylint: disable=W0703
-        rr.append((relname, constants.RUNPARTS_ERR, str(err)))
-      else:
-        rr.append((relname, constants.RUNPARTS_RUN, result))
+      runnable.append(relname)
+
+  if parallel:
+    groups = _GroupRunParts(runnable)
+  else:
+    groups = [[relname] for relname in runnable]
+
+  def _Run(relname):
+    (status, result, duration) = \
+      _RunPart(utils_io.PathJoin(dir_name, relname), env, reset_env, timeout)
+    results[relname] = (status, result)
+    if durations is not None:
+      durations[relname] = duration
+
+  for group in groups:
+    if len(group) == 1:
+      _Run(group[0])
+      continue
+
+    threads = [threading.Thread(target=_Run, args=(relname, ))
+               for relname in group]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+  for relname in sorted(dir_contents):
+    (status, result) = results[relname]
+    rr.append((relname, status, result))
 
   return rr
 
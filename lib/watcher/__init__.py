@@ -50,6 +50,7 @@ from ganeti import objects
 from ganeti import ssconf
 from ganeti import ht
 from ganeti import pathutils
+from ganeti import serializer
 
 import ganeti.rapi.client # pylint: disable=W0611
 from ganeti.rapi.client import UsesRapiClient
@@ -69,12 +70,26 @@ HELPLESS_STATES = compat.UniqueFrozenset([
 NOTICE = "NOTICE"
 ERROR = "ERROR"
 
-#: Number of seconds to wait between starting child processes for node groups
-CHILD_PROCESS_DELAY = 1.0
+#: Maximum number of per-group child processes (and therefore group
+#: verify-disks jobs) running at the same time
+MAX_CONCURRENT_CHILDREN = 4
+
+#: Maximum age in seconds of the group data written by the global watcher
+#: for it to be used by a per-group process
+GROUP_DATA_MAX_AGE = 120.0
+
+#: Fields queried for instances and nodes; the last field of each is the
+#: (primary) node group
+_INSTANCE_FIELDS = ["name", "status", "disks_active", "snodes",
+                    "snodes.group.uuid", "pnode.group.uuid"]
+_NODE_FIELDS = ["name", "bootid", "offline", "group.uuid"]
 
 #: How many seconds to wait for instance status file lock
 INSTANCE_STATUS_LOCK_TIMEOUT = 10.0
 
+#: Maximum number of instance restart or disk activation jobs submitted at once
+MAX_CONCURRENT_JOBS = 20
+
 
 class NotMasterError(errors.GenericError):
   """Exception raised when this host is not the master."""
@@ -143,19 +158,17 @@ class Instance(object):
     self.disks_active = disks_active
     self.snodes = snodes
 
-  def Restart(self, cl):
+  def GetRestartOpCode(self):
     """Encapsulates the start of an instance.
 
     """
-    op = opcodes.OpInstanceStartup(instance_name=self.name, force=False)
-    cli.SubmitOpCode(op, cl=cl)
+    return opcodes.OpInstanceStartup(instance_name=self.name, force=False)
 
-  def ActivateDisks(self, cl):
+  def GetActivateDisksOpCode(self):
     """Encapsulates the activation of all disks of an instance.
 
     """
-    op = opcodes.OpInstanceActivateDisks(instance_name=self.name)
-    cli.SubmitOpCode(op, cl=cl)
+    return opcodes.OpInstanceActivateDisks(instance_name=self.name)
 
 
 class Node:
@@ -172,13 +185,61 @@ class Node:
     self.secondaries = secondaries
 
 
+def _RunInstanceJobs(cl, jobs, what):
+  """Runs independent per-instance jobs and waits for all of them.
+
+  The jobs are submitted in batches of at most L{MAX_CONCURRENT_JOBS} using
+  a single C{SubmitManyJobs} call each, so that they can run in parallel on
+  the master. All jobs of a batch are then polled together.
+
+  @type jobs: list of tuples; (instance name, opcode)
+  @param jobs: Instance names and the opcode to run for each of them
+  @type what: string
+  @param what: Description of the operation, used for logging
+  @rtype: dict
+  @return: Instance name as key, whether the job succeeded as value
+
+  """
+  result = {}
+
+  for start in range(0, len(jobs), MAX_CONCURRENT_JOBS):
+    batch = jobs[start:start + MAX_CONCURRENT_JOBS]
+
+    try:
+      submitted = cl.SubmitManyJobs([[op] for (_, op) in batch])
+    except Exception: # pylint: disable=W0703
+      logging.exception("Error while submitting jobs for %s of instance(s)"
+                        " %s", what, utils.CommaJoin(name for (name, _)
+                                                     in batch))
+      result.update((name, False) for (name, _) in batch)
+      continue
+
+    for ((name, _), (status, job_id)) in zip(batch, submitted):
+      if not status:
+        logging.error("Failed to submit job for %s of instance '%s': %s",
+                      what, name, job_id)
+        result[name] = False
+        continue
+
+      try:
+        cli.PollJob(job_id, cl=cl, feedback_fn=logging.debug)
+      except Exception: # pylint: disable=W0703
+        logging.exception("Error during %s of instance '%s' (job %s)",
+                          what, name, job_id)
+        result[name] = False
+      else:
+        result[name] = True
+
+  return result
+
+
 def _CheckInstances(cl, notepad, instances):
   """Make a pass over the list of instances, restarting downed ones.
 
   """
   notepad.MaintainInstanceList(instances.keys())
 
-  started = set()
+  restart_jobs = []
 
   for inst in instances.values():
     if inst.status in BAD_STATES:
@@ -195,16 +256,9 @@ def _CheckInstances(cl, notepad, instances):
                       " giving up", inst.name, MAXTRIES)
         continue
 
-      try:
-        logging.info("Restarting instance '%s' (attempt #%s)",
-                     inst.name, n + 1)
-        inst.Restart(cl)
-      except Exception: # pylint: disable=W0703
-        logging.exception("Error while restarting instance '%s'", inst.name)
-      else:
-        started.add(inst.name)
-
-      notepad.RecordRestartAttempt(inst.name)
+      logging.info("Restarting instance '%s' (attempt #%s)",
+                   inst.name, n + 1)
+      restart_jobs.append((inst.name, inst.GetRestartOpCode()))
 
     else:
       if notepad.NumberOfRestartAttempts(inst.name):
@@ -212,6 +266,14 @@ def _CheckInstances(cl, notepad, instances):
         if inst.status not in HELPLESS_STATES:
           logging.info("Restart of instance '%s' succeeded", inst.name)
 
+  started = set()
+
+  for (name, success) in _RunInstanceJobs(cl, restart_jobs,
+                                          "restart").items():
+    notepad.RecordRestartAttempt(name)
+    if success:
+      started.add(name)
+
   return started
 
 
@@ -235,6 +297,8 @@ def _CheckDisks(cl, notepad, nodes, instances, started):
       check_nodes.append(node)
 
   if check_nodes:
+    activate_jobs = []
+
     # Activate disks for all instances with any of the checked nodes as a
     # secondary node.
     for node in check_nodes:
@@ -258,12 +322,10 @@ def _CheckDisks(cl, notepad, nodes, instances, started):
                         " it was already started", inst.name)
           continue
 
-        try:
-          logging.info("Activating disks for instance '%s'", inst.name)
-          inst.ActivateDisks(cl)
-        except Exception: # pylint: disable=W0703
-          logging.exception("Error while activating disks for instance '%s'",
-                            inst.name)
+        logging.info("Activating disks for instance '%s'", inst.name)
+        activate_jobs.append((inst.name, inst.GetActivateDisksOpCode()))
+
+    _RunInstanceJobs(cl, activate_jobs, "disk activation")
 
     # Keep changed boot IDs
     for node in check_nodes:
@@ -515,23 +577,45 @@ def GetLuxiClient(try_restart):
     return cli.GetClient()
 
 
+def _WaitForChild(children):
+  """Waits for one of the given child processes to exit.
+
+  @type children: set
+  @param children: PIDs of running children, the exited child is removed
+
+  """
+  try:
+    (pid, status) = utils.RetryOnSignal(os.wait)
+  except EnvironmentError, err:
+    logging.debug("Waiting for children failed: %s", err)
+    children.clear()
+    return
+
+  if pid in children:
+    children.remove(pid)
+  logging.debug("Child PID %s exited with status %s", pid, status)
+
+
 def _StartGroupChildren(cl, wait):
   """Starts a new instance of the watcher for every node group.
 
+  At most L{MAX_CONCURRENT_CHILDREN} children run at the same time, so that
+  the group verify-disks jobs they submit don't overload the master.
+
   """
   assert not compat.any(arg.startswith(cli.NODEGROUP_OPT_NAME)
                         for arg in sys.argv)
 
   result = cl.QueryGroups([], ["name", "uuid"], False)
 
-  children = []
+  children = set()
 
-  for (idx, (name, uuid)) in enumerate(result):
+  for (name, uuid) in result:
     args = sys.argv + [cli.NODEGROUP_OPT_NAME, uuid]
 
-    if idx > 0:
+    while len(children) >= MAX_CONCURRENT_CHILDREN:
       # Let's not kill the system
-      time.sleep(CHILD_PROCESS_DELAY)
+      _WaitForChild(children)
 
     logging.debug("Spawning child for group '%s' (%s), arguments %s",
                   name, uuid, args)
@@ -544,17 +628,11 @@ def _StartGroupChildren(cl, wait):
                         name, uuid)
     else:
       logging.debug("Started with PID %s", pid)
-      children.append(pid)
+      children.add(pid)
 
   if wait:
-    for pid in children:
-      logging.debug("Waiting for child PID %s", pid)
-      try:
-        result = utils.RetryOnSignal(os.waitpid, pid, 0)
-      except EnvironmentError, err:
-        result = str(err)
-
-      logging.debug("Child PID %s exited with status %s", pid, result)
+    while children:
+      _WaitForChild(children)
 
 
 def _ArchiveJobs(cl, age):
@@ -613,29 +691,32 @@ def _GlobalWatcher(opts):
   _CheckMaster(client)
   _ArchiveJobs(client, opts.job_age)
 
+  # Query the data for all node groups at once, the child processes use it
+  try:
+    _WriteGroupsData(pathutils.WATCHER_GROUPS_DATA_FILE,
+                     _QueryGroupsData(client))
+  except Exception: # pylint: disable=W0703
+    logging.exception("Can't write node group data, node group processes"
+                      " will query it themselves")
+
   # Spawn child processes for all node groups
   _StartGroupChildren(client, opts.wait_children)
 
   return constants.EXIT_SUCCESS
 
 
-def _GetGroupData(cl, uuid):
-  """Retrieves instances and nodes per node group.
+def _QueryData(cl, instance_filter, node_filter):
+  """Queries instances and nodes in a single job.
+
+  @return: tuple of (raw instances, raw nodes), rows containing the values of
+    L{_INSTANCE_FIELDS} and L{_NODE_FIELDS} respectively
 
   """
   job = [
-    # Get all primary instances in group
-    opcodes.OpQuery(what=constants.QR_INSTANCE,
-                    fields=["name", "status", "disks_active", "snodes",
-                            "pnode.group.uuid", "snodes.group.uuid"],
-                    qfilter=[qlang.OP_EQUAL, "pnode.group.uuid", uuid],
-                    use_locking=True),
-
-    # Get all nodes in group
-    opcodes.OpQuery(what=constants.QR_NODE,
-                    fields=["name", "bootid", "offline"],
-                    qfilter=[qlang.OP_EQUAL, "group.uuid", uuid],
-                    use_locking=True),
+    opcodes.OpQuery(what=constants.QR_INSTANCE, fields=_INSTANCE_FIELDS,
+                    qfilter=instance_filter, use_locking=True),
+    opcodes.OpQuery(what=constants.QR_NODE, fields=_NODE_FIELDS,
+                    qfilter=node_filter, use_locking=True),
     ]
 
   job_id = cl.SubmitJob(job)
@@ -653,12 +734,106 @@ def _GetGroupData(cl, uuid):
                                  for values in res]
                                 for res in results_data]
 
+  return (raw_instances, raw_nodes)
+
+
+def _QueryGroupsData(cl):
+  """Retrieves instances and nodes of all node groups.
+
+  @rtype: dict
+  @return: group UUID as key, tuple of (raw instances, raw nodes) as value
+
+  """
+  (raw_instances, raw_nodes) = _QueryData(cl, None, None)
+
+  result = {}
+
+  for row in raw_instances:
+    result.setdefault(row[-1], ([], []))[0].append(row)
+
+  for row in raw_nodes:
+    result.setdefault(row[-1], ([], []))[1].append(row)
+
+  return result
+
+
+def _WriteGroupsData(filename, data):
+  """Writes the data of all node groups for the per-group processes.
+
+  @type filename: string
+  @param filename: Path to the data file
+  @type data: dict
+  @param data: Data as returned by L{_QueryGroupsData}
+
+  """
+  logging.debug("Writing data of %s node groups to '%s'", len(data), filename)
+
+  utils.WriteFile(filename, mode=0600,
+                  data=serializer.DumpJson({
+                    "timestamp": time.time(),
+                    "groups": data,
+                    }))
+
+
+def _ReadGroupData(filename, uuid, now=None):
+  """Reads the data of a node group written by the global watcher.
+
+  @type filename: string
+  @param filename: Path to the data file
+  @type uuid: string
+  @param uuid: Node group UUID
+  @rtype: tuple or None
+  @return: tuple of (raw instances, raw nodes); C{None} if the file can't be
+    read, is too old or doesn't contain the node group
+
+  """
+  if now is None:
+    now = time.time()
+
+  try:
+    data = serializer.LoadJson(utils.ReadFile(filename))
+    age = now - data["timestamp"]
+    groupdata = data["groups"].get(uuid)
+  except (EnvironmentError, ValueError, KeyError, TypeError), err:
+    logging.debug("Can't read node group data from '%s': %s", filename, err)
+    return None
+
+  if not 0 <= age <= GROUP_DATA_MAX_AGE:
+    logging.debug("Node group data in '%s' is too old (%.1fs)", filename, age)
+    return None
+
+  if groupdata is None:
+    logging.debug("No data for node group '%s' in '%s'", uuid, filename)
+    return None
+
+  (raw_instances, raw_nodes) = groupdata
+
+  return (raw_instances, raw_nodes)
+
+
+def _GetGroupData(cl, uuid):
+  """Retrieves instances and nodes per node group.
+
+  The data written by the global watcher is used if it is recent enough,
+  otherwise the master is queried.
+
+  """
+  groupdata = _ReadGroupData(pathutils.WATCHER_GROUPS_DATA_FILE, uuid)
+  if groupdata is None:
+    groupdata = _QueryData(cl,
+                           # Get all primary instances in group
+                           [qlang.OP_EQUAL, "pnode.group.uuid", uuid],
+                           # Get all nodes in group
+                           [qlang.OP_EQUAL, "group.uuid", uuid])
+
+  (raw_instances, raw_nodes) = groupdata
+
   secondaries = {}
   instances = []
 
   # Load all instances
-  for (name, status, disks_active, snodes, pnode_group_uuid,
-       snodes_group_uuid) in raw_instances:
+  for (name, status, disks_active, snodes, snodes_group_uuid,
+       pnode_group_uuid) in raw_instances:
     if snodes and set([pnode_group_uuid]) != set(snodes_group_uuid):
       logging.error("Ignoring split instance '%s', primary group %s, secondary"
                     " groups %s", name, pnode_group_uuid,
@@ -671,7 +846,7 @@ def _GetGroupData(cl, uuid):
 
   # Load all nodes
   nodes = [Node(name, bootid, offline, secondaries.get(name, set()))
-           for (name, bootid, offline) in raw_nodes]
+           for (name, bootid, offline, _) in raw_nodes]
 
   return (dict((node.name, node) for node in nodes),
           dict((inst.name, inst) for inst in instances))
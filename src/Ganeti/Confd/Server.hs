@@ -121,6 +121,7 @@ buildResponse cdata req@(ConfdRequest { confdRqType = ReqClusterMaster }) =
   case confdRqQuery req of
     EmptyQuery -> liftM ((,) ReplyStatusOk . J.showJSON) master_name
     PlainQuery _ -> return queryArgumentError
+    BatchQuery _ -> return queryArgumentError
     DictQuery reqq -> do
       mnode <- gntErrorToResult $ getNode cfg master_uuid
       mname <- master_name
@@ -208,6 +209,20 @@ buildResponse cdata req@(ConfdRequest { confdRqType = ReqNodeInstances }) = do
       instances = getNodeInstances cfg node_uuid
   return (ReplyStatusOk, J.showJSON instances)
 
+-- | Answers all requests of a batch, as a list of (status, answer)
+-- pairs in the order of the requests; batches can't be nested.
+buildResponse cdata req@(ConfdRequest { confdRqType = ReqBatch }) =
+  case confdRqQuery req of
+    BatchQuery rqs ->
+      let answer (ReqBatch, _) = queryArgumentError
+          answer (rqtype, rqquery) =
+            case buildResponse cdata req { confdRqType = rqtype
+                                         , confdRqQuery = rqquery } of
+              Bad err -> (ReplyStatusError, J.showJSON err)
+              Ok sa -> sa
+      in return (ReplyStatusOk, J.showJSON $ map answer rqs)
+    _ -> return queryArgumentError
+
 -- | Creates a ConfdReply from a given answer.
 serializeResponse :: Result StatusAnswer -> ConfdReply
 serializeResponse r =
@@ -254,7 +269,7 @@ listener :: S.Socket -> HashKey
          -> (S.Socket -> HashKey -> String -> S.SockAddr -> IO ())
          -> IO ()
 listener s hmac resp = do
-  (msg, _, peer) <- S.recvFrom s 4096
+  (msg, _, peer) <- S.recvFrom s C.confdMaxRequestSize
   if confdMagicFourcc `isPrefixOf` msg
     then forkIO (resp s hmac (drop 4 msg) peer) >> return ()
     else logDebug "Invalid magic code!" >> return ()
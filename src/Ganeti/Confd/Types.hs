@@ -79,6 +79,7 @@ $(declareIADT "ConfdRequestType"
   , ("ReqInstIpsList",      'C.confdReqInstancesIpsList )
   , ("ReqNodeDrbd",         'C.confdReqNodeDrbd )
   , ("ReqNodeInstances",    'C.confdReqNodeInstances)
+  , ("ReqBatch",            'C.confdReqBatch)
   ])
 $(makeJSONInstance ''ConfdRequestType)
 
@@ -106,10 +107,12 @@ $(buildObject "ConfdReqQ" "confdReqQ"
   ])
 
 -- | Confd query type. This is complex enough that we can't
--- automatically derive it via THH.
+-- automatically derive it via THH. A batch query contains the type
+-- and query of each of the requests it combines.
 data ConfdQuery = EmptyQuery
                 | PlainQuery String
                 | DictQuery  ConfdReqQ
+                | BatchQuery [(ConfdRequestType, ConfdQuery)]
                   deriving (Show, Eq)
 
 instance JSON ConfdQuery where
@@ -117,12 +120,14 @@ instance JSON ConfdQuery where
                  JSNull     -> return EmptyQuery
                  JSString s -> return . PlainQuery . fromJSString $ s
                  JSObject _ -> fmap DictQuery (readJSON o::Result ConfdReqQ)
+                 JSArray (_:_) -> fmap BatchQuery (readJSON o)
                  _ -> fail $ "Cannot deserialise into ConfdQuery\
                              \ the value '" ++ show o ++ "'"
   showJSON cq = case cq of
                   EmptyQuery -> JSNull
                   PlainQuery s -> showJSON s
                   DictQuery drq -> showJSON drq
+                  BatchQuery rqs -> showJSON rqs
 
 $(declareIADT "ConfdReplyStatus"
   [ ( "ReplyStatusOk",      'C.confdReplStatusOk )
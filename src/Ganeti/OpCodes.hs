@@ -187,7 +187,7 @@ $(genOpCode "OpCode"
      , pModifyEtcHosts
      , pGlobalFileStorageDir
      ])
-  , ("OpClusterRedistConf", [])
+  , ("OpClusterRedistConf", [ pSkipUnchanged ])
   , ("OpClusterActivateMasterIp", [])
   , ("OpClusterDeactivateMasterIp", [])
   , ("OpQuery",
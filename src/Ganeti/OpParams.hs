@@ -61,6 +61,7 @@ module Ganeti.OpParams
   , pShutdownInstance
   , pForce
   , pIgnoreOfflineNodes
+  , pSkipUnchanged
   , pNodeName
   , pNodeUuid
   , pNodeNames
@@ -578,6 +579,10 @@ pForce = defaultFalse "force"
 pIgnoreOfflineNodes :: Field
 pIgnoreOfflineNodes = defaultFalse "ignore_offline_nodes"
 
+-- | Whether to skip files which are already up to date on a node.
+pSkipUnchanged :: Field
+pSkipUnchanged = defaultFalse "skip_unchanged"
+
 -- | A required node name (for single-node LUs).
 pNodeName :: Field
 pNodeName = simpleField "node_name" [t| NonEmptyString |]
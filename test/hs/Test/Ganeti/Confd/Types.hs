@@ -53,10 +53,17 @@ $(genArbitrary ''ConfdReqField)
 
 $(genArbitrary ''ConfdReqQ)
 
+-- | Generates a non-batch 'ConfdQuery'.
+genSimpleQuery :: Gen ConfdQuery
+genSimpleQuery = oneof [ pure EmptyQuery
+                       , PlainQuery <$> genName
+                       , DictQuery <$> arbitrary
+                       ]
+
 instance Arbitrary ConfdQuery where
-  arbitrary = oneof [ pure EmptyQuery
-                    , PlainQuery <$> genName
-                    , DictQuery <$> arbitrary
+  arbitrary = oneof [ genSimpleQuery
+                    , BatchQuery <$>
+                        listOf1 ((,) <$> arbitrary <*> genSimpleQuery)
                     ]
 
 $(genArbitrary ''ConfdRequest)
@@ -166,7 +166,8 @@ instance Arbitrary OpCodes.OpCode where
           arbitrary <*> arbitrary <*> arbitrary <*> arbitrary <*>
           arbitrary <*> arbitrary <*> arbitrary <*> arbitrary <*> arbitrary <*>
           genMaybe (genName >>= mkNonEmpty)
-      "OP_CLUSTER_REDIST_CONF" -> pure OpCodes.OpClusterRedistConf
+      "OP_CLUSTER_REDIST_CONF" ->
+        OpCodes.OpClusterRedistConf <$> arbitrary
       "OP_CLUSTER_ACTIVATE_MASTER_IP" ->
         pure OpCodes.OpClusterActivateMasterIp
       "OP_CLUSTER_DEACTIVATE_MASTER_IP" ->
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2014 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Script for measuring the cost of reading `drbdsetup show` output
+
+Builds the output of `drbdsetup show` for a number of DRBD 8.4 minors from
+C{test/data/bdev-drbd-8.4.txt} and measures the time needed to parse it per
+minor, to split the output for all minors and to run a command (C{true}
+unless another one is given), which approximates the cost of forking
+`drbdsetup` once per minor.
+
+"""
+
+import time
+import optparse
+
+from ganeti import utils
+from ganeti.storage import drbd_info
+
+
+def ParseOptions():
+  """Parses the command line options.
+
+  In case of command line errors, it will show the usage and exit the
+  program.
+
+  @return: the options in a tuple
+
+  """
+  parser = optparse.OptionParser(usage="%prog [options] <show-data-file>")
+  parser.add_option("-n", dest="count", default=100, type="int",
+                    help="Number of minors", metavar="NUM")
+  parser.add_option("--command", dest="command", default="true",
+                    help="Command to run once per minor", metavar="CMD")
+
+  (opts, args) = parser.parse_args()
+
+  if opts.count < 1:
+    parser.error("Number of minors must be at least 1")
+
+  if len(args) != 1:
+    parser.error("DRBD 8.4 show data file must be given")
+
+  return (opts, args)
+
+
+def _MakeShowData(template, count):
+  """Builds the `drbdsetup show` output for a number of minors.
+
+  """
+  return "".join(template.replace("resource0", "resource%d" % minor)
+                 .replace("minor 0;", "minor %d;" % minor)
+                 for minor in range(count))
+
+
+def _Measure(descr, count, fn):
+  """Runs a function and prints the time it took.
+
+  """
+  start = time.time()
+  fn()
+  duration = time.time() - start
+  print ("%-8s %d minors: %0.3fs (%0.2fms per minor)" %
+         (descr, count, duration, 1000.0 * duration / count))
+
+
+def main():
+  (opts, (filename, )) = ParseOptions()
+
+  cls = drbd_info.DRBD84ShowInfo
+  template = utils.ReadFile(filename)
+  show_data = _MakeShowData(template, opts.count)
+
+  # Build the parser before measuring
+  cls.GetDevInfo(template)
+
+  def _Parse():
+    for _ in range(opts.count):
+      cls.GetDevInfo(template)
+
+  def _Split():
+    assert len(cls.SplitShowData(show_data)) == opts.count
+
+  def _Fork():
+    for _ in range(opts.count):
+      utils.RunCmd([opts.command])
+
+  _Measure("parse", opts.count, _Parse)
+  _Measure("split", opts.count, _Split)
+  _Measure("fork", opts.count, _Fork)
+
+
+if __name__ == "__main__":
+  main()
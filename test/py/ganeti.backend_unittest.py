@@ -26,9 +26,11 @@ import os
 import shutil
 import tempfile
 import testutils
+import threading
 import unittest
 
 from ganeti import backend
+from ganeti import compat
 from ganeti import constants
 from ganeti import errors
 from ganeti import hypervisor
@@ -126,6 +128,69 @@ class TestNodeVerify(testutils.GanetiTestCase):
     self._mock_hv.Verify.assert_called_with(hvparams=hvparams)
 
 
+class TestRunVerifyChecks(unittest.TestCase):
+  def _AddResult(self, key, value, result):
+    result[key] = value
+
+  def test(self):
+    result = {}
+    backend._RunVerifyChecks([
+      ("first", 10, compat.partial(self._AddResult, "a", 1)),
+      ("second", 10, compat.partial(self._AddResult, "b", 2)),
+      ], result)
+    self.assertEqual(result["a"], 1)
+    self.assertEqual(result["b"], 2)
+    self.assertEqual(sorted(result[constants.NV_CHECK_TIMES]),
+                     ["first", "second"])
+    self.assertEqual(result[constants.NV_TIMED_OUT_CHECKS], [])
+
+  def testConcurrent(self):
+    # Each check waits for the other one, which only works if they run at the
+    # same time
+    events = [threading.Event(), threading.Event()]
+
+    def _Check(idx, result):
+      events[idx].set()
+      events[1 - idx].wait(10)
+      result[idx] = events[1 - idx].isSet()
+
+    result = {}
+    backend._RunVerifyChecks([
+      ("first", 10, compat.partial(_Check, 0)),
+      ("second", 10, compat.partial(_Check, 1)),
+      ], result)
+    self.assertTrue(result[0])
+    self.assertTrue(result[1])
+
+  def testTimeout(self):
+    release = threading.Event()
+
+    def _Hang(result):
+      release.wait(10)
+      result["late"] = True
+
+    result = {}
+    try:
+      backend._RunVerifyChecks([
+        ("hanging", 0.1, _Hang),
+        ("quick", 10, compat.partial(self._AddResult, "quick", True)),
+        ], result)
+    finally:
+      release.set()
+
+    self.assertFalse("late" in result)
+    self.assertTrue(result["quick"])
+    self.assertEqual(result[constants.NV_TIMED_OUT_CHECKS], ["hanging"])
+    self.assertTrue(result[constants.NV_CHECK_TIMES]["hanging"] >= 0.1)
+
+  def testError(self):
+    def _Fail(_):
+      raise errors.OpExecError("check failed")
+
+    self.assertRaises(errors.OpExecError, backend._RunVerifyChecks,
+                      [("failing", 10, _Fail)], {})
+
+
 def _DefRestrictedCmdOwner():
   return (os.getuid(), os.getgid())
 
@@ -810,5 +875,53 @@ class TestSpaceReportingConstants(unittest.TestCase):
       self.assertEqual(None, backend._STORAGE_TYPE_INFO_FN[storage_type])
 
 
+class TestBlockdevAssembleMulti(unittest.TestCase):
+  def setUp(self):
+    self._orig_fn = backend.BlockdevAssemble
+    backend.BlockdevAssemble = mock.Mock(side_effect=self._Assemble)
+
+  def tearDown(self):
+    backend.BlockdevAssemble = self._orig_fn
+
+  @staticmethod
+  def _Assemble(disk, owner, as_primary, idx):
+    if disk == "rpcfail":
+      backend._Fail("Can't assemble %s", disk)
+    elif disk == "error":
+      raise errors.BlockDeviceError("Device %s is broken" % disk)
+    return "/dev/%s/%s/%s" % (owner, idx, as_primary)
+
+  def testEmpty(self):
+    self.assertEqual(backend.BlockdevAssembleMulti([]), [])
+    self.assertFalse(backend.BlockdevAssemble.called)
+
+  def testSuccess(self):
+    result = backend.BlockdevAssembleMulti([
+      ("disk0", "inst1", True, 0),
+      ("disk1", "inst2", False, 1),
+      ])
+    self.assertEqual(result, [
+      (True, "/dev/inst1/0/True"),
+      (True, "/dev/inst2/1/False"),
+      ])
+
+  def testPartialFailure(self):
+    result = backend.BlockdevAssembleMulti([
+      ("disk0", "inst1", True, 0),
+      ("rpcfail", "inst1", True, 1),
+      ("error", "inst2", True, 0),
+      ("disk1", "inst2", True, 1),
+      ])
+    self.assertEqual(len(result), 4)
+    self.assertEqual(result[0], (True, "/dev/inst1/0/True"))
+    (success, msg) = result[1]
+    self.assertFalse(success)
+    self.assertTrue("Can't assemble rpcfail" in msg)
+    (success, msg) = result[2]
+    self.assertFalse(success)
+    self.assertTrue("Device error is broken" in msg)
+    self.assertEqual(result[3], (True, "/dev/inst2/1/True"))
+
+
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
@@ -22,11 +22,14 @@
 """Script for unittesting the cmdlib module 'instance_storage'"""
 
 
+import time
 import unittest
 
 from ganeti import constants
 from ganeti.cmdlib import instance_storage
 from ganeti import errors
+from ganeti import objects
+from ganeti import rpc
 
 import testutils
 import mock
@@ -111,5 +114,327 @@ class TestCheckNodesFreeDiskOnVG(unittest.TestCase):
         self.node_name, node_info, self.vg, NotImplemented)
 
 
+def _MakeDrbdDisk(pnode, snode, name):
+  return objects.Disk(dev_type=constants.LD_DRBD8, size=1024, mode="rw",
+                      iv_name="disk/0", params={},
+                      logical_id=(pnode, snode, 11000, 0, 1, "secret"),
+                      children=[
+                        objects.Disk(dev_type=constants.LD_LV, size=1024,
+                                     logical_id=("xenvg", name + "_data"),
+                                     params={}),
+                        objects.Disk(dev_type=constants.LD_LV, size=128,
+                                     logical_id=("xenvg", name + "_meta"),
+                                     params={}),
+                        ])
+
+
+def _MakePlainDisk(name, idx):
+  return objects.Disk(dev_type=constants.LD_LV, size=512, mode="rw",
+                      iv_name="disk/%s" % idx, params={},
+                      logical_id=("xenvg", name))
+
+
+class _MultiInstanceDisksTest(unittest.TestCase):
+  def setUp(self):
+    self.inst1 = objects.Instance(uuid="inst1-uuid", name="inst1",
+                                  primary_node="node1",
+                                  disk_template=constants.DT_DRBD8,
+                                  disks=[_MakeDrbdDisk("node1", "node2",
+                                                       "inst1")])
+    self.inst2 = objects.Instance(uuid="inst2-uuid", name="inst2",
+                                  primary_node="node2",
+                                  disk_template=constants.DT_PLAIN,
+                                  disks=[_MakePlainDisk("inst2-0", 0),
+                                         _MakePlainDisk("inst2-1", 1)])
+
+    self.lu = mock.Mock()
+    self.lu.cfg.GetNodeName = mock.Mock(side_effect=lambda uuid: uuid)
+    self.lu.cfg.GetInstanceDiskParams = \
+      mock.Mock(return_value=constants.DISK_DT_DEFAULTS)
+
+  @staticmethod
+  def _Result(node_uuid, payload=None, fail_msg=None, offline=False):
+    if offline:
+      return rpc.RpcResult(offline=True, node=node_uuid, call="test")
+    elif fail_msg:
+      return rpc.RpcResult(data=fail_msg, failed=True, node=node_uuid,
+                           call="test")
+    else:
+      return rpc.RpcResult(data=(True, payload), node=node_uuid, call="test")
+
+
+class TestAssembleInstancesDisks(_MultiInstanceDisksTest):
+  def setUp(self):
+    _MultiInstanceDisksTest.setUp(self)
+
+    self.calls = []
+    self.failures = {}
+    self.lu.rpc.call_blockdev_assemble_multi = \
+      mock.Mock(side_effect=self._AssembleMulti)
+
+  def _AssembleMulti(self, node_uuids, node_disks, node_params):
+    self.assertEqual(sorted(node_uuids), sorted(node_disks.keys()))
+    self.assertEqual(sorted(node_uuids), sorted(node_params.keys()))
+
+    self.calls.append(dict((node_uuid, node_params[node_uuid])
+                           for node_uuid in node_uuids))
+
+    result = {}
+    for node_uuid in node_uuids:
+      failure = self.failures.get((node_uuid, len(self.calls)))
+      if failure == "offline":
+        result[node_uuid] = self._Result(node_uuid, offline=True)
+      elif failure == "node":
+        result[node_uuid] = self._Result(node_uuid, fail_msg="Node failed")
+      else:
+        payload = []
+        for (owner, on_primary, idx) in node_params[node_uuid]:
+          if failure == (owner, idx):
+            payload.append((False, "Disk failed"))
+          elif on_primary:
+            payload.append((True, "/dev/%s/%s" % (owner, idx)))
+          else:
+            payload.append((True, None))
+        result[node_uuid] = self._Result(node_uuid, payload=payload)
+
+    return result
+
+  def testSuccess(self):
+    result = instance_storage.AssembleInstancesDisks(self.lu, [
+      (self.inst1, None),
+      (self.inst2, None),
+      ])
+
+    self.assertEqual(result, {
+      "inst1-uuid": (True, [("node1", "disk/0", "/dev/inst1/0")]),
+      "inst2-uuid": (True, [("node2", "disk/0", "/dev/inst2/0"),
+                            ("node2", "disk/1", "/dev/inst2/1")]),
+      })
+
+    # One call for the secondary and one for the primary pass
+    self.assertEqual(self.calls, [
+      {
+        "node1": [("inst1", False, 0)],
+        "node2": [("inst1", False, 0), ("inst2", False, 0),
+                  ("inst2", False, 1)],
+      },
+      {
+        "node1": [("inst1", True, 0)],
+        "node2": [("inst2", True, 0), ("inst2", True, 1)],
+      },
+      ])
+    self.assertFalse(self.lu.cfg.MarkInstanceDisksInactive.called)
+
+  def testDiskSubset(self):
+    result = instance_storage.AssembleInstancesDisks(self.lu, [
+      (self.inst2, [self.inst2.disks[1]]),
+      ])
+
+    self.assertEqual(result, {
+      "inst2-uuid": (True, [("node2", "disk/1", "/dev/inst2/0")]),
+      })
+    self.assertEqual(self.calls, [
+      {"node2": [("inst2", False, 0)]},
+      {"node2": [("inst2", True, 0)]},
+      ])
+
+  def testPrimaryDiskFailure(self):
+    self.failures[("node2", 2)] = ("inst2", 1)
+
+    result = instance_storage.AssembleInstancesDisks(self.lu, [
+      (self.inst1, None),
+      (self.inst2, None),
+      ])
+
+    self.assertEqual(result, {
+      "inst1-uuid": (True, [("node1", "disk/0", "/dev/inst1/0")]),
+      "inst2-uuid": (False, [("node2", "disk/0", "/dev/inst2/0"),
+                             ("node2", "disk/1", None)]),
+      })
+    self.lu.cfg.MarkInstanceDisksInactive.assert_called_once_with(
+      "inst2-uuid")
+
+  def testSecondaryNodeFailure(self):
+    self.failures[("node2", 1)] = "node"
+
+    result = instance_storage.AssembleInstancesDisks(self.lu, [
+      (self.inst1, None),
+      (self.inst2, None),
+      ])
+
+    self.assertFalse(result["inst1-uuid"][0])
+    self.assertFalse(result["inst2-uuid"][0])
+    self.assertEqual(self.lu.cfg.MarkInstanceDisksInactive.call_count, 2)
+
+  def testIgnoreSecondaries(self):
+    self.failures[("node2", 1)] = ("inst1", 0)
+
+    result = instance_storage.AssembleInstancesDisks(self.lu, [
+      (self.inst1, None),
+      (self.inst2, None),
+      ], ignore_secondaries=True)
+
+    self.assertTrue(result["inst1-uuid"][0])
+    self.assertTrue(result["inst2-uuid"][0])
+
+  def testOfflineSecondary(self):
+    self.failures[("node2", 1)] = "offline"
+
+    result = instance_storage.AssembleInstancesDisks(self.lu, [
+      (self.inst1, None),
+      ])
+
+    self.assertEqual(result, {
+      "inst1-uuid": (True, [("node1", "disk/0", "/dev/inst1/0")]),
+      })
+
+
+class TestWaitForInstancesSync(_MultiInstanceDisksTest):
+  def setUp(self):
+    _MultiInstanceDisksTest.setUp(self)
+
+    self.statuses = []
+    self.lu.rpc.call_blockdev_getmirrorstatus_multi = \
+      mock.Mock(side_effect=self._GetMirrorStatusMulti)
+
+    self._orig_sleep = time.sleep
+    time.sleep = mock.Mock()
+
+  def tearDown(self):
+    time.sleep = self._orig_sleep
+
+  @staticmethod
+  def _Status(sync_percent=None, estimated_time=None, is_degraded=False):
+    return objects.BlockDevStatus(dev_path="/dev/disk", major=1, minor=0,
+                                  sync_percent=sync_percent,
+                                  estimated_time=estimated_time,
+                                  is_degraded=is_degraded,
+                                  ldisk_status=constants.LDS_OKAY)
+
+  def _GetMirrorStatusMulti(self, node_uuids, node_devs):
+    self.assertEqual(sorted(node_uuids), ["node1", "node2"])
+    self.assertEqual(len(node_devs["node1"]), 1)
+    self.assertEqual(len(node_devs["node2"]), 2)
+
+    # Statuses for a round are given as a callable or as
+    # {node: [status per disk] or error message}
+    if len(self.statuses) > 1:
+      round_statuses = self.statuses.pop(0)
+    else:
+      round_statuses = self.statuses[0]
+
+    result = {}
+    for node_uuid in node_uuids:
+      value = round_statuses[node_uuid]
+      if isinstance(value, basestring):
+        result[node_uuid] = self._Result(node_uuid, fail_msg=value)
+      else:
+        result[node_uuid] = self._Result(node_uuid, payload=value)
+
+    return result
+
+  def _Wait(self, **kwargs):
+    return instance_storage.WaitForInstancesSync(self.lu, [
+      (self.inst1, None),
+      (self.inst2, None),
+      ], **kwargs)
+
+  def testInSync(self):
+    self.statuses.append({
+      "node1": [(True, self._Status())],
+      "node2": [(True, self._Status()), (True, self._Status())],
+      })
+
+    self.assertEqual(self._Wait(), {
+      "inst1-uuid": True,
+      "inst2-uuid": True,
+      })
+    self.assertEqual(self.lu.rpc.call_blockdev_getmirrorstatus_multi.call_count,
+                     1)
+    self.assertFalse(time.sleep.called)
+
+  def testSlowestDisk(self):
+    self.statuses.append({
+      "node1": [(True, self._Status(sync_percent=50.0, estimated_time=10))],
+      "node2": [(True, self._Status(sync_percent=90.0, estimated_time=2)),
+                (True, self._Status())],
+      })
+    self.statuses.append({
+      "node1": [(True, self._Status())],
+      "node2": [(True, self._Status()), (True, self._Status())],
+      })
+
+    self.assertEqual(self._Wait(), {
+      "inst1-uuid": True,
+      "inst2-uuid": True,
+      })
+    self.assertEqual(self.lu.rpc.call_blockdev_getmirrorstatus_multi.call_count,
+                     2)
+    time.sleep.assert_called_once_with(10)
+
+  def testOneshot(self):
+    self.statuses.append({
+      "node1": [(True, self._Status(sync_percent=50.0, estimated_time=10))],
+      "node2": [(True, self._Status()), (True, self._Status())],
+      })
+
+    self.assertEqual(self._Wait(oneshot=True), {
+      "inst1-uuid": True,
+      "inst2-uuid": True,
+      })
+    self.assertFalse(time.sleep.called)
+
+  def testDegraded(self):
+    self.statuses.append({
+      "node1": [(True, self._Status())],
+      "node2": [(True, self._Status()),
+                (True, self._Status(is_degraded=True))],
+      })
+
+    self.assertEqual(self._Wait(), {
+      "inst1-uuid": True,
+      "inst2-uuid": False,
+      })
+    # The initial round and ten retries
+    self.assertEqual(self.lu.rpc.call_blockdev_getmirrorstatus_multi.call_count,
+                     11)
+
+  def testTransientDiskFailure(self):
+    self.statuses.append({
+      "node1": [(True, self._Status())],
+      "node2": [(True, self._Status()), (False, "Can't find device")],
+      })
+    self.statuses.append({
+      "node1": [(True, self._Status())],
+      "node2": [(True, self._Status()), (True, self._Status())],
+      })
+
+    self.assertEqual(self._Wait(), {
+      "inst1-uuid": True,
+      "inst2-uuid": True,
+      })
+    time.sleep.assert_called_once_with(6)
+
+  def testPersistentDiskFailure(self):
+    self.statuses.append({
+      "node1": [(True, self._Status())],
+      "node2": [(True, self._Status()), (False, "Can't find device")],
+      })
+
+    self.assertRaises(errors.RemoteError, self._Wait)
+    self.assertEqual(self.lu.rpc.call_blockdev_getmirrorstatus_multi.call_count,
+                     10)
+
+  def testNodeFailure(self):
+    self.statuses.append({
+      "node1": "Node unreachable",
+      "node2": [(True, self._Status()), (True, self._Status())],
+      })
+
+    self.assertRaises(errors.RemoteError, self._Wait)
+    self.assertEqual(self.lu.rpc.call_blockdev_getmirrorstatus_multi.call_count,
+                     10)
+
+
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
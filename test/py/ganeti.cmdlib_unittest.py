@@ -80,6 +80,20 @@ class TestCertVerification(testutils.GanetiTestCase):
     self.assertEqual(errcode, cluster.LUClusterVerifyConfig.ETYPE_ERROR)
 
 
+class TestGetSlowestNodeCheck(unittest.TestCase):
+  def test(self):
+    self.assertEqual(cluster._GetSlowestNodeCheck({
+      constants.NV_CHECK_TIMES: {"lvm": 1.5, "nodelist": 20.0, "drbd": 0.1},
+      }), ("nodelist", 20.0))
+
+  def testMissing(self):
+    self.assertEqual(cluster._GetSlowestNodeCheck(None), None)
+    self.assertEqual(cluster._GetSlowestNodeCheck({}), None)
+    self.assertEqual(cluster._GetSlowestNodeCheck({
+      constants.NV_CHECK_TIMES: {},
+      }), None)
+
+
 class TestOpcodeParams(testutils.GanetiTestCase):
   def testParamsStructures(self):
     for op in sorted(mcpu.Processor.DISPATCH_TABLE):
@@ -1541,9 +1555,10 @@ class TestWipeDisks(unittest.TestCase):
     self.assertRaises(errors.OpExecError, instance.WipeDisks, lu, inst)
 
   def _FailingWipeCb(self, (disk, _), offset, size):
-    # This should only ever be called for the first disk
-    self.assertEqual(disk.logical_id, "disk0")
-    return (False, None)
+    # Only the first disk fails, the others are wiped concurrently
+    if disk.logical_id == "disk0":
+      return (False, None)
+    return (True, None)
 
   def testFailingWipe(self):
     node_uuid = "node13445-uuid"
@@ -1651,6 +1666,14 @@ class TestWipeDisks(unittest.TestCase):
         "disk1": disks[1].size,
         })
 
+  def testWipeProgress(self):
+    progress = instance_storage._WipeProgress(1000)
+    self.assertEqual(progress.GetStatus(progress.start_time + 10), (0.0, None))
+    progress.Add(100)
+    progress.Add(150)
+    self.assertEqual(progress.GetStatus(progress.start_time + 10),
+                     (25.0, 30.0))
+
 
 class TestDiskSizeInBytesToMebibytes(unittest.TestCase):
   def testLessThanOneMebibyte(self):
@@ -2071,5 +2094,132 @@ class TestGetUpdatedIPolicy(unittest.TestCase):
       self.assertRaises(errors.OpPrereqError, common.GetUpdatedIPolicy, {},
                         bad_policy, group_policy=True)
 
+
+class _FakeConfigForUpToDateFiles:
+  def GetClusterName(self):
+    return "cluster.example.com"
+
+  def GetMasterNode(self):
+    return "master"
+
+  def GetClusterInfo(self):
+    return objects.Cluster(hvparams={})
+
+
+class _FakeRpcForUpToDateFiles:
+  def __init__(self, result):
+    self.result = result
+    self.calls = []
+
+  def call_node_verify(self, node_uuids, what, cluster_name, hvparams):
+    self.calls.append((node_uuids, what))
+    return self.result
+
+
+class _FakeLUForUpToDateFiles:
+  def __init__(self, result):
+    self.cfg = _FakeConfigForUpToDateFiles()
+    self.rpc = _FakeRpcForUpToDateFiles(result)
+
+
+class TestGetUpToDateFiles(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.file1 = utils.PathJoin(self.tmpdir, "file1")
+    self.file2 = utils.PathJoin(self.tmpdir, "file2")
+    self.missing = utils.PathJoin(self.tmpdir, "missing")
+    utils.WriteFile(self.file1, data="Hello World\n")
+    utils.WriteFile(self.file2, data="data\n")
+    self.fp1 = utils.FingerprintFiles([self.file1])[self.file1]
+    self.fp2 = utils.FingerprintFiles([self.file2])[self.file2]
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test(self):
+    lu = _FakeLUForUpToDateFiles({
+      "master": rpc.RpcResult(data=(True, {
+        constants.NV_FILELIST: {
+          self.file1: self.fp1,
+          self.file2: self.fp2,
+          },
+        })),
+      "node1": rpc.RpcResult(data=(True, {
+        constants.NV_FILELIST: {
+          self.file1: self.fp1,
+          self.file2: self.fp2,
+          },
+        })),
+      "node2": rpc.RpcResult(data=(True, {
+        constants.NV_FILELIST: {
+          self.file1: "0" * 40,
+          self.file2: self.fp2,
+          },
+        })),
+      "node3": rpc.RpcResult(data=(True, {
+        constants.NV_FILELIST: {},
+        })),
+      "node4": rpc.RpcResult(data=(False, "Connection refused")),
+      "node5": rpc.RpcResult(offline=True),
+      })
+    node_uuids = ["node%s" % i for i in range(1, 6)]
+
+    self.assertEqual(common._GetUpToDateFiles(lu, node_uuids,
+                                              [self.file1, self.file2,
+                                               self.missing]), {
+      self.file1: set(["node1"]),
+      self.file2: set(["node1", "node2"]),
+      })
+
+    # The master is queried along with the other nodes
+    ((called_nodes, what), ) = lu.rpc.calls
+    self.assertEqual(called_nodes, node_uuids + ["master"])
+    self.assertEqual(sorted(what[constants.NV_FILELIST]),
+                     [self.file1, self.file2, self.missing])
+
+  def testMasterFingerprints(self):
+    # The master's answer is used, even if it differs from the local files
+    lu = _FakeLUForUpToDateFiles({
+      "master": rpc.RpcResult(data=(True, {
+        constants.NV_FILELIST: {
+          self.file1: "0" * 40,
+          },
+        })),
+      "node1": rpc.RpcResult(data=(True, {
+        constants.NV_FILELIST: {
+          self.file1: "0" * 40,
+          self.file2: self.fp2,
+          },
+        })),
+      })
+    self.assertEqual(common._GetUpToDateFiles(lu, ["node1"],
+                                              [self.file1, self.file2]), {
+      self.file1: set(["node1"]),
+      })
+
+  def testMasterFailed(self):
+    lu = _FakeLUForUpToDateFiles({
+      "master": rpc.RpcResult(data=(False, "Connection refused")),
+      "node1": rpc.RpcResult(data=(True, {
+        constants.NV_FILELIST: {
+          self.file1: self.fp1,
+          self.file2: "0" * 40,
+          },
+        })),
+      })
+    self.assertEqual(common._GetUpToDateFiles(lu, ["node1"],
+                                              [self.file1, self.file2,
+                                               self.missing]), {
+      self.file1: set(["node1"]),
+      self.file2: set(),
+      })
+
+  def testNothingToCheck(self):
+    lu = _FakeLUForUpToDateFiles(NotImplemented)
+    self.assertEqual(common._GetUpToDateFiles(lu, [], [self.file1]), {})
+    self.assertEqual(common._GetUpToDateFiles(lu, ["node1"], []), {})
+    self.assertFalse(lu.rpc.calls)
+
+
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
@@ -28,6 +28,8 @@ import unittest
 from ganeti import confd
 from ganeti import constants
 from ganeti import errors
+from ganeti import objects
+from ganeti import serializer
 
 import ganeti.confd.client
 
@@ -70,6 +72,9 @@ class MockConfdAsyncUDPClient(ResettableMock):
     self.last_port = port
     self.last_address = address
 
+  def writable(self):
+    return False
+
 class MockCallback(ResettableMock):
   def Reset(self):
     self.call_count = 0
@@ -187,6 +192,120 @@ class _BaseClientTest:
     self.assertRaises(errors.ConfdClientError,
                       self.client._SetPeersAddressFamily)
 
+  def testBuildBatchRequests(self):
+    queries = [(constants.CONFD_REQ_NODE_PIP_BY_INSTANCE_IP, "192.0.2.%d" % i)
+               for i in range(200)]
+    reqs = self.client._BuildBatchRequests(queries)
+    self.assertTrue(len(reqs) > 1)
+    self.assertEqual([tuple(q) for req in reqs for q in req.query], queries)
+    for req in reqs:
+      self.assertEqual(req.type, constants.CONFD_REQ_BATCH)
+      self.assertTrue(len(self.client._PackRequest(req)) <=
+                      constants.CONFD_MAX_REQUEST_SIZE)
+    self.assertRaises(errors.ConfdClientError,
+                      self.client._BuildBatchRequests,
+                      [(constants.CONFD_REQ_BATCH, [])])
+    self.assertRaises(errors.ConfdClientError,
+                      self.client._BuildBatchRequests,
+                      [(constants.CONFD_REQ_PING,
+                        "x" * constants.CONFD_MAX_REQUEST_SIZE)])
+
+  def testWaitForRepliesUnknown(self):
+    self.assertEqual(self.client.WaitForReplies(["a", "b"], timeout=0),
+                     {"a": (True, 0, 0), "b": (True, 0, 0), })
+    self.assertEqual(self.client.WaitForReply("c", timeout=0), (True, 0, 0))
+
+  def testAnswerCache(self):
+    queries = [[constants.CONFD_REQ_NODE_ROLE_BYNAME, "node1"],
+               [constants.CONFD_REQ_NODE_ROLE_BYNAME, "node2"]]
+    req = confd.client.ConfdClientRequest(type=constants.CONFD_REQ_BATCH,
+                                          query=queries)
+    reply = objects.ConfdReply(status=constants.CONFD_REPL_STATUS_OK,
+                               answer=[[constants.CONFD_REPL_STATUS_OK, 1],
+                                       [constants.CONFD_REPL_STATUS_ERROR,
+                                        "unknown"]])
+    self.client._UpdateCache(req, reply)
+    self.assertEqual(self.client.GetCachedAnswer(*queries[0]),
+                     (constants.CONFD_REPL_STATUS_OK, 1))
+    self.assertEqual(self.client.GetCachedAnswer(*queries[1]),
+                     (constants.CONFD_REPL_STATUS_ERROR, "unknown"))
+    self.assertEqual(self.client.Query(queries),
+                     [(constants.CONFD_REPL_STATUS_OK, 1),
+                      (constants.CONFD_REPL_STATUS_ERROR, "unknown")])
+    self.assertEqual(self.client._socket.send_count, 0)
+    self.mock_time.increase(constants.CONFD_CLIENT_CACHE_TTL)
+    self.assertEqual(self.client.GetCachedAnswer(*queries[0]), None)
+
+  def _ReplyToRequests(self, client, replies):
+    """Makes the mock socket answer all pending requests.
+
+    @param replies: function computing the L{objects.ConfdReply} for a request
+
+    """
+    def _Process(timeout=1):
+      for (salt, rq) in client._requests.items():
+        for ip in rq.sent - rq.rcvd:
+          payload = serializer.DumpSignedJson(replies(rq.request).ToDict(),
+                                              "mykeydata", salt)
+          client.HandleResponse(confd.PackMagic(payload), ip, 0)
+      return True
+    client._socket.process_next_packet = _Process
+
+  @staticmethod
+  def _BatchReply(request):
+    return objects.ConfdReply(status=constants.CONFD_REPL_STATUS_OK,
+                              answer=[[constants.CONFD_REPL_STATUS_OK,
+                                       "%s-answer" % query]
+                                      for (_, query) in request.query])
+
+  def testQueryWithoutCache(self):
+    client = confd.client.ConfdClient("mykeydata", self.mc_list,
+                                      self.callback, cache_ttl=0)
+    self._ReplyToRequests(client, self._BatchReply)
+    queries = [(constants.CONFD_REQ_NODE_ROLE_BYNAME, "node%d" % i)
+               for i in range(3)]
+    self.assertEqual(client.Query(queries),
+                     [(constants.CONFD_REPL_STATUS_OK, "node%d-answer" % i)
+                      for i in range(3)])
+    self.assertTrue(client._socket.send_count > 0)
+    self.assertEqual(client._query_replies, {})
+
+  def testQueryPartiallyCached(self):
+    cached = (constants.CONFD_REQ_NODE_ROLE_BYNAME, "node1")
+    req = confd.client.ConfdClientRequest(type=constants.CONFD_REQ_BATCH,
+                                          query=[cached])
+    self.client._UpdateCache(req, objects.ConfdReply(
+      status=constants.CONFD_REPL_STATUS_OK,
+      answer=[[constants.CONFD_REPL_STATUS_OK, "cached"]]))
+    sent = []
+    def _Replies(request):
+      sent.extend(tuple(q) for q in request.query)
+      return self._BatchReply(request)
+    self._ReplyToRequests(self.client, _Replies)
+    queries = [(constants.CONFD_REQ_NODE_ROLE_BYNAME, "node0"), cached,
+               (constants.CONFD_REQ_NODE_ROLE_BYNAME, "node2")]
+    self.assertEqual(self.client.Query(queries),
+                     [(constants.CONFD_REPL_STATUS_OK, "node0-answer"),
+                      (constants.CONFD_REPL_STATUS_OK, "cached"),
+                      (constants.CONFD_REPL_STATUS_OK, "node2-answer")])
+    self.assertFalse(cached in sent)
+
+  def testQueryBatchError(self):
+    self._ReplyToRequests(self.client, lambda _: objects.ConfdReply(
+      status=constants.CONFD_REPL_STATUS_ERROR, answer="error"))
+    self.assertEqual(self.client.Query([(constants.CONFD_REQ_PING, None)]),
+                     [None])
+    self.assertEqual(self.client._query_replies, {})
+
+  def testAnswerCacheBatchError(self):
+    req = confd.client.ConfdClientRequest(type=constants.CONFD_REQ_BATCH,
+      query=[[constants.CONFD_REQ_PING, None]])
+    reply = objects.ConfdReply(status=constants.CONFD_REPL_STATUS_ERROR,
+                               answer="error")
+    self.client._UpdateCache(req, reply)
+    self.assertEqual(self.client.GetCachedAnswer(constants.CONFD_REQ_PING,
+                                                 None), None)
+
 
 class TestIP4Client(unittest.TestCase, _BaseClientTest):
   """Client tests"""
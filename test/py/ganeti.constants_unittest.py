@@ -67,6 +67,10 @@ class TestConstants(unittest.TestCase):
     self.failUnless(constants.NODE_MAX_CLOCK_SKEW <
                     (0.8 * constants.CONFD_MAX_CLOCK_SKEW))
 
+  def testNodeVerifyCheckTimeout(self):
+    self.failUnless(constants.NODE_VERIFY_CHECK_TIMEOUT <
+                    (0.8 * constants.RPC_TMO_NORMAL))
+
   def testSslCertExpiration(self):
     self.failUnless(constants.SSL_CERT_EXPIRATION_ERROR <
                     constants.SSL_CERT_EXPIRATION_WARN)
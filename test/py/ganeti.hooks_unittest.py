@@ -26,17 +26,20 @@ import unittest
 import os
 import time
 import tempfile
+import threading
 import os.path
 
 from ganeti import errors
 from ganeti import opcodes
 from ganeti import hooksmaster
+from ganeti import mcpu
 from ganeti import backend
 from ganeti import constants
 from ganeti import cmdlib
 from ganeti import rpc
 from ganeti import compat
 from ganeti import pathutils
+from ganeti import utils
 from ganeti.constants import HKR_SUCCESS, HKR_FAIL, HKR_SKIP
 
 from mocks import FakeConfig, FakeProc, FakeContext
@@ -82,10 +85,43 @@ class TestHooksRunner(unittest.TestCase):
   def _rname(self, fname):
     return "/".join(fname.split("/")[-2:])
 
+  def _RunHooks(self, phase, env):
+    """Runs the hooks, checking and removing the run times of scripts.
+
+    """
+    results = []
+    for (script, hkr, output, duration) in \
+        self.hr.RunHooks(self.hpath, phase, env, with_durations=True):
+      if hkr == HKR_SKIP:
+        self.assertEqual(duration, None)
+      else:
+        self.assertTrue(duration >= 0)
+      results.append((script, hkr, output))
+    return results
+
+  def _WriteWaitingScripts(self, phase):
+    """Writes two scripts each waiting for the other one to start.
+
+    """
+    script = ("#!/bin/sh\n"
+              "touch %(dir)s/%(me)s.started\n"
+              "for i in 1 2 3 4 5 6 7 8 9 10; do\n"
+              "  test -e %(dir)s/%(other)s.started && exit 0\n"
+              "  sleep 0.1\n"
+              "done\n"
+              "exit 1\n")
+    for (me, other) in [("10a", "10b"), ("10b", "10a")]:
+      fname = "%s/%s" % (self.ph_dirs[phase], me)
+      utils.WriteFile(fname, data=script % {
+        "dir": self.logdir, "me": me, "other": other,
+        }, mode=0700)
+      self.torm.append((fname, False))
+      self.torm.append(("%s/%s.started" % (self.logdir, me), False))
+
   def testEmpty(self):
     """Test no hooks"""
     for phase in (constants.HOOKS_PHASE_PRE, constants.HOOKS_PHASE_POST):
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}), [])
+      self.failUnlessEqual(self._RunHooks(phase, {}), [])
 
   def testSkipNonExec(self):
     """Test skip non-exec file"""
@@ -94,7 +130,7 @@ class TestHooksRunner(unittest.TestCase):
       f = open(fname, "w")
       f.close()
       self.torm.append((fname, False))
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_SKIP, "")])
 
   def testSkipInvalidName(self):
@@ -106,7 +142,7 @@ class TestHooksRunner(unittest.TestCase):
       f.close()
       os.chmod(fname, 0700)
       self.torm.append((fname, False))
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_SKIP, "")])
 
   def testSkipDir(self):
@@ -115,7 +151,7 @@ class TestHooksRunner(unittest.TestCase):
       fname = "%s/testdir" % self.ph_dirs[phase]
       os.mkdir(fname)
       self.torm.append((fname, True))
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_SKIP, "")])
 
   def testSuccess(self):
@@ -127,7 +163,7 @@ class TestHooksRunner(unittest.TestCase):
       f.close()
       self.torm.append((fname, False))
       os.chmod(fname, 0700)
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_SUCCESS, "")])
 
   def testSymlink(self):
@@ -136,7 +172,7 @@ class TestHooksRunner(unittest.TestCase):
       fname = "%s/success" % self.ph_dirs[phase]
       os.symlink("/bin/true", fname)
       self.torm.append((fname, False))
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_SUCCESS, "")])
 
   def testFail(self):
@@ -148,7 +184,7 @@ class TestHooksRunner(unittest.TestCase):
       f.close()
       self.torm.append((fname, False))
       os.chmod(fname, 0700)
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_FAIL, "")])
 
   def testCombined(self):
@@ -166,7 +202,7 @@ class TestHooksRunner(unittest.TestCase):
         self.torm.append((fname, False))
         os.chmod(fname, 0700)
         expect.append((self._rname(fname), rs, ""))
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}), expect)
+      self.failUnlessEqual(self._RunHooks(phase, {}), expect)
 
   def testOrdering(self):
     for phase in (constants.HOOKS_PHASE_PRE, constants.HOOKS_PHASE_POST):
@@ -182,7 +218,36 @@ class TestHooksRunner(unittest.TestCase):
         self.torm.append((fname, False))
         expect.append((self._rname(fname), HKR_SUCCESS, ""))
       expect.sort()
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}), expect)
+      self.failUnlessEqual(self._RunHooks(phase, {}), expect)
+
+  def testWithoutDurations(self):
+    """Test results without run times, as expected by older masters"""
+    for phase in (constants.HOOKS_PHASE_PRE, constants.HOOKS_PHASE_POST):
+      fname = "%s/success" % self.ph_dirs[phase]
+      os.symlink("/bin/true", fname)
+      self.torm.append((fname, False))
+      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+                           [(self._rname(fname), HKR_SUCCESS, "")])
+
+  def testSequentialByDefault(self):
+    phase = constants.HOOKS_PHASE_PRE
+    self._WriteWaitingScripts(phase)
+    self.assertEqual(self._RunHooks(phase, {"PATH": "/bin:/usr/bin"}), [
+      ("fake-pre.d/10a", HKR_FAIL, ""),
+      ("fake-pre.d/10b", HKR_SUCCESS, ""),
+      ])
+
+  def testParallel(self):
+    phase = constants.HOOKS_PHASE_POST
+    marker = utils.PathJoin(self.ph_dirs[phase],
+                            constants.HOOKS_PARALLEL_MARKER)
+    utils.WriteFile(marker, data="")
+    self.torm.append((marker, False))
+    self._WriteWaitingScripts(phase)
+    self.assertEqual(self._RunHooks(phase, {"PATH": "/bin:/usr/bin"}), [
+      ("fake-post.d/10a", HKR_SUCCESS, ""),
+      ("fake-post.d/10b", HKR_SUCCESS, ""),
+      ])
 
   def testEnv(self):
     """Test environment execution"""
@@ -193,7 +258,7 @@ class TestHooksRunner(unittest.TestCase):
       self.torm.append((fname, False))
       env_snt = {"PHASE": phase}
       env_exp = "PHASE=%s" % phase
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, env_snt),
+      self.failUnlessEqual(self._RunHooks(phase, env_snt),
                            [(self._rname(fname), HKR_SUCCESS, env_exp)])
 
 
@@ -276,6 +341,75 @@ class TestHooksMaster(unittest.TestCase):
     for phase in (constants.HOOKS_PHASE_PRE, constants.HOOKS_PHASE_POST):
       hm.RunPhase(phase)
 
+  def testDurations(self):
+    """Test results with and without script run times"""
+    def _Call(node_list, hpath, phase, env):
+      rr = rpc.RpcResult
+      return {
+        "node1": rr((True, [("utest", constants.HKR_SUCCESS, "ok", 1.5),
+                            ("skipped", constants.HKR_SKIP, "", None)]),
+                    node="node1", call="FakeScriptDurations"),
+        "node2": rr((True, [("utest", constants.HKR_FAIL, "err")]),
+                    node="node2", call="FakeScriptOld"),
+        }
+
+    hm = hooksmaster.HooksMaster.BuildFromLu(_Call, self.lu)
+    self.assertRaises(errors.HooksAbort, hm.RunPhase,
+                      constants.HOOKS_PHASE_PRE)
+    results = hm.RunPhase(constants.HOOKS_PHASE_POST)
+    self.assertEqual(sorted(results.keys()), ["node1", "node2"])
+
+  def testAsyncPost(self):
+    """Test asynchronous post-hooks"""
+    started = threading.Event()
+    release = threading.Event()
+    finished = threading.Event()
+    calls = []
+
+    def _Call(node_list, hpath, phase, env):
+      calls.append(phase)
+      if phase == constants.HOOKS_PHASE_POST:
+        started.set()
+        release.wait()
+      try:
+        return self._call_script_fail(node_list, hpath, phase, env)
+      finally:
+        if phase == constants.HOOKS_PHASE_POST:
+          finished.set()
+
+    self.lu.HOOKS_ASYNC_POST = True
+    hm = hooksmaster.HooksMaster.BuildFromLu(_Call, self.lu)
+    self.assertTrue(hm.async_post)
+    self.assertRaises(errors.HooksAbort, hm.RunPhase,
+                      constants.HOOKS_PHASE_PRE)
+    # Returns without waiting for the hooks; failures are only logged
+    self.assertEqual(hm.RunPhase(constants.HOOKS_PHASE_POST), None)
+    started.wait()
+    self.assertEqual(calls, [constants.HOOKS_PHASE_PRE,
+                             constants.HOOKS_PHASE_POST])
+    self.assertFalse(finished.isSet())
+    release.set()
+    finished.wait()
+
+  def testSyncPostByDefault(self):
+    hm = hooksmaster.HooksMaster.BuildFromLu(FakeHooksRpcSuccess, self.lu)
+    self.assertFalse(hm.async_post)
+    self.assertTrue(hm.RunPhase(constants.HOOKS_PHASE_POST))
+
+
+class TestAsyncPostLus(unittest.TestCase):
+  def testInstanceStartup(self):
+    self.assertTrue(cmdlib.LUInstanceStartup.HOOKS_ASYNC_POST)
+
+  def testNoResultsNeeded(self):
+    # The results of asynchronous post-hooks are never passed to
+    # HooksCallBack, so LUs using them must not rely on it
+    for lu in mcpu.Processor.DISPATCH_TABLE.values():
+      if lu.HOOKS_ASYNC_POST:
+        self.assertTrue(lu.HPATH)
+        self.assertEqual(lu.HooksCallBack.im_func,
+                         cmdlib.LogicalUnit.HooksCallBack.im_func)
+
 
 class FakeEnvLU(cmdlib.LogicalUnit):
   HPATH = "env_test_lu"
@@ -23,10 +23,12 @@
 
 import threading
 import tempfile
+import shutil
 import unittest
 import socket
 import os
 import struct
+import mock
 
 from ganeti import serializer
 from ganeti import constants
@@ -183,6 +185,278 @@ class TestQmp(testutils.GanetiTestCase):
                        msg="Got multi-line message")
       self.assertEqual(response, msg)
 
+  def testClosedByPeer(self):
+    socket_file = tempfile.NamedTemporaryFile()
+    os.remove(socket_file.name)
+    # With no scripted responses, the stub closes the connection upon the
+    # first command it receives
+    qmp_stub = QmpStub(socket_file.name, [])
+    qmp_stub.start()
+
+    qmp_connection = hv_kvm.QmpConnection(socket_file.name)
+    qmp_connection.connect()
+
+    self.assertRaises(errors.HypervisorError, qmp_connection.Execute,
+                      "query-status")
+    self.assertRaises(errors.ProgrammerError, qmp_connection.Execute,
+                      "query-status")
+    qmp_connection.close()
+    qmp_stub.join()
+
+  def testBufferTrimmed(self):
+    socket_file = tempfile.NamedTemporaryFile()
+    os.remove(socket_file.name)
+    qmp_stub = QmpStub(socket_file.name, [
+      '{"return": {}}\r\n{"event": "STOP"}\r\n{"return": {"running": false',
+      ])
+    qmp_stub.start()
+
+    qmp_connection = hv_kvm.QmpConnection(socket_file.name)
+    qmp_connection.connect()
+    self.assertEqual(qmp_connection.Execute("stop"),
+                     hv_kvm.QmpMessage({"return": {}}))
+    # Only the data following the last complete message is kept
+    self.assertEqual(qmp_connection._buf.strip(),
+                     '{"return": {"running": false')
+    self.assertEqual(qmp_connection._messages,
+                     [hv_kvm.QmpMessage({"event": "STOP"})])
+    qmp_connection.close()
+    qmp_stub.join()
+
+
+class ScriptedQmpServer(threading.Thread):
+  """QMP endpoint sending a fixed script without reading the commands
+
+  """
+  def __init__(self, socket_filename, chunks):
+    threading.Thread.__init__(self)
+    self.chunks = chunks
+    self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.socket.bind(socket_filename)
+    self.socket.listen(1)
+
+  def run(self):
+    conn, _ = self.socket.accept()
+    for chunk in self.chunks:
+      conn.send(chunk)
+    # Wait for the client to close the connection
+    while conn.recv(4096):
+      pass
+    conn.close()
+    self.socket.close()
+
+
+class TestQueryInstancesInfo(unittest.TestCase):
+  _GREETING = '{"QMP": {"version": {}, "capabilities": []}}\r\n'
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.servers = []
+
+    class _FakeKvm(hv_kvm.KVMHypervisor):
+      _DIRS = [self.tmpdir]
+      _CTRL_DIR = self.tmpdir
+      _QMP_QUERY_TIMEOUT = 0.5
+
+    self.hv = _FakeKvm()
+
+  def tearDown(self):
+    for server in self.servers:
+      server.join()
+    shutil.rmtree(self.tmpdir)
+
+  def _StartServer(self, name, chunks):
+    server = ScriptedQmpServer(self.hv._InstanceQmpMonitor(name), chunks)
+    server.start()
+    self.servers.append(server)
+
+  def testQuery(self):
+    # Replies split across messages, with an event in between
+    self._StartServer("inst1", [
+      self._GREETING + '{"return": {}}\r\n{"return": [{"CPU": 0}, ',
+      '{"CPU": 1}]}\r\n{"event": "RESUME"}\r\n',
+      '{"return": {"actual": 268435456}}\r\n',
+      ])
+    # Ballooning not enabled
+    self._StartServer("inst2", [
+      self._GREETING, '{"return": {}}\r\n', '{"return": [{"CPU": 0}]}\r\n',
+      '{"error": {"class": "DeviceNotActive", "desc": "", "data": {}}}\r\n',
+      ])
+    # Greeting only, the other replies never arrive
+    self._StartServer("inst3", [self._GREETING])
+
+    result = self.hv._QueryInstancesInfo([
+      ("inst1", 100, 128, 1),
+      ("inst2", 200, 512, 4),
+      ("inst3", 300, 1024, 8),
+      ("inst4", 400, 2048, 16),
+      ])
+    self.assertEqual(result, [
+      ("inst1", 100, 256, 2, "---b-", "0"),
+      ("inst2", 200, 512, 1, "---b-", "0"),
+      ("inst3", 300, 1024, 8, "---b-", "0"),
+      ("inst4", 400, 2048, 16, "---b-", "0"),
+      ])
+
+  def testWrongGreeting(self):
+    self._StartServer("inst1", [
+      '{"return": {}}\r\n{"return": {}}\r\n{"return": []}\r\n',
+      '{"return": {"actual": 268435456}}\r\n',
+      ])
+    result = self.hv._QueryInstancesInfo([("inst1", 100, 128, 1)])
+    self.assertEqual(result, [("inst1", 100, 128, 1, "---b-", "0")])
+
+
+class TestParseQmpMigrationStatus(unittest.TestCase):
+  def testActive(self):
+    info = {
+      "status": "active",
+      "expected-downtime": 120,
+      "ram": {
+        "transferred": 1024 * 1024,
+        "remaining": 3 * 1024 * 1024,
+        "total": 4 * 1024 * 1024,
+        "dirty-pages-rate": 500,
+        },
+      }
+    ms = hv_kvm.KVMHypervisor._ParseQmpMigrationStatus(info)
+    self.assertEqual(ms.status, constants.HV_MIGRATION_ACTIVE)
+    self.assertEqual(ms.transferred_ram, 1024)
+    self.assertEqual(ms.remaining_ram, 3 * 1024)
+    self.assertEqual(ms.total_ram, 4 * 1024)
+    self.assertEqual(ms.dirty_pages_rate, 500)
+    self.assertEqual(ms.expected_downtime, 120)
+
+  def testIntermediateStatus(self):
+    ms = hv_kvm.KVMHypervisor._ParseQmpMigrationStatus({"status": "setup"})
+    self.assertEqual(ms.status, constants.HV_MIGRATION_ACTIVE)
+    self.assertTrue(ms.transferred_ram is None)
+
+  def testFinished(self):
+    for (qmp_status, status) in [
+      ("completed", constants.HV_MIGRATION_COMPLETED),
+      ("failed", constants.HV_MIGRATION_FAILED),
+      ("cancelled", constants.HV_MIGRATION_CANCELLED),
+      ]:
+      ms = hv_kvm.KVMHypervisor._ParseQmpMigrationStatus({"status": qmp_status})
+      self.assertEqual(ms.status, status)
+
+  def testUnknown(self):
+    self.assertTrue(hv_kvm.KVMHypervisor._ParseQmpMigrationStatus({}) is None)
+    self.assertTrue(hv_kvm.KVMHypervisor._ParseQmpMigrationStatus({
+      "status": "no-such-status",
+      }) is None)
+
+
+class TestMigrationParameters(unittest.TestCase):
+  def _GetHvParams(self, **kwargs):
+    hvparams = constants.HVC_DEFAULTS[constants.HT_KVM].copy()
+    hvparams.update(kwargs)
+    return hvparams
+
+  def testDefaults(self):
+    hvparams = self._GetHvParams()
+    self.assertEqual(
+      hv_kvm.KVMHypervisor._GetMigrationCapabilities(hvparams), {})
+    hv_kvm.KVMHypervisor.CheckParameterSyntax(hvparams)
+
+  def testCapabilities(self):
+    hvparams = self._GetHvParams(**{
+      constants.HV_KVM_MIGRATION_COMPRESSION:
+        constants.HT_KVM_MIGRATION_COMPRESSION_XBZRLE,
+      constants.HV_KVM_MIGRATION_POSTCOPY: True,
+      })
+    self.assertEqual(
+      hv_kvm.KVMHypervisor._GetMigrationCapabilities(hvparams), {
+        "xbzrle": True,
+        "postcopy-ram": True,
+        })
+    hv_kvm.KVMHypervisor.CheckParameterSyntax(hvparams)
+
+  def testMultifdWithCompression(self):
+    hvparams = self._GetHvParams(**{
+      constants.HV_KVM_MIGRATION_MULTIFD_CHANNELS: 4,
+      constants.HV_KVM_MIGRATION_COMPRESSION:
+        constants.HT_KVM_MIGRATION_COMPRESSION_COMPRESS,
+      })
+    self.assertRaises(errors.HypervisorError,
+                      hv_kvm.KVMHypervisor.CheckParameterSyntax, hvparams)
+
+  def testPostcopyNonLive(self):
+    hvparams = self._GetHvParams(**{
+      constants.HV_KVM_MIGRATION_POSTCOPY: True,
+      constants.HV_MIGRATION_MODE: constants.HT_MIGRATION_NONLIVE,
+      })
+    self.assertRaises(errors.HypervisorError,
+                      hv_kvm.KVMHypervisor.CheckParameterSyntax, hvparams)
+
+
+class TestIncomingMigration(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.commands = []
+
+    test = self
+
+    class _FakeKvm(hv_kvm.KVMHypervisor):
+      _DIRS = [self.tmpdir]
+      _NICS_DIR = self.tmpdir
+
+      def _CheckDown(self, instance_name):
+        pass
+
+      def _RunKVMCmd(self, name, kvm_cmd, tap_fds=None):
+        test.commands.append(("run", kvm_cmd))
+
+      def _CallMonitorCommand(self, instance_name, command):
+        test.commands.append(("monitor", command))
+
+      def _ExecuteCpuAffinity(self, instance_name, cpu_mask):
+        pass
+
+      def _InstanceStartupMemory(self, instance, hvparams=None):
+        return instance.beparams[constants.BE_MAXMEM]
+
+    self.hv = _FakeKvm()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _Run(self, **kwargs):
+    hvparams = constants.HVC_DEFAULTS[constants.HT_KVM].copy()
+    hvparams.update(kwargs)
+    instance = objects.Instance(name="inst1.example.com", hvparams=hvparams,
+                                beparams={constants.BE_MAXMEM: 128})
+    self.hv._ExecuteKVMRuntime(instance, (["/usr/bin/kvm"], [], {}), "",
+                               incoming=("192.0.2.1", 8102))
+    return self.commands
+
+  def testDirect(self):
+    commands = self._Run()
+    self.assertEqual(len(commands), 1)
+    (kind, kvm_cmd) = commands[0]
+    self.assertEqual(kind, "run")
+    idx = kvm_cmd.index("-incoming")
+    self.assertEqual(kvm_cmd[idx + 1], "tcp:192.0.2.1:8102")
+
+  def testDeferred(self):
+    commands = self._Run(**{
+      constants.HV_KVM_MIGRATION_MULTIFD_CHANNELS: 4,
+      constants.HV_KVM_MIGRATION_POSTCOPY: True,
+      })
+    (kind, kvm_cmd) = commands[0]
+    self.assertEqual(kind, "run")
+    idx = kvm_cmd.index("-incoming")
+    self.assertEqual(kvm_cmd[idx + 1], "defer")
+
+    # The capabilities and parameters are set before the migration starts
+    self.assertEqual(commands[1:], [
+      ("monitor", "migrate_set_capability multifd on"),
+      ("monitor", "migrate_set_capability postcopy-ram on"),
+      ("monitor", "migrate_set_parameter multifd-channels 4"),
+      ("monitor", "migrate_incoming tcp:192.0.2.1:8102"),
+      ])
+
 
 class TestConsole(unittest.TestCase):
   def _Test(self, instance, node, hvparams):
@@ -370,5 +644,136 @@ class TestProbeTapVnetHdr(unittest.TestCase):
     self.assertFalse(hv_kvm._ProbeTapVnetHdr(fd, _features_fn=lambda _: None))
 
 
+class TestInstanceCache(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.cmdlines = {}
+
+    test = self
+
+    class _FakeKvm(hv_kvm.KVMHypervisor):
+      _DIRS = [self.tmpdir]
+      _PIDS_DIR = self.tmpdir
+      _CTRL_DIR = self.tmpdir
+      _CONF_DIR = self.tmpdir
+      _NICS_DIR = self.tmpdir
+      _UIDS_DIR = self.tmpdir
+      _KEYMAP_DIR = self.tmpdir
+      _CHROOT_DIR = self.tmpdir
+      _pidfile_cache = {}
+      _pid_info_cache = {}
+      _watching_instances = True
+
+      @classmethod
+      def _InstancePidInfo(cls, pid):
+        try:
+          result = test.cmdlines[pid]
+        except KeyError:
+          raise errors.HypervisorError("Cannot get info for pid %s" % pid)
+        cls._pid_info_cache[pid] = (None, result)
+        return result
+
+    self.cls = _FakeKvm
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _WritePidFile(self, name, pid, mtime):
+    # Like KVM, the pidfile is rewritten in place
+    path = utils.PathJoin(self.tmpdir, name)
+    fh = open(path, "w")
+    try:
+      fh.write("%s\n" % pid)
+    finally:
+      fh.close()
+    os.utime(path, (mtime, mtime))
+
+  def testReadInstancePid(self):
+    self.assertEqual(self.cls._ReadInstancePid("inst1"), 0)
+    self.assertFalse(self.cls._pidfile_cache)
+
+    self._WritePidFile("inst1", 100, 1000)
+    self.assertEqual(self.cls._ReadInstancePid("inst1"), 100)
+    self.assertEqual(self.cls._pidfile_cache["inst1"][1], 100)
+
+    self._WritePidFile("inst1", 200, 1001)
+    self.assertEqual(self.cls._ReadInstancePid("inst1"), 200)
+
+    os.remove(utils.PathJoin(self.tmpdir, "inst1"))
+    self.assertEqual(self.cls._ReadInstancePid("inst1"), 0)
+    self.assertFalse(self.cls._pidfile_cache)
+
+  def testReadInstancePidNotWatching(self):
+    self.cls._watching_instances = False
+    self._WritePidFile("inst1", 100, 1000)
+    self.assertEqual(self.cls._ReadInstancePid("inst1"), 100)
+    self._WritePidFile("inst1", 200, 1000)
+    self.assertEqual(self.cls._ReadInstancePid("inst1"), 200)
+    self.assertFalse(self.cls._pidfile_cache)
+
+  def testStartInstance(self):
+    self.cmdlines[100] = ("inst1", 128, 1)
+    self._WritePidFile("inst1", 100, 1000)
+    self.assertEqual(self.cls._ReadInstancePid("inst1"), 100)
+
+    # The instance is started again before the watch reports the change, and
+    # the pidfile keeps its file ID
+    self.cmdlines[200] = ("inst1", 128, 1)
+    self._WritePidFile("inst1", 200, 1000)
+    hv = self.cls()
+    with mock.patch.object(utils, "RunCmd",
+                           return_value=mock.Mock(failed=False)):
+      hv._RunKVMCmd("inst1", ["kvm"], [])
+    self.assertEqual(self.cls._ReadInstancePid("inst1"), 200)
+
+  def testCleanupInstance(self):
+    self._WritePidFile("inst1", 100, 1000)
+    self.assertEqual(self.cls._ReadInstancePid("inst1"), 100)
+
+    self.cls().CleanupInstance("inst1")
+    self.assertFalse(self.cls._pidfile_cache)
+    self._WritePidFile("inst1", 200, 1000)
+    self.assertEqual(self.cls._ReadInstancePid("inst1"), 200)
+
+  def testRefresh(self):
+    self.cmdlines[100] = ("inst1", 128, 1)
+    self.cmdlines[200] = ("inst2", 256, 2)
+    self._WritePidFile("inst1", 100, 1000)
+    self._WritePidFile("inst2", 200, 1000)
+    self._WritePidFile("inst3", 300, 1000)
+
+    self.cls.RefreshInstanceCache()
+    self.assertEqual(sorted(self.cls._pidfile_cache),
+                     ["inst1", "inst2", "inst3"])
+    self.assertEqual(sorted(self.cls._pid_info_cache), [100, 200])
+
+    # Instance restarted with a new pid
+    self.cmdlines[101] = ("inst1", 128, 1)
+    self._WritePidFile("inst1", 101, 1001)
+    self.cls.RefreshInstanceCache(["inst1"])
+    self.assertEqual(self.cls._pidfile_cache["inst1"][1], 101)
+    self.assertEqual(sorted(self.cls._pid_info_cache), [101, 200])
+
+    # Instance removed
+    os.remove(utils.PathJoin(self.tmpdir, "inst2"))
+    self.cls.RefreshInstanceCache(["inst2"])
+    self.assertEqual(sorted(self.cls._pidfile_cache), ["inst1", "inst3"])
+    self.assertEqual(sorted(self.cls._pid_info_cache), [101])
+
+    # Lost events
+    os.remove(utils.PathJoin(self.tmpdir, "inst3"))
+    self.cls.RefreshInstanceCache()
+    self.assertEqual(sorted(self.cls._pidfile_cache), ["inst1"])
+
+  def testWatchInstances(self):
+    self.cls._watching_instances = False
+    watched = []
+    self._WritePidFile("inst1", 100, 1000)
+    self.cls.WatchInstances(lambda path, cb: watched.append((path, cb)))
+    self.assertEqual(watched, [(self.tmpdir, self.cls.RefreshInstanceCache)])
+    self.assertTrue(self.cls._watching_instances)
+    self.assertEqual(self.cls._pidfile_cache.keys(), ["inst1"])
+
+
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
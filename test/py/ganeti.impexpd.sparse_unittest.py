@@ -0,0 +1,195 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2014 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Script for testing ganeti.impexpd.sparse"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from ganeti import utils
+from ganeti.impexpd import sparse
+
+import testutils
+
+
+class TestSplitZeroBlocks(unittest.TestCase):
+  def test(self):
+    bs = sparse.BLOCK_SIZE
+    data = "x" * bs
+
+    self.assertEqual(list(sparse._SplitZeroBlocks(0, "")), [])
+    self.assertEqual(list(sparse._SplitZeroBlocks(10, data)),
+                     [(True, 10, data)])
+    self.assertEqual(list(sparse._SplitZeroBlocks(0, "\0" * (2 * bs))),
+                     [(False, 0, 2 * bs)])
+    self.assertEqual(list(sparse._SplitZeroBlocks(0, data + "\0" * bs +
+                                                  data + data)),
+                     [(True, 0, data), (False, bs, bs),
+                      (True, 2 * bs, data + data)])
+
+    # Short trailing blocks
+    self.assertEqual(list(sparse._SplitZeroBlocks(0, data + "\0\0\0")),
+                     [(True, 0, data), (False, bs, 3)])
+    self.assertEqual(list(sparse._SplitZeroBlocks(0, "\0" * bs + "ab")),
+                     [(False, 0, bs), (True, bs, "ab")])
+
+
+class TestEncodeDecode(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.src = utils.PathJoin(self.tmpdir, "source")
+    self.dest = utils.PathJoin(self.tmpdir, "dest")
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _WriteSource(self, layout):
+    fh = open(self.src, "wb")
+    try:
+      for (kind, length) in layout:
+        if kind == "data":
+          fh.write(os.urandom(length))
+        elif kind == "zero":
+          fh.write("\0" * length)
+        elif kind == "hole":
+          fh.seek(length, os.SEEK_CUR)
+        else:
+          raise AssertionError("Unknown kind %s" % kind)
+      fh.truncate(fh.tell())
+    finally:
+      fh.close()
+
+  def _Encode(self, offset=0, size=None):
+    buf = StringIO()
+    fd = os.open(self.src, os.O_RDONLY)
+    try:
+      result = sparse.Encode(fd, buf, offset=offset, size=size)
+    finally:
+      os.close(fd)
+    return (buf.getvalue(), result)
+
+  def _Decode(self, stream, offset=0, truncate=True):
+    flags = os.O_WRONLY | os.O_CREAT
+    if truncate:
+      flags |= os.O_TRUNC
+    fd = os.open(self.dest, flags, 0600)
+    try:
+      return sparse.Decode(StringIO(stream), fd, offset=offset)
+    finally:
+      os.close(fd)
+
+  def _Check(self, layout, expected_data):
+    self._WriteSource(layout)
+
+    (stream, (data_bytes, hole_bytes)) = self._Encode()
+    self.assertEqual(data_bytes, expected_data)
+    self.assertEqual(data_bytes + hole_bytes, os.path.getsize(self.src))
+    self.assertTrue(len(stream) < data_bytes + 1024)
+
+    self.assertEqual(self._Decode(stream), (data_bytes, hole_bytes))
+    self.assertEqual(utils.ReadFile(self.dest), utils.ReadFile(self.src))
+
+    return stream
+
+  def testEmpty(self):
+    self._Check([], 0)
+
+  def testDataOnly(self):
+    self._Check([("data", 5)], 5)
+    self._Check([("data", 3 * sparse.BUFSIZE + 17)], 3 * sparse.BUFSIZE + 17)
+
+  def testHolesOnly(self):
+    self._Check([("hole", 10 * sparse.BUFSIZE)], 0)
+    self._Check([("zero", 3 * sparse.BUFSIZE + 7)], 0)
+
+  def testMixed(self):
+    bs = sparse.BLOCK_SIZE
+    self._Check([
+      ("data", 2 * bs),
+      ("hole", 3 * sparse.BUFSIZE),
+      ("zero", 5 * bs),
+      ("data", bs),
+      ("hole", 7 * bs),
+      ("data", 100),
+      ], 3 * bs + 100)
+
+  def testSize(self):
+    self._WriteSource([("data", 3 * sparse.BUFSIZE)])
+    (stream, result) = self._Encode(size=sparse.BUFSIZE)
+    self.assertEqual(result, (sparse.BUFSIZE, 0))
+    self._Decode(stream)
+    self.assertEqual(utils.ReadFile(self.dest),
+                     utils.ReadFile(self.src, size=sparse.BUFSIZE))
+
+  def testRanges(self):
+    bs = sparse.BLOCK_SIZE
+    self._WriteSource([
+      ("data", 3 * bs),
+      ("hole", 5 * bs),
+      ("data", bs),
+      ("zero", 4 * bs),
+      ("hole", 2 * bs),
+      ])
+
+    ranges = [(0, 2 * bs), (2 * bs, 6 * bs), (8 * bs, 5 * bs),
+              (13 * bs, 2 * bs)]
+
+    streams = [self._Encode(offset=offset, size=size)[0]
+               for (offset, size) in ranges]
+
+    # Ranges may be written in any order
+    utils.WriteFile(self.dest, data="")
+    for idx in [2, 0, 3, 1]:
+      (offset, size) = ranges[idx]
+      (data_bytes, hole_bytes) = self._Decode(streams[idx], offset=offset,
+                                              truncate=False)
+      self.assertEqual(data_bytes + hole_bytes, size)
+
+    self.assertEqual(utils.ReadFile(self.dest), utils.ReadFile(self.src))
+
+  def testWrongOffset(self):
+    self._WriteSource([("data", 2 * sparse.BLOCK_SIZE)])
+    (stream, _) = self._Encode(offset=sparse.BLOCK_SIZE)
+    self.assertRaises(sparse.SparseStreamError, self._Decode, stream)
+
+  def testCorruption(self):
+    bs = sparse.BLOCK_SIZE
+    stream = self._Check([("data", bs), ("hole", bs), ("data", 10)], bs + 10)
+
+    for pos in [len(sparse.MAGIC) + 3, len(stream) / 2, len(stream) - 1]:
+      corrupted = (stream[:pos] + chr(ord(stream[pos]) ^ 0x40) +
+                   stream[pos + 1:])
+      self.assertRaises(sparse.SparseStreamError, self._Decode, corrupted)
+
+  def testTruncated(self):
+    bs = sparse.BLOCK_SIZE
+    stream = self._Check([("data", bs), ("hole", bs)], bs)
+
+    for length in [0, 5, len(sparse.MAGIC) + 3, len(stream) - 1]:
+      self.assertRaises(sparse.SparseStreamError, self._Decode,
+                        stream[:length])
+
+
+if __name__ == "__main__":
+  testutils.GanetiTestProgram()
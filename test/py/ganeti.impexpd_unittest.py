@@ -64,12 +64,17 @@ def CheckCmdWord(cmd, word):
 class TestCommandBuilder(unittest.TestCase):
   def test(self):
     for mode in [constants.IEM_IMPORT, constants.IEM_EXPORT]:
-      if mode == constants.IEM_IMPORT:
-        comprcmd = "gunzip"
-      elif mode == constants.IEM_EXPORT:
-        comprcmd = "gzip"
+      for compress in constants.IEC_ALL:
+        if compress == constants.IEC_NONE:
+          comprcmd = None
+        elif compress == constants.IEC_GZIP:
+          if mode == constants.IEM_IMPORT:
+            comprcmd = "gunzip"
+          elif mode == constants.IEM_EXPORT:
+            comprcmd = "gzip"
+        else:
+          comprcmd = compress
 
-      for compress in [constants.IEC_NONE, constants.IEC_GZIP]:
         for magic in [None, 10 * "-", "HelloWorld", "J9plh4nFo2",
                       "24A02A81-2264-4B51-A882-A2AB9D85B420"]:
           opts = CmdBuilderConfig(magic=magic, compress=compress)
@@ -100,8 +105,13 @@ class TestCommandBuilder(unittest.TestCase):
                 cmd = builder.GetCommand()
                 self.assert_(isinstance(cmd, list))
 
-                if compress == constants.IEC_GZIP:
+                if comprcmd:
                   self.assert_(CheckCmdWord(cmd, comprcmd))
+                else:
+                  for (_, _, programs) in \
+                      impexpd.COMPRESSION_COMMANDS.values():
+                    for name in programs:
+                      self.assertFalse(CheckCmdWord(cmd, name))
 
                 if cmd_prefix is not None:
                   self.assert_(compat.any(cmd_prefix in i for i in cmd))
@@ -186,6 +196,26 @@ class TestCommandBuilder(unittest.TestCase):
     self.assertRaises(errors.GenericError, builder.GetCommand)
 
 
+class TestGetCompressionMethods(unittest.TestCase):
+  def testNone(self):
+    self.assertEqual(impexpd.GetCompressionMethods(lambda _: False),
+                     [constants.IEC_NONE])
+
+  def testAll(self):
+    self.assertEqual(impexpd.GetCompressionMethods(lambda _: True),
+                     sorted(constants.IEC_ALL))
+
+  def testPartial(self):
+    available = frozenset(["/usr/bin/zstd", "/bin/gzip"])
+    self.assertEqual(impexpd.GetCompressionMethods(available.__contains__),
+                     sorted([constants.IEC_NONE, constants.IEC_ZSTD]))
+
+    available = frozenset(["/usr/local/bin/lz4", "/bin/gzip", "/bin/gunzip"])
+    self.assertEqual(impexpd.GetCompressionMethods(available.__contains__),
+                     sorted([constants.IEC_NONE, constants.IEC_GZIP,
+                             constants.IEC_LZ4]))
+
+
 class TestVerifyListening(unittest.TestCase):
   def test(self):
     self.assertEqual(impexpd._VerifyListening(socket.AF_INET,
@@ -218,5 +218,92 @@ class TestProcessStorageInfo(unittest.TestCase):
     self.assertEqual(self.total_storage_lvm, total_disk)
 
 
+class _FakeConfigWithNodeNames:
+  def GetNodeName(self, node_uuid):
+    return "name-%s" % node_uuid
+
+
+class TestAccountNewInstances(unittest.TestCase):
+  def _MakeNodes(self):
+    return {
+      "name-n1": {"free_disk": 10000, "free_spindles": 10},
+      "name-n2": {"free_disk": 20000, "free_spindles": 20},
+      "name-n3": {"offline": True},
+      }
+
+  def testNoInstances(self):
+    nodes = self._MakeNodes()
+    iallocator.IAllocator._AccountNewInstances(_FakeConfigWithNodeNames(),
+                                               nodes, [])
+    self.assertEqual(nodes, self._MakeNodes())
+
+  def testPlain(self):
+    inst = objects.Instance(name="inst1", primary_node="n1",
+                            disk_template=constants.DT_PLAIN,
+                            disks=[objects.Disk(size=1024, spindles=2),
+                                   objects.Disk(size=512, spindles=None)])
+    nodes = self._MakeNodes()
+    iallocator.IAllocator._AccountNewInstances(_FakeConfigWithNodeNames(),
+                                               nodes, [inst])
+    self.assertEqual(nodes["name-n1"],
+                     {"free_disk": 10000 - 1536, "free_spindles": 8})
+    self.assertEqual(nodes["name-n2"], self._MakeNodes()["name-n2"])
+
+  def testNotLvm(self):
+    inst = objects.Instance(name="inst1", primary_node="n1",
+                            disk_template=constants.DT_FILE,
+                            disks=[objects.Disk(size=1024)])
+    nodes = self._MakeNodes()
+    iallocator.IAllocator._AccountNewInstances(_FakeConfigWithNodeNames(),
+                                               nodes, [inst])
+    self.assertEqual(nodes, self._MakeNodes())
+
+
+class TestClusterModelCache(unittest.TestCase):
+  def setUp(self):
+    self.cache = iallocator._ClusterModelCache()
+    self.inst1 = objects.Instance(uuid="i1", name="inst1", serial_no=1)
+    self.inst2 = objects.Instance(uuid="i2", name="inst2", serial_no=4)
+    self.cache.SetNodeInfo("key", 1000.0, [self.inst1], "ndata", "niinfo")
+
+  def testHit(self):
+    self.assertEqual(self.cache.GetNodeInfo("key", 1005.0, 10.0,
+                                            [self.inst1]),
+                     ("ndata", "niinfo", []))
+
+  def testNewInstances(self):
+    self.assertEqual(self.cache.GetNodeInfo("key", 1005.0, 10.0,
+                                            [self.inst1, self.inst2]),
+                     ("ndata", "niinfo", [self.inst2]))
+
+  def testRemovedInstance(self):
+    self.assertEqual(self.cache.GetNodeInfo("key", 1005.0, 10.0, []),
+                     ("ndata", "niinfo", []))
+
+  def testExpired(self):
+    self.assertEqual(self.cache.GetNodeInfo("key", 1010.0, 10.0,
+                                            [self.inst1]), None)
+    self.assertEqual(self.cache.GetNodeInfo("key", 999.0, 10.0,
+                                            [self.inst1]), None)
+    self.assertEqual(self.cache.GetNodeInfo("key", 1005.0, 0.0,
+                                            [self.inst1]), None)
+
+  def testDifferentKey(self):
+    self.assertEqual(self.cache.GetNodeInfo("other", 1005.0, 10.0,
+                                            [self.inst1]), None)
+
+  def testModifiedInstance(self):
+    # E.g. the instance was moved to other nodes
+    self.inst1.serial_no += 1
+    self.assertEqual(self.cache.GetNodeInfo("key", 1005.0, 10.0,
+                                            [self.inst1]), None)
+    self.assertEqual(self.cache.node_info, None)
+
+  def testInvalidate(self):
+    self.cache.InvalidateNodeInfo()
+    self.assertEqual(self.cache.GetNodeInfo("key", 1005.0, 10.0,
+                                            [self.inst1]), None)
+
+
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
@@ -24,9 +24,11 @@
 import os
 import sys
 import unittest
+import mock
 
 from ganeti import constants
 from ganeti import errors
+from ganeti import objects
 from ganeti import utils
 from ganeti import masterd
 
@@ -34,7 +36,9 @@ from ganeti.masterd.instance import \
   ImportExportTimeouts, _DiskImportExportBase, \
   ComputeRemoteExportHandshake, CheckRemoteExportHandshake, \
   ComputeRemoteImportDiskInfo, CheckRemoteExportDiskInfo, \
-  FormatProgress
+  GetRemoteExportCompressions, GetRemoteExportIoTypes, ChooseCompression, \
+  FormatProgress, SplitDiskRanges, CombineProgress, GetRbdSnapshotNames, \
+  ExportInstanceHelper
 
 import testutils
 
@@ -78,6 +82,57 @@ class TestRieHandshake(unittest.TestCase):
     self.assertEqual(hs[0], constants.RIE_VERSION)
 
     self.assertEqual(CheckRemoteExportHandshake(cds, hs), None)
+    self.assertEqual(GetRemoteExportCompressions(hs), None)
+
+  def testCompressions(self):
+    cds = "cd-secret"
+    methods = [constants.IEC_NONE, constants.IEC_ZSTD]
+    hs = ComputeRemoteExportHandshake(cds, methods)
+    self.assertEqual(len(hs), 4)
+    self.assertEqual(CheckRemoteExportHandshake(cds, hs), None)
+    self.assertEqual(GetRemoteExportCompressions(hs), methods)
+
+    # Announced methods are covered by the hash
+    hs = hs[:3] + ([constants.IEC_GZIP], )
+    self.assert_(CheckRemoteExportHandshake(cds, hs))
+
+    self.assert_(CheckRemoteExportHandshake(cds, hs[:3] + (None, )))
+    self.assert_(CheckRemoteExportHandshake(cds, hs + ("x", )))
+
+  def testIoTypes(self):
+    cds = "cd-secret"
+    methods = [constants.IEC_NONE]
+    hs = ComputeRemoteExportHandshake(cds, methods)
+    self.assertEqual(GetRemoteExportIoTypes(hs), None)
+
+    ieios = [constants.IEIO_RBD_DIFF]
+    hs = ComputeRemoteExportHandshake(cds, methods, ieios=ieios)
+    self.assertEqual(len(hs), 5)
+    self.assertEqual(CheckRemoteExportHandshake(cds, hs), None)
+    self.assertEqual(GetRemoteExportCompressions(hs), methods)
+    self.assertEqual(GetRemoteExportIoTypes(hs), ieios)
+
+    # Announced I/O types are covered by the hash
+    self.assert_(CheckRemoteExportHandshake(cds, hs[:4] + ([], )))
+    self.assert_(CheckRemoteExportHandshake(cds, hs[:4]))
+    self.assert_(CheckRemoteExportHandshake(cds, hs[:4] + ("x", )))
+    self.assert_(CheckRemoteExportHandshake(cds, hs + ([], )))
+
+  def testOldPeer(self):
+    cds = "cd-secret"
+    msg = "%s:%s" % (constants.RIE_VERSION, constants.RIE_HANDSHAKE)
+
+    # Handshakes without announcements are accepted by older destinations
+    (version, hmac_digest, hmac_salt) = ComputeRemoteExportHandshake(cds)
+    self.assertEqual(version, constants.RIE_VERSION)
+    self.assert_(utils.VerifySha1Hmac(cds, msg, hmac_digest, salt=hmac_salt))
+
+    # Older sources don't announce anything
+    salt = "a19cf8cc06"
+    hs = (constants.RIE_VERSION, utils.Sha1Hmac(cds, msg, salt=salt), salt)
+    self.assertEqual(CheckRemoteExportHandshake(cds, hs), None)
+    self.assertEqual(GetRemoteExportCompressions(hs), None)
+    self.assertEqual(GetRemoteExportIoTypes(hs), None)
 
   def testCheckErrors(self):
     self.assert_(CheckRemoteExportHandshake(None, None))
@@ -104,13 +159,75 @@ class TestRieDiskInfo(unittest.TestCase):
     salt = "ee5ad9"
     di = ComputeRemoteImportDiskInfo(cds, salt, 0, "node1", 1234, "mag111")
     self.assertEqual(CheckRemoteExportDiskInfo(cds, 0, di),
-                     ("node1", 1234, "mag111"))
+                     ("node1", 1234, "mag111", constants.IEC_DEFAULT,
+                      constants.IEIO_SCRIPT))
 
     for i in range(1, 100):
       # Wrong disk index
       self.assertRaises(errors.GenericError, CheckRemoteExportDiskInfo,
                         cds, i, di)
 
+  def testOldPeer(self):
+    cds = "bbf46ea9a"
+    salt = "ee5ad9"
+
+    # Disk information without a compression method is accepted by older
+    # sources
+    (host, port, magic, hmac_digest, hmac_salt) = \
+      ComputeRemoteImportDiskInfo(cds, salt, 0, "node1", 1234, "mag111")
+    self.assert_(utils.VerifySha1Hmac(cds, "0:node1:1234:mag111",
+                                      hmac_digest, salt=hmac_salt))
+
+    # Older destinations don't announce a compression method
+    di = ("node1", 1234, "mag111",
+          utils.Sha1Hmac(cds, "0:node1:1234:mag111", salt=salt), salt)
+    self.assertEqual(CheckRemoteExportDiskInfo(cds, 0, di),
+                     ("node1", 1234, "mag111", constants.IEC_DEFAULT,
+                      constants.IEIO_SCRIPT))
+
+  def testCompression(self):
+    cds = "bbf46ea9a"
+    salt = "ee5ad9"
+    di = ComputeRemoteImportDiskInfo(cds, salt, 0, "node1", 1234, "mag111",
+                                     compress=constants.IEC_LZ4)
+    self.assertEqual(len(di), 6)
+    self.assertEqual(CheckRemoteExportDiskInfo(cds, 0, di),
+                     ("node1", 1234, "mag111", constants.IEC_LZ4,
+                      constants.IEIO_SCRIPT))
+
+    # Compression method is covered by the hash
+    self.assertRaises(errors.GenericError, CheckRemoteExportDiskInfo,
+                      cds, 0, di[:5] + (constants.IEC_NONE, ))
+
+    di = ComputeRemoteImportDiskInfo(cds, salt, 0, "node1", 1234, "mag111",
+                                     compress="rot13")
+    self.assertRaises(errors.GenericError, CheckRemoteExportDiskInfo,
+                      cds, 0, di)
+
+  def testIoType(self):
+    cds = "bbf46ea9a"
+    salt = "ee5ad9"
+    di = ComputeRemoteImportDiskInfo(cds, salt, 0, "node1", 1234, "mag111",
+                                     compress=constants.IEC_NONE,
+                                     ieio=constants.IEIO_RBD_DIFF)
+    self.assertEqual(len(di), 7)
+    self.assertEqual(CheckRemoteExportDiskInfo(cds, 0, di),
+                     ("node1", 1234, "mag111", constants.IEC_NONE,
+                      constants.IEIO_RBD_DIFF))
+
+    # I/O type is covered by the hash
+    self.assertRaises(errors.GenericError, CheckRemoteExportDiskInfo,
+                      cds, 0, di[:6] + (constants.IEIO_SCRIPT, ))
+    self.assertRaises(errors.GenericError, CheckRemoteExportDiskInfo,
+                      cds, 0, di[:6])
+
+    # Only some I/O types can be used for remote transfers
+    di = ComputeRemoteImportDiskInfo(cds, salt, 0, "node1", 1234, "mag111",
+                                     compress=constants.IEC_NONE,
+                                     ieio=constants.IEIO_FILE)
+    self.assertRaises(errors.GenericError, CheckRemoteExportDiskInfo,
+                      cds, 0, di)
+
   def testInvalidHostPort(self):
     cds = "3ZoJY8KtGJ"
     salt = "drK5oYiHWD"
@@ -147,6 +264,78 @@ class TestRieDiskInfo(unittest.TestCase):
                       cds, 0, ("nodeX", 123, "magic", "fakehash", "xyz"))
 
 
+class TestChooseCompression(unittest.TestCase):
+  def test(self):
+    preference = [constants.IEC_ZSTD, constants.IEC_LZ4]
+
+    self.assertEqual(ChooseCompression(preference, []), constants.IEC_ZSTD)
+    self.assertEqual(ChooseCompression(preference, [
+      [constants.IEC_NONE, constants.IEC_LZ4, constants.IEC_ZSTD],
+      [constants.IEC_NONE, constants.IEC_ZSTD],
+      ]), constants.IEC_ZSTD)
+    self.assertEqual(ChooseCompression(preference, [
+      [constants.IEC_NONE, constants.IEC_LZ4, constants.IEC_ZSTD],
+      [constants.IEC_NONE, constants.IEC_GZIP, constants.IEC_LZ4],
+      ]), constants.IEC_LZ4)
+    self.assertEqual(ChooseCompression(preference, [
+      [constants.IEC_NONE, constants.IEC_GZIP, constants.IEC_ZSTD],
+      [constants.IEC_NONE, constants.IEC_GZIP, constants.IEC_LZ4],
+      ]), constants.IEC_NONE)
+    self.assertEqual(ChooseCompression(preference, [[constants.IEC_NONE]]),
+                     constants.IEC_NONE)
+
+
+class TestSplitDiskRanges(unittest.TestCase):
+  def test(self):
+    minsize = constants.IE_MIN_STREAM_SIZE
+
+    self.assertEqual(SplitDiskRanges(0, 4), [(0, 0)])
+    self.assertEqual(SplitDiskRanges(1024, 1), [(0, 1024)])
+    self.assertEqual(SplitDiskRanges(minsize - 1, 4), [(0, minsize - 1)])
+    self.assertEqual(SplitDiskRanges(2 * minsize, 4),
+                     [(0, minsize), (minsize, minsize)])
+
+    chunk = 10 * minsize // 4
+    self.assertEqual(SplitDiskRanges(10 * minsize + 3, 4), [
+      (0, chunk + 1),
+      (chunk + 1, chunk + 1),
+      (2 * chunk + 2, chunk + 1),
+      (3 * chunk + 3, chunk),
+      ])
+
+  def testCoverage(self):
+    for size in [1, 1023, 1024 * 1024, 1024 * 1024 + 7, 12345678]:
+      for streams in [1, 2, 3, 4, 7]:
+        ranges = SplitDiskRanges(size, streams)
+        self.assertTrue(1 <= len(ranges) <= streams)
+
+        offset = 0
+        for (start, length) in ranges:
+          self.assertEqual(start, offset)
+          self.assertTrue(length > 0)
+          offset += length
+        self.assertEqual(offset, size)
+
+
+class TestCombineProgress(unittest.TestCase):
+  def test(self):
+    self.assertEqual(CombineProgress([]), None)
+    self.assertEqual(CombineProgress([None, None]), None)
+    self.assertEqual(CombineProgress([(10, 2.5, 30, 100)]),
+                     (10, 2.5, 30, 100))
+    self.assertEqual(CombineProgress([(10, 2.5, 30, 100),
+                                      (20, 3.5, 50, 80),
+                                      (300, 0.0, 100, 0)]),
+                     (330, 6.0, 60, 100))
+
+  def testUnknown(self):
+    self.assertEqual(CombineProgress([(10, 2.5, 30, 100), None]),
+                     (10, 2.5, None, None))
+    self.assertEqual(CombineProgress([(10, 2.5, None, None),
+                                      (20, 1.5, 50, 80)]),
+                     (30, 4.0, None, None))
+
+
 class TestFormatProgress(unittest.TestCase):
   def test(self):
     FormatProgress((0, 0, None, None))
@@ -157,5 +346,173 @@ class TestFormatProgress(unittest.TestCase):
                      "1.5G, 12.0 MiB/s, 30%")
 
 
+class TestRbdTransfer(unittest.TestCase):
+  def setUp(self):
+    self.magics = [masterd.instance._GetInstDiskMagic("base", "inst1", idx)
+                   for idx in range(2)]
+    self.disks = [objects.Disk(dev_type=constants.LD_RBD, size=1024,
+                               logical_id=("rbd", "vol%s" % idx),
+                               physical_id=("rbd", "vol%s" % idx))
+                  for idx in range(2)]
+    self.instance = objects.Instance(name="inst1", primary_node="node1",
+                                     disk_template=constants.DT_RBD,
+                                     disks=self.disks)
+    self.disk_info = [("192.0.2.1", 1234 + idx, magic, constants.IEC_GZIP,
+                       constants.IEIO_RBD_DIFF)
+                      for (idx, magic) in enumerate(self.magics)]
+
+    self.lu = mock.Mock()
+    self.lu.rpc.call_blockdev_rbd_snapshot.return_value = \
+      mock.Mock(fail_msg=None)
+    self.lu.rpc.call_blockdev_rbd_remove_snapshot.return_value = \
+      mock.Mock(fail_msg=None)
+
+    self.helper = ExportInstanceHelper(self.lu, lambda _: None, self.instance)
+    self.helper._SendDisks = mock.Mock(return_value=[True, True])
+
+    patcher = mock.patch("ganeti.masterd.instance._GetRbdDiffDisk",
+                         lambda _, __, disk: disk)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def _GetSnapshotCalls(self, fn):
+    return [(disk, snap_name) for ((_, (disk, _), snap_name), _) in
+            fn.call_args_list]
+
+  def testNames(self):
+    (base, final) = GetRbdSnapshotNames(self.magics[0])
+    self.assertNotEqual(base, final)
+    self.assertEqual(GetRbdSnapshotNames(self.magics[0]), (base, final))
+    self.assertNotEqual(GetRbdSnapshotNames(self.magics[1]), (base, final))
+
+    delta_magic = masterd.instance._GetRbdDeltaMagic(self.magics[0])
+    self.assertNotEqual(delta_magic, self.magics[0])
+    self.assertTrue(constants.IE_MAGIC_RE.match(delta_magic))
+
+  def testTwoPasses(self):
+    names = [GetRbdSnapshotNames(magic) for magic in self.magics]
+
+    self.assertTrue(self.helper.RemoteExportBase(self.disk_info, "key", "ca",
+                                                 None))
+    self.assertEqual(
+      self._GetSnapshotCalls(self.lu.rpc.call_blockdev_rbd_snapshot),
+      [(disk, base) for (disk, (base, _)) in zip(self.disks, names)])
+    ((transfers, _, _, _), _) = self.helper._SendDisks.call_args
+    self.assertEqual(transfers,
+                     [(idx, "192.0.2.1", 1234 + idx, magic,
+                       constants.IEC_GZIP, None, constants.IEIO_RBD_DIFF,
+                       (disk, None, base), None)
+                      for (idx, (disk, magic, (base, _))) in
+                        enumerate(zip(self.disks, self.magics, names))])
+    self.assertFalse(self.lu.rpc.call_blockdev_rbd_remove_snapshot.called)
+
+    self.lu.rpc.call_blockdev_rbd_snapshot.reset_mock()
+    self.helper.CreateSnapshots(disk_info=self.disk_info)
+    self.assertEqual(
+      self._GetSnapshotCalls(self.lu.rpc.call_blockdev_rbd_snapshot),
+      [(disk, final) for (disk, (_, final)) in zip(self.disks, names)])
+
+    self.assertEqual(self.helper.RemoteExport(self.disk_info, "key", "ca",
+                                              None),
+                     (True, [True, True]))
+    ((transfers, _, _, _), _) = self.helper._SendDisks.call_args
+    self.assertEqual([transfer[:-1] for transfer in transfers],
+                     [(idx, "192.0.2.1", 1234 + idx,
+                       masterd.instance._GetRbdDeltaMagic(magic),
+                       constants.IEC_GZIP,
+                       constants.RIE_RBD_DELTA_CONNECT_RETRIES,
+                       constants.IEIO_RBD_DIFF, (disk, base, final))
+                      for (idx, (disk, magic, (base, final))) in
+                        enumerate(zip(self.disks, self.magics, names))])
+
+    self.helper.Cleanup()
+    self.assertEqual(
+      sorted(self._GetSnapshotCalls(
+        self.lu.rpc.call_blockdev_rbd_remove_snapshot)),
+      sorted((disk, snap_name) for (disk, snap_names) in zip(self.disks, names)
+             for snap_name in snap_names))
+
+  def testBaseFailed(self):
+    self.helper._SendDisks.return_value = [True, False]
+    self.assertFalse(self.helper.RemoteExportBase(self.disk_info, "key", "ca",
+                                                  None))
+    self.assertEqual(
+      self._GetSnapshotCalls(self.lu.rpc.call_blockdev_rbd_remove_snapshot),
+      [(disk, GetRbdSnapshotNames(magic)[0])
+       for (disk, magic) in zip(self.disks, self.magics)])
+
+  def testBaseSnapshotFailed(self):
+    result = mock.Mock(fail_msg="error")
+    result.Raise.side_effect = errors.OpExecError("error")
+    self.lu.rpc.call_blockdev_rbd_snapshot.return_value = result
+    self.assertRaises(errors.OpExecError, self.helper.RemoteExportBase,
+                      self.disk_info, "key", "ca", None)
+    self.assertFalse(self.helper._SendDisks.called)
+    self.assertEqual(
+      self._GetSnapshotCalls(self.lu.rpc.call_blockdev_rbd_remove_snapshot),
+      [(self.disks[0], GetRbdSnapshotNames(self.magics[0])[0])])
+
+  def testOtherDisks(self):
+    disk_info = [info[:4] + (constants.IEIO_SCRIPT, )
+                 for info in self.disk_info]
+    self.assertTrue(self.helper.RemoteExportBase(disk_info, "key", "ca",
+                                                 None))
+    self.assertEqual(self.helper._SendDisks.call_args[0][0], [])
+    self.assertFalse(self.lu.rpc.call_blockdev_rbd_snapshot.called)
+
+
+class TestRemoteImportRbdDeltas(unittest.TestCase):
+  def setUp(self):
+    self.magics = ["magic0", "magic1"]
+    self.disks = [objects.Disk(dev_type=constants.LD_RBD, size=1024,
+                               logical_id=("rbd", "vol%s" % idx),
+                               physical_id=("rbd", "vol%s" % idx))
+                  for idx in range(2)]
+    self.instance = objects.Instance(name="inst1", primary_node="node1",
+                                     disk_template=constants.DT_RBD,
+                                     disks=self.disks)
+
+    for (name, value) in [
+      ("ImportExportLoop", mock.DEFAULT),
+      ("DiskImport", mock.DEFAULT),
+      ("_GetRbdDiffDisk", lambda _, __, disk: disk),
+      ]:
+      patcher = mock.patch("ganeti.masterd.instance.%s" % name, value)
+      setattr(self, name, patcher.start())
+      self.addCleanup(patcher.stop)
+
+  def _Run(self, dresults):
+    masterd.instance._RemoteImportRbdDeltas(None, lambda _: None,
+                                            self.instance, "key", "ca",
+                                            False, constants.IEC_GZIP, None,
+                                            self.magics, [1234, 1235],
+                                            dresults)
+
+  def test(self):
+    dresults = [True, True]
+    self._Run(dresults)
+
+    self.assertEqual(self.DiskImport.call_count, 2)
+    for (idx, (args, _)) in enumerate(self.DiskImport.call_args_list):
+      (_, node, opts, _, component, ieio, ioargs, _, _) = args
+      self.assertEqual(node, "node1")
+      self.assertEqual(opts.listen_port, 1234 + idx)
+      self.assertEqual(opts.magic,
+                       masterd.instance._GetRbdDeltaMagic(self.magics[idx]))
+      self.assertEqual(component, "disk%s" % idx)
+      self.assertEqual(ieio, constants.IEIO_RBD_DIFF)
+      self.assertEqual(ioargs, (self.disks[idx], ))
+
+    ieloop = self.ImportExportLoop.return_value
+    self.assertTrue(ieloop.Run.called)
+    self.assertTrue(ieloop.FinalizeAll.called)
+
+  def testBaseFailed(self):
+    dresults = [True, False]
+    self._Run(dresults)
+    self.assertEqual(dresults, [False, False])
+    self.assertFalse(self.DiskImport.called)
+
+
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
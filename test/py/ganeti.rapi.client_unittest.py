@@ -136,6 +136,8 @@ class TestConstants(unittest.TestCase):
     self.assertEqual(client.NODE_MIGRATE_REQV1, rlib2._NODE_MIGRATE_REQV1)
     self.assertEqual(client._NODE_EVAC_RES1, rlib2._NODE_EVAC_RES1)
     self.assertEqual(client.NODE_EVAC_RES1, rlib2._NODE_EVAC_RES1)
+    self.assertEqual(client.INST_REMOTE_IMPORT_EXT,
+                     rlib2._INST_REMOTE_IMPORT_EXT)
 
   def testErrors(self):
     self.assertEqual(client.ECODE_ALL, errors.ECODE_ALL)
@@ -150,6 +150,37 @@ class TestSimpleStore(unittest.TestCase):
                                            default="something.example.com"),
                      "cluster.example.com")
 
+  def testReadFileCached(self):
+    filename = self.sstore.KeyToFilename(constants.SS_CLUSTER_NAME)
+    utils.WriteFile(filename, data="cluster.example.com")
+
+    self.assertEqual(self.sstore._ReadFile(constants.SS_CLUSTER_NAME),
+                     "cluster.example.com")
+    self.assertEqual(ssconf._cache[filename],
+                     (utils.GetFileID(path=filename), "cluster.example.com"))
+
+    # Files are replaced, so the new contents must be read
+    self.sstore.WriteFiles({
+      constants.SS_CLUSTER_NAME: "other.example.com",
+      })
+    self.assertEqual(self.sstore._ReadFile(constants.SS_CLUSTER_NAME),
+                     "other.example.com")
+
+    os.remove(filename)
+    os.remove(self.sstore.GetSnapshotFilename())
+    self.assertRaises(errors.ConfigurationError, self.sstore._ReadFile,
+                      constants.SS_CLUSTER_NAME)
+
+  def testReadKeys(self):
+    self.sstore.WriteFiles({
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node1.example.com",
+      })
+    self.assertEqual(self.sstore.ReadKeys([constants.SS_MASTER_NODE,
+                                           constants.SS_NODE_LIST]), {
+      constants.SS_MASTER_NODE: "node1.example.com",
+      })
+
   def testReadAllNoFiles(self):
     self.assertEqual(self.sstore.ReadAll(), {})
 
@@ -173,6 +204,7 @@ class TestSimpleStore(unittest.TestCase):
       "ssconf_cluster_name",
       "ssconf_cluster_tags",
       "ssconf_instance_list",
+      "ssconf_snapshot",
       ]))
 
     self.assertEqual(self._ReadSsFile(constants.SS_CLUSTER_NAME),
@@ -181,6 +213,150 @@ class TestSimpleStore(unittest.TestCase):
                      "value\nwith\nnewlines\n")
     self.assertEqual(self._ReadSsFile(constants.SS_INSTANCE_LIST), "")
 
+  def testWriteFilesSnapshot(self):
+    self.sstore.WriteFiles({
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node1.example.com",
+      })
+
+    snapshot_file = self.sstore.GetSnapshotFilename()
+    self.assertEqual(ssconf.ReadSnapshotFile(snapshot_file), (1, {
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node1.example.com",
+      }))
+
+    name_file = self.sstore.KeyToFilename(constants.SS_CLUSTER_NAME)
+    name_id = utils.GetFileID(path=name_file)
+
+    # Only changed keys are written, others are kept
+    self.sstore.WriteFiles({
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node2.example.com",
+      })
+    self.assertEqual(utils.GetFileID(path=name_file), name_id)
+    self.assertEqual(self._ReadSsFile(constants.SS_MASTER_NODE),
+                     "node2.example.com\n")
+    self.assertEqual(ssconf.ReadSnapshotFile(snapshot_file), (2, {
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node2.example.com",
+      }))
+
+    # Nothing changed
+    snapshot_id = utils.GetFileID(path=snapshot_file)
+    self.sstore.WriteFiles({
+      constants.SS_MASTER_NODE: "node2.example.com",
+      })
+    self.assertEqual(utils.GetFileID(path=snapshot_file), snapshot_id)
+
+    self.assertEqual(self.sstore.ReadAll(), {
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node2.example.com",
+      })
+
+  def testWriteFilesOutdatedFile(self):
+    values = {
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node1.example.com",
+      }
+    self.sstore.WriteFiles(values)
+
+    snapshot_file = self.sstore.GetSnapshotFilename()
+    snapshot_id = utils.GetFileID(path=snapshot_file)
+
+    # Individual files may have been written without updating the snapshot
+    self._WriteNewerFile(constants.SS_MASTER_NODE, "node2.example.com\n")
+    os.remove(self.sstore.KeyToFilename(constants.SS_CLUSTER_NAME))
+
+    self.sstore.WriteFiles({
+      constants.SS_MASTER_NODE: "node1.example.com",
+      })
+    self.assertEqual(self._ReadSsFile(constants.SS_MASTER_NODE),
+                     "node1.example.com\n")
+    self.assertEqual(self._ReadSsFile(constants.SS_CLUSTER_NAME),
+                     "cluster.example.com\n")
+
+    # The snapshot is rewritten to be newer than the individual files again
+    self.assertNotEqual(utils.GetFileID(path=snapshot_file), snapshot_id)
+    self.assertEqual(ssconf.ReadSnapshotFile(snapshot_file), (2, values))
+    self.assertEqual(self.sstore.ReadAll(), values)
+
+  def testWriteFilesNewerFile(self):
+    self.sstore.WriteFiles({
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node1.example.com",
+      })
+    self._WriteNewerFile(constants.SS_MASTER_NODE, "node2.example.com\n")
+
+    # The newer file's value is kept in the snapshot
+    self.sstore.WriteFiles({
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      })
+    self.assertEqual(ssconf.ReadSnapshotFile(
+                       self.sstore.GetSnapshotFilename()), (2, {
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node2.example.com",
+      }))
+    self.assertEqual(self.sstore.GetMasterNode(), "node2.example.com")
+
+  def _WriteNewerFile(self, key, data):
+    """Writes an individual file modified after the snapshot.
+
+    """
+    filename = self.sstore.KeyToFilename(key)
+    mtime = os.stat(self.sstore.GetSnapshotFilename()).st_mtime + 10
+    utils.WriteFile(filename, data=data, atime=mtime, mtime=mtime)
+
+  def testReadNewerFile(self):
+    self.sstore.WriteFiles({
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node1.example.com",
+      })
+    self.assertEqual(self.sstore.GetMasterNode(), "node1.example.com")
+
+    self._WriteNewerFile(constants.SS_MASTER_NODE, "node2.example.com\n")
+
+    self.assertEqual(self.sstore.GetMasterNode(), "node2.example.com")
+    self.assertEqual(self.sstore.GetClusterName(), "cluster.example.com")
+    self.assertEqual(self.sstore.ReadKeys([constants.SS_CLUSTER_NAME,
+                                           constants.SS_MASTER_NODE]), {
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node2.example.com",
+      })
+
+  def testReadOlderFile(self):
+    self.sstore.WriteFiles({
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node1.example.com",
+      })
+
+    # Files older than the snapshot are ignored
+    filename = self.sstore.KeyToFilename(constants.SS_MASTER_NODE)
+    mtime = os.stat(self.sstore.GetSnapshotFilename()).st_mtime - 10
+    utils.WriteFile(filename, data="node2.example.com\n",
+                    atime=mtime, mtime=mtime)
+
+    self.assertEqual(self.sstore.GetMasterNode(), "node1.example.com")
+    self.assertEqual(self.sstore.ReadAll(), {
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node1.example.com",
+      })
+
+  def testReadFileNotInSnapshot(self):
+    self.sstore.WriteFiles({
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      })
+
+    filename = self.sstore.KeyToFilename(constants.SS_MASTER_NODE)
+    mtime = os.stat(self.sstore.GetSnapshotFilename()).st_mtime - 10
+    utils.WriteFile(filename, data="node1.example.com\n",
+                    atime=mtime, mtime=mtime)
+
+    self.assertEqual(self.sstore.GetMasterNode(), "node1.example.com")
+    self.assertEqual(self.sstore.ReadAll(), {
+      constants.SS_CLUSTER_NAME: "cluster.example.com",
+      constants.SS_MASTER_NODE: "node1.example.com",
+      })
+
   def testWriteFilesUnknownKey(self):
     values = {
       "unknown key": "value",
@@ -104,6 +104,68 @@ class TestRADOSBlockDevice(testutils.GanetiTestCase):
     self.assertRaises(errors.BlockDeviceError, parse_function,
                       self.output_invalid, self.volume_name)
 
+  def testUserspaceAccessMapsOnOpen(self):
+    mapped = []
+
+    class _FakeRbd(bdev.RADOSBlockDevice):
+      def _MapVolumeToBlockdev(self, unique_id):
+        mapped.append(unique_id[1])
+        return "/dev/null"
+
+    params = {
+      constants.LDP_POOL: "rbd",
+      constants.LDP_ACCESS: constants.DISK_USERSPACE,
+      }
+    dev = _FakeRbd(("rbd", self.volume_name), [], 1024, params)
+    self.assertTrue(dev.attached)
+    self.assertEqual(dev.dev_path, None)
+    self.assertEqual(mapped, [])
+    self.assertEqual(dev.GetUserspaceAccessUri(constants.HT_KVM),
+                     "rbd:rbd/%s" % self.volume_name)
+
+    # /dev/null is not a block device
+    self.assertRaises(errors.BlockDeviceError, dev.Open)
+    self.assertEqual(mapped, [self.volume_name])
+
+  def testNoAttach(self):
+    class _FakeRbd(bdev.RADOSBlockDevice):
+      def _MapVolumeToBlockdev(self, unique_id):
+        raise AssertionError("Volume must not be mapped")
+
+    params = {
+      constants.LDP_POOL: "rbd",
+      constants.LDP_ACCESS: constants.DISK_KERNELSPACE,
+      }
+    dev = _FakeRbd(("rbd", self.volume_name), [], 1024, params, attach=False)
+    self.assertFalse(dev.attached)
+    self.assertEqual(dev.GetExportDiffCmd(None),
+                     [constants.RBD_CMD, "export-diff", "-p", "rbd",
+                      self.volume_name, "-"])
+
+  def testDiffCommands(self):
+    params = {
+      constants.LDP_POOL: "pool1",
+      constants.LDP_ACCESS: constants.DISK_USERSPACE,
+      }
+    dev = bdev.RADOSBlockDevice(("rbd", "vol1"), [], 1024, params)
+
+    self.assertEqual(dev.GetExportDiffCmd("snap1"),
+                     [constants.RBD_CMD, "export-diff", "-p", "pool1",
+                      "vol1@snap1", "-"])
+    self.assertEqual(dev.GetExportDiffCmd("snap2", from_snap="snap1"),
+                     [constants.RBD_CMD, "export-diff", "-p", "pool1",
+                      "--from-snap", "snap1", "vol1@snap2", "-"])
+    self.assertEqual(dev.GetExportDiffCmd(None, from_snap="snap1"),
+                     [constants.RBD_CMD, "export-diff", "-p", "pool1",
+                      "--from-snap", "snap1", "vol1", "-"])
+    self.assertEqual(dev.GetExportDiffCmd(None),
+                     [constants.RBD_CMD, "export-diff", "-p", "pool1",
+                      "vol1", "-"])
+    self.assertEqual(dev.GetImportDiffCmd(),
+                     [constants.RBD_CMD, "import-diff", "-p", "pool1", "-",
+                      "vol1"])
+
+
 class TestExclusiveStoragePvs(unittest.TestCase):
   """Test cases for functions dealing with LVM PV and exclusive storage"""
   # Allowance for rounding
@@ -168,6 +168,26 @@ class TestDRBD8Runner(testutils.GanetiTestCase):
                                   ("192.0.2.2", 11000)),
                     "Wrong network info (8.4.x)")
 
+  def testSplitShowData84(self):
+    """Test splitting the drbdsetup show output for all minors"""
+    data0 = testutils.ReadTestData("bdev-drbd-8.4.txt")
+    data3 = testutils.ReadTestData("bdev-drbd-8.4-no-disk-params.txt")
+    data3 = (data3.replace("resource0", "resource3")
+             .replace("minor 0;", "minor 3;")
+             .replace(":11000", ":11003"))
+    unused = "resource resource7 {\n    options {\n    }\n}\n"
+
+    self.assertEqual(drbd_info.DRBD84ShowInfo.SplitShowData(""), {})
+
+    result = drbd_info.DRBD84ShowInfo.SplitShowData(data0 + unused + data3)
+    self.assertEqual(result, {0: data0, 3: data3})
+
+    info = drbd_info.DRBD84ShowInfo.GetDevInfo(result[3])
+    self.assertTrue(self._has_disk(info, "/dev/xenvg/test.data",
+                                   "/dev/xenvg/test.meta", meta_index=None))
+    self.assertTrue(self._has_net(info, ("192.0.2.1", 11003),
+                                  ("192.0.2.2", 11003)))
+
   def testParserNetIP4(self):
     """Test drbdsetup show parser for IPv4 network"""
     data = testutils.ReadTestData("bdev-drbd-net-ip4.txt")
@@ -403,6 +423,57 @@ class TestDRBD8Status(testutils.GanetiTestCase):
                       drbd.DRBD8Info.CreateFromFile,
                       filename=self.proc80ev_data)
 
+  def testMinorStatusParsedOnce(self):
+    info = self.drbd_info83
+    self.assertTrue(info.GetMinorStatus(0) is info.GetMinorStatus(0))
+    self.assertFalse(info.GetMinorStatus(0) is info.GetMinorStatus(1))
+    self.assertRaises(KeyError, info.GetMinorStatus, 9)
+
+
+class TestDRBD8ProcInfoSnapshot(testutils.GanetiTestCase):
+  def setUp(self):
+    testutils.GanetiTestCase.setUp(self)
+    self.proc_data = testutils.TestDataFilename("proc_drbd83.txt")
+
+  def _GetMinors(self):
+    return (drbd.DRBD8.GetProcInfo(), drbd.DRBD8.GetUsedDevs())
+
+  @testutils.patch_object(drbd_info.DRBD8Info, "CreateFromFile")
+  def test(self, create_from_file):
+    create_from_file.side_effect = \
+      lambda: drbd_info.DRBD8Info.CreateFromLines(
+        open(self.proc_data).read().splitlines())
+
+    # Without a snapshot, the file is read on every call
+    self._GetMinors()
+    self.assertEqual(create_from_file.call_count, 2)
+
+    create_from_file.reset_mock()
+    (info, used) = drbd.DRBD8.CallWithProcInfoSnapshot(self._GetMinors)
+    self.assertEqual(create_from_file.call_count, 1)
+    self.assertTrue(info.HasMinorStatus(0))
+    self.assertTrue(0 in used and 2 not in used)
+
+    # Nested calls share the snapshot, which is discarded afterwards
+    create_from_file.reset_mock()
+    fn = drbd.WithProcInfoSnapshot(
+      lambda: (drbd.DRBD8.GetProcInfo(),
+               drbd.DRBD8.CallWithProcInfoSnapshot(drbd.DRBD8.GetProcInfo)))
+    (outer, inner) = fn()
+    self.assertTrue(outer is inner)
+    self.assertEqual(create_from_file.call_count, 1)
+    self.assertFalse(drbd.DRBD8.GetProcInfo() is outer)
+    self.assertEqual(create_from_file.call_count, 2)
+
+  @testutils.patch_object(drbd_info.DRBD8Info, "CreateFromFile")
+  def testError(self, create_from_file):
+    create_from_file.side_effect = errors.BlockDeviceError("Can't read")
+    self.assertRaises(errors.BlockDeviceError,
+                      drbd.DRBD8.CallWithProcInfoSnapshot,
+                      drbd.DRBD8.GetProcInfo)
+    self.assertEqual(drbd.DRBD8._proc_info_users, 0)
+    self.assertEqual(drbd.DRBD8._proc_info, None)
+
 
 class TestDRBD8Construction(testutils.GanetiTestCase):
   def setUp(self):
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2014 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Script for unittesting the ganeti.storage.lvm_inventory module"""
+
+import shutil
+import tempfile
+import unittest
+
+from ganeti import errors
+from ganeti import utils
+from ganeti.storage import lvm_inventory
+
+import testutils
+
+
+_VGS_OUTPUT = """\
+  xenvg|1024.00|512.00|wz--n-
+  othervg|20.00|20.00|wz--n-
+"""
+
+
+class TestLvmInventory(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.now = 1000.0
+    self.commands = []
+    self.output = _VGS_OUTPUT
+    self.exit_code = 0
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _RunCmd(self, cmd):
+    self.commands.append(cmd)
+    return utils.RunResult(self.exit_code, None, self.output, "", cmd,
+                           utils.process._TIMEOUT_NONE, 5)
+
+  def _NewInventory(self):
+    return lvm_inventory.LvmInventory(
+      filename=utils.PathJoin(self.tmpdir, "inventory"),
+      stamp_filename=utils.PathJoin(self.tmpdir, "stamp"),
+      ttl=10, _run_cmd_fn=self._RunCmd, _time_fn=lambda: self.now)
+
+  def _GetVgs(self, inventory):
+    return [(vg["vg_name"], vg["vg_free"])
+            for vg in inventory.GetReport(lvm_inventory.REPORT_VGS)]
+
+  def testReport(self):
+    inventory = self._NewInventory()
+    self.output += "invalid line\n"
+    self.assertEqual(inventory.GetReport(lvm_inventory.REPORT_VGS), [
+      {"vg_name": "xenvg", "vg_size": "1024.00", "vg_free": "512.00",
+       "vg_attr": "wz--n-"},
+      {"vg_name": "othervg", "vg_size": "20.00", "vg_free": "20.00",
+       "vg_attr": "wz--n-"},
+      ])
+    self.assertEqual(len(self.commands), 1)
+    self.assertEqual(self.commands[0][0], "vgs")
+    self.assertTrue("-ovg_name,vg_size,vg_free,vg_attr" in self.commands[0])
+
+  def testCaching(self):
+    inventory = self._NewInventory()
+    self._GetVgs(inventory)
+    self.now += 9
+    self._GetVgs(inventory)
+    self.assertEqual(len(self.commands), 1)
+
+    # Expired
+    self.now += 1
+    self._GetVgs(inventory)
+    self.assertEqual(len(self.commands), 2)
+
+  def testSharing(self):
+    first = self._NewInventory()
+    second = self._NewInventory()
+    result = self._GetVgs(first)
+    self.now += 1
+    self.assertEqual(self._GetVgs(second), result)
+    self.assertEqual(len(self.commands), 1)
+
+  def testInvalidate(self):
+    first = self._NewInventory()
+    second = self._NewInventory()
+    self.assertEqual(self._GetVgs(first)[0], ("xenvg", "512.00"))
+    self._GetVgs(second)
+
+    self.now += 1
+    second.Invalidate()
+    self.output = _VGS_OUTPUT.replace("512.00", "256.00")
+
+    self.now += 1
+    self.assertEqual(self._GetVgs(first)[0], ("xenvg", "256.00"))
+    self.assertEqual(self._GetVgs(second)[0], ("xenvg", "256.00"))
+    self.assertEqual(len(self.commands), 2)
+
+  def testStartedBeforeInvalidate(self):
+    inventory = self._NewInventory()
+
+    def _InvalidatingRunCmd(cmd):
+      # Another process changes a volume while the report is running
+      self.now += 1
+      self._NewInventory().Invalidate()
+      return self._RunCmd(cmd)
+
+    inventory._run_cmd_fn = _InvalidatingRunCmd
+    self._GetVgs(inventory)
+    self.assertEqual(len(self.commands), 1)
+
+    inventory._run_cmd_fn = self._RunCmd
+    self.now += 1
+    self._GetVgs(inventory)
+    self._GetVgs(self._NewInventory())
+    self.assertEqual(len(self.commands), 2)
+
+  def testFailure(self):
+    inventory = self._NewInventory()
+    self.exit_code = 1
+    self.assertRaises(errors.CommandError, inventory.GetReport,
+                      lvm_inventory.REPORT_VGS)
+    self.exit_code = 0
+    self._GetVgs(inventory)
+    self.assertEqual(len(self.commands), 2)
+
+  def testBrokenFiles(self):
+    utils.WriteFile(utils.PathJoin(self.tmpdir, "inventory"), data="{")
+    utils.WriteFile(utils.PathJoin(self.tmpdir, "stamp"), data="x")
+    inventory = self._NewInventory()
+    self._GetVgs(inventory)
+    self._GetVgs(inventory)
+    self.assertEqual(len(self.commands), 2)
+
+
+if __name__ == "__main__":
+  testutils.GanetiTestProgram()
@@ -21,6 +21,9 @@
 
 """Script for testing ganeti.utils.hash"""
 
+import os
+import time
+import shutil
 import unittest
 import random
 import operator
@@ -109,5 +112,74 @@ class TestFingerprintFiles(unittest.TestCase):
     self.assertEqual(utils.FingerprintFiles(self.results.keys()), self.results)
 
 
+class TestFingerprintCache(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.cache_file = utils.PathJoin(self.tmpdir, "cache")
+    self.filename = utils.PathJoin(self.tmpdir, "file")
+    self.now = time.time() + 10
+    self._Write("Hello World\n")
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _Write(self, data):
+    # Keep the inode, like editing a file in place would
+    fh = open(self.filename, "w")
+    try:
+      fh.write(data)
+    finally:
+      fh.close()
+
+  def _Fingerprint(self, files):
+    return utils.FingerprintFiles(files, cache_file=self.cache_file,
+                                  _time_fn=lambda: self.now)
+
+  def _ReadCache(self):
+    return utils.hash._ReadFingerprintCache(self.cache_file)
+
+  def test(self):
+    missing = utils.PathJoin(self.tmpdir, "missing")
+    expected = {
+      self.filename: "648a6a6ffffdaa0badb23b8baf90b6168dd16b3a",
+      }
+    self.assertEqual(self._Fingerprint([self.filename, missing, self.tmpdir]),
+                     expected)
+    self.assertEqual(self._ReadCache().keys(), [self.filename])
+
+    # Cached fingerprints are used as long as the file is unchanged
+    cache = self._ReadCache()
+    (file_id, _) = cache[self.filename]
+    cache[self.filename] = (file_id, "cached")
+    utils.hash._WriteFingerprintCache(self.cache_file, cache)
+    self.assertEqual(self._Fingerprint([self.filename]),
+                     {self.filename: "cached"})
+
+    self._Write("Hello World!\n")
+    self.assertEqual(self._Fingerprint([self.filename]), {
+      self.filename: "a0b65939670bc2c010f4d5d6a0b3e4e4590fb92b",
+      })
+
+    os.remove(self.filename)
+    self.assertEqual(self._Fingerprint([self.filename]), {})
+    self.assertEqual(self._ReadCache(), {})
+
+  def testRecentlyChanged(self):
+    self.now = time.time()
+    self._Fingerprint([self.filename])
+    self.assertEqual(self._ReadCache(), {})
+
+  def testOtherFilesKept(self):
+    self._Fingerprint([self.filename])
+    self.assertEqual(self._Fingerprint([]), {})
+    self.assertEqual(self._ReadCache().keys(), [self.filename])
+
+  def testInvalidCache(self):
+    utils.WriteFile(self.cache_file, data="invalid\n")
+    self.assertEqual(self._Fingerprint([self.filename]).keys(),
+                     [self.filename])
+    self.assertEqual(self._ReadCache().keys(), [self.filename])
+
+
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
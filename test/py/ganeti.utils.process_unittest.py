@@ -567,6 +567,72 @@ class TestRunParts(testutils.GanetiTestCase):
     nosuchdir = utils.PathJoin(self.rundir, "no/such/directory")
     self.assertEqual(utils.RunParts(nosuchdir), [])
 
+  def testParallel(self):
+    # Each script waits for the other one to have started
+    script = ("#!/bin/sh\n"
+              "touch %(dir)s/%(me)s.started\n"
+              "for i in $(seq 50); do\n"
+              "  test -e %(dir)s/%(other)s.started && exit 0\n"
+              "  sleep 0.1\n"
+              "done\n"
+              "exit 1\n")
+    markdir = tempfile.mkdtemp(prefix="ganeti-test")
+    try:
+      for (me, other) in [("10a", "10b"), ("10b", "10a")]:
+        fname = os.path.join(self.rundir, me)
+        utils.WriteFile(fname, data=script % {
+          "dir": markdir, "me": me, "other": other,
+          })
+        os.chmod(fname, stat.S_IREAD | stat.S_IEXEC)
+
+      results = utils.RunParts(self.rundir, env={"PATH": "/bin:/usr/bin"},
+                               reset_env=True, parallel=True)
+    finally:
+      shutil.rmtree(markdir)
+
+    self.assertEqual([(relname, status) for (relname, status, _) in results],
+                     [("10a", constants.RUNPARTS_RUN),
+                      ("10b", constants.RUNPARTS_RUN)])
+    for (_, _, runresult) in results:
+      self.assertFalse(runresult.failed)
+
+  def testTimeout(self):
+    fname = os.path.join(self.rundir, "00test")
+    utils.WriteFile(fname, data="#!/bin/sh\n\nexec sleep 60")
+    os.chmod(fname, stat.S_IREAD | stat.S_IEXEC)
+    (relname, status, runresult) = \
+      utils.RunParts(self.rundir, env={"PATH": "/bin:/usr/bin"},
+                     reset_env=True, timeout=1)[0]
+    self.assertEqual(relname, "00test")
+    self.assertEqual(status, constants.RUNPARTS_RUN)
+    self.assertTrue(runresult.failed)
+    self.assertEqual(runresult.exit_code, None)
+
+  def testDurations(self):
+    for (name, data) in [("00run", "#!/bin/sh\nexit 0\n"),
+                         ("10skip", "")]:
+      fname = os.path.join(self.rundir, name)
+      utils.WriteFile(fname, data=data)
+      if data:
+        os.chmod(fname, stat.S_IREAD | stat.S_IEXEC)
+
+    durations = {}
+    utils.RunParts(self.rundir, durations=durations)
+    self.assertEqual(durations.keys(), ["00run"])
+    self.assertTrue(durations["00run"] >= 0)
+
+
+class TestGroupRunParts(unittest.TestCase):
+  def test(self):
+    self.assertEqual(utils.process._GroupRunParts([]), [])
+    self.assertEqual(utils.process._GroupRunParts(["00a", "10a", "10b",
+                                                   "10c", "20a", "foo",
+                                                   "zoo"]),
+                     [["00a"], ["10a", "10b", "10c"], ["20a"], ["foo"],
+                      ["zoo"]])
+    self.assertEqual(utils.process._GroupRunParts(["10a", "100a"]),
+                     [["10a"], ["100a"]])
+
 
 class TestStartDaemon(testutils.GanetiTestCase):
   def setUp(self):
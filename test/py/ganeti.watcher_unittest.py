@@ -0,0 +1,287 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2013 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Script for testing ganeti.watcher"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ganeti import errors
+from ganeti import opcodes
+from ganeti import serializer
+from ganeti import utils
+from ganeti import watcher
+
+import testutils
+
+
+class _FakeJobClient:
+  def __init__(self, fail_submit=frozenset(), fail_poll=frozenset(),
+               raise_submit=False):
+    self._fail_submit = fail_submit
+    self._fail_poll = fail_poll
+    self._raise_submit = raise_submit
+    self._next_job_id = 0
+    self.batches = []
+    self.polled = []
+
+  def SubmitManyJobs(self, jobs):
+    self.batches.append(len(jobs))
+
+    if self._raise_submit:
+      raise errors.GenericError("Submission failed")
+
+    result = []
+    for job in jobs:
+      self._next_job_id += 1
+      (op, ) = job
+      if op.instance_name in self._fail_submit:
+        result.append((False, "Job for %s rejected" % op.instance_name))
+      else:
+        result.append((True, str(self._next_job_id)))
+
+    return result
+
+  def PollJob(self, job_id, cl=None, feedback_fn=None):
+    assert cl is self
+    assert callable(feedback_fn)
+
+    self.polled.append(job_id)
+
+    if job_id in self._fail_poll:
+      raise errors.OpExecError("Job %s failed" % job_id)
+
+    return []
+
+
+class TestRunInstanceJobs(unittest.TestCase):
+  def setUp(self):
+    self._orig_poll_job = watcher.cli.PollJob
+
+  def tearDown(self):
+    watcher.cli.PollJob = self._orig_poll_job
+
+  @staticmethod
+  def _MakeJobs(count):
+    return [("inst%s" % i,
+             opcodes.OpInstanceStartup(instance_name="inst%s" % i))
+            for i in range(count)]
+
+  def _Run(self, cl, jobs):
+    watcher.cli.PollJob = cl.PollJob
+    return watcher._RunInstanceJobs(cl, jobs, "startup")
+
+  def testNoJobs(self):
+    cl = _FakeJobClient()
+    self.assertEqual(self._Run(cl, []), {})
+    self.assertEqual(cl.batches, [])
+    self.assertEqual(cl.polled, [])
+
+  def testSingleBatch(self):
+    for count in [1, watcher.MAX_CONCURRENT_JOBS - 1,
+                  watcher.MAX_CONCURRENT_JOBS]:
+      cl = _FakeJobClient()
+      jobs = self._MakeJobs(count)
+      self.assertEqual(self._Run(cl, jobs),
+                       dict((name, True) for (name, _) in jobs))
+      self.assertEqual(cl.batches, [count])
+      self.assertEqual(cl.polled, map(str, range(1, count + 1)))
+
+  def testMultipleBatches(self):
+    limit = watcher.MAX_CONCURRENT_JOBS
+
+    for (count, batches) in [(limit + 1, [limit, 1]),
+                             (2 * limit, [limit, limit]),
+                             (2 * limit + 3, [limit, limit, 3])]:
+      cl = _FakeJobClient()
+      jobs = self._MakeJobs(count)
+      self.assertEqual(self._Run(cl, jobs),
+                       dict((name, True) for (name, _) in jobs))
+      self.assertEqual(cl.batches, batches)
+      self.assertEqual(len(cl.polled), count)
+
+  def testSubmitFailure(self):
+    cl = _FakeJobClient(fail_submit=frozenset(["inst1"]))
+    result = self._Run(cl, self._MakeJobs(3))
+    self.assertEqual(result, {
+      "inst0": True,
+      "inst1": False,
+      "inst2": True,
+      })
+    self.assertEqual(cl.polled, ["1", "3"])
+
+  def testSubmitError(self):
+    cl = _FakeJobClient(raise_submit=True)
+    jobs = self._MakeJobs(watcher.MAX_CONCURRENT_JOBS + 2)
+    self.assertEqual(self._Run(cl, jobs),
+                     dict((name, False) for (name, _) in jobs))
+    self.assertEqual(cl.batches, [watcher.MAX_CONCURRENT_JOBS, 2])
+    self.assertEqual(cl.polled, [])
+
+  def testPollError(self):
+    cl = _FakeJobClient(fail_poll=frozenset(["2"]))
+    result = self._Run(cl, self._MakeJobs(3))
+    self.assertEqual(result, {
+      "inst0": True,
+      "inst1": False,
+      "inst2": True,
+      })
+    self.assertEqual(cl.polled, ["1", "2", "3"])
+
+
+_INST1 = ["inst1", "running", True, ["node2"], ["group1"], "group1"]
+_INST2 = ["inst2", "ADMIN_down", False, [], [], "group2"]
+_INST3 = ["inst3", "running", True, ["node1"], ["group1"], "group1"]
+_NODE1 = ["node1", "boot1", False, "group1"]
+_NODE2 = ["node2", "boot2", False, "group1"]
+_NODE3 = ["node3", "boot3", True, "group2"]
+
+
+class _WatcherDataTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.filename = utils.PathJoin(self.tmpdir, "groups-data")
+    self.queries = []
+    self._orig_query_data = watcher._QueryData
+    watcher._QueryData = self._QueryData
+
+  def tearDown(self):
+    watcher._QueryData = self._orig_query_data
+    shutil.rmtree(self.tmpdir)
+
+  def _QueryData(self, cl, instance_filter, node_filter):
+    self.queries.append((instance_filter, node_filter))
+
+    instances = [_INST1, _INST2, _INST3]
+    nodes = [_NODE1, _NODE2, _NODE3]
+
+    # Filters are of the form [OP_EQUAL, field, group UUID]
+    if instance_filter is not None:
+      instances = [row for row in instances if row[-1] == instance_filter[2]]
+    if node_filter is not None:
+      nodes = [row for row in nodes if row[-1] == node_filter[2]]
+
+    return (instances, nodes)
+
+  def _WriteData(self, timestamp, groups):
+    utils.WriteFile(self.filename, data=serializer.DumpJson({
+      "timestamp": timestamp,
+      "groups": groups,
+      }))
+
+
+class TestGroupsData(_WatcherDataTest):
+  def testQueryGroupsData(self):
+    self.assertEqual(watcher._QueryGroupsData(NotImplemented), {
+      "group1": ([_INST1, _INST3], [_NODE1, _NODE2]),
+      "group2": ([_INST2], [_NODE3]),
+      })
+    self.assertEqual(self.queries, [(None, None)])
+
+  def testRoundTrip(self):
+    data = watcher._QueryGroupsData(NotImplemented)
+    watcher._WriteGroupsData(self.filename, data)
+
+    for (uuid, groupdata) in data.items():
+      self.assertEqual(watcher._ReadGroupData(self.filename, uuid), groupdata)
+
+    self.assertTrue(watcher._ReadGroupData(self.filename, "group3") is None)
+
+  def testAge(self):
+    groups = {
+      "group1": ([_INST1], [_NODE1]),
+      }
+    self._WriteData(1000.0, groups)
+
+    for now in [1000.0, 1001.5, 1000.0 + watcher.GROUP_DATA_MAX_AGE]:
+      self.assertEqual(watcher._ReadGroupData(self.filename, "group1",
+                                              now=now),
+                       ([_INST1], [_NODE1]))
+
+    # Too old or from the future
+    for now in [1000.0 + watcher.GROUP_DATA_MAX_AGE + 0.1, 999.0, 0.0]:
+      self.assertTrue(watcher._ReadGroupData(self.filename, "group1",
+                                             now=now) is None)
+
+  def testMissingFile(self):
+    self.assertTrue(watcher._ReadGroupData(self.filename, "group1") is None)
+
+  def testInvalidFile(self):
+    for data in ["", "{", "[]", serializer.DumpJson({"groups": {}}),
+                 serializer.DumpJson({"timestamp": "x", "groups": {}}),
+                 serializer.DumpJson({"timestamp": 0})]:
+      utils.WriteFile(self.filename, data=data)
+      self.assertTrue(watcher._ReadGroupData(self.filename, "group1",
+                                             now=0.0) is None)
+
+
+class TestGetGroupData(_WatcherDataTest):
+  def setUp(self):
+    _WatcherDataTest.setUp(self)
+    self._orig_data_file = watcher.pathutils.WATCHER_GROUPS_DATA_FILE
+    watcher.pathutils.WATCHER_GROUPS_DATA_FILE = self.filename
+
+  def tearDown(self):
+    watcher.pathutils.WATCHER_GROUPS_DATA_FILE = self._orig_data_file
+    _WatcherDataTest.tearDown(self)
+
+  def _Check(self, result):
+    (nodes, instances) = result
+
+    self.assertEqual(sorted(nodes.keys()), ["node1", "node2"])
+    self.assertEqual(nodes["node1"].secondaries, set(["inst3"]))
+    self.assertEqual(nodes["node2"].secondaries, set(["inst1"]))
+    self.assertEqual(sorted(instances.keys()), ["inst1", "inst3"])
+    self.assertEqual(instances["inst1"].snodes, ["node2"])
+
+  def testSharedData(self):
+    watcher._WriteGroupsData(self.filename, {
+      "group1": ([_INST1, _INST3], [_NODE1, _NODE2]),
+      "group2": ([_INST2], [_NODE3]),
+      })
+
+    self._Check(watcher._GetGroupData(NotImplemented, "group1"))
+    self.assertEqual(self.queries, [])
+
+  def testNoSharedData(self):
+    self.assertFalse(os.path.exists(self.filename))
+    self._Check(watcher._GetGroupData(NotImplemented, "group1"))
+    self.assertEqual(len(self.queries), 1)
+
+  def testOutdatedSharedData(self):
+    self._WriteData(0.0, {
+      "group1": ([], []),
+      })
+    self._Check(watcher._GetGroupData(NotImplemented, "group1"))
+    self.assertEqual(len(self.queries), 1)
+
+  def testGroupNotInSharedData(self):
+    watcher._WriteGroupsData(self.filename, {
+      "group2": ([_INST2], [_NODE3]),
+      })
+    self._Check(watcher._GetGroupData(NotImplemented, "group1"))
+    self.assertEqual(len(self.queries), 1)
+
+
+if __name__ == "__main__":
+  testutils.GanetiTestProgram()
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2014 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Script for comparing single and multi-instance allocation performance
+
+Given an iallocator input file containing an allocation request (e.g.
+C{test/data/htools/hail-alloc-drbd.json}), this places a number of copies of
+the requested instance once with one allocation request per instance, and
+once with a single multi-allocation request. Each allocator run serializes
+the input, writes it to a temporary file and runs the allocator script, like
+the master and L{backend.IAllocatorRunner} do.
+
+"""
+
+import os
+import copy
+import time
+import tempfile
+import optparse
+
+from ganeti import constants
+from ganeti import serializer
+from ganeti import utils
+
+
+def ParseOptions():
+  """Parses the command line options.
+
+  In case of command line errors, it will show the usage and exit the
+  program.
+
+  @return: the options in a tuple
+
+  """
+  parser = optparse.OptionParser(usage="%prog [options] <allocator> <input>")
+  parser.add_option("-n", dest="count", default=20, type="int",
+                    help="Number of instances to place", metavar="NUM")
+
+  (opts, args) = parser.parse_args()
+
+  if opts.count < 1:
+    parser.error("Number of instances must be at least 1")
+
+  if len(args) != 2:
+    parser.error("Allocator and input file must be given")
+
+  return (opts, args)
+
+
+def _RunAllocator(allocator, data):
+  """Runs an allocator on the given input data.
+
+  """
+  (fd, filename) = tempfile.mkstemp(prefix="ganeti-iallocator.")
+  try:
+    os.write(fd, serializer.Dump(data))
+    os.close(fd)
+    result = utils.RunCmd([allocator, filename])
+    if result.failed:
+      raise Exception("Allocator failed: %s, output '%s'" %
+                      (result.fail_reason, result.output))
+  finally:
+    os.unlink(filename)
+
+  output = serializer.Load(result.stdout)
+  if not output["success"]:
+    raise Exception("Allocation failed: %s" % output["info"])
+
+  return output["result"]
+
+
+def _MakeRequests(template, count):
+  """Builds allocation requests for a number of instances.
+
+  """
+  result = []
+  for idx in range(count):
+    request = copy.deepcopy(template)
+    request["name"] = "perf-instance%d.example.com" % idx
+    request["type"] = constants.IALLOCATOR_MODE_ALLOC
+    result.append(request)
+  return result
+
+
+def _AddInstance(data, request, nodes):
+  """Adds a placed instance to the cluster data.
+
+  """
+  data["instances"][request["name"]] = {
+    "tags": request["tags"],
+    "admin_state": constants.ADMINST_UP,
+    "vcpus": request["vcpus"],
+    "memory": request["memory"],
+    "spindle_use": request["spindle_use"],
+    "os": request["os"],
+    "nodes": nodes,
+    "nics": request["nics"],
+    "disks": request["disks"],
+    "disk_template": request["disk_template"],
+    "disk_space_total": request["disk_space_total"],
+    "hypervisor": request["hypervisor"],
+    }
+
+
+def PlaceSingle(allocator, data, requests):
+  """Places instances with one allocation request each.
+
+  """
+  data = copy.deepcopy(data)
+  for request in requests:
+    data["request"] = request
+    nodes = _RunAllocator(allocator, data)
+    _AddInstance(data, request, nodes)
+
+
+def PlaceMulti(allocator, data, requests):
+  """Places instances with a single multi-allocation request.
+
+  """
+  data = copy.deepcopy(data)
+  data["request"] = {
+    "type": constants.IALLOCATOR_MODE_MULTI_ALLOC,
+    "instances": requests,
+    }
+  (allocatable, failed) = _RunAllocator(allocator, data)
+  if failed:
+    raise Exception("Allocation failed for %s" % utils.CommaJoin(failed))
+  assert len(allocatable) == len(requests)
+
+
+def main():
+  (opts, (allocator, filename)) = ParseOptions()
+
+  data = serializer.Load(utils.ReadFile(filename))
+  template = data.pop("request")
+  if template.get("type") != constants.IALLOCATOR_MODE_ALLOC:
+    raise Exception("Input must contain an allocation request")
+
+  requests = _MakeRequests(template, opts.count)
+
+  for (descr, fn) in [("single", PlaceSingle), ("multi", PlaceMulti)]:
+    start = time.time()
+    fn(allocator, data, requests)
+    duration = time.time() - start
+    print ("%-6s placement of %d instances: %0.3fs (%0.2fms per instance)" %
+           (descr, opts.count, duration, 1000.0 * duration / opts.count))
+
+
+if __name__ == "__main__":
+  main()